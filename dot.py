@@ -15,40 +15,59 @@ Usage:
     ./dot.py provision --type provisioner  # Install only core provisioners
     ./dot.py shell --zsh                # Generate complete shell init
     ./dot.py shell --zsh --stage early  # Generate only early stage (fast)
+    ./dot.py shell --zsh --compile      # Cache init, print loader to source
+    ./dot.py shell --zsh --instrument   # Log per-snippet startup timings
+    ./dot.py shell-profile              # Summarize logged startup timings
+    ./dot.py bench --runs 30            # Benchmark interactive shell startup
+    ./dot.py bench-compare              # Significance test of the last two runs
     ./dot.py status                     # Show provisioning status
     ./dot.py cleanup                    # Remove unwanted files from home
 """
 
 from __future__ import annotations
 
-import argparse
-import asyncio
+# Heavy stdlib modules (asyncio, argparse, subprocess, tomllib, platform) are
+# imported where they are used so `dot.py shell` stays on a lean import path.
 import dataclasses
 import enum
+import hashlib
 import logging
 import os
 import pathlib
-import platform
+import pickle
+import re
 import shutil
-import subprocess
 import sys
 import time
-import tomllib
 import typing
 
 if typing.TYPE_CHECKING:
+    import asyncio
     import collections.abc
+    import http.client
+    import ssl
 
 __version__ = "2.0.0"
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%H:%M:%S",
-)
+# Bump when the pickled DotfilesConfig layout changes incompatibly
+CONFIG_SNAPSHOT_FORMAT = 7
+
+# Bump when generated shell init changes for identical snippets; part of the
+# content hash naming compiled init artifacts
+SHELL_GENERATOR_VERSION = 1
+
 logger = logging.getLogger(__name__)
 
+
+def _configure_logging(level: int = logging.INFO) -> None:
+    """Configure root logging for CLI use."""
+    logging.basicConfig(
+        level=level,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        datefmt="%H:%M:%S",
+    )
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # TYPE DEFINITIONS - Modern Python 3.12+ typing
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -58,6 +77,7 @@ type ShellName = typing.Literal["bash", "zsh", "fish"]
 type StageLevel = typing.Literal["early", "main", "late"]
 type Priority = int  # 0-9, lower runs first
 type PackageGroup = typing.Literal["minimal", "development", "desktop", "full"]
+type PlanFormat = typing.Literal["table", "plain", "json"]
 
 # NewType for path safety
 SourcePath = typing.NewType("SourcePath", pathlib.Path)
@@ -88,6 +108,25 @@ class ShellStage(enum.Enum):
     LATE = 9  # Heavy tools, prompt, plugins (100ms)
 
 
+# Startup time budget per stage, reported against by `dot.py shell-profile`
+STAGE_BUDGET_MS = {ShellStage.EARLY: 5, ShellStage.MAIN: 20, ShellStage.LATE: 100}
+
+# Snippet name under which instrumented init logs a whole stage's duration
+PROFILE_STAGE_TOTAL = "_total"
+
+# Seconds a `status` verify probe may run before it is killed
+STATUS_PROBE_TIMEOUT = 10.0
+
+# Seconds one benchmarked shell startup may take before it is killed
+BENCH_RUN_TIMEOUT = 30.0
+
+# Install runs whose backups `[config] backup_keep` retains by default
+BACKUP_KEEP = 10
+
+# Marks a directory trashed beside itself, on a filesystem without the trash
+TRASH_SUFFIX = ".dot-trash."
+
+
 class SymlinkAction(enum.Enum):
     """Possible outcomes for a symlink operation."""
 
@@ -107,7 +146,10 @@ class ProvisionerDict(typing.TypedDict):
     type: typing.NotRequired[str]  # "foundation", "provisioner", "enhancement"
     install_method: typing.NotRequired[str]  # "script", "package", "binary"
     install_script: typing.NotRequired[str]
+    script_sha256: typing.NotRequired[str]  # Expected digest of a `curl | sh` installer
     package_name: typing.NotRequired[str]
+    binary_url: typing.NotRequired[str]
+    binary_sha256: typing.NotRequired[str]  # Expected digest of the download
     provides: list[str]
     requires: list[str]
     priority: typing.NotRequired[int]
@@ -161,8 +203,10 @@ class Provisioner:
 
     # Installation details
     install_script: str = ""
+    script_sha256: str = ""
     package_name: str = ""
     binary_url: str = ""
+    binary_sha256: str = ""
 
     def __post_init__(self) -> None:
         """Validate and freeze provides/requires sets."""
@@ -194,6 +238,10 @@ class ShellSnippet:
     zsh: str = ""
     fish: str = ""
     default: str = ""  # Template with {shell} placeholder
+    # Cacheable eval: command whose output is sourced from a cache file,
+    # regenerated only when the binary or an input file's signature changes
+    cache_command: str = ""  # Template with {shell} placeholder
+    cache_inputs: list[str] = dataclasses.field(default_factory=list)
 
     def get_content(self, shell: ShellName) -> str:
         """Get content for specific shell.
@@ -234,6 +282,113 @@ class SymlinkPlan:
     is_dir: bool = False
 
 
+@dataclasses.dataclass(slots=True)
+class BackupEntry:
+    """A dest as it was before install replaced it."""
+
+    dest: pathlib.Path
+    kind: typing.Literal["file", "dir", "symlink"]
+    data: pathlib.Path  # Copy of the file or tree; unused for symlinks
+    target: str = ""  # Link target, for symlinks
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class ConditionFact:
+    """A snippet condition evaluated at shell-init generation time."""
+
+    kind: typing.Literal["command", "path"]
+    subject: str  # Command name or expanded path
+    present: bool  # Truth of the evaluated test, not mere existence
+    resolved: str = ""  # Binary path for commands found on PATH
+    test: str = ""  # test(1) operator for paths, e.g. "-x"
+
+
+@dataclasses.dataclass(slots=True)
+class CompiledShellInit:
+    """Precompiled shell init artifacts and the loader that sources them."""
+
+    loader: pathlib.Path
+    artifacts: list[pathlib.Path]
+    digest: str
+
+
+@dataclasses.dataclass(slots=True)
+class ProfileRow:
+    """Aggregated startup timings for one snippet (or whole stage)."""
+
+    stage: str
+    snippet: str
+    samples: int
+    p50_ms: float
+    p95_ms: float
+    max_ms: float
+
+
+@dataclasses.dataclass(slots=True)
+class BenchmarkStats:
+    """Wall-clock samples and summary statistics for one startup command."""
+
+    name: str
+    command: list[str]
+    env: dict[str, str]
+    samples_ms: list[float]
+    mean_ms: float
+    stddev_ms: float
+    cv_pct: float
+    stability: str
+    min_ms: float
+    p50_ms: float
+    p95_ms: float
+    max_ms: float
+
+    @classmethod
+    def from_samples(
+        cls,
+        name: str,
+        command: list[str],
+        samples_ms: list[float],
+        env: dict[str, str] | None = None,
+    ) -> BenchmarkStats:
+        """Summarize raw samples.
+
+        Returns:
+            BenchmarkStats with mean, sample stddev, CV and percentiles.
+
+        """
+        import statistics
+
+        ordered = sorted(samples_ms)
+        mean = statistics.fmean(ordered)
+        stddev = statistics.stdev(ordered) if len(ordered) > 1 else 0.0
+        cv_pct = stddev / mean * 100 if mean else 0.0
+        return cls(
+            name=name,
+            command=command,
+            env=env or {},
+            samples_ms=samples_ms,
+            mean_ms=mean,
+            stddev_ms=stddev,
+            cv_pct=cv_pct,
+            stability=_stability_band(cv_pct),
+            min_ms=ordered[0],
+            p50_ms=_percentile(ordered, 0.5),
+            p95_ms=_percentile(ordered, 0.95),
+            max_ms=ordered[-1],
+        )
+
+
+@dataclasses.dataclass(slots=True)
+class BenchComparison:
+    """Before/after comparison of one benchmark."""
+
+    name: str
+    before_ms: float  # median
+    after_ms: float  # median
+    delta_pct: float
+    p_value: float
+    verdict: typing.Literal["faster", "slower", "unchanged"]
+
+
 @dataclasses.dataclass(slots=True)
 class Result:
     """Base result for any operation that can succeed or fail."""
@@ -297,6 +452,14 @@ class CleanupResult(Result):
     errors: list[tuple[str, str]] = dataclasses.field(default_factory=list)
 
 
+@dataclasses.dataclass(slots=True)
+class RestoreResult(Result):
+    """Result of restore — tracks restored dests and errors."""
+
+    restored: list[pathlib.Path] = dataclasses.field(default_factory=list)
+    errors: list[tuple[str, str]] = dataclasses.field(default_factory=list)
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # CONFIGURATION - Modern structure
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -309,6 +472,8 @@ class DotfilesConfig:
     # Basic config
     source: pathlib.Path = pathlib.Path("~/.dot-config")
     backup: bool = True
+    backup_keep: int = BACKUP_KEEP
+    trash: bool = False  # Move replaced directories aside, delete them later
 
     # Templates
     template_vars: dict[str, typing.Any] = dataclasses.field(default_factory=dict)
@@ -322,6 +487,8 @@ class DotfilesConfig:
     provisioners: dict[str, Provisioner] = dataclasses.field(default_factory=dict)
     enhancements: dict[str, Provisioner] = dataclasses.field(default_factory=dict)
     packages: dict[str, typing.Any] = dataclasses.field(default_factory=dict)
+    # Group name -> groups it includes, from [package_groups]
+    package_groups: dict[str, list[str]] = dataclasses.field(default_factory=dict)
 
     # Protected directories (never wiped by shutil.rmtree)
     protected: list[pathlib.Path] = dataclasses.field(default_factory=list)
@@ -370,6 +537,19 @@ class DependencyResolver:
             key=lambda name: (self.provisioners[name].priority, name),
         )
 
+    def get_dependencies(self, name: str) -> set[str]:
+        """Get the provisioners that provide what *name* requires.
+
+        Returns:
+            Names of providing provisioners, excluding *name* itself.
+
+        """
+        return {
+            provider
+            for tool in self.provisioners[name].requires
+            if (provider := self._provides_map.get(tool)) and provider != name
+        }
+
     def check_requirements(self, provisioner: Provisioner) -> tuple[bool, list[str]]:
         """Check if requirements are met.
 
@@ -415,6 +595,8 @@ class Platform:
             SystemInfo object with platform details.
 
         """
+        import platform
+
         system = platform.system().lower()
 
         # Pattern match for OS detection
@@ -527,9 +709,15 @@ class AsyncCommandRunner:
         capture: bool = True,
         shell: bool = True,
         env: dict[str, str] | None = None,
+        timeout: float | None = None,
     ) -> CommandResult:
         """Run a command asynchronously.
 
+        With *timeout*, the command runs in its own process group, and the
+        whole group is killed if it has not finished after that many
+        seconds, so `sh -c` grandchildren do not outlive it. Such commands
+        cannot read the terminal, so this is for non-interactive probes.
+
         Returns:
             CommandResult with success status and output.
 
@@ -537,6 +725,9 @@ class AsyncCommandRunner:
             CalledProcessError: If check=True and command fails.
 
         """
+        import asyncio
+        import subprocess
+
         cmd_str = " ".join(cmd) if isinstance(cmd, list) else cmd
 
         if self.dry_run:
@@ -546,6 +737,10 @@ class AsyncCommandRunner:
         logger.debug("Executing: %s", cmd_str)
         start_time = time.monotonic()
 
+        # Only timed commands get their own group; others keep the terminal
+        # (sudo prompts) as the foreground process group
+        group: dict[str, typing.Any] = {} if timeout is None else {"process_group": 0}
+
         try:
             if shell:
                 proc = await asyncio.create_subprocess_shell(
@@ -553,6 +748,7 @@ class AsyncCommandRunner:
                     stdout=asyncio.subprocess.PIPE if capture else None,
                     stderr=asyncio.subprocess.PIPE if capture else None,
                     env=env,
+                    **group,
                 )
             else:
                 proc = await asyncio.create_subprocess_exec(
@@ -560,9 +756,29 @@ class AsyncCommandRunner:
                     stdout=asyncio.subprocess.PIPE if capture else None,
                     stderr=asyncio.subprocess.PIPE if capture else None,
                     env=env,
+                    **group,
                 )
 
-            stdout, stderr = await proc.communicate()
+            try:
+                async with asyncio.timeout(timeout):
+                    stdout, stderr = await proc.communicate()
+            except TimeoutError:
+                AsyncCommandRunner._kill_group(proc.pid)
+                await proc.communicate()
+                logger.warning("Timed out after %ss: %s", timeout, cmd_str)
+                return CommandResult(
+                    success=False,
+                    stderr=f"Timed out after {timeout}s",
+                    returncode=-1,
+                    duration=time.monotonic() - start_time,
+                )
+            except asyncio.CancelledError:
+                if proc.returncode is None:
+                    if group:
+                        AsyncCommandRunner._kill_group(proc.pid)
+                    else:
+                        proc.kill()
+                raise
             duration = time.monotonic() - start_time
 
             result = CommandResult(
@@ -589,6 +805,15 @@ class AsyncCommandRunner:
                 duration=time.monotonic() - start_time,
             )
 
+    @staticmethod
+    def _kill_group(pgid: int) -> None:
+        """SIGKILL a process group, ignoring one that already exited."""
+        import contextlib
+        import signal
+
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(pgid, signal.SIGKILL)
+
     @staticmethod
     def _raise_process_error(
         result: CommandResult,
@@ -600,6 +825,8 @@ class AsyncCommandRunner:
             CalledProcessError: Always raises this exception.
 
         """
+        import subprocess
+
         raise subprocess.CalledProcessError(
             result.returncode,
             cmd_str,
@@ -620,6 +847,8 @@ class AsyncCommandRunner:
             List of CommandResult objects for each command.
 
         """
+        import asyncio
+
         semaphore = asyncio.Semaphore(max_concurrent)
         results: list[CommandResult] = []
 
@@ -653,9 +882,127 @@ class AsyncCommandRunner:
 class ShellGenerator:
     """Generate optimized shell initialization scripts with staging."""
 
-    def __init__(self, platform: Platform) -> None:
-        """Initialize shell generator with platform info."""
+    # Conditions simple enough to evaluate in Python, e.g.
+    # `command -v starship >/dev/null 2>&1` and `[ -f "$HOME/.cargo/env" ]`
+    _COMMAND_CONDITION = re.compile(
+        r"command -v (?P<name>[\w.+-]+)(?:\s*>\s*/dev/null(?:\s+2>&1)?)?",
+    )
+    _TEST_CONDITION = re.compile(
+        r"\[ -(?P<op>[fdex]) (?P<quote>[\"']?)(?P<path>[^\"' ]+)(?P=quote) \]",
+    )
+
+    def __init__(
+        self,
+        platform: Platform | None = None,
+        *,
+        defer_late: bool = False,
+        resolve_conditions: bool = False,
+        instrument: bool = False,
+    ) -> None:
+        """Initialize shell generator with optional platform info and modes.
+
+        The generated init does not depend on platform detection, so the
+        `shell` fast path constructs the generator without a Platform.
+
+        With *defer_late*, LATE-stage snippets are wrapped in a one-shot
+        loader that runs after the first prompt instead of before it.
+
+        With *resolve_conditions*, simple snippet conditions are evaluated
+        now (against this process's PATH and filesystem): false snippets are
+        dropped and true ones unwrapped. Evaluated facts are kept in
+        ``facts`` so compiled artifacts can be invalidated when they change.
+
+        With *instrument*, every snippet and stage is timed and the durations
+        are appended to a per-session log for `dot.py shell-profile`.
+        """
         self.platform = platform
+        self.defer_late = defer_late
+        self.resolve_conditions = resolve_conditions
+        self.instrument = instrument
+        self.facts: dict[tuple[str, str, str], ConditionFact] = {}
+
+    def mode_flags(self) -> list[str]:
+        """CLI flags that reproduce this generator's output modes.
+
+        Returns:
+            List of `dot.py shell` flags.
+
+        """
+        flags = []
+        if self.defer_late:
+            flags.append("--defer-late")
+        if self.resolve_conditions:
+            flags.append("--resolve-conditions")
+        if self.instrument:
+            flags.append("--instrument")
+        return flags
+
+    def _resolve_condition(self, condition: str, shell: ShellName) -> bool | None:
+        """Evaluate a snippet condition in Python if it is a known pattern.
+
+        Returns:
+            Truth of the condition, or None if it must stay in the script.
+
+        """
+        condition = condition.strip()
+        if match := self._COMMAND_CONDITION.fullmatch(condition):
+            name = match["name"]
+            resolved = shutil.which(name)
+            fact = ConditionFact("command", name, resolved is not None, resolved or "")
+            self.facts[fact.kind, fact.subject, fact.test] = fact
+            return fact.present
+
+        if match := self._TEST_CONDITION.fullmatch(condition):
+            raw_path = match["path"].replace("${shell}", shell)
+            raw_path = raw_path.replace("$shell", shell)
+            expanded = os.path.expandvars(raw_path)
+            if "$" in expanded:
+                return None  # Unknown variable, leave it to the shell
+            path = pathlib.Path(expanded).expanduser()
+            match match["op"]:
+                case "f":
+                    result = path.is_file()
+                case "d":
+                    result = path.is_dir()
+                case "x":
+                    result = os.access(path, os.X_OK)
+                case _:
+                    result = path.exists()
+            fact = ConditionFact("path", str(path), result, test=f"-{match['op']}")
+            self.facts[fact.kind, fact.subject, fact.test] = fact
+            return fact.present
+
+        return None
+
+    def invalidation_paths(
+        self,
+    ) -> tuple[list[pathlib.Path], list[tuple[str, pathlib.Path, bool]]]:
+        """Paths whose changes would flip a resolved condition.
+
+        Path facts are rechecked with their own test operator, so a chmod or
+        a file replaced by a directory is caught as well as creation and
+        removal. Absent commands can only appear by creating an entry in a
+        PATH directory, which bumps that directory's mtime; present ones
+        disappear when their binary stops existing.
+
+        Returns:
+            (paths that must not be newer than the artifact,
+            (operator, path, expected truth) tests that must still hold)
+
+        """
+        newer: dict[str, pathlib.Path] = {}
+        checks: dict[tuple[str, str], tuple[str, pathlib.Path, bool]] = {}
+        for fact in self.facts.values():
+            if fact.kind == "path":
+                path = pathlib.Path(fact.subject)
+                checks[fact.test, fact.subject] = (fact.test, path, fact.present)
+            elif fact.present:
+                checks["-e", fact.resolved] = ("-e", pathlib.Path(fact.resolved), True)
+            else:
+                for entry in os.environ.get("PATH", "").split(os.pathsep):
+                    if entry and pathlib.Path(entry).is_dir():
+                        newer[entry] = pathlib.Path(entry)
+        return list(newer.values()), list(checks.values())
 
     def generate_staged_init(
         self,
@@ -700,9 +1047,13 @@ class ShellGenerator:
             Shell script header as a string.
 
         """
+        budgets = " | ".join(
+            f"{stage.name.title()}: {budget}ms"
+            for stage, budget in STAGE_BUDGET_MS.items()
+        )
         return f"""# Generated by dot.py v2.0 - Staged Shell Initialization
 # Optimized for {shell} with 90% faster startup via staged loading
-# Early: 5ms | Main: 20ms | Late: 100ms
+# {budgets}
 """
 
     def _generate_stage(
@@ -717,13 +1068,27 @@ class ShellGenerator:
             return ""
 
         lines = []
+        uses_eval_cache = False
+        stage_name = target_stage.name.lower()
         for snippet in sorted(stage_snippets, key=lambda s: s.name):
             content = snippet.get_content(shell)
+            if content and snippet.cache_command:
+                content = ShellGenerator._cached_eval_call(shell, snippet)
+                uses_eval_cache = True
             if content:
+                resolved = (
+                    self._resolve_condition(snippet.condition, shell)
+                    if snippet.condition and self.resolve_conditions
+                    else None
+                )
+                if resolved is False:
+                    continue
                 lines.append(f"# {snippet.description or snippet.name}")
+                if self.instrument:
+                    lines.append(ShellGenerator._profile_start(shell, "_dot_t0"))
 
                 # Add condition wrapper if needed
-                if snippet.condition:
+                if snippet.condition and resolved is None:
                     if shell == "fish":
                         condition = self._convert_condition_to_fish(snippet.condition)
                         lines.append(f"if {condition}")
@@ -736,9 +1101,485 @@ class ShellGenerator:
                 else:
                     lines.append(content)
 
+                if self.instrument:
+                    lines.append(f"_dot_profile {stage_name} {snippet.name} $_dot_t0")
                 lines.append("")  # Empty line between snippets
 
-        return "\n".join(lines).rstrip()
+        content = "\n".join(lines).rstrip()
+        if content and uses_eval_cache:
+            content = f"{ShellGenerator._cached_eval_helper(shell)}\n\n{content}"
+        if content and self.instrument:
+            content = "\n".join(
+                [
+                    ShellGenerator._profile_helper(shell),
+                    ShellGenerator._profile_start(shell, "_dot_stage_t0"),
+                    "",
+                    content,
+                    "",
+                    f"_dot_profile {stage_name} {PROFILE_STAGE_TOTAL} $_dot_stage_t0",
+                ],
+            )
+        if content and self.defer_late and target_stage == ShellStage.LATE:
+            return ShellGenerator._wrap_deferred(shell, content)
+        return content
+
+    @staticmethod
+    def _cached_eval_call(shell: ShellName, snippet: ShellSnippet) -> str:
+        """Emit the lines that source a snippet's cached command output.
+
+        The cache is sourced at the call site rather than inside the helper,
+        so `declare`/`typeset`/`set` in the init script stay global.
+
+        Returns:
+            A `_dot_cached_eval` invocation followed by the source command.
+
+        """
+        import shlex
+
+        command = snippet.cache_command.replace("{shell}", shell)
+        args = ["_dot_cached_eval", shlex.quote(f"{snippet.name}.{shell}")]
+        args.append(shlex.quote(command))
+        for raw in snippet.cache_inputs:
+            path = raw.replace("{shell}", shell)
+            if path == "~" or path.startswith("~/"):
+                path = "$HOME" + path[1:]
+            # Double quotes keep $HOME-style variables live in every shell
+            args.append('"' + path.replace('"', '\\"') + '"')
+        call = " ".join(args)
+        if shell == "fish":
+            return f"if {call}\n    source $_dot_eval_cache\nend"
+        return f'if {call}; then\n    source "$_dot_eval_cache"\nfi'
+
+    @staticmethod
+    def _cached_eval_helper(shell: ShellName) -> str:
+        """Emit the helper that refreshes a command's cached output.
+
+        The signature is the resolved binary path, the command line and
+        which inputs exist, stored as the cache file's first line. A `.bin`
+        stamp next to the cache carries the binary's mtime. The cache is
+        regenerated when the signature differs, when the binary's mtime
+        moves either way from the stamp (upgrade or downgrade), or when any
+        input is newer than the cache. Hits use only builtins, so no process
+        is forked. This generalizes the stat-signature cache in
+        config/fish/conf.d/asdf.fish. A failed refresh discards its partial
+        output; the helper then returns 1 unless an older cache exists.
+
+        Returns:
+            Shell function definition for `_dot_cached_eval`.
+
+        """
+        if shell == "fish":
+            return """function _dot_cached_eval -a name cmd
+    set -l cache_root $HOME/.cache
+    set -q XDG_CACHE_HOME; and set cache_root $XDG_CACHE_HOME
+    set -l cache $cache_root/dot/eval/$name
+    set -l stamp $cache.bin
+    set -l bin (command -s (string split -m1 ' ' -- $cmd)[1]); or return 1
+    set -l sig "$bin "(string replace -a \\n ' ' -- $cmd)
+    for input in $argv[3..-1]
+        if test -e $input
+            set sig $sig:1
+        else
+            set sig $sig:0
+        end
+    end
+    set -l stale
+    if not test -f $cache; or not test -f $stamp
+        set stale 1
+    else if test $bin -nt $stamp; or test $bin -ot $stamp
+        set stale 1
+    else
+        read -l line <$cache
+        test "$line" = "# dot-signature: $sig"; or set stale 1
+        for input in $argv[3..-1]
+            test $input -nt $cache; and set stale 1
+        end
+    end
+    if set -q stale[1]
+        mkdir -p $cache_root/dot/eval
+        begin
+            echo "# dot-signature: $sig"
+            eval $cmd
+        end >$cache.$fish_pid; and mv -f $cache.$fish_pid $cache
+        and touch -r $bin $stamp
+        or rm -f $cache.$fish_pid
+    end
+    test -f $cache; or return 1
+    set -g _dot_eval_cache $cache
+end"""
+
+        if shell == "zsh":
+            resolve = "    bin=${commands[${cmd%% *}]}"
+        else:
+            resolve = """    local dir
+    while IFS= read -r -d : dir; do
+        if [[ -x $dir/${cmd%% *} ]]; then
+            bin=$dir/${cmd%% *}
+            break
+        fi
+    done <<<"$PATH:"
+"""
+        return f"""_dot_cached_eval() {{
+    local name=$1 cmd=$2 bin= sig input line= stale=
+    shift 2
+    local cache="${{XDG_CACHE_HOME:-$HOME/.cache}}/dot/eval/$name"
+    local stamp=$cache.bin
+{resolve.rstrip()}
+    [[ -n $bin ]] || return 1
+    sig="$bin ${{cmd//$'\\n'/ }}"
+    for input in "$@"; do
+        if [[ -e $input ]]; then sig+=":1"; else sig+=":0"; fi
+    done
+    if [[ ! -f $cache || ! -f $stamp || $bin -nt $stamp || $bin -ot $stamp ]]; then
+        stale=1
+    else
+        IFS= read -r line <"$cache"
+        [[ $line == "# dot-signature: $sig" ]] || stale=1
+        for input in "$@"; do
+            [[ $input -nt $cache ]] && stale=1
+        done
+    fi
+    if [[ -n $stale ]]; then
+        mkdir -p "${{cache%/*}}"
+        {{
+            printf '# dot-signature: %s\\n' "$sig"
+            eval "$cmd"
+        }} >"$cache.$$" && mv -f "$cache.$$" "$cache" &&
+            touch -r "$bin" "$stamp" || rm -f "$cache.$$"
+    fi
+    [[ -f $cache ]] || return 1
+    _dot_eval_cache=$cache
+}}"""
+
+    @staticmethod
+    def _profile_start(shell: ShellName, variable: str) -> str:
+        """Emit an assignment of the current time in microseconds.
+
+        Returns:
+            Shell statement setting *variable*.
+
+        """
+        if shell == "fish":
+            return f"set -g {variable} (date +%s%N)"
+        # EPOCHREALTIME uses the locale's decimal separator
+        return f"{variable}=${{EPOCHREALTIME//[.,]/}}"
+
+    @staticmethod
+    def _profile_helper(shell: ShellName) -> str:
+        r"""Emit the helper that logs one timing sample.
+
+        Samples are appended as `<stage>\t<snippet>\t<microseconds>` to
+        `$XDG_CACHE_HOME/dot/shell-profile/<shell>.<pid>.log`. zsh and bash 5
+        read `$EPOCHREALTIME` without forking. fish has no equivalent, so it
+        forks `date +%s%N` and converts nanoseconds. Bash before 5.0 lacks
+        `$EPOCHREALTIME` and logs nothing.
+
+        Returns:
+            Shell definitions for `_dot_profile`.
+
+        """
+        if shell == "fish":
+            return r"""set -g _dot_profile_log $HOME/.cache
+set -q XDG_CACHE_HOME; and set _dot_profile_log $XDG_CACHE_HOME
+set _dot_profile_log $_dot_profile_log/dot/shell-profile
+test -d $_dot_profile_log; or mkdir -p $_dot_profile_log
+set _dot_profile_log $_dot_profile_log/fish.$fish_pid.log
+function _dot_profile -a stage name start
+    set -l now (date +%s%N)
+    set -l usec (math --scale=0 "($now - $start) / 1000")
+    printf '%s\t%s\t%d\n' $stage $name $usec >>$_dot_profile_log
+end"""
+
+        preamble = "zmodload zsh/datetime 2>/dev/null\n" if shell == "zsh" else ""
+        return preamble + (
+            r"""_dot_profile_log=${XDG_CACHE_HOME:-$HOME/.cache}/dot/shell-profile
+[[ -d $_dot_profile_log ]] || mkdir -p "$_dot_profile_log"
+_dot_profile_log+=/SHELL.$$.log
+_dot_profile() {
+    [[ -n $3 ]] || return 0
+    local usec=$((${EPOCHREALTIME//[.,]/} - $3))
+    printf '%s\t%s\t%d\n' "$1" "$2" "$usec" >>"$_dot_profile_log"
+}""".replace("SHELL", shell)
+        )
+
+    @staticmethod
+    def _wrap_deferred(shell: ShellName, content: str) -> str:
+        """Wrap stage content so it runs once, after the first prompt.
+
+        Snippet order inside the deferred batch is preserved. Non-interactive
+        shells never draw a prompt, so they run the batch immediately.
+
+        bash evals the batch from PROMPT_COMMAND at global scope, so
+        `declare`/`typeset` keep their usual meaning. zsh and fish can only
+        run code after the prompt from a function (zle handler, fish_prompt
+        event), so there the batch is a function body: declarations must be
+        global (`typeset -g`, `set -g`) to outlive it.
+
+        Returns:
+            Deferred loader wrapping *content*.
+
+        """
+        body = "\n".join(f"    {line}" if line else "" for line in content.split("\n"))
+        match shell:
+            case "zsh":
+                # precmd arms a zle -F handler on an always-readable fd, which
+                # fires once zle is idle, i.e. after the first prompt is drawn
+                return f"""# Deferred: runs once zle is idle after the first prompt
+_dot_deferred_late() {{
+{body}
+}}
+_dot_deferred_late_fd() {{
+    local fd=$1
+    zle -F $fd
+    exec {{fd}}<&-
+    _dot_deferred_late
+    zle reset-prompt
+}}
+_dot_deferred_late_arm() {{
+    precmd_functions=(${{precmd_functions:#_dot_deferred_late_arm}})
+    local fd
+    exec {{fd}}</dev/null
+    zle -N _dot_deferred_late_fd
+    zle -F -w $fd _dot_deferred_late_fd
+}}
+if [[ -o interactive ]]; then
+    precmd_functions+=(_dot_deferred_late_arm)
+else
+    _dot_deferred_late
+fi"""
+            case "bash":
+                # PROMPT_COMMAND runs at global scope, unlike a function body
+                return f"""# Deferred: runs once from the first PROMPT_COMMAND
+IFS= read -r -d '' _dot_deferred_late_body <<'__dot_deferred_late__'
+{content}
+__dot_deferred_late__
+_dot_deferred_late_restore() {{
+    if [[ -n ${{_dot_prompt_command_saved+x}} ]]; then
+        PROMPT_COMMAND=$_dot_prompt_command_saved
+        unset _dot_prompt_command_saved
+    fi
+}}
+_dot_deferred_late='_dot_deferred_late_restore
+eval "$_dot_deferred_late_body"; unset _dot_deferred_late_body'
+if [[ $- == *i* ]]; then
+    _dot_prompt_command_saved=${{PROMPT_COMMAND-}}
+    PROMPT_COMMAND="$_dot_deferred_late${{PROMPT_COMMAND:+; $PROMPT_COMMAND}}"
+else
+    eval "$_dot_deferred_late"
+fi
+unset _dot_deferred_late"""
+            case "fish":
+                return f"""# Deferred: runs once on the first fish_prompt event
+function _dot_deferred_late --on-event fish_prompt
+    functions --erase _dot_deferred_late
+{body}
+end
+if not status is-interactive
+    _dot_deferred_late
+end"""
+
+    def snippets_digest(
+        self,
+        shell: ShellName,
+        snippets: list[ShellSnippet],
+        stage: ShellStage | None = None,
+    ) -> str:
+        """Content hash of everything that determines the generated init.
+
+        With *stage*, only that stage's snippets count.
+
+        Returns:
+            Short hex digest naming compiled artifacts.
+
+        """
+        if stage is not None:
+            snippets = [s for s in snippets if s.stage == stage]
+        hasher = hashlib.sha256()
+        hasher.update(f"{SHELL_GENERATOR_VERSION}:{__version__}:{shell}".encode())
+        if stage is not None:
+            hasher.update(f":{stage.name}".encode())
+        hasher.update(" ".join(self.mode_flags()).encode())
+        for snippet in sorted(snippets, key=lambda s: s.name):
+            hasher.update(repr(dataclasses.astuple(snippet)).encode())
+            if self.resolve_conditions and snippet.condition:
+                self._resolve_condition(snippet.condition, shell)
+        for key in sorted(self.facts):
+            hasher.update(repr(self.facts[key]).encode())
+        return hasher.hexdigest()[:16]
+
+    def compile_staged_init(
+        self,
+        shell: ShellName,
+        snippets: list[ShellSnippet],
+        cache_dir: pathlib.Path,
+        *,
+        watch: collections.abc.Sequence[pathlib.Path],
+        regenerate_cmd: str,
+        stage: StageLevel | None = None,
+    ) -> CompiledShellInit:
+        """Write per-stage init artifacts plus a stable loader stub.
+
+        Artifacts are named ``<stage>-<digest>.<shell>``, digesting only that
+        stage's snippets, so a stage whose snippets are unchanged is never
+        rewritten. The loader at ``init[-<stage>].<shell>`` sources
+        the current artifacts and only runs *regenerate_cmd* when a *watch*
+        path is newer than the loader itself. zsh artifacts are zcompiled.
+
+        With resolved conditions, the loader also recompiles when a fact's
+        invalidation paths change (see ``invalidation_paths``).
+
+        Returns:
+            CompiledShellInit describing the loader and artifacts.
+
+        """
+        digest = self.snippets_digest(shell, snippets)
+        shell_dir = cache_dir / shell
+        shell_dir.mkdir(parents=True, exist_ok=True)
+
+        stage_mapping = {
+            "early": ShellStage.EARLY,
+            "main": ShellStage.MAIN,
+            "late": ShellStage.LATE,
+        }
+        stages = (
+            [stage_mapping[stage]]
+            if stage
+            else [ShellStage.EARLY, ShellStage.MAIN, ShellStage.LATE]
+        )
+
+        stage_digests = {
+            shell_stage.name.lower(): self.snippets_digest(shell, snippets, shell_stage)
+            for shell_stage in ShellStage
+        }
+        artifacts: list[pathlib.Path] = []
+        for shell_stage in stages:
+            stage_name = shell_stage.name.lower()
+            artifact = shell_dir / f"{stage_name}-{stage_digests[stage_name]}.{shell}"
+            if not artifact.exists():
+                content = self._generate_stage(shell, snippets, shell_stage)
+                if not content:
+                    continue
+                _atomic_write_text(artifact, content + "\n")
+                if shell == "zsh":
+                    ShellGenerator._zcompile(artifact)
+            artifacts.append(artifact)
+
+        loader_name = f"init-{stage}.{shell}" if stage else f"init.{shell}"
+        loader = shell_dir / loader_name
+        fact_newer, fact_checks = self.invalidation_paths()
+        loader_content = self._generate_loader(
+            shell,
+            loader,
+            artifacts,
+            watch=[*watch, *fact_newer],
+            checks=fact_checks,
+            regenerate_cmd=regenerate_cmd,
+        )
+        _atomic_write_text(loader, loader_content)
+
+        ShellGenerator._prune_artifacts(shell_dir, shell, stage_digests)
+        return CompiledShellInit(loader=loader, artifacts=artifacts, digest=digest)
+
+    @staticmethod
+    def _generate_loader(
+        shell: ShellName,
+        loader: pathlib.Path,
+        artifacts: list[pathlib.Path],
+        *,
+        watch: collections.abc.Sequence[pathlib.Path],
+        regenerate_cmd: str,
+        checks: collections.abc.Sequence[tuple[str, pathlib.Path, bool]] = (),
+    ) -> str:
+        """Generate the loader stub that sources compiled artifacts.
+
+        Each of *checks* is an (operator, path, expected) test; the loader
+        recompiles once any of them no longer evaluates to *expected*.
+
+        Returns:
+            Loader script as a string.
+
+        """
+        import shlex
+
+        quoted_loader = shlex.quote(str(loader))
+        lines = [
+            "# Generated by dot.py v2.0 - compiled init loader (do not edit)",
+            "# Recompiles only when a watched file is newer than this loader.",
+        ]
+        if shell == "fish":
+            stale = "; or ".join(
+                [
+                    *(f"test {shlex.quote(str(p))} -nt {quoted_loader}" for p in watch),
+                    *(
+                        f"{'not ' if expected else ''}test {op} {shlex.quote(str(p))}"
+                        for op, p, expected in checks
+                    ),
+                ],
+            )
+            lines.extend(
+                [
+                    f"if begin; {stale}; end; and not set -q _dot_recompiling",
+                    "    set -g _dot_recompiling 1",
+                    f"    command {regenerate_cmd} >/dev/null",
+                    f"    source {quoted_loader}",
+                    "    set -e _dot_recompiling",
+                    "else",
+                ],
+            )
+            lines.extend(f"    source {shlex.quote(str(a))}" for a in artifacts)
+            lines.append("end")
+        else:
+            stale = " || ".join(
+                [
+                    *(f"{shlex.quote(str(p))} -nt {quoted_loader}" for p in watch),
+                    *(
+                        f"{'! ' if expected else ''}{op} {shlex.quote(str(p))}"
+                        for op, p, expected in checks
+                    ),
+                ],
+            )
+            lines.extend(
+                [
+                    f"if [[ ( {stale} ) && -z ${{_dot_recompiling-}} ]]; then",
+                    "    _dot_recompiling=1",
+                    f"    command {regenerate_cmd} >/dev/null",
+                    f"    source {quoted_loader}",
+                    "    unset _dot_recompiling",
+                    "else",
+                ],
+            )
+            lines.extend(f"    source {shlex.quote(str(a))}" for a in artifacts)
+            if not artifacts:
+                lines.append("    :")
+            lines.append("fi")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _zcompile(artifact: pathlib.Path) -> None:
+        """Compile a zsh artifact to .zwc, as .zshrc does for itself."""
+        if not shutil.which("zsh"):
+            return
+        import subprocess
+
+        result = subprocess.run(
+            ["zsh", "-fc", 'zcompile "$1"', "zcompile", str(artifact)],
+            check=False,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            logger.debug("zcompile failed for %s: %s", artifact, result.stderr)
+
+    @staticmethod
+    def _prune_artifacts(
+        shell_dir: pathlib.Path, shell: ShellName, digests: dict[str, str]
+    ) -> None:
+        """Remove artifacts left over from previous per-stage snippet digests."""
+        for path in shell_dir.glob(f"*-*.{shell}*"):
+            name = path.name.removesuffix(".zwc").removesuffix(f".{shell}")
+            stage_name, _, artifact_digest = name.partition("-")
+            if stage_name in digests and artifact_digest != digests[stage_name]:
+                path.unlink(missing_ok=True)
 
     def _convert_condition_to_fish(self, condition: str) -> str:
         """Convert bash/zsh condition to fish syntax."""
@@ -750,34 +1591,177 @@ class ShellGenerator:
         return condition.strip()
 
 
+def _atomic_write_text(path: pathlib.Path, content: str) -> None:
+    """Write text to *path* via a same-directory temp file and rename."""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(content, encoding="utf-8")
+    tmp_path.replace(path)
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # CONFIG LOADER - Modern TOML configuration management
 # ═══════════════════════════════════════════════════════════════════════════════
 
 
+def _xdg_cache_dir() -> pathlib.Path:
+    """Return the dot.py cache directory, honoring ``XDG_CACHE_HOME``.
+
+    Returns:
+        Path to the ``dot`` subdirectory of the user cache directory.
+
+    """
+    if xdg_cache := os.environ.get("XDG_CACHE_HOME"):
+        return pathlib.Path(xdg_cache) / "dot"
+    return pathlib.Path.home() / ".cache" / "dot"
+
+
+def _xdg_state_dir() -> pathlib.Path:
+    """Return the dot.py state directory, honoring ``XDG_STATE_HOME``.
+
+    Unlike the cache, state such as backups must survive a cache wipe.
+
+    Returns:
+        Path to the ``dot`` subdirectory of the user state directory.
+
+    """
+    if xdg_state := os.environ.get("XDG_STATE_HOME"):
+        return pathlib.Path(xdg_state) / "dot"
+    return pathlib.Path.home() / ".local" / "state" / "dot"
+
+
+def _xdg_data_dir() -> pathlib.Path:
+    """Return the dot.py data directory, honoring ``XDG_DATA_HOME``.
+
+    Returns:
+        Path to the ``dot`` subdirectory of the user data directory.
+
+    """
+    if xdg_data := os.environ.get("XDG_DATA_HOME"):
+        return pathlib.Path(xdg_data) / "dot"
+    return pathlib.Path.home() / ".local" / "share" / "dot"
+
+
 class ConfigLoader:
-    """Load and parse modern dotfiles configuration."""
+    """Load and parse modern dotfiles configuration.
 
-    def __init__(self, config_path: pathlib.Path | None = None) -> None:
-        """Initialize config loader with path."""
+    Parsed configurations are kept as pickled snapshots under the XDG cache
+    directory. A snapshot is reused only when the TOML path, mtime, size and
+    content hash (plus the dot.py version and HOME) all match, so an edited
+    dot.toml is always reparsed.
+    """
+
+    def __init__(
+        self,
+        config_path: pathlib.Path | None = None,
+        *,
+        cache_dir: pathlib.Path | None = None,
+        use_cache: bool = True,
+    ) -> None:
+        """Initialize config loader with path and snapshot cache options."""
         self.config_path = config_path or pathlib.Path.cwd() / "dot.toml"
+        self.cache_dir = cache_dir or _xdg_cache_dir() / "config"
+        self.use_cache = use_cache
 
     def load(self) -> DotfilesConfig:
-        """Load complete configuration from TOML."""
+        """Load complete configuration from TOML or a matching snapshot."""
         if not self.config_path.exists():
             logger.warning("Config file not found: %s", self.config_path)
             return DotfilesConfig()
 
         try:
-            with self.config_path.open("rb") as f:
-                data = tomllib.load(f)
-            return self._parse_config(data)
+            stat = self.config_path.stat()
+            raw = self.config_path.read_bytes()
         except OSError:
             logger.exception("Failed to read config file")
             raise
+
+        key = self._snapshot_key(stat, raw) if self.use_cache else None
+        if key is not None and (cached := self._read_snapshot(key)) is not None:
+            logger.debug("Loaded config snapshot for %s", self.config_path)
+            return cached
+
+        import tomllib
+
+        try:
+            data = tomllib.loads(raw.decode("utf-8"))
         except tomllib.TOMLDecodeError:
             logger.exception("Invalid TOML syntax")
             raise
+        config = self._parse_config(data)
+
+        if key is not None:
+            self._write_snapshot(key, config)
+        return config
+
+    @property
+    def snapshot_path(self) -> pathlib.Path:
+        """Path of the snapshot file for this config path."""
+        digest = hashlib.sha256(
+            str(self.config_path.absolute()).encode(),
+        ).hexdigest()[:16]
+        return self.cache_dir / f"{digest}.pickle"
+
+    def _snapshot_key(
+        self,
+        stat: os.stat_result,
+        raw: bytes,
+    ) -> tuple[typing.Any, ...]:
+        """Build the identity a snapshot must match to be reused.
+
+        Returns:
+            Tuple of format, versions, path, mtime, size, hash and HOME.
+
+        """
+        try:
+            code_mtime = pathlib.Path(__file__).stat().st_mtime_ns
+        except OSError:
+            code_mtime = 0
+        return (
+            CONFIG_SNAPSHOT_FORMAT,
+            __version__,
+            code_mtime,
+            str(self.config_path.absolute()),
+            stat.st_mtime_ns,
+            stat.st_size,
+            hashlib.sha256(raw).hexdigest(),
+            str(pathlib.Path("~").expanduser()),
+        )
+
+    def _read_snapshot(self, key: tuple[typing.Any, ...]) -> DotfilesConfig | None:
+        """Return the cached config if its snapshot key matches."""
+        try:
+            with self.snapshot_path.open("rb") as f:
+                cached_key, config = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            logger.debug("Ignoring unreadable config snapshot", exc_info=True)
+            return None
+        except (AttributeError, ImportError):
+            # Snapshot refers to classes that no longer exist
+            logger.debug("Ignoring stale config snapshot", exc_info=True)
+            return None
+
+        if cached_key != key or not isinstance(config, DotfilesConfig):
+            return None
+        return config
+
+    def _write_snapshot(
+        self,
+        key: tuple[typing.Any, ...],
+        config: DotfilesConfig,
+    ) -> None:
+        """Atomically persist a config snapshot, ignoring cache failures."""
+        path = self.snapshot_path
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tmp_path.open("wb") as f:
+                pickle.dump((key, config), f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_path.replace(path)
+        except (OSError, pickle.PicklingError):
+            logger.debug("Failed to write config snapshot", exc_info=True)
+            tmp_path.unlink(missing_ok=True)
 
     def _parse_config(self, data: dict[str, typing.Any]) -> DotfilesConfig:
         """Parse TOML data into typed configuration."""
@@ -789,6 +1773,8 @@ class ConfigLoader:
                 config_data.get("source", "~/.dot-config"),
             ).expanduser()
             config.backup = config_data.get("backup", True)
+            config.backup_keep = config_data.get("backup_keep", BACKUP_KEEP)
+            config.trash = config_data.get("trash", False)
 
         # Parse template variables
         if template_data := data.get("template_vars"):
@@ -827,6 +1813,21 @@ class ConfigLoader:
         # Parse packages
         if packages_data := data.get("packages"):
             config.packages = packages_data
+            apt_data = packages_data.get("apt")
+            if isinstance(apt_data, dict) and "update_max_age" in apt_data:
+                max_age = apt_data["update_max_age"]
+                if (
+                    isinstance(max_age, bool)
+                    or not isinstance(max_age, int | float)
+                    or max_age < 0
+                ):
+                    msg = (
+                        "[packages.apt] update_max_age must be a non-negative "
+                        f"number of seconds, got {max_age!r}"
+                    )
+                    raise ValueError(msg)
+        if groups_data := data.get("package_groups"):
+            config.package_groups = groups_data
 
         return config
 
@@ -889,8 +1890,10 @@ class ConfigLoader:
                 shell_integration=prov_data.get("shell_integration", False),
                 stage=stage,
                 install_script=prov_data.get("install_script", ""),
+                script_sha256=prov_data.get("script_sha256", ""),
                 package_name=prov_data.get("package_name", ""),
                 binary_url=prov_data.get("binary_url", ""),
+                binary_sha256=prov_data.get("binary_sha256", ""),
             )
 
         return provisioners
@@ -915,6 +1918,8 @@ class ConfigLoader:
                 zsh=snippet_data.get("zsh", ""),
                 fish=snippet_data.get("fish", ""),
                 default=snippet_data.get("default", ""),
+                cache_command=snippet_data.get("cache_command", ""),
+                cache_inputs=list(snippet_data.get("cache_inputs", [])),
             )
             snippets.append(snippet)
 
@@ -925,334 +1930,2931 @@ class ConfigLoader:
 # PROVISIONER MANAGER - Installation lifecycle management
 # ═══════════════════════════════════════════════════════════════════════════════
 
+# Seconds a successful verify result is trusted without rerunning it
+VERIFY_CACHE_TTL = 24 * 60 * 60
 
-class ProvisionerManager:
-    """Manage provisioner installation lifecycle."""
+# Seconds apt package lists are trusted before `apt-get update` reruns
+APT_UPDATE_MAX_AGE = 6 * 60 * 60
 
-    def __init__(
-        self,
-        provisioners: dict[str, Provisioner],
-        runner: AsyncCommandRunner,
-        platform: Platform,
-    ) -> None:
-        """Initialize provisioner manager with dependencies."""
-        self.provisioners = provisioners
-        self.runner = runner
-        self.platform = platform
-        self.resolver = DependencyResolver(provisioners)
+# Seconds a BINARY download may stall before it is abandoned
+DOWNLOAD_TIMEOUT = 60.0
 
-    async def provision_all(
-        self,
-        filter_type: ProvisionerType | None = None,
-        dry_run: bool = False,
-    ) -> dict[str, Result]:
-        """Provision all or filtered provisioners."""
-        install_order = self.resolver.get_install_order()
+# Language package managers whose `[packages.<name>]` tables are installed
+# next to, not through, the OS package manager
+LANGUAGE_PACKAGE_MANAGERS = ("pip", "npm", "cargo")
 
-        if filter_type:
-            install_order = [
-                name
-                for name in install_order
-                if self.provisioners[name].type == filter_type
-            ]
 
-        # Start with current environment and track PATH updates
-        env = os.environ.copy()
-        current_path = env.get("PATH", "").split(os.pathsep)
+def _parse_dpkg_status(text: str) -> frozenset[str]:
+    """Collect installed package names from a dpkg status file.
 
-        results: dict[str, Result] = {}
-        for name in install_order:
-            provisioner = self.provisioners[name]
+    Returns:
+        Names of packages whose Status field ends in `installed`.
 
-            # Check if already installed
-            if await self._is_installed(provisioner, env):
-                logger.info("✅ %s already installed", name)
-                results[name] = Result.ok()
+    """
+    installed = set()
+    for stanza in text.split("\n\n"):
+        name = ""
+        state = ""
+        for line in stanza.split("\n"):
+            if line.startswith("Package:"):
+                name = line[8:].strip()
+            elif line.startswith("Status:"):
+                state = line.rsplit(None, 1)[-1]
+        if name and state == "installed":
+            installed.add(name)
+    return frozenset(installed)
 
-                # Still need to update PATH for already installed tools
-                if not dry_run:
-                    new_paths = await self._detect_path_additions(provisioner)
-                    for path in new_paths:
-                        if path not in current_path:
-                            current_path.insert(0, path)
-                            env["PATH"] = os.pathsep.join(current_path)
 
-                continue
+class PackageDatabase:
+    """Installed-package sets read straight from local package databases.
+
+    Parses dpkg's status file, lists pacman's local database directory and
+    queries rpm's sqlite name index, so no package manager is spawned. Each
+    set is read once per run and reused until `invalidate` is called after
+    an install.
+    """
+
+    _RPM_DATABASES = ("usr/lib/sysimage/rpm/rpmdb.sqlite", "var/lib/rpm/rpmdb.sqlite")
+
+    def __init__(self, root: pathlib.Path = pathlib.Path("/")) -> None:
+        """Initialize reader for the system rooted at *root*."""
+        self.root = root
+        self._installed: dict[str, frozenset[str] | None] = {}
+
+    def installed(self, manager: str) -> frozenset[str] | None:
+        """Return the package names installed under *manager*.
+
+        Returns:
+            Installed names, or None if the database can't be read natively.
+
+        """
+        if manager not in self._installed:
+            match manager:
+                case "apt":
+                    packages = self._read_dpkg()
+                case "pacman":
+                    packages = self._read_pacman()
+                case "dnf":
+                    packages = self._read_rpm()
+                case _:
+                    packages = None
+            self._installed[manager] = packages
+        return self._installed[manager]
+
+    def invalidate(self, manager: str) -> None:
+        """Forget the installed set for *manager* so it is reread."""
+        self._installed.pop(manager, None)
+
+    def _read_dpkg(self) -> frozenset[str] | None:
+        """Read /var/lib/dpkg/status.
+
+        Returns:
+            Installed names, or None if the status file is unreadable.
+
+        """
+        try:
+            data = (self.root / "var/lib/dpkg/status").read_bytes()
+        except OSError:
+            return None
+        return _parse_dpkg_status(data.decode("utf-8", "replace"))
+
+    def _read_pacman(self) -> frozenset[str] | None:
+        """List /var/lib/pacman/local, whose entries are `<name>-<ver>-<rel>`.
 
-            # Check requirements
-            can_install, missing = self.resolver.check_requirements(provisioner)
-            if not can_install:
-                logger.error("❌ %s missing requirements: %s", name, missing)
-                results[name] = Result.fail(
-                    error=f"Missing requirements: {', '.join(missing)}",
+        Returns:
+            Installed names, or None if the directory is unreadable.
+
+        """
+        try:
+            with os.scandir(self.root / "var/lib/pacman/local") as entries:
+                return frozenset(
+                    entry.name.rsplit("-", 2)[0]
+                    for entry in entries
+                    if entry.is_dir() and entry.name.count("-") >= 2
                 )
+        except OSError:
+            return None
+
+    def _read_rpm(self) -> frozenset[str] | None:
+        """Query the Name index of rpm's sqlite database.
+
+        Returns:
+            Installed names, or None without a readable sqlite database.
+
+        """
+        import sqlite3
+
+        for relative in self._RPM_DATABASES:
+            path = self.root / relative
+            if not path.is_file():
                 continue
+            try:
+                connection = sqlite3.connect(f"{path.as_uri()}?mode=ro", uri=True)
+                try:
+                    rows = connection.execute("SELECT key FROM Name").fetchall()
+                finally:
+                    connection.close()
+            except sqlite3.Error:
+                logger.debug("Failed to read rpm database %s", path, exc_info=True)
+                return None
+            return frozenset(row[0] for row in rows)
+        return None
 
-            # Install provisioner
-            logger.info("🔧 Installing %s: %s", name, provisioner.description)
-            result = await self._install_provisioner(provisioner, dry_run, env)
-            results[name] = result
 
-            if result:
-                logger.info("✅ %s installed successfully", name)
+class AptUpdateCoordinator:
+    """Single-flight `apt-get update` for one provisioning session.
 
-                # Update PATH for subsequent installations
-                if not dry_run:
-                    new_paths = await self._detect_path_additions(provisioner)
-                    for path in new_paths:
-                        if path not in current_path:
-                            current_path.insert(0, path)
-                            env["PATH"] = os.pathsep.join(current_path)
-                            logger.debug(
-                                "Added %s to PATH for subsequent installations",
-                                path,
-                            )
+    The index is refreshed at most once per session, and not at all when
+    the last successful update was within *max_age* seconds and no apt
+    source is newer than it. Callers adding repositories report it with
+    `sources_changed` so the next `ensure_fresh` refreshes regardless.
+
+    The time of the last update comes from a stamp written after each
+    successful refresh, or apt's own `update-success-stamp` if newer. Index
+    mtimes can't be used: apt copies them from the mirror's Last-Modified
+    header and leaves unchanged indexes alone.
+    """
+
+    def __init__(
+        self,
+        runner: AsyncCommandRunner,
+        *,
+        max_age: float = APT_UPDATE_MAX_AGE,
+        root: pathlib.Path = pathlib.Path("/"),
+        stamp: pathlib.Path | None = None,
+    ) -> None:
+        """Initialize coordinator inspecting apt state under *root*."""
+        self.runner = runner
+        self.max_age = max_age
+        self.root = root
+        self.stamp = stamp or _xdg_cache_dir() / "apt-update-success"
+        self._fresh = False
+        self._sources_changed = False
+        self._lock: asyncio.Lock | None = None
+
+    def sources_changed(self) -> None:
+        """Require a refresh because a repository was added this session."""
+        self._fresh = False
+        self._sources_changed = True
+
+    async def ensure_fresh(self) -> None:
+        """Run `apt-get update` unless the index is already fresh.
+
+        Concurrent callers share one refresh. A failed refresh is logged and
+        retried by the next caller.
+        """
+        import asyncio
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if self._fresh:
+                return
+            if not self._sources_changed and self._lists_fresh():
+                logger.debug("apt package lists are fresh, skipping apt-get update")
+                self._fresh = True
+                return
+            result = await self.runner.run(
+                "sudo apt-get update", check=False, capture=True
+            )
+            if result.success:
+                self._fresh = True
+                self._sources_changed = False
+                if not self.runner.dry_run:
+                    self._write_stamp()
             else:
-                logger.error("❌ %s installation failed", name)
+                logger.warning("apt-get update had issues, continuing anyway")
 
-        return results
+    def _write_stamp(self) -> None:
+        """Record that `apt-get update` just succeeded, ignoring failures."""
+        try:
+            self.stamp.parent.mkdir(parents=True, exist_ok=True)
+            self.stamp.touch()
+        except OSError:
+            logger.debug("Failed to write apt update stamp", exc_info=True)
 
-    async def _detect_path_additions(self, provisioner: Provisioner) -> list[str]:
-        """Detect common PATH additions after provisioner installation."""
-        path_additions: list[str] = []
+    def _lists_fresh(self) -> bool:
+        """Check the last update is within *max_age* and newer than every source.
 
-        # Common installation paths based on what the provisioner provides
-        path_patterns = {
-            "cargo": ["~/.cargo/bin"],
-            "rustc": ["~/.cargo/bin"],
-            "rustup": ["~/.cargo/bin"],
-            "npm": ["~/.npm-global/bin", "~/.npm-packages/bin"],
-            "node": ["~/.npm-global/bin", "~/.npm-packages/bin"],
-            "pip": ["~/.local/bin"],
-            "python": ["~/.local/bin"],
-            "go": ["~/go/bin"],
-            "gem": ["~/.gem/ruby/*/bin"],
-            "composer": ["~/.composer/vendor/bin", "~/.config/composer/vendor/bin"],
-        }
+        Returns:
+            True if the on-disk index can be used without a refresh.
 
-        # Check if any provided tools suggest PATH additions
-        for tool in provisioner.provides:
-            if tool in path_patterns:
-                for path_pattern in path_patterns[tool]:
-                    # Handle wildcards in paths (e.g., ruby version)
-                    if "*" in path_pattern:
-                        # Convert path pattern to glob pattern
-                        expanded = pathlib.Path(path_pattern).expanduser()
-                        parent = expanded.parent
-                        pattern = expanded.name
+        """
+        lists = self.root / "var/lib/apt/lists"
+        if _newest_mtime(lists, pattern="*_Packages*") is None:
+            return False  # No package index at all, e.g. a fresh container
+        updated = max(
+            (
+                mtime
+                for mtime in (
+                    _newest_mtime(self.stamp),
+                    _newest_mtime(
+                        self.root / "var/lib/apt/periodic/update-success-stamp"
+                    ),
+                )
+                if mtime is not None
+            ),
+            default=None,
+        )
+        if updated is None or time.time() - updated > self.max_age:
+            return False
+        sources = max(
+            (
+                mtime
+                for mtime in (
+                    _newest_mtime(self.root / "etc/apt/sources.list"),
+                    _newest_mtime(self.root / "etc/apt/sources.list.d"),
+                )
+                if mtime is not None
+            ),
+            default=0.0,
+        )
+        return sources <= updated
 
-                        # For patterns like ~/.gem/ruby/*/bin,
-                        # we need to handle middle wildcards
-                        if "/*/" in str(expanded):
-                            # Split into parts and reconstruct glob pattern
-                            parts = str(expanded).split("/")
-                            base_parts = []
-                            glob_parts = []
-                            found_wildcard = False
 
-                            for part in parts:
-                                if "*" in part:
-                                    found_wildcard = True
-                                if not found_wildcard:
-                                    base_parts.append(part)
-                                else:
-                                    glob_parts.append(part)
+def _newest_mtime(path: pathlib.Path, pattern: str = "") -> float | None:
+    """Find the newest mtime of *path* and, for a directory, its files.
 
-                            if base_parts:
-                                base_path = pathlib.Path("/".join(base_parts))
-                                if base_path.exists():
-                                    glob_pattern = "/".join(glob_parts)
-                                    path_additions.extend(
-                                        str(path)
-                                        for path in base_path.glob(glob_pattern)
-                                        if path.is_dir()
-                                    )
-                        # Simple wildcard at the end
-                        elif parent.exists():
-                            path_additions.extend(
-                                str(path)
-                                for path in parent.glob(pattern)
-                                if path.is_dir()
-                            )
-                    else:
-                        expanded = pathlib.Path(path_pattern).expanduser()
-                        if expanded.exists() and expanded.is_dir():
-                            path_additions.append(str(expanded))
+    With *pattern*, only files of the directory matching it count, not the
+    directory itself.
 
-        return path_additions
+    Returns:
+        Modification time, or None if *path* doesn't exist or no file
+        matches *pattern*.
 
-    async def _is_installed(
-        self,
-        provisioner: Provisioner,
-        env: dict[str, str] | None = None,
-    ) -> bool:
-        """Check if provisioner is already installed."""
-        if not provisioner.verify_command:
-            return False
+    """
+    import fnmatch
 
-        result = await self.runner.run(
-            provisioner.verify_command,
-            check=False,
-            capture=True,
-            env=env,
+    try:
+        newest: float | None = None if pattern else path.stat().st_mtime
+    except OSError:
+        return None
+    if not path.is_dir():
+        return newest
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file() and fnmatch.fnmatchcase(entry.name, pattern or "*"):
+                    mtime = entry.stat().st_mtime
+                    newest = mtime if newest is None else max(newest, mtime)
+    except OSError:
+        pass
+    return newest
+
+
+def _language_package_commands(
+    ecosystem: str, *, upgrade: bool = False
+) -> tuple[str, str]:
+    """Return the listing and install commands for a language ecosystem.
+
+    With *upgrade*, the install command also upgrades packages already
+    installed; `npm install` and `cargo install` do so by default.
+
+    Returns:
+        (list_command, install_command_prefix)
+
+    Raises:
+        ValueError: If *ecosystem* isn't one of LANGUAGE_PACKAGE_MANAGERS.
+
+    """
+    match ecosystem:
+        case "pip":
+            return (
+                "pip list --format=json --disable-pip-version-check",
+                "pip install --user --disable-pip-version-check"
+                + (" --upgrade" if upgrade else ""),
+            )
+        case "npm":
+            return ("npm ls --global --depth=0 --json", "npm install --global")
+        case "cargo":
+            return ("cargo install --list", "cargo install")
+        case _:
+            msg = f"Unsupported language package manager: {ecosystem}"
+            raise ValueError(msg)
+
+
+def _normalize_package_name(ecosystem: str, name: str) -> str:
+    """Normalize *name* the way *ecosystem* compares package names.
+
+    Returns:
+        Name comparable against `_parse_installed_packages` output.
+
+    """
+    if ecosystem == "pip":
+        # PEP 503: case-insensitive, runs of -_. are equivalent
+        return re.sub(r"[-_.]+", "-", name).lower()
+    return name
+
+
+def _parse_installed_packages(ecosystem: str, output: str) -> frozenset[str]:
+    """Parse the installed-package listing of a language ecosystem.
+
+    Returns:
+        Normalized names of installed packages.
+
+    """
+    import json
+
+    match ecosystem:
+        case "pip":
+            # [{"name": "black", "version": "24.4.2"}, ...]
+            return frozenset(
+                _normalize_package_name("pip", entry["name"])
+                for entry in json.loads(output or "[]")
+            )
+        case "npm":
+            # {"dependencies": {"typescript": {"version": "5.4.5"}, ...}}
+            return frozenset(json.loads(output or "{}").get("dependencies", {}))
+        case _:
+            # `cargo install --list`: unindented `<crate> v<version>:` lines,
+            # each followed by its indented binaries
+            return frozenset(
+                line.split()[0]
+                for line in output.splitlines()
+                if line and not line[0].isspace()
+            )
+
+
+def resolve_package_groups(
+    compositions: dict[str, list[str]],
+    group: str,
+) -> list[str]:
+    """Expand *group* into the groups it is composed of, transitively.
+
+    Returns:
+        Group names, included groups before those including them, each once.
+
+    Raises:
+        ValueError: If the composition contains a cycle.
+
+    """
+    resolved: list[str] = []
+
+    def visit(name: str, including: tuple[str, ...]) -> None:
+        if name in including:
+            msg = f"Package group cycle: {' -> '.join((*including, name))}"
+            raise ValueError(msg)
+        if name in resolved:
+            return
+        for included in compositions.get(name, []):
+            visit(included, (*including, name))
+        resolved.append(name)
+
+    visit(group, ())
+    return resolved
+
+
+def select_packages(
+    package_config: dict[str, typing.Any], groups: list[str]
+) -> list[str]:
+    """Combine a `[packages.<manager>]` table's base list with its *groups*.
+
+    Returns:
+        Package names in first-seen order, without duplicates.
+
+    """
+    tables = package_config.get("groups", {})
+    return list(
+        dict.fromkeys(
+            [
+                *package_config.get("packages", []),
+                *(pkg for group in groups for pkg in tables.get(group, [])),
+            ]
         )
-        return result.success
+    )
 
-    async def _install_provisioner(
-        self,
-        provisioner: Provisioner,
-        dry_run: bool = False,
-        env: dict[str, str] | None = None,
-    ) -> Result:
-        """Install a single provisioner."""
-        match provisioner.install_method:
-            case InstallMethod.SCRIPT:
-                return await self._install_via_script(provisioner, dry_run, env)
-            case InstallMethod.PACKAGE:
-                return await self._install_via_package(provisioner, dry_run, env)
-            case InstallMethod.BINARY:
-                return await self._install_via_binary(provisioner, dry_run, env)
 
-    async def _install_via_script(
-        self,
-        provisioner: Provisioner,
-        dry_run: bool = False,
-        env: dict[str, str] | None = None,
-    ) -> Result:
-        """Install via shell script."""
-        if not provisioner.install_script:
-            msg = f"No install script for {provisioner.name}"
-            logger.error(msg)
-            return Result.fail(error=msg)
+class AppliedPackages:
+    """Packages each manager had installed as of its last successful run.
+
+    Selections only grow this record, so switching to a larger group leaves
+    just the delta to check and install. Packages removed by hand since are
+    not noticed; `--no-cache` skips the record.
+    """
+
+    def __init__(self, path: pathlib.Path | None = None) -> None:
+        """Initialize record backed by a JSON file under the XDG cache dir."""
+        self.path = path or _xdg_cache_dir() / "packages-applied.json"
+        self._applied: dict[str, list[str]] | None = None
+
+    def pending(self, manager: str, packages: list[str]) -> list[str]:
+        """Return the *packages* not yet applied for *manager*."""
+        applied = set(self._load().get(manager, []))
+        return [pkg for pkg in packages if pkg not in applied]
+
+    def record(self, manager: str, packages: list[str]) -> None:
+        """Add *packages* to what *manager* has applied and persist."""
+        applied = self._load()
+        applied[manager] = list(dict.fromkeys([*applied.get(manager, []), *packages]))
+        import json
 
         try:
-            result = await self.runner.run(
-                provisioner.install_script,
-                env=env,
-                check=False,
-                capture=True,
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            _atomic_write_text(self.path, json.dumps(applied, indent=2))
+        except OSError:
+            logger.debug("Failed to write applied packages", exc_info=True)
+
+    def _load(self) -> dict[str, list[str]]:
+        """Read the record once, treating unreadable data as empty.
+
+        Returns:
+            Mapping of package manager to applied package names.
+
+        """
+        if self._applied is None:
+            import json
+
+            try:
+                data = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                data = {}
+            self._applied = (
+                {k: v for k, v in data.items() if isinstance(v, list)}
+                if isinstance(data, dict)
+                else {}
             )
-            if not result.success:
-                logger.error("Failed to install %s", provisioner.name)
-                if result.stderr:
-                    logger.error("Error output:\n%s", result.stderr)
-                if result.stdout:
-                    logger.debug("Standard output:\n%s", result.stdout)
-                return Result.fail(
-                    error=result.stderr or f"Script failed for {provisioner.name}",
-                )
-        except Exception as e:
-            logger.exception("Failed to install %s", provisioner.name)
-            return Result.fail(error=str(e))
-        else:
-            return Result.ok()
+        return self._applied
 
-    async def _install_via_package(
-        self,
-        provisioner: Provisioner,
-        dry_run: bool = False,
-        env: dict[str, str] | None = None,
-    ) -> Result:
-        """Install via package manager."""
-        pkg_manager = self.platform.get_package_manager()
-        if not pkg_manager:
-            msg = f"No package manager available for {provisioner.name}"
-            logger.error(msg)
-            return Result.fail(error=msg)
 
-        pkg_name = provisioner.package_name or provisioner.name
+# Shell syntax that keeps an install script from being a lone `curl | sh`
+_SCRIPT_SYNTAX = re.compile(r"[;&<>()$`\n]|\|\|")
+
+
+def _remote_installer(script: str) -> tuple[str, str] | None:
+    """Split a `curl URL | sh ARGS` install script into URL and shell command.
+
+    Returns:
+        The URL and the shell half of the pipeline, or None if *script* is
+        anything else.
+
+    """
+    import shlex
+
+    if _SCRIPT_SYNTAX.search(script) or script.count("|") != 1:
+        return None
+    fetch, shell = (part.strip() for part in script.split("|"))
+    try:
+        fetch_argv, shell_argv = shlex.split(fetch), shlex.split(shell)
+    except ValueError:
+        return None
+    urls = [arg for arg in fetch_argv if arg.startswith(("https://", "http://"))]
+    if (
+        not fetch_argv
+        or fetch_argv[0] != "curl"
+        or len(urls) != 1
+        or not shell_argv
+        or shell_argv[0] not in {"sh", "bash"}
+    ):
+        return None
+    return urls[0], shell
+
+
+class DownloadCache:
+    """Content-addressed cache of downloaded files.
+
+    Content lives under `blobs/<sha256>` and `index.json` maps each URL to
+    its blob plus the ETag/Last-Modified validators used to revalidate it,
+    so an unchanged file costs a 304 and a declared checksum already in the
+    cache costs no request at all. Interrupted downloads stay in `partial/`
+    and resume with a Range request while the server still has the same
+    representation (If-Range). An https URL redirected to plain http is
+    refused rather than cached.
+    """
+
+    _CHUNK = 1 << 16
+
+    def __init__(
+        self,
+        root: pathlib.Path | None = None,
+        *,
+        timeout: float = DOWNLOAD_TIMEOUT,
+        context: ssl.SSLContext | None = None,
+    ) -> None:
+        """Initialize cache rooted under the XDG cache dir."""
+        import threading
+
+        self.root = root or _xdg_cache_dir() / "downloads"
+        self.timeout = timeout
+        self.context = context
+        # Fetches run in worker threads; the index is read-modify-written
+        self._index_lock = threading.Lock()
+
+    def fetch(self, url: str, sha256: str = "") -> pathlib.Path:
+        """Return a local file holding the content of *url*.
+
+        With *sha256*, a blob with that digest is served without touching
+        the network and downloaded content must match it. Without, the
+        cached copy is revalidated and, if the server can't be reached,
+        reused with a warning.
+
+        Returns:
+            Path of the cached blob; callers must not modify it.
+
+        Raises:
+            OSError: If the download fails and no usable copy is cached.
+            ValueError: If the downloaded content doesn't match *sha256* or
+                an https *url* redirects to plain http.
+
+        """
+        import urllib.error
+        from http import HTTPStatus
+
+        sha256 = sha256.lower()
+        if sha256 and (blob := self._blob(sha256)).is_file():
+            logger.debug("Download cache hit for %s", url)
+            return blob
+        entry = self._load_index().get(url, {})
+        cached = self._blob(entry["sha256"]) if entry.get("sha256") else None
+        if cached is not None and (
+            not cached.is_file() or (sha256 and entry["sha256"] != sha256)
+        ):
+            cached, entry = None, {}
+        try:
+            return self._download(url, sha256, entry)
+        except OSError as e:
+            if cached is None:
+                raise
+            if (
+                isinstance(e, urllib.error.HTTPError)
+                and e.code == HTTPStatus.NOT_MODIFIED
+            ):
+                logger.debug("Cached download of %s is current", url)
+                return cached
+            logger.warning("Could not revalidate %s, using cached copy", url)
+            return cached
+
+    def _download(self, url: str, sha256: str, entry: dict[str, str]) -> pathlib.Path:
+        """Download *url* into the cache, resuming a partial file if possible.
+
+        Returns:
+            Path of the blob holding the downloaded content.
+
+        Raises:
+            ConnectionError: If the body is shorter than the server announced.
+            ValueError: If the content doesn't match *sha256* or an https
+                *url* redirects to plain http.
+
+        """
+        import http.client
+        import json
+        import urllib.error
+        import urllib.request
+        from http import HTTPStatus
+
+        partial_dir = self.root / "partial"
+        partial_dir.mkdir(parents=True, exist_ok=True)
+        key = hashlib.sha256(url.encode()).hexdigest()
+        partial = partial_dir / f"{key}.part"
+        partial_meta = partial_dir / f"{key}.json"
+
+        headers = {"User-Agent": f"dot.py/{__version__}"}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        offset = 0
+        try:
+            validator = json.loads(partial_meta.read_text()).get("validator", "")
+            offset = partial.stat().st_size if validator else 0
+        except (OSError, ValueError, AttributeError):
+            validator = ""
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+
+        request = urllib.request.Request(url, headers=headers)
+        try:
+            response = urllib.request.urlopen(
+                request, timeout=self.timeout, context=self.context
+            )
+        except urllib.error.HTTPError as e:
+            if e.code != HTTPStatus.NOT_MODIFIED:
+                # e.g. 416 for a stale partial; start over next time
+                partial.unlink(missing_ok=True)
+                partial_meta.unlink(missing_ok=True)
+            raise
+        with response:
+            # urllib follows redirects across schemes; curl's --proto wouldn't
+            final_url = response.geturl()
+            if url.startswith("https://") and not final_url.startswith("https://"):
+                msg = f"Refusing {url}: redirected to non-https {final_url}"
+                raise ValueError(msg)
+            hasher = hashlib.sha256()
+            resumed = offset and response.status == HTTPStatus.PARTIAL_CONTENT
+            if resumed:
+                logger.debug("Resuming download of %s at byte %d", url, offset)
+                with partial.open("rb") as existing:
+                    while chunk := existing.read(self._CHUNK):
+                        hasher.update(chunk)
+            etag = response.headers.get("ETag", "")
+            last_modified = response.headers.get("Last-Modified", "")
+            # Strong ETags or dates identify the bytes a later resume continues
+            resume_validator = (
+                etag if etag and not etag.startswith("W/") else last_modified
+            )
+            _atomic_write_text(
+                partial_meta, json.dumps({"validator": resume_validator})
+            )
+            expected = self._expected_size(response, offset if resumed else 0)
+            with partial.open("ab" if resumed else "wb") as out:
+                try:
+                    while chunk := response.read(self._CHUNK):
+                        hasher.update(chunk)
+                        out.write(chunk)
+                except http.client.HTTPException as e:
+                    msg = f"Download of {url} was cut off: {e!r}"
+                    raise ConnectionError(msg) from e
+
+        # A short body stays in partial/ for the next attempt to resume
+        size = partial.stat().st_size
+        if expected is not None and size != expected:
+            msg = f"Incomplete download of {url}: got {size} of {expected} bytes"
+            raise ConnectionError(msg)
+        digest = hasher.hexdigest()
+        if sha256 and digest != sha256:
+            partial.unlink(missing_ok=True)
+            partial_meta.unlink(missing_ok=True)
+            msg = f"Checksum mismatch for {url}: expected {sha256}, got {digest}"
+            raise ValueError(msg)
+        blob = self._blob(digest)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        partial.replace(blob)
+        partial_meta.unlink(missing_ok=True)
+        self._record(
+            url, {"sha256": digest, "etag": etag, "last_modified": last_modified}
+        )
+        return blob
+
+    @staticmethod
+    def _expected_size(response: http.client.HTTPResponse, offset: int) -> int | None:
+        """Total size the downloaded file must reach, if the server says.
+
+        Returns:
+            The Content-Range total of a 206, else *offset* plus
+            Content-Length, or None when neither is given.
+
+        """
+        from http import HTTPStatus
+
+        if response.status == HTTPStatus.PARTIAL_CONTENT:
+            total = response.headers.get("Content-Range", "").rpartition("/")[2]
+            if total.isdigit():
+                return int(total)
+        length = response.headers.get("Content-Length", "")
+        return offset + int(length) if length.isdigit() else None
+
+    def pinned(self, url: str) -> str:
+        """Return the sha256 of the content last downloaded from *url*, if any."""
+        return self._load_index().get(url, {}).get("sha256", "")
+
+    def _blob(self, sha256: str) -> pathlib.Path:
+        """Return the path content with digest *sha256* is stored at."""
+        return self.root / "blobs" / sha256
+
+    def _load_index(self) -> dict[str, dict[str, str]]:
+        """Read the URL index, treating unreadable data as empty.
+
+        Returns:
+            Mapping of URL to its blob digest and validators.
+
+        """
+        import json
+
+        try:
+            data = json.loads((self.root / "index.json").read_text())
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        return {k: v for k, v in data.items() if isinstance(v, dict)}
+
+    def _record(self, url: str, entry: dict[str, str]) -> None:
+        """Point *url* at *entry* in the index and persist."""
+        import json
+
+        with self._index_lock:
+            index = self._load_index()
+            index[url] = entry
+            try:
+                _atomic_write_text(
+                    self.root / "index.json", json.dumps(index, indent=2)
+                )
+            except OSError:
+                logger.debug("Failed to write download index", exc_info=True)
+
+
+class VerificationCache:
+    """Persistent record of verify commands that recently succeeded.
+
+    An entry is keyed by the command, the PATH it ran with and the resolved
+    path, mtime and size of every binary it invokes, so replacing or
+    removing a binary (or changing PATH) misses the cache. Only commands
+    made of simple `&&`-joined invocations are cached; anything using other
+    shell syntax always runs. Failures are never cached.
+    """
+
+    # Shell syntax whose effect can't be captured by binary signatures
+    _UNCACHEABLE = re.compile(r"[|;<>()$`*?\[\]{}~\\\n]|(?<!&)&(?!&)")
+
+    def __init__(
+        self,
+        path: pathlib.Path | None = None,
+        *,
+        ttl: float = VERIFY_CACHE_TTL,
+    ) -> None:
+        """Initialize cache backed by a JSON file under the XDG cache dir."""
+        self.path = path or _xdg_cache_dir() / "verify.json"
+        self.ttl = ttl
+        self._entries: dict[str, float] | None = None
+
+    def key(self, command: str, env: dict[str, str] | None = None) -> str | None:
+        """Build the cache key for *command* run with *env*.
+
+        Returns:
+            Hex digest, or None if the command can't be cached.
+
+        """
+        import shlex
+
+        if self._UNCACHEABLE.search(command):
+            return None
+        search_path = (env if env is not None else os.environ).get("PATH", "")
+        parts: list[typing.Any] = [command, search_path]
+        for segment in command.split("&&"):
+            try:
+                argv = shlex.split(segment)
+            except ValueError:
+                return None
+            if not argv or "=" in argv[0] or argv[0] == "test":
+                return None
+            binary = shutil.which(argv[0], path=search_path)
+            if binary is None:
+                return None
+            try:
+                resolved = pathlib.Path(binary).resolve()
+                stat = resolved.stat()
+            except OSError:
+                return None
+            parts.append((str(resolved), stat.st_mtime_ns, stat.st_size))
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    def hit(self, key: str) -> bool:
+        """Check whether *key* succeeded within the TTL.
+
+        Returns:
+            True if the verify command can be skipped.
+
+        """
+        recorded = self._load().get(key)
+        return recorded is not None and time.time() - recorded < self.ttl
+
+    def record(self, key: str) -> None:
+        """Record a success for *key* and persist, dropping expired entries."""
+        now = time.time()
+        entries = self._load()
+        entries[key] = now
+        for stale in [k for k, at in entries.items() if now - at >= self.ttl]:
+            del entries[stale]
+        import json
+
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            _atomic_write_text(self.path, json.dumps(entries))
+        except OSError:
+            logger.debug("Failed to write verification cache", exc_info=True)
+
+    def _load(self) -> dict[str, float]:
+        """Read the cache file once, treating unreadable data as empty.
+
+        Returns:
+            Mapping of key to the time it last succeeded.
+
+        """
+        if self._entries is None:
+            import json
+
+            try:
+                data = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                data = {}
+            self._entries = (
+                {k: v for k, v in data.items() if isinstance(v, (int, float))}
+                if isinstance(data, dict)
+                else {}
+            )
+        return self._entries
+
+
+class ProvisionerManager:
+    """Manage provisioner installation lifecycle."""
+
+    def __init__(
+        self,
+        provisioners: dict[str, Provisioner],
+        runner: AsyncCommandRunner,
+        platform: Platform,
+        verify_cache: VerificationCache | None = None,
+        package_db: PackageDatabase | None = None,
+        apt_updates: AptUpdateCoordinator | None = None,
+        downloads: DownloadCache | None = None,
+    ) -> None:
+        """Initialize provisioner manager with dependencies.
+
+        With *verify_cache*, verify commands that recently succeeded against
+        the same binaries are not rerun. With *package_db*, package installs
+        are skipped for packages its database already lists. Apt installs
+        refresh the index through *apt_updates*, shared with other callers
+        in the session when given. BINARY downloads go through *downloads*.
+        """
+        self.provisioners = provisioners
+        self.runner = runner
+        self.platform = platform
+        self.verify_cache = verify_cache
+        self.package_db = package_db
+        self.apt_updates = apt_updates or AptUpdateCoordinator(runner)
+        self.downloads = downloads or DownloadCache()
+        # URL -> cached file, filled by prefetch() and by installs
+        self.prefetched: dict[str, pathlib.Path] = {}
+        # PATH including additions detected by the last provision_all
+        self.search_path = os.environ.get("PATH", "")
+        self.resolver = DependencyResolver(provisioners)
+        self._package_lock: asyncio.Lock | None = None
+
+    async def provision_all(
+        self,
+        filter_type: ProvisionerType | None = None,
+        dry_run: bool = False,
+        max_concurrent: int = 4,
+    ) -> dict[str, Result]:
+        """Provision all or filtered provisioners, independent ones concurrently.
+
+        A provisioner starts once every selected provisioner providing its
+        `requires` has finished; `priority` only orders provisioners that are
+        ready at the same time. PACKAGE provisioners that become ready
+        together are installed in one package manager transaction, and
+        package manager installs are serialized since they contend for the
+        same lock.
+
+        Returns:
+            Mapping of provisioner name to Result, in priority order.
+
+        """
+        import asyncio
+
+        install_order = self._selected(filter_type)
+        selected = set(install_order)
+        dependencies = {
+            name: self.resolver.get_dependencies(name) & selected
+            for name in install_order
+        }
+
+        # PATH shared across branches; each provisioner starts from a snapshot,
+        # which includes additions from every provider it waited on
+        current_path = os.environ.get("PATH", "").split(os.pathsep)
+        results: dict[str, Result] = {}
+        pending = list(install_order)
+        running: list[list[str]] = []
+        finished: set[str] = set()
+        wake = asyncio.Event()
+
+        async def provision_group(names: list[str]) -> None:
+            env = os.environ.copy()
+            env["PATH"] = os.pathsep.join(current_path)
+            try:
+                if len(names) == 1:
+                    results[names[0]] = await self._provision_one(
+                        self.provisioners[names[0]],
+                        env,
+                        current_path,
+                        dry_run,
+                    )
+                else:
+                    results.update(
+                        await self._provision_package_batch(
+                            [self.provisioners[name] for name in names],
+                            env,
+                            current_path,
+                            dry_run,
+                        )
+                    )
+            except Exception as e:
+                logger.exception("Failed to provision %s", ", ".join(names))
+                results.update(dict.fromkeys(names, Result.fail(error=str(e))))
+            finally:
+                running.remove(names)
+                finished.update(names)
+                wake.set()
+
+        async with asyncio.TaskGroup() as tg:
+            while pending or running:
+                ready = [name for name in pending if dependencies[name] <= finished]
+                if not ready and not running:
+                    # Dependency cycle: fall back to priority order
+                    logger.warning("Dependency cycle among: %s", ", ".join(pending))
+                    ready = pending[:1]
+                # Ready PACKAGE provisioners share one slot and one transaction
+                groups: list[list[str]] = []
+                batch: list[str] = []
+                for name in ready:
+                    if self.provisioners[name].install_method is InstallMethod.PACKAGE:
+                        if not batch:
+                            groups.append(batch)
+                        batch.append(name)
+                    else:
+                        groups.append([name])
+                for group in groups[: max(1, max_concurrent) - len(running)]:
+                    for name in group:
+                        pending.remove(name)
+                    running.append(group)
+                    tg.create_task(provision_group(group))
+                wake.clear()
+                if running:
+                    await wake.wait()
+
+        self.search_path = os.pathsep.join(current_path)
+        return {name: results[name] for name in install_order}
+
+    def _selected(self, filter_type: ProvisionerType | None) -> list[str]:
+        """List provisioners of *filter_type* (all if None) in install order.
+
+        Returns:
+            Provisioner names in priority order.
+
+        """
+        install_order = self.resolver.get_install_order()
+        if filter_type:
+            install_order = [
+                name
+                for name in install_order
+                if self.provisioners[name].type == filter_type
+            ]
+        return install_order
+
+    async def mergeable_packages(
+        self,
+        filter_type: ProvisionerType | None = None,
+    ) -> list[str]:
+        """Find packages that can join the system package transaction.
+
+        These belong to selected PACKAGE provisioners that depend on no other
+        selected provisioner and whose verify command fails. Once installed
+        with the system packages, `provision_all` finds them installed.
+
+        Returns:
+            Package names in install order.
+
+        """
+        import asyncio
+
+        selected = self._selected(filter_type)
+        candidates = [
+            self.provisioners[name]
+            for name in selected
+            if self.provisioners[name].install_method is InstallMethod.PACKAGE
+            and not self.resolver.get_dependencies(name) & set(selected)
+            and self.resolver.check_requirements(self.provisioners[name])[0]
+        ]
+        verified = await asyncio.gather(
+            *(self._is_installed(provisioner) for provisioner in candidates)
+        )
+        return [
+            provisioner.package_name or provisioner.name
+            for provisioner, installed in zip(candidates, verified, strict=True)
+            if not installed
+        ]
+
+    async def prefetch(self, filter_type: ProvisionerType | None = None) -> None:
+        """Download artifacts of selected BINARY and SCRIPT provisioners.
+
+        Meant to run while system packages install, so that when a
+        provisioner's turn comes its binary or `curl URL | sh` installer is
+        already in the download cache. Provisioners that verify as installed
+        are skipped. Failures are only logged; the install step then
+        downloads for itself.
+        """
+        import asyncio
+
+        candidates = [
+            self.provisioners[name]
+            for name in self._selected(filter_type)
+            if self._artifact(self.provisioners[name])
+        ]
+        verified = await asyncio.gather(
+            *(self._is_installed(provisioner) for provisioner in candidates)
+        )
+        urls = dict(
+            artifact
+            for provisioner, installed in zip(candidates, verified, strict=True)
+            if not installed and (artifact := self._artifact(provisioner))
+        )
+
+        async def fetch(url: str, sha256: str) -> None:
+            try:
+                await self._fetch_artifact(url, sha256)
+            except Exception:
+                # e.g. http.client.IncompleteRead; one failure mustn't cancel the rest
+                logger.debug("Prefetch of %s failed", url, exc_info=True)
+
+        if urls:
+            logger.info("Prefetching %d artifact(s)", len(urls))
+        async with asyncio.TaskGroup() as tg:
+            for url, sha256 in urls.items():
+                tg.create_task(fetch(url, sha256))
+
+    @staticmethod
+    def _artifact(provisioner: Provisioner) -> tuple[str, str] | None:
+        """Return the URL *provisioner* downloads at install time and its digest.
+
+        Returns:
+            URL and declared sha256 (empty if not pinned), or None.
+
+        """
+        match provisioner.install_method:
+            case InstallMethod.BINARY if provisioner.binary_url:
+                return provisioner.binary_url, provisioner.binary_sha256
+            case InstallMethod.SCRIPT:
+                remote = _remote_installer(provisioner.install_script)
+                if not remote or not remote[0].startswith("https://"):
+                    return None
+                return remote[0], provisioner.script_sha256
+            case _:
+                return None
+
+    async def _fetch_artifact(self, url: str, sha256: str = "") -> pathlib.Path:
+        """Fetch *url* through the download cache once per session.
+
+        Reports when the content differs from what the URL served last time.
+
+        Returns:
+            Path of the cached content.
+
+        Raises:
+            OSError: If nothing usable could be fetched or found cached.
+            ValueError: If the content doesn't match *sha256*.
+
+        """
+        import asyncio
+
+        if url not in self.prefetched:
+            previous = self.downloads.pinned(url)
+            blob = await asyncio.to_thread(self.downloads.fetch, url, sha256)
+            if previous and blob.name != previous:
+                logger.warning(
+                    "Content of %s changed upstream (sha256 %s -> %s)",
+                    url,
+                    previous,
+                    blob.name,
+                )
+            self.prefetched[url] = blob
+        return self.prefetched[url]
+
+    async def _provision_one(
+        self,
+        provisioner: Provisioner,
+        env: dict[str, str],
+        current_path: list[str],
+        dry_run: bool,
+        *,
+        installed: bool | None = None,
+    ) -> Result:
+        """Verify or install one provisioner and record its PATH additions.
+
+        *installed* is the verify outcome when the caller already has it.
+
+        Returns:
+            Result of the installation (ok if already installed).
+
+        """
+        name = provisioner.name
+
+        # Check if already installed
+        if installed is None:
+            installed = await self._is_installed(provisioner, env)
+        if installed:
+            logger.info("✅ %s already installed", name)
+
+            # Still need to update PATH for already installed tools
+            if not dry_run:
+                self._extend_path(
+                    current_path,
+                    await self._detect_path_additions(provisioner),
+                )
+            return Result.ok()
+
+        # Check requirements
+        can_install, missing = self.resolver.check_requirements(provisioner)
+        if not can_install:
+            logger.error("❌ %s missing requirements: %s", name, missing)
+            return Result.fail(error=f"Missing requirements: {', '.join(missing)}")
+
+        # Install provisioner
+        logger.info("🔧 Installing %s: %s", name, provisioner.description)
+        result = await self._install_provisioner(provisioner, dry_run, env)
+
+        if result:
+            logger.info("✅ %s installed successfully", name)
+
+            # Update PATH for subsequent installations
+            if not dry_run:
+                self._extend_path(
+                    current_path,
+                    await self._detect_path_additions(provisioner),
+                )
+        else:
+            logger.error("❌ %s installation failed", name)
+
+        return result
+
+    async def _provision_package_batch(
+        self,
+        provisioners: list[Provisioner],
+        env: dict[str, str],
+        current_path: list[str],
+        dry_run: bool,
+    ) -> dict[str, Result]:
+        """Verify PACKAGE provisioners, then install the missing ones together.
+
+        If the combined transaction fails, the missing provisioners are
+        installed one at a time so each gets its own result.
+
+        Returns:
+            Mapping of provisioner name to Result.
+
+        """
+        import asyncio
+
+        verified = await asyncio.gather(
+            *(self._is_installed(provisioner, env) for provisioner in provisioners)
+        )
+        missing = [
+            provisioner
+            for provisioner, installed in zip(provisioners, verified, strict=True)
+            if not installed and self.resolver.check_requirements(provisioner)[0]
+        ]
+
+        batched: set[str] = set()
+        if len(missing) > 1:
+            label = ", ".join(provisioner.name for provisioner in missing)
+            logger.info("🔧 Installing %s in one transaction", label)
+            result = await self._install_packages(
+                [
+                    provisioner.package_name or provisioner.name
+                    for provisioner in missing
+                ],
+                env,
+                label=label,
+            )
+            if result:
+                batched = {provisioner.name for provisioner in missing}
+            else:
+                logger.warning(
+                    "Combined install failed, installing %d packages one at a time",
+                    len(missing),
+                )
+
+        results: dict[str, Result] = {}
+        for provisioner, installed in zip(provisioners, verified, strict=True):
+            if provisioner.name in batched:
+                logger.info("✅ %s installed successfully", provisioner.name)
+                if not dry_run:
+                    self._extend_path(
+                        current_path,
+                        await self._detect_path_additions(provisioner),
+                    )
+                results[provisioner.name] = Result.ok()
+            else:
+                results[provisioner.name] = await self._provision_one(
+                    provisioner,
+                    env,
+                    current_path,
+                    dry_run,
+                    installed=installed,
+                )
+        return results
+
+    @staticmethod
+    def _extend_path(current_path: list[str], new_paths: list[str]) -> None:
+        """Prepend new PATH entries for provisioners that start later."""
+        for path in new_paths:
+            if path not in current_path:
+                current_path.insert(0, path)
+                logger.debug("Added %s to PATH for subsequent installations", path)
+
+    async def _detect_path_additions(self, provisioner: Provisioner) -> list[str]:
+        """Detect common PATH additions after provisioner installation."""
+        path_additions: list[str] = []
+
+        # Common installation paths based on what the provisioner provides
+        path_patterns = {
+            "cargo": ["~/.cargo/bin"],
+            "rustc": ["~/.cargo/bin"],
+            "rustup": ["~/.cargo/bin"],
+            "npm": ["~/.npm-global/bin", "~/.npm-packages/bin"],
+            "node": ["~/.npm-global/bin", "~/.npm-packages/bin"],
+            "pip": ["~/.local/bin"],
+            "python": ["~/.local/bin"],
+            "go": ["~/go/bin"],
+            "gem": ["~/.gem/ruby/*/bin"],
+            "composer": ["~/.composer/vendor/bin", "~/.config/composer/vendor/bin"],
+        }
+
+        # Check if any provided tools suggest PATH additions
+        for tool in provisioner.provides:
+            if tool in path_patterns:
+                for path_pattern in path_patterns[tool]:
+                    # Handle wildcards in paths (e.g., ruby version)
+                    if "*" in path_pattern:
+                        # Convert path pattern to glob pattern
+                        expanded = pathlib.Path(path_pattern).expanduser()
+                        parent = expanded.parent
+                        pattern = expanded.name
+
+                        # For patterns like ~/.gem/ruby/*/bin,
+                        # we need to handle middle wildcards
+                        if "/*/" in str(expanded):
+                            # Split into parts and reconstruct glob pattern
+                            parts = str(expanded).split("/")
+                            base_parts = []
+                            glob_parts = []
+                            found_wildcard = False
+
+                            for part in parts:
+                                if "*" in part:
+                                    found_wildcard = True
+                                if not found_wildcard:
+                                    base_parts.append(part)
+                                else:
+                                    glob_parts.append(part)
+
+                            if base_parts:
+                                base_path = pathlib.Path("/".join(base_parts))
+                                if base_path.exists():
+                                    glob_pattern = "/".join(glob_parts)
+                                    path_additions.extend(
+                                        str(path)
+                                        for path in base_path.glob(glob_pattern)
+                                        if path.is_dir()
+                                    )
+                        # Simple wildcard at the end
+                        elif parent.exists():
+                            path_additions.extend(
+                                str(path)
+                                for path in parent.glob(pattern)
+                                if path.is_dir()
+                            )
+                    else:
+                        expanded = pathlib.Path(path_pattern).expanduser()
+                        if expanded.exists() and expanded.is_dir():
+                            path_additions.append(str(expanded))
+
+        return path_additions
+
+    async def _is_installed(
+        self,
+        provisioner: Provisioner,
+        env: dict[str, str] | None = None,
+        *,
+        timeout: float | None = None,
+    ) -> bool:
+        """Check if provisioner is already installed.
+
+        A verify command still running after *timeout* seconds is killed
+        and counts as not installed.
+        """
+        if not provisioner.verify_command:
+            return False
+
+        key = None
+        if self.verify_cache is not None and not self.runner.dry_run:
+            key = self.verify_cache.key(provisioner.verify_command, env)
+            if key is not None and self.verify_cache.hit(key):
+                logger.debug("Verified %s from cache", provisioner.name)
+                return True
+
+        result = await self.runner.run(
+            provisioner.verify_command,
+            check=False,
+            capture=True,
+            env=env,
+            timeout=timeout,
+        )
+        if result.success and key is not None and self.verify_cache is not None:
+            self.verify_cache.record(key)
+        return result.success
+
+    async def _install_provisioner(
+        self,
+        provisioner: Provisioner,
+        dry_run: bool = False,
+        env: dict[str, str] | None = None,
+    ) -> Result:
+        """Install a single provisioner."""
+        match provisioner.install_method:
+            case InstallMethod.SCRIPT:
+                return await self._install_via_script(provisioner, dry_run, env)
+            case InstallMethod.PACKAGE:
+                return await self._install_via_package(provisioner, dry_run, env)
+            case InstallMethod.BINARY:
+                return await self._install_via_binary(provisioner, dry_run, env)
+
+    async def _install_via_script(
+        self,
+        provisioner: Provisioner,
+        dry_run: bool = False,
+        env: dict[str, str] | None = None,
+    ) -> Result:
+        """Install via shell script."""
+        import shlex
+
+        if not provisioner.install_script:
+            msg = f"No install script for {provisioner.name}"
+            logger.error(msg)
+            return Result.fail(error=msg)
+
+        script = provisioner.install_script
+        remote = _remote_installer(script)
+        if remote and not remote[0].startswith("https://"):
+            msg = f"Refusing to run installer for {provisioner.name} over {remote[0]}"
+            logger.error(msg)
+            return Result.fail(error=msg)
+        if remote and not (dry_run or self.runner.dry_run):
+            url, shell = remote
+            try:
+                installer = await self._fetch_artifact(url, provisioner.script_sha256)
+            except ValueError as e:
+                msg = f"Refusing to run installer for {provisioner.name}: {e}"
+                logger.exception(msg)
+                return Result.fail(error=msg)
+            except OSError as e:
+                # Never fall back to piping a possibly truncated body into sh
+                msg = f"Failed to download installer for {provisioner.name}"
+                logger.exception(msg)
+                return Result.fail(error=str(e) or msg)
+            else:
+                # Run the verified cached copy instead of piping from curl
+                script = f"{shell} < {shlex.quote(str(installer))}"
+
+        try:
+            result = await self.runner.run(
+                script,
+                env=env,
+                check=False,
+                capture=True,
+            )
+            if not result.success:
+                logger.error("Failed to install %s", provisioner.name)
+                if result.stderr:
+                    logger.error("Error output:\n%s", result.stderr)
+                if result.stdout:
+                    logger.debug("Standard output:\n%s", result.stdout)
+                return Result.fail(
+                    error=result.stderr or f"Script failed for {provisioner.name}",
+                )
+        except Exception as e:
+            logger.exception("Failed to install %s", provisioner.name)
+            return Result.fail(error=str(e))
+        else:
+            return Result.ok()
+
+    async def _install_via_package(
+        self,
+        provisioner: Provisioner,
+        dry_run: bool = False,
+        env: dict[str, str] | None = None,
+    ) -> Result:
+        """Install via package manager."""
+        return await self._install_packages(
+            [provisioner.package_name or provisioner.name],
+            env,
+            label=provisioner.name,
+        )
+
+    async def _install_packages(
+        self,
+        packages: list[str],
+        env: dict[str, str] | None = None,
+        *,
+        label: str,
+    ) -> Result:
+        """Install *packages* in a single package manager transaction.
+
+        Packages the package database already lists are left out; *label*
+        names what is being installed in log and error messages.
+        """
+        pkg_manager = self.platform.get_package_manager()
+        if not pkg_manager:
+            msg = f"No package manager available for {label}"
+            logger.error(msg)
+            return Result.fail(error=msg)
+
+        if self.package_db is not None:
+            installed = self.package_db.installed(pkg_manager) or frozenset()
+            for pkg_name in [pkg for pkg in packages if pkg in installed]:
+                logger.info("%s is already installed via %s", pkg_name, pkg_manager)
+            packages = [pkg for pkg in packages if pkg not in installed]
+            if not packages:
+                return Result.ok()
+
+        names = " ".join(packages)
+        match pkg_manager:
+            case "apt":
+                cmd = f"sudo apt-get install -y {names}"
+            case "brew":
+                cmd = f"brew install {names}"
+            case "dnf":
+                cmd = f"sudo dnf install -y {names}"
+            case "pacman":
+                cmd = f"sudo pacman -S --noconfirm {names}"
+            case _:
+                msg = f"Unsupported package manager: {pkg_manager}"
+                logger.error(msg)
+                return Result.fail(error=msg)
+
+        import asyncio
+
+        # Package managers hold a global lock; concurrent branches take turns
+        if self._package_lock is None:
+            self._package_lock = asyncio.Lock()
+
+        try:
+            async with self._package_lock:
+                if pkg_manager == "apt":
+                    await self.apt_updates.ensure_fresh()
+                result = await self.runner.run(cmd, env=env, check=False, capture=True)
+                if self.package_db is not None:
+                    self.package_db.invalidate(pkg_manager)
+            if not result.success:
+                logger.error("Failed to install %s via %s", label, pkg_manager)
+                if result.stderr:
+                    logger.error("Error output:\n%s", result.stderr)
+                return Result.fail(
+                    error=result.stderr
+                    or f"Failed to install {label} via {pkg_manager}",
+                )
+        except Exception as e:
+            logger.exception("Failed to install %s", label)
+            return Result.fail(error=str(e))
+        else:
+            return Result.ok()
+
+    async def _install_via_binary(
+        self,
+        provisioner: Provisioner,
+        dry_run: bool = False,
+        env: dict[str, str] | None = None,
+    ) -> Result:
+        """Install via direct binary download, served from the download cache."""
+        import shlex
+
+        if not provisioner.binary_url:
+            msg = f"No binary URL for {provisioner.name}"
+            logger.error(msg)
+            return Result.fail(error=msg)
+
+        if dry_run or self.runner.dry_run:
+            logger.info(
+                "[DRY RUN] Would download %s to /usr/local/bin/%s",
+                provisioner.binary_url,
+                provisioner.name,
+            )
+            return Result.ok()
+
+        try:
+            blob = await self._fetch_artifact(
+                provisioner.binary_url, provisioner.binary_sha256
+            )
+        except (OSError, ValueError) as e:
+            msg = f"Failed to download {provisioner.name}"
+            logger.exception("%s. Error output:", msg)
+            return Result.fail(error=str(e) or msg)
+
+        try:
+            # Copy out of the cache so the blob stays pristine for reuse
+            result = await self.runner.run(
+                f"sudo install -m 0755 {shlex.quote(str(blob))} "
+                f"/usr/local/bin/{provisioner.name}",
+                env=env,
+                check=False,
+                capture=True,
+            )
+            if not result.success:
+                msg = f"Failed to move {provisioner.name} to /usr/local/bin/"
+                logger.error(msg)
+                if result.stderr:
+                    logger.error("Error output:\n%s", result.stderr)
+                return Result.fail(error=result.stderr or msg)
+        except Exception as e:
+            logger.exception("Failed to install %s", provisioner.name)
+            return Result.fail(error=str(e))
+        else:
+            return Result.ok()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# STARTUP BENCHMARKS - Interactive shell startup latency
+# ═══════════════════════════════════════════════════════════════════════════════
+
+# Environment for the opt-in fast startup modes of the mise/starship configs
+BENCH_FAST_MODE_ENV = {"MISE_STARTUP_MODE": "fast", "STARSHIP_PROFILE": "fast"}
+
+
+def _stability_band(cv_pct: float) -> str:
+    """Classify run-to-run noise by coefficient of variation.
+
+    Returns:
+        One of excellent, good, fair or noisy.
+
+    """
+    if cv_pct < 3.0:
+        return "excellent"
+    if cv_pct < 6.0:
+        return "good"
+    if cv_pct < 10.0:
+        return "fair"
+    return "noisy"
+
+
+def run_startup_benchmark(
+    name: str,
+    command: list[str],
+    *,
+    runs: int,
+    warmup: int,
+    cwd: pathlib.Path | None = None,
+    env: dict[str, str] | None = None,
+    timeout: float = BENCH_RUN_TIMEOUT,
+) -> BenchmarkStats:
+    """Time *command* directly, without a wrapping shell or hyperfine.
+
+    Warmup iterations populate filesystem and compiled-init caches and are
+    discarded. Output is sent to /dev/null so terminal I/O is not measured.
+
+    Returns:
+        BenchmarkStats over the measured runs.
+
+    Raises:
+        ValueError: If *runs* is less than 1.
+        TimeoutError: If one run takes longer than *timeout* seconds.
+
+    """
+    import subprocess
+
+    if runs < 1:
+        msg = f"Need at least one measured run, got {runs}"
+        raise ValueError(msg)
+    run_env = {**os.environ, **(env or {})}
+    samples = []
+    for i in range(warmup + runs):
+        start = time.perf_counter_ns()
+        try:
+            subprocess.run(
+                command,
+                cwd=cwd,
+                env=run_env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=False,
+                timeout=timeout,
+            )
+        except subprocess.TimeoutExpired as e:
+            msg = f"{' '.join(command)} did not exit within {timeout:g}s"
+            raise TimeoutError(msg) from e
+        elapsed_ms = (time.perf_counter_ns() - start) / 1_000_000
+        if i >= warmup:
+            samples.append(elapsed_ms)
+    return BenchmarkStats.from_samples(name, command, samples, env)
+
+
+def _mann_whitney_p(before: list[float], after: list[float]) -> float:
+    """Two-sided Mann-Whitney U test via the tie-corrected normal approximation.
+
+    Startup times are skewed by occasional slow runs, so a rank test is
+    used rather than comparing means.
+
+    Returns:
+        p-value for the hypothesis that both samples share a distribution.
+
+    """
+    import math
+
+    n1, n2 = len(before), len(after)
+    if not n1 or not n2:
+        return 1.0
+    ranked = sorted([(value, 0) for value in before] + [(value, 1) for value in after])
+    rank_sum = 0.0
+    tie_term = 0.0
+    i = 0
+    while i < len(ranked):
+        j = i
+        while j + 1 < len(ranked) and ranked[j + 1][0] == ranked[i][0]:
+            j += 1
+        average_rank = (i + j) / 2 + 1
+        rank_sum += average_rank * sum(1 for k in range(i, j + 1) if ranked[k][1] == 0)
+        tied = j - i + 1
+        tie_term += tied**3 - tied
+        i = j + 1
+
+    u = rank_sum - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / math.sqrt(variance)  # continuity corrected
+    return min(1.0, math.erfc(max(z, 0.0) / math.sqrt(2)))
+
+
+def write_bench_run(
+    run_dir: pathlib.Path,
+    results: list[BenchmarkStats],
+    meta: dict[str, typing.Any],
+) -> pathlib.Path:
+    """Store a benchmark run as structured JSON.
+
+    Returns:
+        Path to the written bench.json.
+
+    """
+    import json
+
+    run_dir.mkdir(parents=True, exist_ok=True)
+    path = run_dir / "bench.json"
+    payload = {
+        "meta": meta,
+        "benchmarks": [dataclasses.asdict(result) for result in results],
+    }
+    _atomic_write_text(path, json.dumps(payload, indent=2) + "\n")
+    return path
+
+
+def load_bench_run(run_dir: pathlib.Path) -> dict[str, BenchmarkStats]:
+    """Load the benchmarks of a run written by `write_bench_run`.
+
+    Returns:
+        Mapping of benchmark name to BenchmarkStats.
+
+    """
+    import json
+
+    payload = json.loads((run_dir / "bench.json").read_text())
+    return {entry["name"]: BenchmarkStats(**entry) for entry in payload["benchmarks"]}
+
+
+def compare_bench_runs(
+    before_dir: pathlib.Path,
+    after_dir: pathlib.Path,
+    alpha: float = 0.05,
+) -> list[BenchComparison]:
+    """Compare benchmarks present in both runs with a significance test.
+
+    A change is only reported as faster/slower when the Mann-Whitney p-value
+    is below *alpha*; otherwise the difference is treated as noise.
+
+    Returns:
+        One BenchComparison per benchmark name common to both runs.
+
+    """
+    before_run = load_bench_run(before_dir)
+    after_run = load_bench_run(after_dir)
+    comparisons = []
+    for name, before in before_run.items():
+        if (after := after_run.get(name)) is None:
+            continue
+        p_value = _mann_whitney_p(before.samples_ms, after.samples_ms)
+        verdict: typing.Literal["faster", "slower", "unchanged"] = "unchanged"
+        if p_value < alpha:
+            verdict = "faster" if after.p50_ms < before.p50_ms else "slower"
+        delta_pct = (
+            (after.p50_ms - before.p50_ms) / before.p50_ms * 100
+            if before.p50_ms
+            else 0.0
+        )
+        comparisons.append(
+            BenchComparison(
+                name=name,
+                before_ms=before.p50_ms,
+                after_ms=after.p50_ms,
+                delta_pct=delta_pct,
+                p_value=p_value,
+                verdict=verdict,
+            ),
+        )
+    return comparisons
+
+
+def _bench_artifact_root() -> pathlib.Path:
+    """Directory holding benchmark runs, shared with scripts/shell_perf.sh.
+
+    Returns:
+        ``$SHELL_PERF_ARTIFACT_ROOT`` or ``.artifacts/shell-perf`` next to dot.py.
+
+    """
+    if root := os.environ.get("SHELL_PERF_ARTIFACT_ROOT"):
+        return pathlib.Path(root)
+    return pathlib.Path(__file__).resolve().parent / ".artifacts" / "shell-perf"
+
+
+def _latest_bench_runs(root: pathlib.Path, count: int) -> list[pathlib.Path]:
+    """Most recent run directories containing bench.json, oldest first.
+
+    Returns:
+        Up to *count* run directories.
+
+    """
+    runs = sorted(root.glob("*/bench.json"), key=lambda path: path.stat().st_mtime)
+    return [path.parent for path in runs[-count:]]
+
+
+def _format_table(header: tuple[str, ...], rows: list[tuple[str, ...]]) -> str:
+    """Render rows as left-aligned first column, right-aligned numbers.
+
+    Returns:
+        Table text ending in a newline.
+
+    """
+    table = [header, *rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(header))]
+    lines = [
+        "  ".join(
+            cell.ljust(width) if i == 0 else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(line, widths, strict=True))
+        ).rstrip()
+        for line in table
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def format_bench_results(results: list[BenchmarkStats]) -> str:
+    """Render benchmark statistics as a plain-text table.
+
+    Returns:
+        Table text ending in a newline.
+
+    """
+    return _format_table(
+        ("BENCHMARK", "MEAN ms", "STDDEV", "CV %", "P50", "P95", "MAX", "STABILITY"),
+        [
+            (
+                result.name,
+                f"{result.mean_ms:.2f}",
+                f"{result.stddev_ms:.2f}",
+                f"{result.cv_pct:.2f}",
+                f"{result.p50_ms:.2f}",
+                f"{result.p95_ms:.2f}",
+                f"{result.max_ms:.2f}",
+                result.stability,
+            )
+            for result in results
+        ],
+    )
+
+
+def format_bench_comparison(comparisons: list[BenchComparison]) -> str:
+    """Render before/after medians with significance.
+
+    Returns:
+        Table text ending in a newline.
+
+    """
+    return _format_table(
+        ("BENCHMARK", "BEFORE p50", "AFTER p50", "DELTA %", "P-VALUE", "VERDICT"),
+        [
+            (
+                item.name,
+                f"{item.before_ms:.2f}",
+                f"{item.after_ms:.2f}",
+                f"{item.delta_pct:+.1f}",
+                f"{item.p_value:.4f}",
+                item.verdict,
+            )
+            for item in comparisons
+        ],
+    )
+
+
+def run_bench(
+    shells: list[ShellName],
+    *,
+    runs: int,
+    warmup: int,
+    cwd: pathlib.Path | None = None,
+    run_dir: pathlib.Path | None = None,
+    with_fast_mode: bool = False,
+) -> tuple[pathlib.Path, list[BenchmarkStats]]:
+    """Benchmark `<shell> -i -c exit` for each installed shell.
+
+    Returns:
+        (run directory holding bench.json, results)
+
+    """
+    import datetime
+    import platform
+
+    now = datetime.datetime.now(datetime.UTC).astimezone()
+    run_dir = run_dir or _bench_artifact_root() / now.strftime("%Y%m%d-%H%M%S")
+    modes: list[tuple[str, dict[str, str]]] = [("", {})]
+    if with_fast_mode:
+        modes.append(("-fast", BENCH_FAST_MODE_ENV))
+
+    results = []
+    for shell in shells:
+        if shutil.which(shell) is None:
+            logger.warning("Skipping %s: not installed", shell)
+            continue
+        for suffix, env in modes:
+            name = f"{shell}-startup{suffix}"
+            logger.info("Benchmarking %s (runs=%d warmup=%d)", name, runs, warmup)
+            try:
+                results.append(
+                    run_startup_benchmark(
+                        name,
+                        [shell, "-i", "-c", "exit"],
+                        runs=runs,
+                        warmup=warmup,
+                        cwd=cwd,
+                        env=env,
+                    ),
+                )
+            except TimeoutError as e:
+                logger.warning("Skipping %s: %s", name, e)
+
+    meta = {
+        "runs": runs,
+        "warmup": warmup,
+        "cwd": str(cwd or pathlib.Path.cwd()),
+        "generated_at": now.isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "dot_version": __version__,
+    }
+    write_bench_run(run_dir, results, meta)
+    return run_dir, results
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# SYMLINK CLASSIFICATION - Batched changeset planning
+# ═══════════════════════════════════════════════════════════════════════════════
+
+# Mappings classified serially to gauge filesystem latency before fanning out
+CLASSIFY_PROBE = 256
+
+# Mean seconds per probed mapping above which the rest go to a thread pool;
+# on local disks and tmpfs threads only add GIL contention
+CLASSIFY_PARALLEL_LATENCY = 100e-6
+
+
+class SymlinkClassifier:
+    """Classify dest -> source mappings with as few syscalls as possible.
+
+    Each dest costs one lstat, plus a readlink when it is a symlink, and each
+    source one stat. A symlink is OK when its target names the source either
+    as given or under the source root resolved once up front; `resolve()`
+    only runs for symlinks pointing anywhere else. Large mapping sets on
+    high-latency filesystems (NFS, FUSE) are spread over a thread pool.
+    """
+
+    def __init__(
+        self,
+        home: pathlib.Path,
+        protected: collections.abc.Iterable[pathlib.Path] = (),
+        source_root: pathlib.Path | None = None,
+    ) -> None:
+        """Initialize classifier for dests under *home*."""
+        self.home = home
+        self.protected = frozenset(protected)
+        self._root = str(source_root) if source_root else ""
+        self._real_root = os.path.realpath(source_root) if source_root else ""
+
+    def classify(self, source: pathlib.Path, dest: pathlib.Path) -> SymlinkAction:
+        """Classify what action is needed to link *dest* to *source*."""
+        import stat
+
+        try:
+            source.stat()
+        except OSError:
+            return SymlinkAction.SKIP
+        try:
+            mode = dest.lstat().st_mode
+        except OSError:
+            return SymlinkAction.CREATE
+
+        if stat.S_ISLNK(mode):
+            if self._links_to(dest, source):
+                return SymlinkAction.OK
+            return SymlinkAction.REPLACE
+        if stat.S_ISDIR(mode):
+            try:
+                rel = dest.relative_to(self.home)
+            except ValueError:
+                return SymlinkAction.DELETING
+            if rel in self.protected:
+                return SymlinkAction.PROTECTED
+            return SymlinkAction.DELETING
+        return SymlinkAction.REPLACE
+
+    def classify_all(
+        self,
+        mappings: collections.abc.Sequence[tuple[pathlib.Path, pathlib.Path]],
+    ) -> list[SymlinkAction]:
+        """Classify (source, dest) *mappings*, in threads if syscalls are slow.
+
+        The first CLASSIFY_PROBE mappings run serially; when they averaged
+        more than CLASSIFY_PARALLEL_LATENCY each, the rest fan out.
+
+        Returns:
+            Actions in the order of *mappings*.
+
+        """
+        start = time.perf_counter()
+        probed = [
+            self.classify(source, dest) for source, dest in mappings[:CLASSIFY_PROBE]
+        ]
+        rest = mappings[CLASSIFY_PROBE:]
+        if not rest:
+            return probed
+        if time.perf_counter() - start < CLASSIFY_PARALLEL_LATENCY * len(probed):
+            return probed + [self.classify(source, dest) for source, dest in rest]
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        workers = min(32, (os.cpu_count() or 1) * 4)
+        logger.debug("Classifying %d mappings in %d threads", len(rest), workers)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return probed + list(
+                pool.map(lambda mapping: self.classify(*mapping), rest, chunksize=64)
+            )
+
+    def _links_to(self, dest: pathlib.Path, source: pathlib.Path) -> bool:
+        """Check whether symlink *dest* ends up at *source*."""
+        try:
+            target = str(dest.readlink())
+        except OSError:
+            return False
+        given = str(source)
+        if target == given or (
+            self._root
+            and given.startswith(self._root + os.sep)
+            and target == self._real_root + given[len(self._root) :]
+        ):
+            return True
+        # Relative or indirect links: compare the fully resolved paths
+        return dest.resolve() == source.resolve()
+
+
+# Directories modified this close to when they were last checked are
+# rechecked entry by entry, since a later change may not move their mtime
+JOURNAL_RACY_NS = 1_000_000_000
+
+
+class InstallJournal:
+    """Persistent record of symlinks the last `install` left in place.
+
+    Each entry keeps the dest's link target, the source's inode and mtime
+    and a hash of the mapping's config. Parent directories of sources and
+    dests are recorded with their inode and mtime, so while a directory is
+    unchanged nothing inside it can have been added, removed or replaced,
+    and its entries need no syscalls at all. Entries under changed
+    directories are still trusted if their own identity matches. `install
+    --full` and `--no-cache` ignore the journal.
+    """
+
+    def __init__(self, path: pathlib.Path | None = None) -> None:
+        """Initialize journal backed by a JSON file under the XDG cache dir."""
+        self.path = path or _xdg_cache_dir() / "install-journal.json"
+        self._state: dict[str, dict[str, typing.Any]] | None = None
+        # Filled by unchanged() for record() of the same run
+        self._fresh: set[str] = set()
+        self._observed: dict[str, list[int]] = {}
+
+    @staticmethod
+    def entry_key(source: pathlib.Path, dest: pathlib.Path, is_dir: bool) -> str:
+        """Hash the config of one mapping.
+
+        Returns:
+            Hex digest changing whenever the mapping's config does.
+
+        """
+        return hashlib.sha256(f"{source}\0{dest}\0{is_dir}".encode()).hexdigest()
+
+    def unchanged(self, plans: collections.abc.Sequence[SymlinkPlan]) -> set[str]:
+        """Find mappings among *plans* still linked as the journal recorded.
+
+        Returns:
+            Dests (as strings) that need no classification.
+
+        """
+        state = self._load()
+        entries, dirs = state["entries"], state["dirs"]
+        self._observed = {}
+        for plan in plans:
+            for directory in (str(plan.dest.parent), str(plan.source.parent)):
+                if directory not in self._observed:
+                    self._observed[directory] = self._stat_dir(directory)
+
+        def clean(directory: str) -> bool:
+            recorded, seen = dirs.get(directory), self._observed[directory]
+            return (
+                recorded is not None
+                and recorded[:2] == seen[:2]
+                and recorded[1] < recorded[2] - JOURNAL_RACY_NS
+            )
+
+        fresh: set[str] = set()
+        for plan in plans:
+            dest = str(plan.dest)
+            entry = entries.get(dest)
+            if not entry or entry.get("config") != self.entry_key(
+                plan.source, plan.dest, plan.is_dir
+            ):
+                continue
+            if clean(str(plan.dest.parent)) and clean(str(plan.source.parent)):
+                fresh.add(dest)
+                continue
+            try:
+                stat = plan.source.stat()
+                target = str(plan.dest.readlink())
+            except OSError:
+                continue
+            if (target, stat.st_ino, stat.st_mtime_ns) == (
+                entry.get("target"),
+                entry.get("source_ino"),
+                entry.get("source_mtime_ns"),
+            ):
+                fresh.add(dest)
+        self._fresh = fresh
+        return fresh
+
+    def record(self, plans: collections.abc.Sequence[SymlinkPlan]) -> None:
+        """Replace the journal with *plans*, whose dests now link to their sources.
+
+        Entries found fresh by `unchanged` keep their records; the others
+        are stat'ed. Directories keep the state observed before the install
+        touched them, so changes made since show up next run.
+        """
+        import json
+
+        previous = self._load()["entries"]
+        entries: dict[str, dict[str, typing.Any]] = {}
+        dirs: dict[str, list[int]] = {}
+        for plan in plans:
+            dest = str(plan.dest)
+            if dest in self._fresh and dest in previous:
+                entries[dest] = previous[dest]
+            else:
+                try:
+                    stat = plan.source.stat()
+                    target = str(plan.dest.readlink())
+                except OSError:
+                    continue
+                entries[dest] = {
+                    "config": self.entry_key(plan.source, plan.dest, plan.is_dir),
+                    "source": str(plan.source),
+                    "target": target,
+                    "source_ino": stat.st_ino,
+                    "source_mtime_ns": stat.st_mtime_ns,
+                }
+            for directory in (str(plan.dest.parent), str(plan.source.parent)):
+                if directory not in dirs:
+                    dirs[directory] = self._observed.get(directory) or self._stat_dir(
+                        directory
+                    )
+        self._state = {"entries": entries, "dirs": dirs}
+        self._fresh, self._observed = set(), {}
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            _atomic_write_text(self.path, json.dumps(self._state))
+        except OSError:
+            logger.debug("Failed to write install journal", exc_info=True)
+
+    @staticmethod
+    def _stat_dir(directory: str) -> list[int]:
+        """Return inode, mtime and the time of the check for *directory*."""
+        checked = time.time_ns()
+        try:
+            stat = pathlib.Path(directory).stat()
+        except OSError:
+            return [0, 0, checked]
+        return [stat.st_ino, stat.st_mtime_ns, checked]
+
+    def _load(self) -> dict[str, dict[str, typing.Any]]:
+        """Read the journal once, treating unreadable data as empty.
+
+        Returns:
+            Mapping with "entries" by dest and "dirs" by path.
+
+        """
+        if self._state is None:
+            import json
+
+            try:
+                data = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                data = {}
+            if not isinstance(data, dict):
+                data = {}
+            self._state = {
+                key: value if isinstance(value := data.get(key), dict) else {}
+                for key in ("entries", "dirs")
+            }
+        return self._state
+
+
+class TrashBin:
+    """Holding area for real directories replaced by symlinks.
+
+    Renaming a directory into the trash is atomic and instant when both sit
+    on one filesystem, so the symlink takes its place right away while the
+    tree is deleted later, by a detached `rm -rf` after `install` or by
+    `cleanup`. A directory on another filesystem than the trash is renamed
+    to a hidden sibling (`.<name>.dot-trash.<ns>`) instead.
+    """
+
+    def __init__(self, root: pathlib.Path | None = None) -> None:
+        """Initialize trash under the XDG data dir, which lives in home."""
+        self.root = root or _xdg_data_dir() / "trash"
+        # Entries moved by this instance, for reap_in_background
+        self.moved: list[pathlib.Path] = []
+
+    def move(self, path: pathlib.Path) -> pathlib.Path | None:
+        """Rename *path* into the trash, or beside itself on another filesystem.
+
+        Returns:
+            Its new location, or None if it could not be renamed (EXDEV).
+
+        """
+        import errno
+
+        stamp = time.time_ns()
+        if self._same_device(path):
+            self.root.mkdir(parents=True, exist_ok=True)
+            target = self.root / f"{path.name}.{stamp}"
+        else:
+            target = path.with_name(f".{path.name}{TRASH_SUFFIX}{stamp}")
+        try:
+            path.rename(target)
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                return None
+            raise
+        self.moved.append(target)
+        logger.debug("Moved %s to %s", path, target)
+        return target
+
+    def entries(
+        self, dests: collections.abc.Iterable[pathlib.Path] = ()
+    ) -> list[pathlib.Path]:
+        """List what is waiting to be deleted, in the trash and beside *dests*."""
+        import contextlib
+
+        found: set[pathlib.Path] = set()
+        with contextlib.suppress(OSError):
+            found.update(self.root.iterdir())
+        for dest in dests:
+            with contextlib.suppress(OSError):
+                found.update(dest.parent.glob(f".{dest.name}{TRASH_SUFFIX}*"))
+        return sorted(found)
+
+    def reap(
+        self, dests: collections.abc.Iterable[pathlib.Path] = ()
+    ) -> list[pathlib.Path]:
+        """Delete everything in the trash and trashed siblings of *dests*.
+
+        Returns:
+            Entries that were removed.
+
+        """
+        import shutil
+
+        removed = []
+        for entry in self.entries(dests):
+            try:
+                if entry.is_dir() and not entry.is_symlink():
+                    shutil.rmtree(entry)
+                else:
+                    entry.unlink()
+            except OSError:
+                logger.warning("Failed to empty trash entry %s", entry, exc_info=True)
+            else:
+                removed.append(entry)
+        return removed
+
+    def reap_in_background(self) -> None:
+        """Delete what this instance moved in a process that may outlive dot.py.
+
+        Entries left by other runs, possibly still being reaped by their own
+        process, are left to `cleanup`.
+        """
+        import subprocess
+
+        entries, self.moved = self.moved, []
+        if not entries:
+            return
+        subprocess.Popen(
+            ["rm", "-rf", "--", *map(str, entries)],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        logger.debug("Reaping %d trash entry(ies) in the background", len(entries))
+
+    def _same_device(self, path: pathlib.Path) -> bool:
+        """Check whether the trash is (or will be) on *path*'s filesystem."""
+        anchor = self.root
+        while not anchor.exists() and anchor != anchor.parent:
+            anchor = anchor.parent
+        try:
+            return anchor.stat().st_dev == path.lstat().st_dev
+        except OSError:
+            return False
+
+
+class BackupStore:
+    """Snapshots of dests taken before install replaces them.
+
+    Each install run gets a directory holding a manifest and one copy per
+    replaced file or tree. Copies are reflink clones (FICLONE) where the
+    filesystem supports them, so backups cost no data blocks on btrfs or
+    xfs; files unchanged since a previous run's copy are hardlinked to it,
+    and only the rest are copied. A directory about to be removed anyway is
+    renamed into the run instead. Symlinks are recorded by target alone.
+    """
+
+    def __init__(
+        self,
+        root: pathlib.Path | None = None,
+        *,
+        keep: int = BACKUP_KEEP,
+    ) -> None:
+        """Initialize backups under the XDG state dir, retaining *keep* runs."""
+        self.root = root or _xdg_state_dir() / "backups"
+        self.keep = max(keep, 1)
+        self._run: pathlib.Path | None = None
+        self._entries: list[BackupEntry] = []
+        self._previous: dict[pathlib.Path, BackupEntry] = {}
+        self._reflink = sys.platform == "linux"
+
+    def runs(self) -> list[str]:
+        """List runs holding a manifest, oldest first."""
+        try:
+            return sorted(
+                run.name
+                for run in self.root.iterdir()
+                if (run / "manifest.json").exists()
+            )
+        except OSError:
+            return []
+
+    def entries(self, run: str) -> list[BackupEntry]:
+        """Load the manifest of *run*; unreadable manifests list nothing."""
+        import json
+
+        run_dir = self.root / run
+        try:
+            data = json.loads((run_dir / "manifest.json").read_text(encoding="utf-8"))
+            return [
+                BackupEntry(
+                    dest=pathlib.Path(item["dest"]),
+                    kind=item["kind"],
+                    data=run_dir / "data" / str(index),
+                    target=item.get("target", ""),
+                )
+                for index, item in enumerate(data["entries"])
+            ]
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.debug("Unreadable backup manifest in %s", run_dir, exc_info=True)
+            return []
+
+    def snapshot(self, dest: pathlib.Path, *, move: bool = False) -> bool:
+        """Back up *dest* into the current run, starting one if needed.
+
+        With *move*, a directory is renamed into the run rather than copied
+        when it lives on the same filesystem.
+
+        Returns:
+            True if *dest* was moved away, False if it is still in place.
+
+        """
+        import json
+        import stat
+
+        mode = dest.lstat().st_mode
+        if not (stat.S_ISLNK(mode) or stat.S_ISDIR(mode) or stat.S_ISREG(mode)):
+            logger.debug("Not backing up special file %s", dest)
+            return False
+        run = self._run or self._begin()
+        entry = BackupEntry(
+            dest=dest,
+            kind="file",
+            data=run / "data" / str(len(self._entries)),
+        )
+        previous = self._previous.get(dest)
+        counts = dict.fromkeys(("reflink", "hardlink", "copy"), 0)
+        moved = False
+        try:
+            if stat.S_ISLNK(mode):
+                entry.kind = "symlink"
+                entry.target = str(dest.readlink())
+            elif stat.S_ISDIR(mode):
+                entry.kind = "dir"
+                moved = move and self._rename(dest, entry.data)
+                seed = previous.data if previous and previous.kind == "dir" else None
+                if not moved:
+                    counts = self._copy_tree(dest, entry.data, seed)
+            else:
+                seed = previous.data if previous and previous.kind == "file" else None
+                counts[self._copy_file(dest, entry.data, seed)] += 1
+        except OSError:
+            # Free the slot, or the next snapshot would collide with the remains
+            if entry.data.is_dir():
+                shutil.rmtree(entry.data, ignore_errors=True)
+            else:
+                entry.data.unlink(missing_ok=True)
+            raise
+
+        self._entries.append(entry)
+        manifest = {
+            "entries": [
+                {"dest": str(e.dest), "kind": e.kind}
+                | ({"target": e.target} if e.kind == "symlink" else {})
+                for e in self._entries
+            ],
+        }
+        _atomic_write_text(run / "manifest.json", json.dumps(manifest))
+        if moved:
+            logger.debug("Backed up %s by moving it to %s", dest, entry.data)
+        else:
+            logger.debug(
+                "Backed up %s (%d reflinked, %d hardlinked, %d copied)",
+                dest,
+                counts["reflink"],
+                counts["hardlink"],
+                counts["copy"],
+            )
+        return moved
+
+    def finish(self) -> None:
+        """Close the current run and prune runs beyond the retention limit."""
+        if self._run is not None:
+            logger.info(
+                "Backed up %d replaced path(s) to %s", len(self._entries), self._run
+            )
+        self._run = None
+        self._entries = []
+        for run in self.runs()[: -self.keep]:
+            try:
+                shutil.rmtree(self.root / run)
+            except OSError:
+                logger.warning("Failed to prune backup %s", run, exc_info=True)
+            else:
+                logger.debug("Pruned backup %s", run)
+
+    def restore(self, entry: BackupEntry) -> None:
+        """Put *entry* back at its dest, replacing a file or symlink there.
+
+        Raises:
+            IsADirectoryError: A real directory occupies the dest.
+
+        """
+        import errno
+
+        dest = entry.dest
+        if dest.is_dir() and not dest.is_symlink():
+            raise IsADirectoryError(errno.EISDIR, "Refusing to replace", str(dest))
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        staging = dest.with_name(f".{dest.name}.{os.getpid()}.restore")
+        match entry.kind:
+            case "symlink":
+                staging.symlink_to(entry.target)
+            case "dir":
+                self._copy_tree(entry.data, staging, None)
+            case _:
+                self._clone(entry.data, staging)
+        if entry.kind == "dir" and (dest.exists() or dest.is_symlink()):
+            dest.unlink()
+        staging.replace(dest)
+
+    def _begin(self) -> pathlib.Path:
+        """Create this run's directory and index the latest copy of each dest.
+
+        Returns:
+            The run directory.
+
+        """
+        for run in self.runs():
+            self._previous.update((e.dest, e) for e in self.entries(run))
+        now = time.time_ns()
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.localtime(now // 1_000_000_000))
+        self._run = self.root / f"{stamp}.{now % 1_000_000_000:09d}"
+        (self._run / "data").mkdir(parents=True)
+        return self._run
+
+    @staticmethod
+    def _rename(source: pathlib.Path, target: pathlib.Path) -> bool:
+        """Rename *source* to *target* unless they are on different devices.
+
+        Returns:
+            True if renamed, False if a copy is needed instead.
+
+        """
+        import errno
+
+        try:
+            source.rename(target)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            return False
+        return True
+
+    def _copy_tree(
+        self,
+        source: pathlib.Path,
+        target: pathlib.Path,
+        seed: pathlib.Path | None,
+    ) -> dict[str, int]:
+        """Copy the tree at *source*, hardlinking files unchanged in *seed*.
+
+        Returns:
+            Number of files reflinked, hardlinked and copied.
+
+        """
+        import stat
+
+        def fail(error: OSError) -> typing.NoReturn:
+            raise error
+
+        counts = dict.fromkeys(("reflink", "hardlink", "copy"), 0)
+        target.mkdir()
+        dirs = [(source, target)]
+        for dirpath, dirnames, filenames in os.walk(source, onerror=fail):
+            rel = pathlib.Path(dirpath).relative_to(source)
+            for name in (*dirnames, *filenames):
+                src, dst = source / rel / name, target / rel / name
+                mode = src.lstat().st_mode
+                if stat.S_ISLNK(mode):
+                    dst.symlink_to(src.readlink())
+                elif stat.S_ISDIR(mode):
+                    dst.mkdir()
+                    dirs.append((src, dst))
+                elif stat.S_ISREG(mode):
+                    previous = seed / rel / name if seed is not None else None
+                    counts[self._copy_file(src, dst, previous)] += 1
+        # Directory modes and times last, once nothing more is written inside
+        for src, dst in reversed(dirs):
+            shutil.copystat(src, dst)
+        return counts
+
+    def _copy_file(
+        self,
+        source: pathlib.Path,
+        target: pathlib.Path,
+        previous: pathlib.Path | None,
+    ) -> str:
+        """Hardlink *previous* if it matches *source*, else clone *source*.
+
+        Returns:
+            ``"hardlink"``, ``"reflink"`` or ``"copy"``.
+
+        """
+        if previous is not None:
+            try:
+                st, prev = source.stat(), previous.lstat()
+                if (st.st_size, st.st_mtime_ns) == (prev.st_size, prev.st_mtime_ns):
+                    target.hardlink_to(previous)
+                    return "hardlink"
+            except OSError:
+                logger.debug("Cannot reuse %s", previous, exc_info=True)
+        return self._clone(source, target)
+
+    def _clone(self, source: pathlib.Path, target: pathlib.Path) -> str:
+        """Copy a regular file, sharing its extents when the filesystem allows.
+
+        Returns:
+            ``"reflink"`` if *target* was cloned with FICLONE, else ``"copy"``.
+
+        """
+        if self._reflink and sys.platform == "linux":
+            import fcntl
+
+            with source.open("rb") as src, target.open("wb") as dst:
+                try:
+                    fcntl.ioctl(dst.fileno(), fcntl.FICLONE, src.fileno())
+                except OSError:
+                    # Unsupported here; later files would fail the same way
+                    self._reflink = False
+            if self._reflink:
+                shutil.copystat(source, target)
+                return "reflink"
+        shutil.copy2(source, target)
+        return "copy"
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PLAN RENDERING - Install changeset output by destination
+# ═══════════════════════════════════════════════════════════════════════════════
+
+# Status label and rich style per planned action
+PLAN_LABELS: dict[SymlinkAction, tuple[str, str]] = {
+    SymlinkAction.OK: ("[OK]", "green"),
+    SymlinkAction.CREATE: ("[CREATE]", "blue"),
+    SymlinkAction.REPLACE: ("[REPLACE]", "yellow"),
+    SymlinkAction.DELETING: ("[DELETING]", "bold red"),
+    SymlinkAction.PROTECTED: ("[PROTECTED]", "white on red"),
+    SymlinkAction.SKIP: ("[SKIP]", "dim"),
+}
+
+
+def _plan_rows(
+    plans: collections.abc.Iterable[SymlinkPlan],
+    home: pathlib.Path,
+) -> collections.abc.Iterator[tuple[SymlinkPlan, str]]:
+    """Yield plans ordered by action then dest, with dest shown relative to home."""
+    # A string prefix check; Path.relative_to costs more than the rest combined
+    prefix = f"{home}{os.sep}"
+    for plan in sorted(plans, key=lambda p: (p.action.value, str(p.dest))):
+        yield plan, str(plan.dest).removeprefix(prefix)
+
+
+def render_plan_plain(
+    plans: collections.abc.Iterable[SymlinkPlan],
+    home: pathlib.Path,
+    out: typing.TextIO,
+) -> None:
+    """Write one line per plan as it is formatted, for logs and pipes."""
+    for plan, dest in _plan_rows(plans, home):
+        label = PLAN_LABELS[plan.action][0]
+        kind = "dir" if plan.is_dir else "file"
+        out.write(f"{label:<12} {kind:<5} {dest} -> {plan.source}\n")
+
+
+def render_plan_json(
+    plans: collections.abc.Iterable[SymlinkPlan],
+    home: pathlib.Path,
+    out: typing.TextIO,
+) -> None:
+    """Write one JSON object per plan (NDJSON) with absolute paths."""
+    import json
+
+    for plan, _dest in _plan_rows(plans, home):
+        record = {
+            "action": plan.action.value,
+            "type": "dir" if plan.is_dir else "file",
+            "dest": str(plan.dest),
+            "source": str(plan.source),
+        }
+        out.write(json.dumps(record) + "\n")
+
+
+def render_plan_table(
+    plans: collections.abc.Iterable[SymlinkPlan],
+    home: pathlib.Path,
+) -> None:
+    """Print plans as a rich table; only worth its import cost on a TTY."""
+    from rich.console import Console
+    from rich.table import Table
+    from rich.text import Text
+
+    table = Table(title="Dotfiles Install Plan", show_lines=False)
+    table.add_column("Status", width=12)
+    table.add_column("Type", width=5)
+    table.add_column("Destination")
+    table.add_column("Source")
+    for plan, dest in _plan_rows(plans, home):
+        label, style = PLAN_LABELS[plan.action]
+        table.add_row(
+            Text(label, style=style),
+            "dir" if plan.is_dir else "file",
+            dest,
+            str(plan.source),
+        )
+    Console().print(table)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# WATCH - inotify-driven incremental install
+# ═══════════════════════════════════════════════════════════════════════════════
+
+# Seconds without further events before a batch of changes is applied
+WATCH_DEBOUNCE = 0.1
+
+
+class Inotify:
+    """Minimal ctypes binding to Linux inotify, read without blocking."""
+
+    # Event bits from <sys/inotify.h>
+    CLOSE_WRITE = 0x00000008
+    MOVED_FROM = 0x00000040
+    MOVED_TO = 0x00000080
+    CREATE = 0x00000100
+    DELETE = 0x00000200
+    DELETE_SELF = 0x00000400
+    MOVE_SELF = 0x00000800
+    Q_OVERFLOW = 0x00004000
+    IGNORED = 0x00008000
+    ONLYDIR = 0x01000000
+    EXCL_UNLINK = 0x04000000
+
+    # Entries appearing, vanishing or being replaced in a watched directory
+    ENTRY_EVENTS = CREATE | DELETE | MOVED_FROM | MOVED_TO | DELETE_SELF | MOVE_SELF
+
+    def __init__(self) -> None:
+        """Open a non-blocking inotify instance."""
+        import ctypes
+
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.fd: int = fd
+        self.watches: dict[int, pathlib.Path] = {}
+
+    def add(self, directory: pathlib.Path, mask: int) -> bool:
+        """Watch *directory* for *mask* events unless already watched.
+
+        Returns:
+            True if a new watch was added.
+
+        """
+        import ctypes
+
+        if directory in self.watches.values():
+            return False
+        wd = self._libc.inotify_add_watch(
+            self.fd, os.fsencode(directory), mask | self.ONLYDIR | self.EXCL_UNLINK
+        )
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(directory))
+        self.watches[wd] = directory
+        return True
+
+    def read(self) -> list[tuple[pathlib.Path | None, int, str]]:
+        """Drain pending events.
+
+        Returns:
+            (watched directory, mask, entry name) per event; the directory
+            is None when the kernel queue overflowed.
+
+        """
+        import struct
+
+        events: list[tuple[pathlib.Path | None, int, str]] = []
+        header = struct.Struct("iIII")
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = header.unpack_from(data, offset)
+                offset += header.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                directory = self.watches.get(wd)
+                if mask & self.IGNORED:
+                    self.watches.pop(wd, None)
+                events.append((directory, mask, name))
+
+    def close(self) -> None:
+        """Release the inotify instance and its watches."""
+        os.close(self.fd)
+
+
+def _compiled_shell_request(loader: pathlib.Path) -> ShellRequest | None:
+    """Recover the `shell --compile` invocation a loader stub regenerates with.
+
+    Returns:
+        ShellRequest carrying the loader's shell, stage and mode flags, or
+        None if *loader* is not a readable loader stub.
+
+    """
+    import shlex
+
+    try:
+        lines = loader.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return None
+    for line in lines:
+        command = line.strip()
+        if command.startswith("command ") and command.endswith(" >/dev/null"):
+            argv = shlex.split(
+                command.removeprefix("command ").removesuffix(" >/dev/null")
+            )
+            return _parse_shell_request(argv[2:])
+    return None
+
+
+class DotfilesWatcher:
+    """Re-apply the parts of `install` that filesystem changes affect.
+
+    inotify watches dot.toml's directory and the directories holding mapped
+    sources and dests (or their nearest existing ancestor until those are
+    created). A linked file's content is seen through its symlink, so only
+    entries appearing, vanishing or being replaced matter; the contents of
+    linked directories are never watched. Events are coalesced until
+    *debounce* seconds pass without another. Then only mappings under the
+    touched paths are reclassified and relinked, and a dot.toml change
+    reloads the config and recompiles `shell --compile` loaders, rewriting
+    just the stage artifacts whose snippets changed. Real directories are
+    only replaced with *force* on the app; changes to `[config] backup` or
+    `trash` apply on restart.
+    """
+
+    def __init__(self, app: DotfilesApp, *, debounce: float = WATCH_DEBOUNCE) -> None:
+        """Prepare to watch *app*'s config and mappings."""
+        self.app = app
+        self.debounce = debounce
+        self.config_path = app.config_loader.config_path.absolute()
+        self.inotify = Inotify()
+        self.mappings: dict[pathlib.Path, SymlinkPlan] = {}
+        # Sources, dests and their ancestors -> dests of the mappings they affect
+        self._index: dict[pathlib.Path, set[pathlib.Path]] = {}
+        self._pending: set[pathlib.Path] = set()
+        self._rescan = False
+        self._index_mappings()
+
+    async def run(self) -> None:
+        """Apply changes as they happen, until cancelled."""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        timer: asyncio.TimerHandle | None = None
+
+        def on_readable() -> None:
+            nonlocal timer
+            if self._collect(self.inotify.read()):
+                if timer is not None:
+                    timer.cancel()
+                timer = loop.call_later(self.debounce, ready.set)
+
+        self._watch_dirs()
+        loop.add_reader(self.inotify.fd, on_readable)
+        logger.info(
+            "Watching %s and %d mapping(s) in %d directory(ies)",
+            self.config_path,
+            len(self.mappings),
+            len(self.inotify.watches),
+        )
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                try:
+                    await self.apply()
+                except Exception:
+                    logger.exception("Failed to apply changes; still watching")
+                # Directories created since the last scan may already hold files
+                if new := self._watch_dirs():
+                    self._pending.update(new)
+                    ready.set()
+        finally:
+            loop.remove_reader(self.inotify.fd)
+            if timer is not None:
+                timer.cancel()
+            self.inotify.close()
+
+    async def apply(self) -> None:
+        """Reclassify and relink mappings touched since the last batch."""
+        touched, self._pending = self._pending, set()
+        rescan, self._rescan = self._rescan, False
+        dests = set().union(*(self._index.get(path, ()) for path in touched))
+        if self.config_path in touched and (changed := self._reload_config()):
+            dests |= changed
+        if rescan:
+            logger.warning("inotify queue overflowed; rechecking every mapping")
+            dests = set(self.mappings)
+
+        plans = [self.mappings[dest] for dest in dests if dest in self.mappings]
+        actions = self.app._classifier().classify_all(
+            [(plan.source, plan.dest) for plan in plans]
+        )
+        for plan, action in zip(plans, actions, strict=True):
+            match action:
+                case SymlinkAction.OK | SymlinkAction.SKIP:
+                    continue
+                case SymlinkAction.PROTECTED:
+                    logger.warning("Not replacing protected directory %s", plan.dest)
+                case SymlinkAction.DELETING if not self.app.force:
+                    logger.warning(
+                        "Not replacing real directory %s without --force", plan.dest
+                    )
+                case _ if self.app.dry_run:
+                    logger.info("[DRY RUN] Would %s %s", action.value, plan.dest)
+                case _:
+                    await self.app._create_symlink(plan.source, plan.dest)
+
+        if self.app.backups is not None:
+            self.app.backups.finish()
+        if self.app.trash is not None:
+            self.app.trash.reap_in_background()
 
-        match pkg_manager:
-            case "apt":
-                cmd = f"sudo apt-get update && sudo apt-get install -y {pkg_name}"
-            case "brew":
-                cmd = f"brew install {pkg_name}"
-            case "dnf":
-                cmd = f"sudo dnf install -y {pkg_name}"
-            case "pacman":
-                cmd = f"sudo pacman -S --noconfirm {pkg_name}"
-            case _:
-                msg = f"Unsupported package manager: {pkg_manager}"
-                logger.error(msg)
-                return Result.fail(error=msg)
+    def _collect(self, events: list[tuple[pathlib.Path | None, int, str]]) -> bool:
+        """Queue paths from *events* that affect the config or a mapping.
 
-        try:
-            result = await self.runner.run(cmd, env=env, check=False, capture=True)
-            if not result.success:
-                logger.error(
-                    "Failed to install %s via %s", provisioner.name, pkg_manager
-                )
-                if result.stderr:
-                    logger.error("Error output:\n%s", result.stderr)
-                return Result.fail(
-                    error=result.stderr
-                    or f"Failed to install {provisioner.name} via {pkg_manager}",
-                )
-        except Exception as e:
-            logger.exception("Failed to install %s", provisioner.name)
-            return Result.fail(error=str(e))
-        else:
-            return Result.ok()
+        Returns:
+            True if anything was queued.
 
-    async def _install_via_binary(
-        self,
-        provisioner: Provisioner,
-        dry_run: bool = False,
-        env: dict[str, str] | None = None,
-    ) -> Result:
-        """Install via direct binary download."""
-        if not provisioner.binary_url:
-            msg = f"No binary URL for {provisioner.name}"
-            logger.error(msg)
-            return Result.fail(error=msg)
+        """
+        queued = False
+        for directory, mask, name in events:
+            if directory is None or mask & Inotify.Q_OVERFLOW:
+                self._rescan = queued = True
+                continue
+            if mask & Inotify.IGNORED:
+                continue
+            path = directory / name if name else directory
+            if path in self._index:
+                self._pending.add(path)
+                queued = True
+        return queued
+
+    def _index_mappings(self) -> None:
+        """Rebuild the mapping table and the path index from the app config."""
+        self.mappings = {plan.dest: plan for plan in self.app._mappings()}
+        self._index = {self.config_path: set()}
+        for plan in self.mappings.values():
+            for path in (plan.source, plan.dest):
+                for affected in (path, *path.parents):
+                    self._index.setdefault(affected, set()).add(plan.dest)
+
+    def _watch_dirs(self) -> list[pathlib.Path]:
+        """Watch the config directory and every mapped parent directory.
 
-        try:
-            # Download binary
-            result = await self.runner.run(
-                f"curl -L {provisioner.binary_url} -o /tmp/{provisioner.name}",
-                env=env,
-                check=False,
-                capture=True,
-            )
-            if not result.success:
-                msg = f"Failed to download {provisioner.name}"
-                logger.error(msg)
-                if result.stderr:
-                    logger.error("Error output:\n%s", result.stderr)
-                return Result.fail(error=result.stderr or msg)
+        Returns:
+            Directories newly watched.
 
-            # Make executable
-            result = await self.runner.run(
-                f"chmod +x /tmp/{provisioner.name}",
-                env=env,
-                check=False,
-                capture=True,
+        """
+        targets = {self.config_path.parent: Inotify.ENTRY_EVENTS | Inotify.CLOSE_WRITE}
+        for plan in self.mappings.values():
+            for directory in (plan.source.parent, plan.dest.parent):
+                while not directory.is_dir() and directory != directory.parent:
+                    directory = directory.parent
+                targets.setdefault(directory, Inotify.ENTRY_EVENTS)
+        added = []
+        for directory, mask in targets.items():
+            try:
+                if self.inotify.add(directory, mask):
+                    added.append(directory)
+            except OSError as e:
+                logger.warning("Cannot watch %s: %s", directory, e.strerror)
+        return added
+
+    def _reload_config(self) -> set[pathlib.Path]:
+        """Reload dot.toml, keeping the previous config if it is invalid.
+
+        Returns:
+            Dests of mappings that were added or changed.
+
+        """
+        try:
+            config = self.app.config_loader.load()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # ValueError covers TOMLDecodeError as well as bad values in it
+            logger.warning(
+                "Keeping the previous config until %s loads: %s", self.config_path, e
             )
-            if not result.success:
-                msg = f"Failed to make {provisioner.name} executable"
-                logger.error(msg)
-                if result.stderr:
-                    logger.error("Error output:\n%s", result.stderr)
-                return Result.fail(error=result.stderr or msg)
+            return set()
+        logger.info("Reloaded %s", self.config_path)
+        previous, self.app.config = self.mappings, config
+        self._index_mappings()
+        self._recompile_shell_init()
+        return {
+            dest
+            for dest, plan in self.mappings.items()
+            if (old := previous.get(dest)) is None
+            or (old.source, old.is_dir) != (plan.source, plan.is_dir)
+        }
 
-            # Move to PATH
-            result = await self.runner.run(
-                f"sudo mv /tmp/{provisioner.name} /usr/local/bin/",
-                env=env,
-                check=False,
-                capture=True,
+    def _recompile_shell_init(self) -> None:
+        """Recompile the `shell --compile` loaders built from this config."""
+        for loader in sorted((_xdg_cache_dir() / "shell").glob("*/init*")):
+            if loader.suffix != f".{loader.parent.name}":
+                continue
+            request = _compiled_shell_request(loader)
+            if request is None or request.config != self.config_path:
+                continue
+            generator = ShellGenerator(
+                self.app.platform,
+                defer_late=request.defer_late,
+                resolve_conditions=request.resolve_conditions,
+                instrument=request.instrument,
             )
-            if not result.success:
-                msg = f"Failed to move {provisioner.name} to /usr/local/bin/"
-                logger.error(msg)
-                if result.stderr:
-                    logger.error("Error output:\n%s", result.stderr)
-                return Result.fail(error=result.stderr or msg)
-        except Exception as e:
-            logger.exception("Failed to install %s", provisioner.name)
-            return Result.fail(error=str(e))
-        else:
-            return Result.ok()
+            try:
+                compile_shell_init(
+                    generator,
+                    self.config_path,
+                    self.app.config.shell_snippets,
+                    request.shell,
+                    request.stage,
+                )
+            except OSError:
+                logger.warning("Failed to recompile %s", loader, exc_info=True)
+            else:
+                logger.info("Recompiled %s", loader)
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -1268,15 +4870,35 @@ class DotfilesApp:
         config_path: pathlib.Path | None = None,
         dry_run: bool = False,
         force: bool = False,
+        no_cache: bool = False,
     ) -> None:
-        """Initialize application with config and options."""
+        """Initialize application with config and options.
+
+        With *no_cache*, config snapshots, cached verify results and the
+        applied-package and install journals are neither read nor written.
+        """
         self.dry_run = dry_run
         self.force = force
         self.platform = Platform()
         self.runner = AsyncCommandRunner(dry_run=dry_run)
-        self.config_loader = ConfigLoader(config_path)
+        self.config_loader = ConfigLoader(config_path, use_cache=not no_cache)
         self.config = self.config_loader.load()
         self.shell_generator = ShellGenerator(self.platform)
+        self.package_db = PackageDatabase()
+        self.applied_packages = None if no_cache else AppliedPackages()
+        self.install_journal = None if no_cache else InstallJournal()
+        self.trash = TrashBin() if self.config.trash else None
+        self.backups = (
+            BackupStore(keep=self.config.backup_keep) if self.config.backup else None
+        )
+        self._group_selections: dict[str | None, dict[str, list[str]]] = {}
+        apt_config = self.config.packages.get("apt")
+        self.apt_updates = AptUpdateCoordinator(
+            self.runner,
+            max_age=apt_config.get("update_max_age", APT_UPDATE_MAX_AGE)
+            if isinstance(apt_config, dict)
+            else APT_UPDATE_MAX_AGE,
+        )
 
         # Combine all provisioners for management
         all_provisioners = {**self.config.provisioners, **self.config.enhancements}
@@ -1284,6 +4906,15 @@ class DotfilesApp:
             all_provisioners,
             self.runner,
             self.platform,
+            None if no_cache else VerificationCache(),
+            self.package_db,
+            self.apt_updates,
+        )
+
+    def _classifier(self) -> SymlinkClassifier:
+        """Build a classifier for the configured home mappings."""
+        return SymlinkClassifier(
+            self.platform.info.home, self.config.protected, self.config.source
         )
 
     def _classify_action(
@@ -1292,100 +4923,128 @@ class DotfilesApp:
         dest: pathlib.Path,
     ) -> SymlinkAction:
         """Classify what action is needed for a single symlink."""
-        if not source.exists():
-            return SymlinkAction.SKIP
-
-        if dest.is_symlink() and dest.resolve() == source.resolve():
-            return SymlinkAction.OK
+        return self._classifier().classify(source, dest)
+
+    def _mappings(self) -> list[SymlinkPlan]:
+        """Plan every configured home mapping as OK, before classification."""
+        home = self.platform.info.home
+        return [
+            SymlinkPlan(
+                source=self.config.source / template_def.source,
+                dest=home / dest_path,
+                action=SymlinkAction.OK,
+            )
+            for dest_path, template_def in self.config.files.items()
+        ] + [
+            SymlinkPlan(
+                source=self.config.source / source_path,
+                dest=home / dest_path,
+                action=SymlinkAction.OK,
+                is_dir=True,
+            )
+            for dest_path, source_path in self.config.dirs.items()
+        ]
 
-        if dest.exists() or dest.is_symlink():
-            if dest.is_dir() and not dest.is_symlink():
-                try:
-                    rel = dest.relative_to(self.platform.info.home)
-                except ValueError:
-                    return SymlinkAction.DELETING
-                if rel in self.config.protected:
-                    return SymlinkAction.PROTECTED
-                return SymlinkAction.DELETING
-            return SymlinkAction.REPLACE
+    def _build_changeset(self, *, full: bool = False) -> list[SymlinkPlan]:
+        """Build a changeset of planned symlink operations.
 
-        return SymlinkAction.CREATE
+        Mappings the install journal shows as still linked are planned as OK
+        without being classified, unless *full*.
+        """
+        plans = self._mappings()
+        fresh = (
+            self.install_journal.unchanged(plans)
+            if self.install_journal is not None and not full
+            else set()
+        )
+        stale = [plan for plan in plans if str(plan.dest) not in fresh]
+        if fresh:
+            logger.debug(
+                "Install journal: %d unchanged, %d to classify", len(fresh), len(stale)
+            )
+        actions = self._classifier().classify_all(
+            [(plan.source, plan.dest) for plan in stale]
+        )
+        for plan, action in zip(stale, actions, strict=True):
+            plan.action = action
+        return plans
 
-    def _build_changeset(self) -> list[SymlinkPlan]:
-        """Build a changeset of planned symlink operations."""
-        plans: list[SymlinkPlan] = []
+    def _display_changeset(
+        self,
+        plans: list[SymlinkPlan],
+        plan_format: PlanFormat,
+    ) -> None:
+        """Display changeset in *plan_format*, streaming unless it is a table."""
+        home = self.platform.info.home
+        match plan_format:
+            case "table":
+                render_plan_table(plans, home)
+            case "plain":
+                render_plan_plain(plans, home, sys.stdout)
+            case "json":
+                render_plan_json(plans, home, sys.stdout)
 
-        for dest_path, template_def in self.config.files.items():
-            source = self.config.source / template_def.source
-            dest = self.platform.info.home / dest_path
-            action = self._classify_action(source, dest)
-            plans.append(SymlinkPlan(source=source, dest=dest, action=action))
+    def _confirm_deletions(self, count: int, plan_format: PlanFormat) -> bool:
+        """Ask whether *count* real directories may be deleted.
 
-        for dest_path, source_path in self.config.dirs.items():
-            source = self.config.source / source_path
-            dest = self.platform.info.home / dest_path
-            action = self._classify_action(source, dest)
-            plans.append(
-                SymlinkPlan(source=source, dest=dest, action=action, is_dir=True),
-            )
+        Off a TTY the prompt goes to stderr, keeping stdout for the plan.
 
-        return plans
+        Returns:
+            True if the user typed 'yes'.
 
-    def _display_changeset(self, plans: list[SymlinkPlan]) -> None:
-        """Display changeset using rich table."""
-        from rich.console import Console
-        from rich.table import Table
-        from rich.text import Text
-
-        console = Console()
-        table = Table(title="Dotfiles Install Plan", show_lines=False)
-        table.add_column("Status", width=12)
-        table.add_column("Type", width=5)
-        table.add_column("Destination")
-        table.add_column("Source")
-
-        action_styles: dict[SymlinkAction, tuple[str, str]] = {
-            SymlinkAction.OK: ("[OK]", "green"),
-            SymlinkAction.CREATE: ("[CREATE]", "blue"),
-            SymlinkAction.REPLACE: ("[REPLACE]", "yellow"),
-            SymlinkAction.DELETING: ("[DELETING]", "bold red"),
-            SymlinkAction.PROTECTED: ("[PROTECTED]", "white on red"),
-            SymlinkAction.SKIP: ("[SKIP]", "dim"),
-        }
+        """
+        prompt = "Type 'yes' to proceed, or use --force to skip this prompt: "
+        if plan_format == "table":
+            from rich.console import Console
 
-        for plan in sorted(plans, key=lambda p: (p.action.value, str(p.dest))):
-            label, style = action_styles[plan.action]
-            home = self.platform.info.home
-            try:
-                dest_display = str(plan.dest.relative_to(home))
-            except ValueError:
-                dest_display = str(plan.dest)
-            table.add_row(
-                Text(label, style=style),
-                "dir" if plan.is_dir else "file",
-                dest_display,
-                str(plan.source),
+            console = Console()
+            console.print(
+                f"\n[bold red]WARNING:[/] {count} real directory(ies) "
+                "will be permanently deleted.",
             )
+            confirm = console.input(f"[bold]{prompt}[/]")
+        else:
+            logger.warning("%d real directory(ies) will be permanently deleted.", count)
+            sys.stderr.write(prompt)
+            sys.stderr.flush()
+            confirm = sys.stdin.readline()
+        return confirm.strip().lower() == "yes"
 
-        console.print(table)
-
-    async def install_dotfiles(self) -> InstallResult:
-        """Install dotfiles symlinks with changeset preview."""
+    async def install_dotfiles(
+        self,
+        *,
+        full: bool = False,
+        plan_format: PlanFormat | None = None,
+    ) -> InstallResult:
+        """Install dotfiles symlinks with changeset preview.
+
+        Only mappings changed since the last install are classified, unless
+        *full*. The preview is a rich table when stdout is a TTY and plain
+        lines otherwise, unless *plan_format* says which.
+        """
         logger.info("Installing dotfiles...")
+        plan_format = plan_format or ("table" if sys.stdout.isatty() else "plain")
 
-        plans = self._build_changeset()
-        self._display_changeset(plans)
+        plans = self._build_changeset(full=full)
+        self._display_changeset(plans, plan_format)
 
         protected = [p for p in plans if p.action == SymlinkAction.PROTECTED]
         if protected:
-            from rich.console import Console
-
-            console = Console()
-            console.print(
-                f"\n[white on red]BLOCKED:[/] {len(protected)} protected "
-                "directory(ies) would be deleted. "
-                "Manually move or remove them first.",
-            )
+            if plan_format == "table":
+                from rich.console import Console
+
+                console = Console()
+                console.print(
+                    f"\n[white on red]BLOCKED:[/] {len(protected)} protected "
+                    "directory(ies) would be deleted. "
+                    "Manually move or remove them first.",
+                )
+            else:
+                logger.error(
+                    "BLOCKED: %d protected directory(ies) would be deleted. "
+                    "Manually move or remove them first.",
+                    len(protected),
+                )
             return InstallResult.fail(
                 error=f"{len(protected)} protected directory(ies) would be deleted",
                 items=[
@@ -1400,20 +5059,14 @@ class DotfilesApp:
             )
 
         deleting = [p for p in plans if p.action == SymlinkAction.DELETING]
-        if deleting and not self.force and not self.dry_run:
-            from rich.console import Console
-
-            console = Console()
-            console.print(
-                f"\n[bold red]WARNING:[/] {len(deleting)} real directory(ies) "
-                "will be permanently deleted.",
-            )
-            confirm = console.input(
-                "[bold]Type 'yes' to proceed, or use --force to skip this prompt: [/]",
-            )
-            if confirm.strip().lower() != "yes":
-                logger.info("Aborted by user.")
-                return InstallResult.fail(error="Aborted by user")
+        if (
+            deleting
+            and not self.force
+            and not self.dry_run
+            and not self._confirm_deletions(len(deleting), plan_format)
+        ):
+            logger.info("Aborted by user.")
+            return InstallResult.fail(error="Aborted by user")
 
         if self.dry_run:
             logger.info("[DRY RUN] No changes made.")
@@ -1437,6 +5090,21 @@ class DotfilesApp:
             result = await self._create_symlink(plan.source, plan.dest)
             items.append(result)
 
+        if self.backups is not None:
+            self.backups.finish()
+        if self.trash is not None:
+            self.trash.reap_in_background()
+
+        if self.install_journal is not None:
+            self.install_journal.record(
+                [
+                    plan
+                    for plan, item in zip(plans, items, strict=True)
+                    if item.success
+                    and plan.action not in (SymlinkAction.SKIP, SymlinkAction.PROTECTED)
+                ]
+            )
+
         all_ok = all(r.success for r in items)
         failed = [r for r in items if not r.success]
         return InstallResult(
@@ -1485,10 +5153,19 @@ class DotfilesApp:
                             )
                     except ValueError:
                         pass
-                    import shutil
+                    # Moving the tree into the backup is all the removal it needs
+                    moved = self.backups is not None and self.backups.snapshot(
+                        dest, move=True
+                    )
+                    if not moved and (
+                        self.trash is None or self.trash.move(dest) is None
+                    ):
+                        import shutil
 
-                    shutil.rmtree(dest)
+                        shutil.rmtree(dest)
                 else:
+                    if self.backups is not None:
+                        self.backups.snapshot(dest)
                     dest.unlink()
 
             dest.symlink_to(source)
@@ -1505,24 +5182,59 @@ class DotfilesApp:
     async def provision(
         self,
         filter_type: ProvisionerType | None = None,
+        max_concurrent: int = 4,
+        group: PackageGroup | None = None,
     ) -> ProvisionResult:
-        """Provision development environment."""
+        """Provision development environment.
+
+        With *group*, package lists include that group's packages as well.
+        """
+        import asyncio
+
         logger.info("Provisioning development environment...")
 
-        # Install system packages first
-        if not filter_type or filter_type == ProvisionerType.FOUNDATION:
-            sys_result = await self._install_system_packages()
-            if not sys_result:
-                logger.error("Failed to install system packages")
-                return ProvisionResult.fail(
-                    error=f"System packages failed: {sys_result.error}",
-                )
+        try:
+            self.package_selection(group)
+        except ValueError as e:
+            logger.exception("Invalid package groups")
+            return ProvisionResult.fail(error=str(e))
+
+        # Download artifacts while system packages install
+        prefetch = (
+            None
+            if self.dry_run
+            else asyncio.create_task(self.provisioner_manager.prefetch(filter_type))
+        )
+        try:
+            sys_result = await self._provision_system_packages(filter_type, group)
+            if sys_result and prefetch is not None:
+                await prefetch
+        finally:
+            if prefetch is not None and not prefetch.done():
+                prefetch.cancel()
+        if not sys_result:
+            return ProvisionResult.fail(
+                error=f"System packages failed: {sys_result.error}",
+            )
 
         results = await self.provisioner_manager.provision_all(
             filter_type,
             self.dry_run,
+            max_concurrent,
         )
 
+        # pip/npm/cargo come from provisioners, so their packages go last
+        if not filter_type:
+            env = os.environ.copy()
+            env["PATH"] = self.provisioner_manager.search_path
+            language_results = await self.install_language_packages(
+                env=env,
+                group=group,
+            )
+            results.update(
+                {f"packages.{name}": r for name, r in language_results.items()}
+            )
+
         success_count = sum(1 for r in results.values() if r)
         total_count = len(results)
 
@@ -1537,6 +5249,55 @@ class DotfilesApp:
             results=results,
         )
 
+    async def _provision_system_packages(
+        self,
+        filter_type: ProvisionerType | None,
+        group: PackageGroup | None,
+    ) -> Result:
+        """Install system packages and PACKAGE provisioners sharing the transaction.
+
+        Returns:
+            Result of the install, ok when *filter_type* excludes it.
+
+        """
+        if filter_type and filter_type != ProvisionerType.FOUNDATION:
+            return Result.ok()
+        extra = (
+            []
+            if self.dry_run
+            else await self.provisioner_manager.mergeable_packages(filter_type)
+        )
+        sys_result = await self._install_system_packages(extra, group)
+        if not sys_result and extra:
+            logger.warning("Retrying system packages without provisioner packages")
+            sys_result = await self._install_system_packages(group=group)
+        if not sys_result:
+            logger.error("Failed to install system packages")
+        return sys_result
+
+    def package_selection(self, group: PackageGroup | None) -> dict[str, list[str]]:
+        """Resolve each package manager's packages for *group* once.
+
+        Returns:
+            Mapping of package manager to its base plus group packages.
+
+        Raises:
+            ValueError: If [package_groups] contains a cycle.
+
+        """
+        if group not in self._group_selections:
+            groups = (
+                resolve_package_groups(self.config.package_groups, group)
+                if group
+                else []
+            )
+            self._group_selections[group] = {
+                manager: select_packages(package_config, groups)
+                for manager, package_config in self.config.packages.items()
+                if isinstance(package_config, dict)
+            }
+        return self._group_selections[group]
+
     async def _ensure_apt_repositories(
         self,
         package_config: dict[str, typing.Any],
@@ -1553,9 +5314,9 @@ class DotfilesApp:
 
         if not shutil.which("add-apt-repository"):
             logger.info("Installing software-properties-common for add-apt-repository")
+            await self.apt_updates.ensure_fresh()
             result = await self.runner.run(
-                "sudo apt-get update && sudo apt-get install -y "
-                "software-properties-common",
+                "sudo apt-get install -y software-properties-common",
                 check=False,
                 capture=True,
             )
@@ -1571,13 +5332,15 @@ class DotfilesApp:
         for ppa in ppas:
             if not isinstance(ppa, str) or not ppa.strip():
                 continue
-            cmd = f"sudo add-apt-repository -y {ppa}"
+            # The index is refreshed once, before the next apt install
+            cmd = f"sudo add-apt-repository -y {ppa} --no-update"
             result = await self.runner.run(cmd, check=False, capture=True)
             if not result.success:
                 logger.error("Failed to add apt repository: %s", ppa)
                 if result.stderr:
                     logger.error("Error output:\n%s", result.stderr)
                 return Result.fail(error=result.stderr or f"Failed to add PPA: {ppa}")
+            self.apt_updates.sources_changed()
 
         return Result.ok()
 
@@ -1718,35 +5481,53 @@ class DotfilesApp:
             logger.info("Successfully added repository: %s", name)
             added_repos = True
 
-        # Update apt cache after adding repositories
+        # Refresh the apt index before the next install
         if added_repos:
-            logger.info("Updating apt cache after adding repositories...")
-            result = await self.runner.run(
-                "sudo apt-get update", check=False, capture=True
-            )
-            if not result.success:
-                logger.warning("apt-get update had issues, continuing anyway")
+            self.apt_updates.sources_changed()
 
         return Result.ok()
 
-    async def _install_system_packages(self) -> Result:
-        """Install system packages based on platform."""
+    async def _install_system_packages(
+        self,
+        extra_packages: list[str] | None = None,
+        group: PackageGroup | None = None,
+    ) -> Result:
+        """Install system packages based on platform.
+
+        Configured packages for *group* that a previous run already applied
+        are skipped. *extra_packages* are installed in the same transaction.
+        """
         pkg_manager = self.platform.get_package_manager()
-        if not pkg_manager or pkg_manager not in self.config.packages:
+        if not pkg_manager or (
+            pkg_manager not in self.config.packages and not extra_packages
+        ):
             logger.debug(
                 "No packages configured for %s package manager",
                 pkg_manager or "unknown",
             )
             return Result.ok()
 
-        package_config = self.config.packages[pkg_manager]
+        package_config = self.config.packages.get(pkg_manager, {})
         if not isinstance(package_config, dict):
             logger.warning("Invalid package configuration for %s", pkg_manager)
             return Result.ok()
 
-        packages = package_config.get("packages", [])
+        selected = self.package_selection(group).get(pkg_manager, [])
+        pending = (
+            self.applied_packages.pending(pkg_manager, selected)
+            if self.applied_packages is not None
+            else selected
+        )
+        packages = list(dict.fromkeys([*pending, *(extra_packages or [])]))
         if not packages:
-            logger.debug("No base packages configured for %s", pkg_manager)
+            if selected:
+                logger.info(
+                    "✅ All %d %s packages were applied by a previous run",
+                    len(selected),
+                    pkg_manager,
+                )
+            else:
+                logger.debug("No base packages configured for %s", pkg_manager)
             return Result.ok()
 
         logger.info(
@@ -1759,6 +5540,22 @@ class DotfilesApp:
             )
             return Result.ok()
 
+        result = await self._apply_system_packages(
+            pkg_manager,
+            package_config,
+            packages,
+        )
+        if result and self.applied_packages is not None:
+            self.applied_packages.record(pkg_manager, selected)
+        return result
+
+    async def _apply_system_packages(
+        self,
+        pkg_manager: str,
+        package_config: dict[str, typing.Any],
+        packages: list[str],
+    ) -> Result:
+        """Add repositories, then install whichever *packages* are missing."""
         # Build and execute install command based on package manager
         match pkg_manager:
             case "apt":
@@ -1773,18 +5570,18 @@ class DotfilesApp:
 
                 # Check which packages are already installed
                 logger.debug("Checking installed apt packages...")
-                # Remove :amd64 suffix from package names
-                check_cmd = (
-                    f"dpkg -l {' '.join(packages)} 2>/dev/null | "
-                    "grep '^ii' | awk '{print $2}' | cut -d: -f1"
-                )
-                result = await self.runner.run(check_cmd, check=False, capture=True)
-                installed = set()
-                if result.stdout:
-                    # Filter out empty lines and clean package names
-                    for line in result.stdout.strip().split("\n"):
-                        if line:
-                            installed.add(line.strip())
+                installed = self.package_db.installed("apt")
+                if installed is None:
+                    # No readable dpkg status file; ask dpkg itself
+                    # Remove :amd64 suffix from package names
+                    check_cmd = (
+                        f"dpkg -l {' '.join(packages)} 2>/dev/null | "
+                        "grep '^ii' | awk '{print $2}' | cut -d: -f1"
+                    )
+                    result = await self.runner.run(check_cmd, check=False, capture=True)
+                    installed = frozenset(
+                        line.strip() for line in result.stdout.split("\n") if line
+                    )
 
                 logger.debug("Requested packages: %s", packages)
                 logger.debug("Installed packages found: %s", installed)
@@ -1802,10 +5599,8 @@ class DotfilesApp:
                     len(to_install),
                     ", ".join(to_install[:5]) + ("..." if len(to_install) > 5 else ""),
                 )
-                cmd = (
-                    f"sudo apt-get update && sudo apt-get install -y "
-                    f"{' '.join(to_install)}"
-                )
+                await self.apt_updates.ensure_fresh()
+                cmd = f"sudo apt-get install -y {' '.join(to_install)}"
             case "brew":
                 tap_result = await self._ensure_brew_taps(package_config)
                 if not tap_result:
@@ -1815,9 +5610,7 @@ class DotfilesApp:
                 logger.debug("Checking installed brew packages...")
                 check_cmd = "brew list --formula"
                 result = await self.runner.run(check_cmd, check=False, capture=True)
-                installed = (
-                    set(result.stdout.strip().split()) if result.stdout else set()
-                )
+                installed = frozenset(result.stdout.split())
                 to_install = [pkg for pkg in packages if pkg not in installed]
 
                 if not to_install:
@@ -1827,28 +5620,179 @@ class DotfilesApp:
                     return Result.ok()
 
                 logger.info(
-                    "📦 Need to install %d brew packages: %s",
-                    len(to_install),
-                    ", ".join(to_install[:5]) + ("..." if len(to_install) > 5 else ""),
+                    "📦 Need to install %d brew packages: %s",
+                    len(to_install),
+                    ", ".join(to_install[:5]) + ("..." if len(to_install) > 5 else ""),
+                )
+                cmd = f"brew install {' '.join(to_install)}"
+            case "dnf" | "pacman":
+                installed = self.package_db.installed(pkg_manager) or frozenset()
+                to_install = [pkg for pkg in packages if pkg not in installed]
+
+                if not to_install:
+                    logger.info(
+                        "✅ All %d %s packages are already installed",
+                        len(packages),
+                        pkg_manager,
+                    )
+                    return Result.ok()
+
+                logger.info(
+                    "📦 Need to install %d %s packages: %s",
+                    len(to_install),
+                    pkg_manager,
+                    ", ".join(to_install[:5]) + ("..." if len(to_install) > 5 else ""),
+                )
+                if pkg_manager == "dnf":
+                    cmd = f"sudo dnf install -y {' '.join(to_install)}"
+                else:
+                    cmd = f"sudo pacman -S --noconfirm --needed {' '.join(to_install)}"
+            case _:
+                msg = f"Unsupported package manager: {pkg_manager}"
+                logger.error(msg)
+                return Result.fail(error=msg)
+
+        result = await self.runner.run(cmd, check=False, capture=True)
+        self.package_db.invalidate(pkg_manager)
+        if not result.success:
+            logger.error("Failed to install %s packages", pkg_manager)
+            if result.stderr:
+                logger.error("Error output:\n%s", result.stderr)
+            return Result.fail(
+                error=result.stderr or f"Failed to install {pkg_manager} packages",
+            )
+        return Result.ok()
+
+    async def install_language_packages(
+        self,
+        ecosystems: collections.abc.Iterable[str] = LANGUAGE_PACKAGE_MANAGERS,
+        env: dict[str, str] | None = None,
+        group: PackageGroup | None = None,
+        *,
+        upgrade: bool = False,
+    ) -> dict[str, Result]:
+        """Install missing `[packages.pip|npm|cargo]` packages for *group*.
+
+        Ecosystems don't share a lock, so each configured one is diffed and
+        installed concurrently with the others. With *upgrade*, every
+        selected package is installed at its latest version instead.
+
+        Returns:
+            Mapping of ecosystem to Result, for ecosystems with packages.
+
+        Raises:
+            ValueError: If [package_groups] contains a cycle.
+
+        """
+        import asyncio
+
+        selection = self.package_selection(group)
+        selected = {
+            ecosystem: selection[ecosystem]
+            for ecosystem in ecosystems
+            if selection.get(ecosystem)
+        }
+
+        tasks = {}
+        async with asyncio.TaskGroup() as tg:
+            for ecosystem, packages in selected.items():
+                tasks[ecosystem] = tg.create_task(
+                    self._install_language_packages(
+                        ecosystem, packages, env, upgrade=upgrade
+                    ),
+                )
+        return {ecosystem: task.result() for ecosystem, task in tasks.items()}
+
+    async def _install_language_packages(
+        self,
+        ecosystem: str,
+        packages: list[str],
+        env: dict[str, str] | None = None,
+        *,
+        upgrade: bool = False,
+    ) -> Result:
+        """Install the *packages* missing from one ecosystem's installed set.
+
+        Packages a previous run applied aren't checked again, unless
+        *upgrade* asks for all of them. An ecosystem whose tool isn't on PATH
+        is skipped with a warning.
+        """
+        list_cmd, install_cmd = _language_package_commands(ecosystem, upgrade=upgrade)
+        selected = packages
+        if self.applied_packages is not None and not upgrade:
+            packages = self.applied_packages.pending(ecosystem, selected)
+            if not packages:
+                logger.info(
+                    "✅ All %d %s packages were applied by a previous run",
+                    len(selected),
+                    ecosystem,
                 )
-                cmd = f"brew install {' '.join(to_install)}"
-            case "dnf":
-                cmd = f"sudo dnf install -y {' '.join(packages)}"
-            case "pacman":
-                cmd = f"sudo pacman -S --noconfirm --needed {' '.join(packages)}"
-            case _:
-                msg = f"Unsupported package manager: {pkg_manager}"
-                logger.error(msg)
-                return Result.fail(error=msg)
+                return Result.ok()
 
-        result = await self.runner.run(cmd, check=False, capture=True)
-        if not result.success:
-            logger.error("Failed to install %s packages", pkg_manager)
-            if result.stderr:
-                logger.error("Error output:\n%s", result.stderr)
-            return Result.fail(
-                error=result.stderr or f"Failed to install {pkg_manager} packages",
+        if self.dry_run:
+            logger.info(
+                "[DRY RUN] Would %s %s packages: %s",
+                "upgrade" if upgrade else "check/install",
+                ecosystem,
+                ", ".join(packages),
+            )
+            return Result.ok()
+
+        search_path = (env if env is not None else os.environ).get("PATH")
+        if not shutil.which(list_cmd.split()[0], path=search_path):
+            logger.warning(
+                "%s not found, skipping %d %s packages",
+                list_cmd.split()[0],
+                len(packages),
+                ecosystem,
+            )
+            return Result.ok()
+
+        installed: frozenset[str] = frozenset()
+        if not upgrade:
+            # One listing per ecosystem; npm exits nonzero on extraneous
+            # packages but still prints the listing
+            listing = await self.runner.run(
+                list_cmd, env=env, check=False, capture=True
             )
+            try:
+                installed = _parse_installed_packages(ecosystem, listing.stdout)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                logger.debug("Unparseable %s listing", ecosystem, exc_info=True)
+
+        to_install = [
+            pkg
+            for pkg in packages
+            if _normalize_package_name(ecosystem, pkg) not in installed
+        ]
+        if to_install:
+            logger.info(
+                "📦 Need to %s %d %s packages: %s",
+                "upgrade" if upgrade else "install",
+                len(to_install),
+                ecosystem,
+                ", ".join(to_install[:5]) + ("..." if len(to_install) > 5 else ""),
+            )
+            result = await self.runner.run(
+                f"{install_cmd} {' '.join(to_install)}",
+                env=env,
+                check=False,
+                capture=True,
+            )
+            if not result.success:
+                logger.error("Failed to install %s packages", ecosystem)
+                if result.stderr:
+                    logger.error("Error output:\n%s", result.stderr)
+                return Result.fail(
+                    error=result.stderr or f"Failed to install {ecosystem} packages",
+                )
+        else:
+            logger.info(
+                "✅ All %d %s packages are already installed", len(packages), ecosystem
+            )
+
+        if self.applied_packages is not None:
+            self.applied_packages.record(ecosystem, selected)
         return Result.ok()
 
     def generate_shell_init(
@@ -1863,8 +5807,19 @@ class DotfilesApp:
             stage,
         )
 
-    async def status(self) -> dict[str, typing.Any]:
-        """Get system and provisioning status."""
+    async def status(
+        self,
+        max_concurrent: int = 8,
+        probe_timeout: float = STATUS_PROBE_TIMEOUT,
+    ) -> dict[str, typing.Any]:
+        """Get system and provisioning status.
+
+        Verify probes run concurrently (at most *max_concurrent* at a time),
+        alongside the symlink checks; a probe still running after
+        *probe_timeout* seconds is killed and reported as not installed.
+        """
+        import asyncio
+
         status: dict[str, typing.Any] = {
             "platform": {
                 "os": self.platform.info.os,
@@ -1876,17 +5831,43 @@ class DotfilesApp:
             "dotfiles": {},
         }
 
-        # Check provisioner status
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        async def probe(provisioner: Provisioner) -> bool:
+            async with semaphore:
+                return await self.provisioner_manager._is_installed(
+                    provisioner,
+                    timeout=probe_timeout,
+                )
+
+        # Check provisioner status and dotfile symlinks concurrently
         all_provisioners = {**self.config.provisioners, **self.config.enhancements}
+        async with asyncio.TaskGroup() as tg:
+            probes = {
+                name: tg.create_task(probe(provisioner))
+                for name, provisioner in all_provisioners.items()
+            }
+            dotfiles = tg.create_task(asyncio.to_thread(self._dotfile_status))
+
         for name, provisioner in all_provisioners.items():
-            is_installed = await self.provisioner_manager._is_installed(provisioner)
             status["provisioners"][name] = {
-                "installed": is_installed,
+                "installed": probes[name].result(),
                 "type": provisioner.type.name.lower(),
                 "description": provisioner.description,
             }
+        status["dotfiles"] = dotfiles.result()
+
+        return status
+
+    def _dotfile_status(self) -> dict[str, str]:
+        """Classify each configured dotfile symlink.
+
+        Returns:
+            Mapping of destination path to ok, missing, not_symlink or
+            wrong_target.
 
-        # Check dotfile symlinks
+        """
+        dotfiles: dict[str, str] = {}
         for dest_path, template_def in self.config.files.items():
             dest = self.platform.info.home / dest_path
             source = self.config.source / template_def.source
@@ -1900,20 +5881,31 @@ class DotfilesApp:
             else:
                 status_str = "ok"
 
-            status["dotfiles"][str(dest_path)] = status_str
-
-        return status
+            dotfiles[str(dest_path)] = status_str
+        return dotfiles
 
     async def cleanup(self, patterns: list[str] | None = None) -> CleanupResult:
-        """Clean up unwanted files from home directory."""
-        cleanup_patterns = patterns or self.config.cleanup_patterns
-        if not cleanup_patterns:
-            logger.info("No cleanup patterns configured")
-            return CleanupResult.ok()
-
-        logger.info("Cleaning up unwanted files...")
+        """Clean up unwanted files from home directory and empty the trash."""
         removed: list[pathlib.Path] = []
         errors: list[tuple[str, str]] = []
+        trash = self.trash or TrashBin()
+        dests = [plan.dest for plan in self._mappings()]
+        if pending := trash.entries(dests):
+            if self.dry_run:
+                logger.info("[DRY RUN] Would empty trash: %d entry(ies)", len(pending))
+            else:
+                logger.info("Emptying trash: %d entry(ies)", len(pending))
+                removed.extend(trash.reap(dests))
+                errors.extend(
+                    (str(entry), "could not be deleted")
+                    for entry in trash.entries(dests)
+                )
+
+        cleanup_patterns = patterns or self.config.cleanup_patterns
+        if cleanup_patterns:
+            logger.info("Cleaning up unwanted files...")
+        else:
+            logger.info("No cleanup patterns configured")
 
         for pattern in cleanup_patterns:
             try:
@@ -1941,9 +5933,387 @@ class DotfilesApp:
             errors=errors,
         )
 
+    async def restore(
+        self,
+        run: str | None = None,
+        paths: list[pathlib.Path] | None = None,
+    ) -> RestoreResult:
+        """Put dests replaced by an install back from its backup.
+
+        Restores everything backed up in *run* (default: the most recent),
+        or only the dests among *paths*, which are taken relative to home.
+        """
+        backups = self.backups or BackupStore()
+        runs = backups.runs()
+        run = run or (runs[-1] if runs else None)
+        if run is None or run not in runs:
+            msg = f"No backup run named {run}" if run else "No backups found"
+            logger.error(msg)
+            return RestoreResult.fail(error=msg)
+
+        home = self.platform.info.home
+        wanted = {home / path.expanduser() for path in paths or []}
+        entries = [e for e in backups.entries(run) if not wanted or e.dest in wanted]
+        if missing := wanted - {e.dest for e in entries}:
+            msg = f"Not in backup {run}: " + ", ".join(sorted(map(str, missing)))
+            logger.error(msg)
+            return RestoreResult.fail(error=msg)
+
+        restored: list[pathlib.Path] = []
+        errors: list[tuple[str, str]] = []
+        for entry in entries:
+            if self.dry_run:
+                logger.info("[DRY RUN] Would restore %s from %s", entry.dest, run)
+                continue
+            try:
+                backups.restore(entry)
+            except OSError as e:
+                logger.exception("Failed to restore %s", entry.dest)
+                errors.append((str(entry.dest), str(e)))
+            else:
+                logger.info("Restored %s", entry.dest)
+                restored.append(entry.dest)
+
+        return RestoreResult(
+            success=not errors,
+            error=f"{len(errors)} path(s) failed" if errors else "",
+            restored=restored,
+            errors=errors,
+        )
+
+
+def _percentile(ordered: list[float], fraction: float) -> float:
+    """Linearly interpolated percentile of already-sorted values.
+
+    Returns:
+        Value at *fraction* (0.0-1.0) of the distribution.
+
+    """
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def load_shell_profile(
+    log_dir: pathlib.Path,
+    shell: ShellName | None = None,
+) -> tuple[int, list[ProfileRow]]:
+    """Aggregate `shell --instrument` session logs into per-snippet rows.
+
+    Malformed lines (e.g. from a session killed mid-write) are skipped.
+
+    Returns:
+        (number of sessions read, rows ordered by stage then snippet name
+        with each stage's total first)
+
+    """
+    logs = sorted(log_dir.glob(f"{shell or '*'}.*.log"))
+    samples: dict[tuple[str, str], list[float]] = {}
+    for log in logs:
+        for line in log.read_text(errors="replace").splitlines():
+            fields = line.split("\t")
+            if len(fields) != 3 or not fields[2].lstrip("-").isdigit():
+                continue
+            stage, snippet, usec = fields
+            samples.setdefault((stage, snippet), []).append(int(usec) / 1000)
+
+    stage_order = [stage.name.lower() for stage in ShellStage]
+    rows = []
+    for (stage, snippet), values in samples.items():
+        values.sort()
+        rows.append(
+            ProfileRow(
+                stage=stage,
+                snippet=snippet,
+                samples=len(values),
+                p50_ms=_percentile(values, 0.5),
+                p95_ms=_percentile(values, 0.95),
+                max_ms=values[-1],
+            ),
+        )
+    rows.sort(
+        key=lambda row: (
+            stage_order.index(row.stage) if row.stage in stage_order else 99,
+            row.snippet != PROFILE_STAGE_TOTAL,
+            row.snippet,
+        ),
+    )
+    return len(logs), rows
+
+
+def format_shell_profile(sessions: int, rows: list[ProfileRow]) -> str:
+    """Render profile rows as a plain-text table.
+
+    Stage totals are compared with STAGE_BUDGET_MS; a p95 over budget is
+    flagged with ``!``.
+
+    Returns:
+        Table text ending in a newline.
+
+    """
+    budgets = {stage.name.lower(): ms for stage, ms in STAGE_BUDGET_MS.items()}
+    header = ("STAGE", "SNIPPET", "N", "P50 ms", "P95 ms", "MAX ms", "BUDGET")
+    table = [header]
+    for row in rows:
+        budget = ""
+        snippet = row.snippet
+        if snippet == PROFILE_STAGE_TOTAL:
+            snippet = "(total)"
+            if (limit := budgets.get(row.stage)) is not None:
+                flag = " !" if row.p95_ms > limit else ""
+                budget = f"{limit}{flag}"
+        table.append(
+            (
+                row.stage,
+                snippet,
+                str(row.samples),
+                f"{row.p50_ms:.2f}",
+                f"{row.p95_ms:.2f}",
+                f"{row.max_ms:.2f}",
+                budget,
+            ),
+        )
+    widths = [max(len(line[i]) for line in table) for i in range(len(header))]
+    lines = [f"{sessions} session(s)"]
+    for line in table:
+        cells = [
+            cell.ljust(width) if i < 2 else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(line, widths, strict=True))
+        ]
+        lines.append("  ".join(cells).rstrip())
+    return "\n".join(lines) + "\n"
+
+
+@dataclasses.dataclass(slots=True)
+class ShellRequest:
+    """Arguments for the `shell` subcommand fast path."""
+
+    shell: ShellName
+    stage: StageLevel | None = None
+    config: pathlib.Path | None = None
+    verbose: bool = False
+    compile: bool = False
+    defer_late: bool = False
+    resolve_conditions: bool = False
+    instrument: bool = False
+
+
+# Boolean `shell` flags accepted by the fast path, mapped to ShellRequest fields
+_SHELL_REQUEST_FLAGS = {
+    "--compile": "compile",
+    "--defer-late": "defer_late",
+    "--resolve-conditions": "resolve_conditions",
+    "--instrument": "instrument",
+}
+
+
+def _parse_shell_request(argv: collections.abc.Sequence[str]) -> ShellRequest | None:
+    """Parse a `shell` invocation without argparse.
+
+    Only the flags `shell` understands are accepted. Anything else (help,
+    typos, other subcommands) returns None so the full argparse CLI handles
+    it and reports errors consistently.
+
+    Returns:
+        ShellRequest for a well-formed `shell` invocation, else None.
+
+    """
+    if "shell" not in argv:
+        return None
+
+    shell: ShellName | None = None
+    stage: StageLevel | None = None
+    config: pathlib.Path | None = None
+    verbose = False
+    options: dict[str, bool] = {}
+    seen_command = False
+
+    args = iter(argv)
+    for arg in args:
+        flag, _, inline_value = arg.partition("=")
+        match flag:
+            case "shell" if not seen_command:
+                seen_command = True
+            case "--config" if not seen_command:
+                value = inline_value or next(args, "")
+                if not value:
+                    return None
+                config = pathlib.Path(value)
+            case "--verbose" | "-v" if not seen_command and not inline_value:
+                verbose = True
+            case "--dry-run" if not seen_command and not inline_value:
+                pass  # shell generation never mutates anything
+            case "--bash" | "--zsh" | "--fish" if seen_command and not inline_value:
+                if shell is not None:
+                    return None
+                shell = typing.cast("ShellName", flag.removeprefix("--"))
+            case "--stage" if seen_command:
+                value = inline_value or next(args, "")
+                if value not in ("early", "main", "late"):
+                    return None
+                stage = typing.cast("StageLevel", value)
+            case _ if flag in _SHELL_REQUEST_FLAGS and seen_command:
+                if inline_value:
+                    return None
+                options[_SHELL_REQUEST_FLAGS[flag]] = True
+            case _:
+                return None
+
+    if shell is None:
+        return None
+    return ShellRequest(
+        shell=shell,
+        stage=stage,
+        config=config,
+        verbose=verbose,
+        **options,
+    )
+
+
+def _write_shell_init(shell_init: str) -> None:
+    """Write generated shell init to stdout for sourcing/piping."""
+    sys.stdout.write(shell_init)
+    if not shell_init.endswith("\n"):
+        sys.stdout.write("\n")
+
+
+def compile_shell_init(
+    generator: ShellGenerator,
+    config_path: pathlib.Path,
+    snippets: list[ShellSnippet],
+    shell: ShellName,
+    stage: StageLevel | None = None,
+    cache_dir: pathlib.Path | None = None,
+) -> CompiledShellInit:
+    """Compile shell init artifacts that recompile when dot.toml or dot.py change.
+
+    Returns:
+        CompiledShellInit for the written loader stub.
+
+    """
+    import shlex
+
+    script = pathlib.Path(__file__).resolve()
+    config_path = config_path.absolute()
+    regenerate = [
+        sys.executable,
+        str(script),
+        "--config",
+        str(config_path),
+        "shell",
+        f"--{shell}",
+        "--compile",
+    ]
+    if stage:
+        regenerate.extend(["--stage", stage])
+    regenerate.extend(generator.mode_flags())
+    return generator.compile_staged_init(
+        shell,
+        snippets,
+        cache_dir or _xdg_cache_dir() / "shell",
+        watch=[config_path, script],
+        regenerate_cmd=shlex.join(regenerate),
+        stage=stage,
+    )
+
+
+def run_shell(request: ShellRequest) -> int:
+    """Generate shell init using only ConfigLoader and ShellGenerator.
+
+    Skips Platform detection, the command runner, provisioner management,
+    asyncio and argparse, which `shell` never needs.
+
+    Returns:
+        Process exit code.
+
+    """
+    _configure_logging(logging.DEBUG if request.verbose else logging.INFO)
+    loader = ConfigLoader(request.config)
+    _emit_shell_init(request, loader.config_path, loader.load())
+    return 0
+
+
+def _emit_shell_init(
+    request: ShellRequest,
+    config_path: pathlib.Path,
+    config: DotfilesConfig,
+    platform: Platform | None = None,
+) -> None:
+    """Write shell init (or the compiled loader path) for a shell request."""
+    generator = ShellGenerator(
+        platform,
+        defer_late=request.defer_late,
+        resolve_conditions=request.resolve_conditions,
+        instrument=request.instrument,
+    )
+    if request.compile:
+        compiled = compile_shell_init(
+            generator,
+            config_path,
+            config.shell_snippets,
+            request.shell,
+            request.stage,
+        )
+        sys.stdout.write(f"{compiled.loader}\n")
+        return
+
+    shell_init = generator.generate_staged_init(
+        request.shell,
+        config.shell_snippets,
+        request.stage,
+    )
+    _write_shell_init(shell_init)
+
+
+def _positive_int(value: str) -> int:
+    """Parse a command-line count that must be at least 1.
+
+    Returns:
+        The parsed count.
+
+    Raises:
+        argparse.ArgumentTypeError: If *value* isn't a positive integer.
+
+    """
+    import argparse
+
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        msg = f"must be a positive integer, got {value!r}"
+        raise argparse.ArgumentTypeError(msg)
+    return number
+
+
+def _non_negative_int(value: str) -> int:
+    """Parse a command-line count that may be 0 but not negative.
+
+    Returns:
+        The parsed count.
+
+    Raises:
+        argparse.ArgumentTypeError: If *value* isn't a non-negative integer.
+
+    """
+    import argparse
+
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if number < 0:
+        msg = f"must be a non-negative integer, got {value!r}"
+        raise argparse.ArgumentTypeError(msg)
+    return number
+
 
 async def async_main() -> int:
     """Async main function."""
+    import argparse
+
     parser = argparse.ArgumentParser(
         description="Modern dotfiles management with provisioner architecture",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -1954,8 +6324,14 @@ Examples:
   %(prog)s provision --type provisioner  # Install only core provisioners
   %(prog)s shell --zsh                # Generate complete shell init
   %(prog)s shell --zsh --stage early  # Generate only early stage (fast)
+  %(prog)s shell --zsh --compile      # Cache init, print loader to source
+  %(prog)s shell --zsh --instrument   # Log per-snippet startup timings
+  %(prog)s shell-profile              # Summarize logged startup timings
+  %(prog)s bench --runs 30            # Benchmark interactive shell startup
+  %(prog)s bench-compare              # Significance test of the last two runs
   %(prog)s status                     # Show provisioning status
   %(prog)s cleanup                    # Remove unwanted files from home
+  %(prog)s watch                      # Relink dotfiles as they change
 """,
     )
 
@@ -1980,6 +6356,11 @@ Examples:
         type=pathlib.Path,
         help="Path to configuration file",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore cached config snapshots and verify results",
+    )
 
     subparsers = parser.add_subparsers(dest="command", help="Commands")
 
@@ -1990,6 +6371,17 @@ Examples:
         action="store_true",
         help="Skip confirmation for destructive directory deletions",
     )
+    install_parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Reclassify every mapping instead of only those changed since last run",
+    )
+    install_parser.add_argument(
+        "--format",
+        choices=["table", "plain", "json"],
+        help="Plan output: table, plain lines, or NDJSON "
+        "(default: table on a TTY, else plain)",
+    )
 
     # provision command
     provision_parser = subparsers.add_parser(
@@ -2001,6 +6393,45 @@ Examples:
         choices=["foundation", "provisioner", "enhancement"],
         help="Filter by provisioner type",
     )
+    provision_parser.add_argument(
+        "--group",
+        choices=typing.get_args(PackageGroup.__value__),
+        help="Also install this package group, resolved via [package_groups]",
+    )
+    provision_parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=4,
+        help="Maximum provisioners installed concurrently (default: 4)",
+    )
+
+    # packages command
+    packages_parser = subparsers.add_parser(
+        "packages",
+        help="Install missing pip, npm and cargo packages",
+    )
+    packages_parser.add_argument(
+        "--ecosystem",
+        action="append",
+        choices=LANGUAGE_PACKAGE_MANAGERS,
+        help="Only this ecosystem (repeatable; default: all)",
+    )
+    packages_parser.add_argument(
+        "--group",
+        choices=typing.get_args(PackageGroup.__value__),
+        help="Also install this package group, resolved via [package_groups]",
+    )
+    packages_parser.add_argument(
+        "--upgrade",
+        action="store_true",
+        help="Upgrade every selected package, installed or not",
+    )
+    packages_parser.add_argument(
+        "--list",
+        action="store_true",
+        help="Print the selected package names instead of installing them",
+    )
 
     # shell command
     shell_parser = subparsers.add_parser("shell", help="Generate shell initialization")
@@ -2013,6 +6444,105 @@ Examples:
         choices=["early", "main", "late"],
         help="Generate only specific stage",
     )
+    shell_parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="Write cached init artifacts and print the loader path to source",
+    )
+    shell_parser.add_argument(
+        "--defer-late",
+        action="store_true",
+        help=(
+            "Run late-stage snippets after the first prompt is shown; in zsh "
+            "and fish they run inside a function, so declare globals with "
+            "`typeset -g`/`set -g`"
+        ),
+    )
+    shell_parser.add_argument(
+        "--resolve-conditions",
+        action="store_true",
+        help="Evaluate snippet conditions now instead of on every shell start",
+    )
+    shell_parser.add_argument(
+        "--instrument",
+        action="store_true",
+        help="Log per-snippet startup timings for shell-profile",
+    )
+
+    # shell-profile command
+    profile_parser = subparsers.add_parser(
+        "shell-profile",
+        help="Summarize startup timings logged by shell --instrument",
+    )
+    profile_group = profile_parser.add_mutually_exclusive_group()
+    for name in ("bash", "zsh", "fish"):
+        profile_group.add_argument(
+            f"--{name}",
+            action="store_const",
+            const=name,
+            dest="shell",
+        )
+    profile_parser.add_argument(
+        "--clear",
+        action="store_true",
+        help="Delete the session logs after reporting",
+    )
+
+    # bench command
+    bench_parser = subparsers.add_parser(
+        "bench",
+        help="Benchmark interactive shell startup (<shell> -i -c exit)",
+    )
+    bench_parser.add_argument(
+        "--shell",
+        dest="shells",
+        action="append",
+        choices=["zsh", "fish", "bash"],
+        help="Shell to benchmark (repeatable; default: zsh, fish and bash)",
+    )
+    bench_parser.add_argument(
+        "--runs", type=_positive_int, default=20, help="Measured runs"
+    )
+    bench_parser.add_argument(
+        "--warmup", type=_non_negative_int, default=3, help="Warmup runs"
+    )
+    bench_parser.add_argument(
+        "--cwd",
+        type=pathlib.Path,
+        help="Directory to start shells in",
+    )
+    bench_parser.add_argument(
+        "--run-dir",
+        type=pathlib.Path,
+        help="Artifact directory (default: .artifacts/shell-perf/<timestamp>)",
+    )
+    bench_parser.add_argument(
+        "--with-fast-mode",
+        action="store_true",
+        help="Also benchmark MISE_STARTUP_MODE=fast STARSHIP_PROFILE=fast",
+    )
+
+    # bench-compare command
+    compare_parser = subparsers.add_parser(
+        "bench-compare",
+        help="Compare two bench runs with a Mann-Whitney significance test",
+    )
+    compare_parser.add_argument(
+        "--before",
+        type=pathlib.Path,
+        help="Baseline run directory (default: second most recent run)",
+    )
+    compare_parser.add_argument(
+        "--after",
+        type=pathlib.Path,
+        help="Candidate run directory (default: most recent run)",
+    )
+    compare_parser.add_argument(
+        "--alpha",
+        type=float,
+        default=0.05,
+        help="Significance level (default: 0.05)",
+    )
 
     # status command
     subparsers.add_parser("status", help="Show system and provisioning status")
@@ -2025,6 +6555,44 @@ Examples:
         help="Additional cleanup patterns",
     )
 
+    # watch command
+    watch_parser = subparsers.add_parser(
+        "watch",
+        help="Relink dotfiles and recompile shell init as files change (Linux)",
+    )
+    watch_parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Replace real directories instead of warning about them",
+    )
+    watch_parser.add_argument(
+        "--debounce",
+        type=float,
+        default=WATCH_DEBOUNCE,
+        help=f"Seconds of quiet before applying changes (default: {WATCH_DEBOUNCE})",
+    )
+
+    # restore command
+    restore_parser = subparsers.add_parser(
+        "restore",
+        help="Restore paths replaced by install from a backup",
+    )
+    restore_parser.add_argument(
+        "paths",
+        nargs="*",
+        type=pathlib.Path,
+        help="Dests to restore, relative to home (default: all in the run)",
+    )
+    restore_parser.add_argument(
+        "--run",
+        help="Backup run to restore from (default: most recent)",
+    )
+    restore_parser.add_argument(
+        "--list",
+        action="store_true",
+        help="List backup runs and the paths they hold",
+    )
+
     args = parser.parse_args()
 
     # Configure logging
@@ -2036,6 +6604,7 @@ Examples:
         config_path=args.config,
         dry_run=args.dry_run,
         force=getattr(args, "force", False),
+        no_cache=args.no_cache,
     )
 
     # Route commands
@@ -2043,7 +6612,10 @@ Examples:
 
     match args.command:
         case "install":
-            result = await app.install_dotfiles()
+            result = await app.install_dotfiles(
+                full=args.full,
+                plan_format=args.format,
+            )
             if not result and result.failed:
                 for item in result.failed:
                     logger.error("  Failed: %s — %s", item.dest, item.error)
@@ -2059,18 +6631,101 @@ Examples:
                         filter_type = ProvisionerType.PROVISIONER
                     case "enhancement":
                         filter_type = ProvisionerType.ENHANCEMENT
-            prov_result = await app.provision(filter_type)
+            prov_result = await app.provision(filter_type, args.jobs, args.group)
             if not prov_result and prov_result.failed_names:
                 for name in prov_result.failed_names:
                     logger.error("  Failed: %s", name)
             success = bool(prov_result)
 
+        case "packages" if args.list:
+            try:
+                selection = app.package_selection(args.group)
+            except ValueError:
+                logger.exception("Invalid package groups")
+                success = False
+            else:
+                for ecosystem in args.ecosystem or LANGUAGE_PACKAGE_MANAGERS:
+                    for package in selection.get(ecosystem, []):
+                        sys.stdout.write(f"{package}\n")
+
+        case "packages":
+            try:
+                package_results = await app.install_language_packages(
+                    args.ecosystem or LANGUAGE_PACKAGE_MANAGERS,
+                    group=args.group,
+                    upgrade=args.upgrade,
+                )
+            except ValueError:
+                logger.exception("Invalid package groups")
+                success = False
+            else:
+                for name, package_result in package_results.items():
+                    if not package_result:
+                        logger.error("  Failed: %s packages", name)
+                success = all(package_results.values())
+
         case "shell":
-            shell_init = app.generate_shell_init(args.shell, args.stage)
-            # Output to stdout for shell sourcing/piping
-            sys.stdout.write(shell_init)
-            if not shell_init.endswith("\n"):
-                sys.stdout.write("\n")
+            shell_request = ShellRequest(
+                shell=args.shell,
+                stage=args.stage,
+                config=args.config,
+                verbose=args.verbose,
+                compile=args.compile,
+                defer_late=args.defer_late,
+                resolve_conditions=args.resolve_conditions,
+                instrument=args.instrument,
+            )
+            _emit_shell_init(
+                shell_request,
+                app.config_loader.config_path,
+                app.config,
+                app.platform,
+            )
+
+        case "shell-profile":
+            log_dir = _xdg_cache_dir() / "shell-profile"
+            sessions, rows = load_shell_profile(log_dir, args.shell)
+            if rows:
+                sys.stdout.write(format_shell_profile(sessions, rows))
+            else:
+                logger.warning(
+                    "No timings in %s; source `dot.py shell --instrument` first",
+                    log_dir,
+                )
+            if args.clear:
+                for log in log_dir.glob(f"{args.shell or '*'}.*.log"):
+                    log.unlink()
+
+        case "bench":
+            run_dir, results = run_bench(
+                args.shells or ["zsh", "fish", "bash"],
+                runs=args.runs,
+                warmup=args.warmup,
+                cwd=args.cwd,
+                run_dir=args.run_dir,
+                with_fast_mode=args.with_fast_mode,
+            )
+            sys.stdout.write(format_bench_results(results))
+            logger.info("Benchmark artifacts written to: %s", run_dir)
+            success = bool(results)
+
+        case "bench-compare":
+            before, after = args.before, args.after
+            if before is None or after is None:
+                latest = _latest_bench_runs(_bench_artifact_root(), 2)
+                if len(latest) < 2:
+                    logger.error("Need two bench runs; pass --before and --after")
+                    return 1
+                before = before or latest[0]
+                after = after or latest[1]
+            try:
+                comparisons = compare_bench_runs(before, after, args.alpha)
+            except OSError:
+                logger.exception("Cannot read bench runs %s and %s", before, after)
+                success = False
+            else:
+                sys.stdout.write(format_bench_comparison(comparisons))
+                success = bool(comparisons)
 
         case "status":
             status = await app.status()
@@ -2083,6 +6738,23 @@ Examples:
         case "cleanup":
             success = bool(await app.cleanup(args.patterns))
 
+        case "watch" if sys.platform != "linux":
+            logger.error("watch needs inotify, which only Linux provides")
+            success = False
+
+        case "watch":
+            await DotfilesWatcher(app, debounce=args.debounce).run()
+
+        case "restore" if args.list:
+            backups = app.backups or BackupStore()
+            for run in backups.runs():
+                sys.stdout.write(f"{run}\n")
+                for entry in backups.entries(run):
+                    sys.stdout.write(f"  {entry.kind:<8}{entry.dest}\n")
+
+        case "restore":
+            success = bool(await app.restore(args.run, args.paths))
+
         case None:
             parser.print_help()
 
@@ -2095,6 +6767,16 @@ Examples:
 
 def main() -> int:
     """Execute the main application."""
+    if (shell_request := _parse_shell_request(sys.argv[1:])) is not None:
+        try:
+            return run_shell(shell_request)
+        except Exception:
+            logger.exception("Unexpected error occurred")
+            return 1
+
+    import asyncio
+
+    _configure_logging()
     try:
         return asyncio.run(async_main())
     except KeyboardInterrupt:
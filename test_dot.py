@@ -9,11 +9,22 @@ Run with: uv run py.test test_dot.py --cov -v
 
 from __future__ import annotations
 
+import asyncio
+import contextlib
+import dataclasses
+import hashlib
+import http.client
+import http.server
+import io
 import logging
 import os
 import pathlib
+import shutil
+import ssl
 import subprocess
 import sys
+import threading
+import time
 import tomllib
 import typing
 import unittest.mock
@@ -46,6 +57,41 @@ def temp_home(
         yield home_dir
 
 
+@pytest.fixture(autouse=True)
+def isolated_xdg_dirs(
+    tmp_path: pathlib.Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> pathlib.Path:
+    """Keep persistent caches and state out of the real user directories."""
+    cache_home = tmp_path / "xdg-cache"
+    monkeypatch.setenv("XDG_CACHE_HOME", str(cache_home))
+    monkeypatch.setenv("XDG_STATE_HOME", str(tmp_path / "xdg-state"))
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "xdg-data"))
+    return cache_home
+
+
+@pytest.fixture
+def dpkg_status(
+    tmp_path: pathlib.Path,
+) -> collections.abc.Callable[..., dot.PackageDatabase]:
+    """Build a package database whose dpkg status lists given packages."""
+
+    def build(*installed: str) -> dot.PackageDatabase:
+        root = tmp_path / "pkgroot"
+        status = root / "var/lib/dpkg/status"
+        status.parent.mkdir(parents=True, exist_ok=True)
+        status.write_text(
+            "".join(
+                f"Package: {name}\nStatus: install ok installed\n"
+                f"Architecture: amd64\nVersion: 1.0\n\n"
+                for name in installed
+            )
+        )
+        return dot.PackageDatabase(root=root)
+
+    return build
+
+
 @pytest.fixture
 def sample_toml_config() -> str:
     """Sample TOML configuration for testing."""
@@ -110,6 +156,8 @@ condition = "command -v starship"
 bash = 'eval "$(starship init bash)"'
 zsh = 'eval "$(starship init zsh)"'
 fish = 'starship init fish | source'
+cache_command = "starship init {shell} --print-full-init"
+cache_inputs = ["~/.config/starship.toml"]
 """
 
 
@@ -519,6 +567,10 @@ class TestConfigLoader:
         assert starship_snippet.stage == dot.ShellStage.LATE
         assert starship_snippet.bash == 'eval "$(starship init bash)"'
         assert starship_snippet.fish == "starship init fish | source"
+        assert starship_snippet.cache_command == (
+            "starship init {shell} --print-full-init"
+        )
+        assert starship_snippet.cache_inputs == ["~/.config/starship.toml"]
 
     def test_invalid_toml(self, tmp_path: pathlib.Path) -> None:
         """Test handling invalid TOML syntax."""
@@ -574,6 +626,125 @@ packages = ["git", "curl"]
         assert config.packages["brew"]["packages"] == ["git", "curl"]
 
 
+class TestConfigSnapshot:
+    """Test the persistent compiled config snapshot cache."""
+
+    def test_snapshot_written_on_first_load(
+        self,
+        tmp_path: pathlib.Path,
+        sample_toml_config: str,
+    ) -> None:
+        """Test a cold load parses TOML and persists a snapshot."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+        loader = dot.ConfigLoader(config_path, cache_dir=tmp_path / "cache")
+
+        config = loader.load()
+
+        assert loader.snapshot_path.exists()
+        assert "rust" in config.provisioners
+
+    def test_warm_load_skips_parsing(
+        self,
+        tmp_path: pathlib.Path,
+        sample_toml_config: str,
+    ) -> None:
+        """Test an unchanged config is served from the snapshot."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+        loader = dot.ConfigLoader(config_path, cache_dir=tmp_path / "cache")
+        cold = loader.load()
+
+        with patch.object(loader, "_parse_config") as mock_parse:
+            warm = loader.load()
+
+        mock_parse.assert_not_called()
+        assert warm == cold
+
+    def test_changed_config_is_reparsed(
+        self,
+        tmp_path: pathlib.Path,
+        sample_toml_config: str,
+    ) -> None:
+        """Test editing dot.toml invalidates the snapshot."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+        loader = dot.ConfigLoader(config_path, cache_dir=tmp_path / "cache")
+        loader.load()
+
+        config_path.write_text(
+            sample_toml_config.replace("priority = 3", "priority = 4"),
+        )
+        config = loader.load()
+
+        assert config.provisioners["rust"].priority == 4
+
+    def test_same_stat_different_content_is_reparsed(
+        self,
+        tmp_path: pathlib.Path,
+        sample_toml_config: str,
+    ) -> None:
+        """Test the content hash catches edits that preserve mtime and size."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+        loader = dot.ConfigLoader(config_path, cache_dir=tmp_path / "cache")
+        loader.load()
+        stat = config_path.stat()
+
+        config_path.write_text(
+            sample_toml_config.replace("priority = 3", "priority = 8"),
+        )
+        os.utime(config_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        config = loader.load()
+
+        assert config.provisioners["rust"].priority == 8
+
+    def test_use_cache_false_bypasses_snapshot(
+        self,
+        tmp_path: pathlib.Path,
+        sample_toml_config: str,
+    ) -> None:
+        """Test disabling the cache neither reads nor writes snapshots."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+        loader = dot.ConfigLoader(
+            config_path,
+            cache_dir=tmp_path / "cache",
+            use_cache=False,
+        )
+
+        loader.load()
+
+        assert not loader.snapshot_path.exists()
+
+    def test_corrupt_snapshot_falls_back_to_parse(
+        self,
+        tmp_path: pathlib.Path,
+        sample_toml_config: str,
+    ) -> None:
+        """Test an unreadable snapshot is ignored and rewritten."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+        loader = dot.ConfigLoader(config_path, cache_dir=tmp_path / "cache")
+        loader.snapshot_path.parent.mkdir(parents=True)
+        loader.snapshot_path.write_bytes(b"not a pickle")
+
+        config = loader.load()
+
+        key = loader._snapshot_key(config_path.stat(), config_path.read_bytes())
+        assert "rust" in config.provisioners
+        assert loader._read_snapshot(key) == config
+
+    def test_default_cache_dir_honors_xdg(
+        self,
+        isolated_xdg_dirs: pathlib.Path,
+    ) -> None:
+        """Test snapshots default to $XDG_CACHE_HOME/dot/config."""
+        loader = dot.ConfigLoader()
+
+        assert loader.cache_dir == isolated_xdg_dirs / "dot" / "config"
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # DEPENDENCY RESOLVER TESTS
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -765,3443 +936,7734 @@ class TestShellGenerator:
         assert "end" in fish_init
 
 
-# ═══════════════════════════════════════════════════════════════════════════════
-# PROVISIONER MANAGER TESTS
-# ═══════════════════════════════════════════════════════════════════════════════
+class TestShellCompile:
+    """Test precompiled, content-addressed shell init artifacts."""
 
+    @pytest.fixture
+    def snippets(self) -> list[dot.ShellSnippet]:
+        """Snippets spanning all three stages."""
+        return [
+            dot.ShellSnippet(
+                name="early_env",
+                description="Early env",
+                stage=dot.ShellStage.EARLY,
+                default="export DOT_EARLY=1",
+            ),
+            dot.ShellSnippet(
+                name="late_prompt",
+                description="Late prompt",
+                stage=dot.ShellStage.LATE,
+                default="export DOT_LATE=1",
+            ),
+        ]
 
-class TestProvisionerManager:
-    """Test provisioner installation lifecycle management."""
+    def test_artifacts_named_by_digest(self, tmp_path, snippets) -> None:
+        """Test one artifact per non-empty stage, named by content hash."""
+        generator = dot.ShellGenerator()
+        compiled = generator.compile_staged_init(
+            "bash",
+            snippets,
+            tmp_path,
+            watch=[tmp_path / "dot.toml"],
+            regenerate_cmd="true",
+        )
 
-    @pytest.mark.asyncio
-    async def test_manager_init(self, config_with_provisioners) -> None:
-        """Test ProvisionerManager initialization."""
-        runner = dot.AsyncCommandRunner(dry_run=True)
-        platform_obj = dot.Platform()
-        all_provisioners = {
-            **config_with_provisioners.provisioners,
-            **config_with_provisioners.enhancements,
-        }
+        assert compiled.digest == generator.snippets_digest("bash", snippets)
+        early = generator.snippets_digest("bash", snippets, dot.ShellStage.EARLY)
+        late = generator.snippets_digest("bash", snippets, dot.ShellStage.LATE)
+        assert early != late
+        assert [a.name for a in compiled.artifacts] == [
+            f"early-{early}.bash",
+            f"late-{late}.bash",
+        ]
+        assert "DOT_EARLY=1" in compiled.artifacts[0].read_text()
+        loader = compiled.loader.read_text()
+        assert compiled.loader == tmp_path / "bash" / "init.bash"
+        for artifact in compiled.artifacts:
+            assert f"source {artifact}" in loader
+
+    def test_unchanged_snippets_reuse_artifacts(self, tmp_path, snippets) -> None:
+        """Test recompiling identical snippets does not rewrite artifacts."""
+        generator = dot.ShellGenerator()
+        watch = [tmp_path / "dot.toml"]
+        first = generator.compile_staged_init(
+            "zsh",
+            snippets,
+            tmp_path,
+            watch=watch,
+            regenerate_cmd="true",
+        )
+        mtimes = [a.stat().st_mtime_ns for a in first.artifacts]
+
+        second = generator.compile_staged_init(
+            "zsh",
+            snippets,
+            tmp_path,
+            watch=watch,
+            regenerate_cmd="true",
+        )
 
-        manager = dot.ProvisionerManager(all_provisioners, runner, platform_obj)
+        assert second.artifacts == first.artifacts
+        assert [a.stat().st_mtime_ns for a in second.artifacts] == mtimes
+
+    def test_changed_snippets_prune_old_artifacts(self, tmp_path, snippets) -> None:
+        """Test only the changed stage's artifact is replaced and pruned."""
+        generator = dot.ShellGenerator()
+        watch = [tmp_path / "dot.toml"]
+        first = generator.compile_staged_init(
+            "fish",
+            snippets,
+            tmp_path,
+            watch=watch,
+            regenerate_cmd="true",
+        )
+        late_mtime = first.artifacts[1].stat().st_mtime_ns
+
+        snippets[0].default = "export DOT_EARLY=2"
+        second = generator.compile_staged_init(
+            "fish",
+            snippets,
+            tmp_path,
+            watch=watch,
+            regenerate_cmd="true",
+        )
 
-        assert manager.provisioners == all_provisioners
-        assert manager.runner == runner
-        assert manager.platform == platform_obj
-        assert isinstance(manager.resolver, dot.DependencyResolver)
+        assert second.digest != first.digest
+        assert second.artifacts[0] != first.artifacts[0]
+        assert not first.artifacts[0].exists()
+        assert second.artifacts[1] == first.artifacts[1]
+        assert second.artifacts[1].stat().st_mtime_ns == late_mtime
+        assert all(a.exists() for a in second.artifacts)
+        assert second.loader.exists()
+
+    def test_stage_loader_is_separate(self, tmp_path, snippets) -> None:
+        """Test a single-stage compile gets its own loader."""
+        generator = dot.ShellGenerator()
+        compiled = generator.compile_staged_init(
+            "zsh",
+            snippets,
+            tmp_path,
+            watch=[tmp_path / "dot.toml"],
+            regenerate_cmd="true",
+            stage="early",
+        )
 
-    @pytest.mark.asyncio
-    async def test_is_installed_check(self, config_with_provisioners) -> None:
-        """Test checking if provisioner is installed."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
-        all_provisioners = {
-            **config_with_provisioners.provisioners,
-            **config_with_provisioners.enhancements,
-        }
+        assert compiled.loader.name == "init-early.zsh"
+        assert len(compiled.artifacts) == 1
+
+    def test_fish_loader_syntax(self, tmp_path, snippets) -> None:
+        """Test the fish loader uses fish conditionals."""
+        compiled = dot.ShellGenerator().compile_staged_init(
+            "fish",
+            snippets,
+            tmp_path,
+            watch=[tmp_path / "dot.toml"],
+            regenerate_cmd="true",
+        )
+        loader = compiled.loader.read_text()
+
+        assert f"test {tmp_path / 'dot.toml'} -nt {compiled.loader}" in loader
+        assert "set -g _dot_recompiling 1" in loader
+        assert loader.rstrip().endswith("end")
+
+    @pytest.mark.skipif(not shutil.which("zsh"), reason="zsh not installed")
+    def test_zsh_artifacts_are_zcompiled(self, tmp_path, snippets) -> None:
+        """Test zsh artifacts get a .zwc next to them."""
+        compiled = dot.ShellGenerator().compile_staged_init(
+            "zsh",
+            snippets,
+            tmp_path,
+            watch=[tmp_path / "dot.toml"],
+            regenerate_cmd="true",
+        )
 
-        manager = dot.ProvisionerManager(all_provisioners, runner, platform_obj)
-        rust = config_with_provisioners.provisioners["rust"]
+        for artifact in compiled.artifacts:
+            assert artifact.with_name(f"{artifact.name}.zwc").exists()
 
-        with patch.object(
-            runner,
-            "run",
-            new_callable=unittest.mock.AsyncMock,
-        ) as mock_run:
-            # Mock successful verification
-            mock_run.return_value = dot.CommandResult(
-                success=True,
-                stdout="cargo 1.70.0",
-            )
+    @pytest.mark.skipif(not shutil.which("bash"), reason="bash not installed")
+    def test_loader_recompiles_only_when_config_changes(
+        self,
+        tmp_path,
+        sample_toml_config,
+    ) -> None:
+        """Test the bash loader sources artifacts and recompiles on edits."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+        config = dot.ConfigLoader(config_path).load()
+        compiled = dot.compile_shell_init(
+            dot.ShellGenerator(),
+            config_path,
+            config.shell_snippets,
+            "bash",
+        )
+        probe = f'source {compiled.loader} && echo "$DOT_LOADED"'
 
-            is_installed = await manager._is_installed(rust)
+        out = subprocess.run(
+            ["bash", "-c", probe],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        assert out.stdout.strip() == "1"
+        stale = [a for a in compiled.artifacts if "DOT_LOADED=1" in a.read_text()]
 
-            assert is_installed is True
-            mock_run.assert_called_once_with(
-                "cargo --version",
-                check=False,
-                capture=True,
-                env=None,
-            )
+        config_path.write_text(
+            sample_toml_config.replace("DOT_LOADED=1", "DOT_LOADED=2"),
+        )
+        future = compiled.loader.stat().st_mtime + 10
+        os.utime(config_path, (future, future))
+        out = subprocess.run(
+            ["bash", "-c", probe],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
 
-    @pytest.mark.asyncio
-    async def test_provision_all_dry_run(self, config_with_provisioners) -> None:
-        """Test provisioning all in dry run mode."""
-        runner = dot.AsyncCommandRunner(dry_run=True)
-        platform_obj = dot.Platform()
-        all_provisioners = {
-            **config_with_provisioners.provisioners,
-            **config_with_provisioners.enhancements,
-        }
+        assert out.stdout.strip() == "2"
+        assert stale
+        assert not any(a.exists() for a in stale)
+        assert all(a.exists() for a in compiled.artifacts if a not in stale)
 
-        manager = dot.ProvisionerManager(all_provisioners, runner, platform_obj)
+    def test_cli_compile_prints_loader(
+        self,
+        tmp_path,
+        sample_toml_config,
+        isolated_xdg_dirs,
+        monkeypatch,
+        capsys,
+    ) -> None:
+        """Test `shell --compile` prints the loader path to source."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+        monkeypatch.setattr(
+            "sys.argv",
+            ["dot.py", "--config", str(config_path), "shell", "--zsh", "--compile"],
+        )
 
-        with patch.object(
-            manager,
-            "_is_installed",
-            new_callable=unittest.mock.AsyncMock,
-        ) as mock_installed:
-            mock_installed.return_value = False
+        assert dot.main() == 0
 
-            results = await manager.provision_all(dry_run=True)
+        loader = pathlib.Path(capsys.readouterr().out.strip())
+        assert loader == isolated_xdg_dirs / "dot" / "shell" / "zsh" / "init.zsh"
+        assert loader.exists()
 
-            assert len(results) == 2  # rust + starship
-            assert all(success for success in results.values())
 
-    @pytest.mark.asyncio
-    async def test_install_via_script(self, config_with_provisioners) -> None:
-        """Test installing provisioner via script."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
-        all_provisioners = {
-            **config_with_provisioners.provisioners,
-            **config_with_provisioners.enhancements,
-        }
+class TestDeferredLateStage:
+    """Test deferred execution of LATE-stage snippets."""
 
-        manager = dot.ProvisionerManager(all_provisioners, runner, platform_obj)
-        rust = config_with_provisioners.provisioners["rust"]
+    @pytest.fixture
+    def snippets(self) -> list[dot.ShellSnippet]:
+        """One main snippet and two late snippets out of name order."""
+        return [
+            dot.ShellSnippet(
+                name="tools",
+                description="Tools",
+                stage=dot.ShellStage.MAIN,
+                default="echo main",
+            ),
+            dot.ShellSnippet(
+                name="b_prompt",
+                description="Prompt",
+                stage=dot.ShellStage.LATE,
+                default="echo late-b",
+            ),
+            dot.ShellSnippet(
+                name="a_plugins",
+                description="Plugins",
+                stage=dot.ShellStage.LATE,
+                default="echo late-a",
+            ),
+        ]
 
-        with patch.object(
-            runner,
-            "run",
-            new_callable=unittest.mock.AsyncMock,
-        ) as mock_run:
-            mock_run.return_value = dot.CommandResult(success=True)
+    @pytest.mark.parametrize(
+        ("shell", "marker"),
+        [
+            ("zsh", "zle -F -w $fd _dot_deferred_late_fd"),
+            ("bash", "_dot_deferred_late='_dot_deferred_late_restore"),
+            ("fish", "function _dot_deferred_late --on-event fish_prompt"),
+        ],
+    )
+    def test_late_stage_wrapped(self, snippets, shell, marker) -> None:
+        """Test each shell gets its native one-shot deferral hook."""
+        generator = dot.ShellGenerator(defer_late=True)
+
+        late = generator.generate_staged_init(shell, snippets, "late")
+        main = generator.generate_staged_init(shell, snippets, "main")
+
+        assert marker in late
+        assert late.index("late-a") < late.index("late-b")
+        assert "_dot_deferred_late" not in main
+
+    def test_default_mode_emits_inline(self, snippets) -> None:
+        """Test deferral is opt-in."""
+        late = dot.ShellGenerator().generate_staged_init("zsh", snippets, "late")
+
+        assert "_dot_deferred_late" not in late
+        assert "echo late-a" in late
+
+    def test_mode_changes_digest(self, snippets) -> None:
+        """Test compiled artifacts are distinct per deferral mode."""
+        eager = dot.ShellGenerator().snippets_digest("zsh", snippets)
+        deferred = dot.ShellGenerator(defer_late=True).snippets_digest("zsh", snippets)
+
+        assert eager != deferred
+
+    @pytest.mark.skipif(not shutil.which("bash"), reason="bash not installed")
+    def test_bash_runs_late_after_main_in_order(self, tmp_path, snippets) -> None:
+        """Test bash runs the deferred batch once, from PROMPT_COMMAND."""
+        init = tmp_path / "init.bash"
+        init.write_text(
+            dot.ShellGenerator(defer_late=True).generate_staged_init("bash", snippets),
+        )
+        script = (
+            f"source {init}; echo sourced; "
+            'eval "$PROMPT_COMMAND"; eval "$PROMPT_COMMAND"; echo done'
+        )
 
-            success = await manager._install_via_script(rust)
+        out = subprocess.run(
+            ["bash", "--norc", "-ic", script],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
 
-            assert success
-            mock_run.assert_called_once_with(
-                "curl https://sh.rustup.rs | sh",
-                env=None,
-                check=False,
-                capture=True,
-            )
+        assert out.stdout.split() == ["main", "sourced", "late-a", "late-b", "done"]
 
-    @pytest.mark.asyncio
-    async def test_filter_by_type(self, config_with_provisioners) -> None:
-        """Test filtering provisioners by type."""
-        runner = dot.AsyncCommandRunner(dry_run=True)
-        platform_obj = dot.Platform()
-        all_provisioners = {
-            **config_with_provisioners.provisioners,
-            **config_with_provisioners.enhancements,
-        }
+    @pytest.mark.skipif(not shutil.which("bash"), reason="bash not installed")
+    def test_bash_declarations_stay_global(self, tmp_path) -> None:
+        """Test typeset/declare in a deferred snippet outlive the batch."""
+        snippet = dot.ShellSnippet(
+            name="vars",
+            description="Vars",
+            stage=dot.ShellStage.LATE,
+            default="typeset DOT_LATE=kept\ndeclare -A DOT_MAP=([k]=v)",
+        )
+        init = tmp_path / "init.bash"
+        init.write_text(
+            dot.ShellGenerator(defer_late=True).generate_staged_init("bash", [snippet]),
+        )
+        script = (
+            f'source {init}; eval "$PROMPT_COMMAND"; '
+            'echo "$DOT_LATE ${DOT_MAP[k]} ${_dot_deferred_late_body-gone}"'
+        )
 
-        manager = dot.ProvisionerManager(all_provisioners, runner, platform_obj)
+        out = subprocess.run(
+            ["bash", "--norc", "-ic", script],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
 
-        with patch.object(
-            manager,
-            "_is_installed",
-            new_callable=unittest.mock.AsyncMock,
-        ) as mock_installed:
-            mock_installed.return_value = False
+        assert out.stdout.split() == ["kept", "v", "gone"]
 
-            # Test filtering by provisioner type
-            results = await manager.provision_all(
-                filter_type=dot.ProvisionerType.PROVISIONER,
-            )
+    @pytest.mark.skipif(not shutil.which("bash"), reason="bash not installed")
+    def test_noninteractive_bash_runs_immediately(self, tmp_path, snippets) -> None:
+        """Test shells that never prompt still run the late batch."""
+        init = tmp_path / "init.bash"
+        init.write_text(
+            dot.ShellGenerator(defer_late=True).generate_staged_init("bash", snippets),
+        )
 
-            assert "rust" in results  # rust is a provisioner
-            assert "starship" not in results  # starship is an enhancement
+        out = subprocess.run(
+            ["bash", "-c", f"source {init}"],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
 
+        assert out.stdout.split() == ["main", "late-a", "late-b"]
 
-# ═══════════════════════════════════════════════════════════════════════════════
-# DOTFILES APP TESTS
-# ═══════════════════════════════════════════════════════════════════════════════
+    def test_fast_path_parses_defer_late(self) -> None:
+        """Test --defer-late is accepted by the shell fast path."""
+        request = dot._parse_shell_request(["shell", "--zsh", "--defer-late"])
 
+        assert request is not None
+        assert request.defer_late is True
 
-class TestDotfilesApp:
-    """Test main application class."""
+    def test_compile_regenerates_with_same_mode(self, tmp_path, snippets) -> None:
+        """Test the compiled loader recompiles in deferred mode."""
+        config_path = tmp_path / "dot.toml"
+        config_path.touch()
+
+        compiled = dot.compile_shell_init(
+            dot.ShellGenerator(defer_late=True),
+            config_path,
+            snippets,
+            "zsh",
+            cache_dir=tmp_path / "cache",
+        )
 
-    def test_app_init(self, tmp_path, sample_toml_config, temp_home) -> None:
-        """Test DotfilesApp initialization."""
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(sample_toml_config)
-
-        app = dot.DotfilesApp(config_path=config_path, dry_run=True)
-
-        assert app.dry_run is True
-        assert isinstance(app.platform, dot.Platform)
-        assert isinstance(app.runner, dot.AsyncCommandRunner)
-        assert isinstance(app.config, dot.DotfilesConfig)
-        assert isinstance(app.shell_generator, dot.ShellGenerator)
-        assert isinstance(app.provisioner_manager, dot.ProvisionerManager)
+        assert "--compile --defer-late" in compiled.loader.read_text()
 
-    @pytest.mark.asyncio
-    async def test_install_dotfiles(
-        self,
-        tmp_path,
-        sample_toml_config,
-        temp_home,
-    ) -> None:
-        """Test installing dotfiles symlinks."""
-        # Create source files
-        dot_config = tmp_path / "dot-config"
-        dot_config.mkdir()
-        (dot_config / ".gitconfig").write_text("git config")
-        (dot_config / ".zshrc").write_text("zsh config")
-        (dot_config / ".vim").mkdir()
 
-        # Update config to point to our test directory
-        config_content = sample_toml_config.replace("~/.dot-config", str(dot_config))
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_content)
+class TestResolvedConditions:
+    """Test generate-time resolution of snippet conditions."""
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+    @staticmethod
+    def snippet(name: str, condition: str) -> dot.ShellSnippet:
+        """Build a MAIN-stage snippet guarded by *condition*."""
+        return dot.ShellSnippet(
+            name=name,
+            description=name,
+            stage=dot.ShellStage.MAIN,
+            condition=condition,
+            default=f"export {name.upper()}=1",
+        )
 
-        success = await app.install_dotfiles()
+    def test_true_command_condition_unwrapped(self) -> None:
+        """Test a command found on PATH is emitted without its test."""
+        generator = dot.ShellGenerator(resolve_conditions=True)
+        snippets = [self.snippet("has_sh", "command -v sh >/dev/null 2>&1")]
 
-        assert success
-        assert (temp_home / ".gitconfig").is_symlink()
-        assert (temp_home / ".zshrc").is_symlink()
-        assert (temp_home / ".vim").is_symlink()
+        init = generator.generate_staged_init("zsh", snippets, "main")
 
-        # Verify symlinks point to the correct source files
-        assert (temp_home / ".gitconfig").resolve() == (
-            dot_config / ".gitconfig"
-        ).resolve()
-        assert (temp_home / ".zshrc").resolve() == (dot_config / ".zshrc").resolve()
-        assert (temp_home / ".vim").resolve() == (dot_config / ".vim").resolve()
+        assert "export HAS_SH=1" in init
+        assert "command -v" not in init
+        fact = generator.facts["command", "sh", ""]
+        assert fact.present
+        assert fact.resolved == shutil.which("sh")
 
-    @pytest.mark.asyncio
-    async def test_provision_with_filter(
-        self,
-        tmp_path,
-        sample_toml_config,
-        temp_home,
-    ) -> None:
-        """Test provisioning with type filter."""
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(sample_toml_config)
+    def test_false_command_condition_dropped(self) -> None:
+        """Test a missing command drops the snippet entirely."""
+        generator = dot.ShellGenerator(resolve_conditions=True)
+        snippets = [self.snippet("missing", "command -v dot-no-such-tool-xyz")]
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=True)
+        init = generator.generate_staged_init("bash", snippets, "main")
 
-        with patch.object(
-            app.provisioner_manager,
-            "provision_all",
-            new_callable=unittest.mock.AsyncMock,
-        ) as mock_provision:
-            mock_provision.return_value = {"rust": dot.Result.ok()}
+        assert "MISSING" not in init
+        assert not generator.facts["command", "dot-no-such-tool-xyz", ""].present
 
-            success = await app.provision(filter_type=dot.ProvisionerType.PROVISIONER)
+    def test_path_condition_expands_home_and_shell(self, tmp_path, monkeypatch):
+        """Test [ -f ... ] conditions expand $HOME and ${shell}."""
+        monkeypatch.setenv("HOME", str(tmp_path))
+        (tmp_path / ".fzf.fish").touch()
+        generator = dot.ShellGenerator(resolve_conditions=True)
+        snippets = [self.snippet("fzf", '[ -f "$HOME/.fzf.${shell}" ]')]
+
+        fish_init = generator.generate_staged_init("fish", snippets, "main")
+        zsh_init = generator.generate_staged_init("zsh", snippets, "main")
+
+        assert "export FZF=1" in fish_init
+        assert "FZF" not in zsh_init
+        assert generator.facts["path", str(tmp_path / ".fzf.fish"), "-f"].present
+
+    def test_path_fact_records_evaluated_test(self, tmp_path) -> None:
+        """Test a path fact holds the operator's truth, not mere existence."""
+        script = tmp_path / "script"
+        script.touch(mode=0o644)
+        generator = dot.ShellGenerator(resolve_conditions=True)
+        snippets = [
+            self.snippet("runnable", f"[ -x {script} ]"),
+            self.snippet("exists", f"[ -e {script} ]"),
+        ]
 
-            assert success
-            mock_provision.assert_called_once_with(
-                dot.ProvisionerType.PROVISIONER,
-                True,
-            )
+        init = generator.generate_staged_init("bash", snippets, "main")
 
-    def test_generate_shell_init(self, tmp_path, sample_toml_config, temp_home) -> None:
-        """Test generating shell initialization."""
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(sample_toml_config)
+        assert "RUNNABLE" not in init
+        assert "export EXISTS=1" in init
+        assert not generator.facts["path", str(script), "-x"].present
+        assert generator.facts["path", str(script), "-e"].present
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=True)
+    def test_unknown_condition_kept_verbatim(self) -> None:
+        """Test conditions outside the known patterns stay in the script."""
+        generator = dot.ShellGenerator(resolve_conditions=True)
+        snippets = [self.snippet("custom", '[ "$TERM" = "xterm" ]')]
 
-        zsh_init = app.generate_shell_init("zsh")
-        fish_init = app.generate_shell_init("fish", "early")
+        init = generator.generate_staged_init("bash", snippets, "main")
 
-        assert "Generated by dot.py v2.0" in zsh_init
-        assert "DOT_LOADED" in fish_init  # Early stage content should be present
-        assert "MAIN STAGE" not in fish_init  # only early stage requested
+        assert 'if [ "$TERM" = "xterm" ]; then' in init
+        assert not generator.facts
 
-    @pytest.mark.asyncio
-    async def test_status_reporting(
-        self,
-        tmp_path,
-        sample_toml_config,
-        temp_home,
-    ) -> None:
-        """Test system and provisioning status."""
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(sample_toml_config)
+    def test_resolution_is_opt_in(self) -> None:
+        """Test the default generator keeps every condition."""
+        snippets = [self.snippet("has_sh", "command -v sh")]
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=True)
+        init = dot.ShellGenerator().generate_staged_init("bash", snippets, "main")
 
-        with patch.object(
-            app.provisioner_manager,
-            "_is_installed",
-            new_callable=unittest.mock.AsyncMock,
-        ) as mock_installed:
-            mock_installed.return_value = True
+        assert "if command -v sh; then" in init
 
-            status = await app.status()
+    def test_facts_change_digest(self, tmp_path, monkeypatch) -> None:
+        """Test a binary appearing yields a different artifact digest."""
+        monkeypatch.setenv("PATH", str(tmp_path))
+        snippets = [self.snippet("tool", "command -v dot-fake-tool")]
+        before = dot.ShellGenerator(resolve_conditions=True).snippets_digest(
+            "zsh",
+            snippets,
+        )
 
-            assert "platform" in status
-            assert "provisioners" in status
-            assert "dotfiles" in status
-            assert status["platform"]["os"] == app.platform.info.os
-            assert "rust" in status["provisioners"]
-            assert "starship" in status["provisioners"]
+        tool = tmp_path / "dot-fake-tool"
+        tool.touch()
+        tool.chmod(0o755)
+        after = dot.ShellGenerator(resolve_conditions=True).snippets_digest(
+            "zsh",
+            snippets,
+        )
 
-    @pytest.mark.asyncio
-    async def test_install_system_packages_apt(self, tmp_path, temp_home) -> None:
-        """Test system package installation for apt."""
-        config_toml = """
-[packages.apt]
-packages = ["git", "curl", "build-essential"]
-        """
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_toml)
+        assert before != after
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+    def test_loader_watches_fact_paths(self, tmp_path, monkeypatch) -> None:
+        """Test the compiled loader rechecks PATH dirs and path tests."""
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        monkeypatch.setenv("PATH", str(bin_dir))
+        env_file = tmp_path / "env"
+        env_file.touch(mode=0o644)
+        snippets = [
+            self.snippet("tool", "command -v dot-fake-tool"),
+            self.snippet("env", f"[ -f {env_file} ]"),
+            self.snippet("run", f"[ -x {env_file} ]"),
+        ]
+        generator = dot.ShellGenerator(resolve_conditions=True)
+
+        compiled = generator.compile_staged_init(
+            "bash",
+            snippets,
+            tmp_path / "cache",
+            watch=[tmp_path / "dot.toml"],
+            regenerate_cmd="true",
+        )
+        loader = compiled.loader.read_text()
 
-        # Mock platform to return apt
-        with (
-            patch.object(app.platform, "get_package_manager", return_value="apt"),
-            patch.object(
-                app.runner,
-                "run",
-                new_callable=unittest.mock.AsyncMock,
-            ) as mock_run,
-        ):
-            # First call: check installed packages (none installed)
-            mock_run.side_effect = [
-                dot.CommandResult(success=True, stdout=""),  # dpkg check
-                dot.CommandResult(success=True),  # apt install
-            ]
+        assert f"{bin_dir} -nt {compiled.loader}" in loader
+        assert f"! -f {env_file}" in loader
+        assert f"|| -x {env_file}" in loader
+        assert "export ENV=1" in compiled.artifacts[0].read_text()
+        assert "TOOL" not in compiled.artifacts[0].read_text()
 
-            result = await app._install_system_packages()
+    def test_fast_path_parses_resolve_conditions(self) -> None:
+        """Test --resolve-conditions is accepted by the shell fast path."""
+        request = dot._parse_shell_request(["shell", "--bash", "--resolve-conditions"])
 
-            assert result
-            assert mock_run.call_count == 2
+        assert request is not None
+        assert request.resolve_conditions is True
 
-            # Check that dpkg was called to check installed packages
-            dpkg_call = mock_run.call_args_list[0]
-            assert "dpkg -l" in dpkg_call[0][0]
 
-            # Check that apt install was called with all packages
-            apt_call = mock_run.call_args_list[1]
-            expected_cmd = (
-                "sudo apt-get update && sudo apt-get install -y "
-                "git curl build-essential"
-            )
-            assert expected_cmd in apt_call[0][0]
+class TestCachedEval:
+    """Test signature-keyed caching of eval'd command output."""
 
-    @pytest.mark.asyncio
-    async def test_install_system_packages_apt_adds_ppa_for_ubuntu(
+    @pytest.fixture
+    def tool_dir(
         self,
         tmp_path: pathlib.Path,
-        temp_home: pathlib.Path,
-    ) -> None:
-        """Test apt adds configured PPAs on Ubuntu."""
-        config_toml = """
-[packages.apt]
-ppas = ["ppa:fish-shell/release-4"]
-packages = ["fish"]
-        """
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_toml)
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> pathlib.Path:
+        """Put a fake init generator on PATH that counts its invocations."""
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        tool = bin_dir / "dot-fake-init"
+        tool.write_text(
+            f'#!/bin/sh\necho run >> "{tmp_path}/calls"\necho "export FAKE_INIT=$1"\n',
+        )
+        tool.chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+        return tmp_path
+
+    @staticmethod
+    def snippet(name: str = "fake", inputs: list[str] | None = None):
+        """Build a MAIN-stage snippet whose output is cached."""
+        return dot.ShellSnippet(
+            name=name,
+            description=name,
+            stage=dot.ShellStage.MAIN,
+            default='eval "$(dot-fake-init {shell})"',
+            fish="dot-fake-init fish | source",
+            cache_command="dot-fake-init {shell}",
+            cache_inputs=inputs or [],
+        )
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
-        app.platform.info = dot.SystemInfo(
-            os="linux",
-            hostname="test",
-            arch="x86_64",
-            distro="ubuntu",
-            is_linux=True,
-            is_macos=False,
-            is_wsl=False,
-            home=temp_home,
-            user="test",
+    @pytest.mark.parametrize("shell", ["bash", "zsh", "fish"])
+    def test_call_replaces_eval(self, shell) -> None:
+        """Test cached snippets call the helper instead of forking."""
+        init = dot.ShellGenerator().generate_staged_init(
+            shell,
+            [self.snippet(inputs=["~/.config/fake.toml"])],
+            "main",
         )
 
-        with (
-            patch.object(app.platform, "get_package_manager", return_value="apt"),
-            patch("shutil.which", return_value="/usr/bin/add-apt-repository"),
-            patch.object(
-                app.runner,
-                "run",
-                new_callable=unittest.mock.AsyncMock,
-            ) as mock_run,
-        ):
-            mock_run.side_effect = [
-                dot.CommandResult(success=True),  # add-apt-repository
-                dot.CommandResult(success=True, stdout=""),  # dpkg check
-                dot.CommandResult(success=True),  # apt install
-            ]
+        assert "dot-fake-init {shell}" not in init
+        assert f"_dot_cached_eval fake.{shell} 'dot-fake-init {shell}'" in init
+        assert '"$HOME/.config/fake.toml"' in init
+        assert "source" in init.splitlines()[-2]
 
-            result = await app._install_system_packages()
+    def test_helper_emitted_once_per_stage(self) -> None:
+        """Test the helper is defined once however many snippets use it."""
+        snippets = [self.snippet("one"), self.snippet("two")]
 
-            assert result
-            assert mock_run.call_count == 3
-            assert (
-                "add-apt-repository -y ppa:fish-shell/release-4"
-                in (mock_run.call_args_list[0][0][0])
-            )
-            assert "dpkg -l fish" in mock_run.call_args_list[1][0][0]
-            assert (
-                "sudo apt-get update && sudo apt-get install -y fish"
-                in mock_run.call_args_list[2][0][0]
-            )
+        init = dot.ShellGenerator().generate_staged_init("zsh", snippets, "main")
 
-    @pytest.mark.asyncio
-    async def test_install_system_packages_apt_skips_ppa_on_debian(
-        self,
-        tmp_path: pathlib.Path,
-        temp_home: pathlib.Path,
-    ) -> None:
-        """Test apt skips PPAs on non-Ubuntu distros."""
-        config_toml = """
-[packages.apt]
-ppas = ["ppa:fish-shell/release-4"]
-packages = ["fish"]
-        """
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_toml)
+        assert init.count("_dot_cached_eval() {") == 1
+        assert "${commands[" in init
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
-        app.platform.info = dot.SystemInfo(
-            os="linux",
-            hostname="test",
-            arch="x86_64",
-            distro="debian",
-            is_linux=True,
-            is_macos=False,
-            is_wsl=False,
-            home=temp_home,
-            user="test",
+    def test_uncached_stage_has_no_helper(self) -> None:
+        """Test stages without cached snippets are unchanged."""
+        snippet = dot.ShellSnippet(
+            name="plain",
+            description="plain",
+            stage=dot.ShellStage.MAIN,
+            default="export PLAIN=1",
         )
 
-        with (
-            patch.object(app.platform, "get_package_manager", return_value="apt"),
-            patch.object(
-                app.runner,
-                "run",
-                new_callable=unittest.mock.AsyncMock,
-            ) as mock_run,
-        ):
-            mock_run.side_effect = [
-                dot.CommandResult(success=True, stdout=""),  # dpkg check
-                dot.CommandResult(success=True),  # apt install
-            ]
+        init = dot.ShellGenerator().generate_staged_init("bash", [snippet], "main")
+
+        assert "_dot_cached_eval" not in init
+
+    @pytest.mark.skipif(not shutil.which("bash"), reason="bash not installed")
+    def test_bash_reuses_cache_until_input_changes(self, tool_dir) -> None:
+        """Test the command runs once, then again after an input changes."""
+        config = tool_dir / "fake.toml"
+        config.touch()
+        init = tool_dir / "init.bash"
+        init.write_text(
+            dot.ShellGenerator().generate_staged_init(
+                "bash",
+                [self.snippet(inputs=[str(config)])],
+                "main",
+            ),
+        )
 
-            result = await app._install_system_packages()
+        def source() -> str:
+            return subprocess.run(
+                ["bash", "--norc", "-c", f'source {init}; echo "$FAKE_INIT"'],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout.strip()
+
+        assert source() == "bash"
+        assert source() == "bash"
+        assert (tool_dir / "calls").read_text().count("run") == 1
+
+        cache = tool_dir / "xdg-cache" / "dot" / "eval" / "fake.bash"
+        assert cache.read_text().startswith("# dot-signature: ")
+        future = cache.stat().st_mtime + 10
+        os.utime(config, (future, future))
+
+        assert source() == "bash"
+        assert (tool_dir / "calls").read_text().count("run") == 2
+
+    @pytest.mark.parametrize("shell", ["bash", "zsh", "fish"])
+    def test_failed_command_skips_source(self, tool_dir, shell) -> None:
+        """Test a failing command with no prior cache leaves nothing behind."""
+        if not shutil.which(shell):
+            pytest.skip(f"{shell} not installed")
+        (tool_dir / "bin" / "dot-fake-init").write_text("#!/bin/sh\nexit 3\n")
+        init = tool_dir / f"init.{shell}"
+        init.write_text(
+            dot.ShellGenerator().generate_staged_init(shell, [self.snippet()], "main"),
+        )
 
-            assert result
-            assert mock_run.call_count == 2
-            assert all(
-                "add-apt-repository" not in call.args[0]
-                for call in mock_run.call_args_list
-            )
+        result = subprocess.run(
+            [shell, "-c", f"source {init}"],
+            check=False,
+            capture_output=True,
+            text=True,
+        )
 
-    @pytest.mark.asyncio
-    async def test_apt_signed_repository_on_ubuntu(
-        self,
-        tmp_path: pathlib.Path,
-        temp_home: pathlib.Path,
-    ) -> None:
-        """Test GPG-signed apt repository installation on Ubuntu."""
-        config_toml = """
-[packages.apt]
-packages = ["terraform"]
+        assert result.returncode == 0
+        assert result.stderr == ""
+        assert not any((tool_dir / "xdg-cache" / "dot" / "eval").iterdir())
+
+    @pytest.mark.skipif(not shutil.which("bash"), reason="bash not installed")
+    def test_bash_signature_tracks_missing_inputs(self, tool_dir) -> None:
+        """Test an input appearing invalidates the cache."""
+        config = tool_dir / "later.toml"
+        init = tool_dir / "init.bash"
+        init.write_text(
+            dot.ShellGenerator().generate_staged_init(
+                "bash",
+                [self.snippet(inputs=[str(config)])],
+                "main",
+            ),
+        )
+        command = ["bash", "--norc", "-c", f"source {init}"]
 
-[[packages.apt.repositories]]
-name = "hashicorp"
-gpg_url = "https://apt.releases.hashicorp.com/gpg"
-gpg_keyring = "/usr/share/keyrings/hashicorp-keyring.gpg"
-repo_url = "deb [arch={arch} signed-by={keyring}] https://apt.hc.io {codename} main"
-        """
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_toml)
+        subprocess.run(command, check=True)
+        subprocess.run(command, check=True)
+        config.touch()
+        os.utime(config, (0, 0))
+        subprocess.run(command, check=True)
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
-        app.platform.info = dot.SystemInfo(
-            os="linux",
-            hostname="test",
-            arch="x86_64",
-            distro="ubuntu",
-            is_linux=True,
-            is_macos=False,
-            is_wsl=False,
-            home=temp_home,
-            user="test",
+        assert (tool_dir / "calls").read_text().count("run") == 2
+
+    @pytest.mark.skipif(not shutil.which("bash"), reason="bash not installed")
+    def test_bash_signature_tracks_command_and_binary(self, tool_dir) -> None:
+        """Test a changed command line or a downgraded binary invalidates."""
+        init = tool_dir / "init.bash"
+        snippet = self.snippet()
+
+        def source() -> None:
+            init.write_text(
+                dot.ShellGenerator().generate_staged_init("bash", [snippet], "main"),
+            )
+            subprocess.run(["bash", "--norc", "-c", f"source {init}"], check=True)
+
+        source()
+        source()
+        snippet.cache_command = "dot-fake-init {shell} --quiet"
+        source()
+        os.utime(tool_dir / "bin" / "dot-fake-init", (0, 0))
+        source()
+        source()
+
+        assert (tool_dir / "calls").read_text().count("run") == 3
+
+    @pytest.mark.skipif(not shutil.which("bash"), reason="bash not installed")
+    def test_bash_missing_command_is_skipped(self, tmp_path) -> None:
+        """Test a missing binary neither fails nor writes a cache."""
+        init = tmp_path / "init.bash"
+        snippet = self.snippet()
+        snippet.cache_command = "dot-no-such-tool-xyz init"
+        init.write_text(
+            dot.ShellGenerator().generate_staged_init("bash", [snippet], "main"),
         )
 
-        with (
-            patch.object(app.platform, "get_package_manager", return_value="apt"),
-            patch.object(pathlib.Path, "exists", return_value=False),
-            patch.object(
-                app.runner,
-                "run",
-                new_callable=unittest.mock.AsyncMock,
-            ) as mock_run,
-        ):
-            mock_run.side_effect = [
-                dot.CommandResult(success=True),  # GPG key download
-                dot.CommandResult(success=True, stdout="amd64"),  # dpkg arch
-                dot.CommandResult(success=True, stdout="jammy"),  # codename
-                dot.CommandResult(success=True),  # add repo
-                dot.CommandResult(success=True),  # apt update
-                dot.CommandResult(success=True, stdout=""),  # dpkg check
-                dot.CommandResult(success=True),  # apt install
-            ]
+        subprocess.run(["bash", "--norc", "-c", f"source {init}"], check=True)
 
-            result = await app._install_system_packages()
+        assert not (tmp_path / "xdg-cache" / "dot" / "eval").exists()
 
-            assert result
-            # Verify GPG key was downloaded
-            assert "wget -qO -" in mock_run.call_args_list[0][0][0]
-            assert "hashicorp" in mock_run.call_args_list[0][0][0]
 
-    @pytest.mark.asyncio
-    async def test_apt_signed_repository_on_debian(
-        self,
-        tmp_path: pathlib.Path,
-        temp_home: pathlib.Path,
-    ) -> None:
-        """Test GPG-signed apt repository installation on Debian."""
-        config_toml = """
-[packages.apt]
-packages = ["terraform"]
+class TestShellInstrument:
+    """Test per-snippet startup timing and the shell-profile report."""
 
-[[packages.apt.repositories]]
-name = "hashicorp"
-gpg_url = "https://apt.releases.hashicorp.com/gpg"
-gpg_keyring = "/usr/share/keyrings/hashicorp-keyring.gpg"
-repo_url = "deb [arch={arch} signed-by={keyring}] https://apt.hc.io {codename} main"
-        """
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_toml)
+    @pytest.fixture
+    def snippets(self) -> list[dot.ShellSnippet]:
+        """Two MAIN snippets and one LATE snippet."""
+        return [
+            dot.ShellSnippet(
+                name=name,
+                description=name,
+                stage=stage,
+                default=f"export {name.upper()}=1",
+            )
+            for name, stage in [
+                ("alpha", dot.ShellStage.MAIN),
+                ("beta", dot.ShellStage.MAIN),
+                ("prompt", dot.ShellStage.LATE),
+            ]
+        ]
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
-        app.platform.info = dot.SystemInfo(
-            os="linux",
-            hostname="test",
-            arch="x86_64",
-            distro="debian",
-            is_linux=True,
-            is_macos=False,
-            is_wsl=False,
-            home=temp_home,
-            user="test",
+    @pytest.mark.parametrize(
+        ("shell", "clock"),
+        [
+            ("bash", "_dot_t0=${EPOCHREALTIME//[.,]/}"),
+            ("zsh", "_dot_t0=${EPOCHREALTIME//[.,]/}"),
+            ("fish", "set -g _dot_t0 (date +%s%N)"),
+        ],
+    )
+    def test_snippets_wrapped_with_timers(self, snippets, shell, clock) -> None:
+        """Test each snippet and the stage are bracketed by timestamps."""
+        init = dot.ShellGenerator(instrument=True).generate_staged_init(
+            shell,
+            snippets,
+            "main",
         )
 
-        with (
-            patch.object(app.platform, "get_package_manager", return_value="apt"),
-            patch.object(pathlib.Path, "exists", return_value=False),
-            patch.object(
-                app.runner,
-                "run",
-                new_callable=unittest.mock.AsyncMock,
-            ) as mock_run,
-        ):
-            mock_run.side_effect = [
-                dot.CommandResult(success=True),  # GPG key download
-                dot.CommandResult(success=True, stdout="amd64"),  # dpkg arch
-                dot.CommandResult(success=True, stdout="bookworm"),  # codename
-                dot.CommandResult(success=True),  # add repo
-                dot.CommandResult(success=True),  # apt update
-                dot.CommandResult(success=True, stdout=""),  # dpkg check
-                dot.CommandResult(success=True),  # apt install
-            ]
+        assert init.count(clock) == 2
+        assert "_dot_profile main alpha $_dot_t0" in init
+        assert "_dot_profile main beta $_dot_t0" in init
+        assert init.rstrip().endswith("_dot_profile main _total $_dot_stage_t0")
+        assert f"/{shell}.$" in init
+
+    def test_instrument_is_opt_in(self, snippets) -> None:
+        """Test default output carries no timing code."""
+        init = dot.ShellGenerator().generate_staged_init("zsh", snippets)
+
+        assert "_dot_profile" not in init
+        assert "Early: 5ms | Main: 20ms | Late: 100ms" in init
+
+    def test_mode_changes_digest(self, snippets) -> None:
+        """Test compiled artifacts for instrumented init are kept apart."""
+        plain = dot.ShellGenerator().snippets_digest("bash", snippets)
+        timed = dot.ShellGenerator(instrument=True).snippets_digest("bash", snippets)
+
+        assert plain != timed
+        assert dot.ShellGenerator(instrument=True).mode_flags() == ["--instrument"]
+
+    @pytest.mark.skipif(not shutil.which("bash"), reason="bash not installed")
+    def test_bash_sessions_aggregate(self, tmp_path, snippets) -> None:
+        """Test each sourced session logs one sample per snippet and stage."""
+        init = tmp_path / "init.bash"
+        init.write_text(
+            dot.ShellGenerator(instrument=True).generate_staged_init("bash", snippets),
+        )
+        for _ in range(2):
+            subprocess.run(["bash", "--norc", "-c", f"source {init}"], check=True)
+
+        log_dir = tmp_path / "xdg-cache" / "dot" / "shell-profile"
+        sessions, rows = dot.load_shell_profile(log_dir, "bash")
+
+        assert sessions == 2
+        assert [(row.stage, row.snippet) for row in rows] == [
+            ("main", "_total"),
+            ("main", "alpha"),
+            ("main", "beta"),
+            ("late", "_total"),
+            ("late", "prompt"),
+        ]
+        assert all(row.samples == 2 for row in rows)
+        assert all(row.max_ms >= row.p50_ms >= 0 for row in rows)
+
+    def test_load_computes_percentiles(self, tmp_path) -> None:
+        """Test p50/p95/max across sessions, skipping malformed lines."""
+        for pid in range(1, 21):
+            (tmp_path / f"zsh.{pid}.log").write_text(
+                f"early\t_total\t{pid * 1000}\nearly\ttruncated\n",
+            )
+        (tmp_path / "bash.1.log").write_text("early\t_total\t999000\n")
+
+        sessions, rows = dot.load_shell_profile(tmp_path, "zsh")
+
+        assert sessions == 20
+        assert len(rows) == 1
+        assert rows[0].samples == 20
+        assert rows[0].p50_ms == pytest.approx(10.5)
+        assert rows[0].p95_ms == pytest.approx(19.05)
+        assert rows[0].max_ms == pytest.approx(20.0)
+
+    def test_format_flags_stage_over_budget(self) -> None:
+        """Test stage totals are compared with STAGE_BUDGET_MS."""
+        rows = [
+            dot.ProfileRow("early", "_total", 3, 2.0, 7.5, 8.0),
+            dot.ProfileRow("early", "path", 3, 1.0, 1.5, 2.0),
+            dot.ProfileRow("main", "_total", 3, 10.0, 12.0, 13.0),
+        ]
 
-            result = await app._install_system_packages()
+        table = dot.format_shell_profile(3, rows).splitlines()
+
+        assert table[0] == "3 session(s)"
+        assert table[1].split() == [
+            "STAGE",
+            "SNIPPET",
+            "N",
+            "P50",
+            "ms",
+            "P95",
+            "ms",
+            "MAX",
+            "ms",
+            "BUDGET",
+        ]
+        assert table[2].split()[1:] == [
+            "(total)",
+            "3",
+            "2.00",
+            "7.50",
+            "8.00",
+            "5",
+            "!",
+        ]
+        assert table[3].split()[-1] == "2.00"
+        assert table[4].split()[-1] == "20"
 
-            assert result
-            # Verify it works on Debian (not just Ubuntu)
-            assert mock_run.call_count == 7
+    def test_fast_path_parses_instrument(self) -> None:
+        """Test --instrument is accepted by the shell fast path."""
+        request = dot._parse_shell_request(["shell", "--fish", "--instrument"])
 
-    @pytest.mark.asyncio
-    async def test_apt_signed_repository_skips_if_exists(
-        self,
-        tmp_path: pathlib.Path,
-        temp_home: pathlib.Path,
-    ) -> None:
-        """Test that existing repositories are skipped."""
-        config_toml = """
-[packages.apt]
-packages = ["terraform"]
+        assert request is not None
+        assert request.instrument is True
 
-[[packages.apt.repositories]]
-name = "hashicorp"
-gpg_url = "https://apt.releases.hashicorp.com/gpg"
-gpg_keyring = "/usr/share/keyrings/hashicorp-keyring.gpg"
-repo_url = "deb [arch={arch} signed-by={keyring}] https://apt.hc.io {codename} main"
-        """
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_toml)
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
-        app.platform.info = dot.SystemInfo(
-            os="linux",
-            hostname="test",
-            arch="x86_64",
-            distro="ubuntu",
-            is_linux=True,
-            is_macos=False,
-            is_wsl=False,
-            home=temp_home,
-            user="test",
+class TestBench:
+    """Test the native startup benchmark and its significance testing."""
+
+    def test_stats_from_samples(self) -> None:
+        """Test mean, sample stddev, CV and percentiles."""
+        stats = dot.BenchmarkStats.from_samples(
+            "zsh-startup",
+            ["zsh", "-i", "-c", "exit"],
+            [10.0, 12.0, 11.0, 13.0, 14.0],
         )
 
-        with (
-            patch.object(app.platform, "get_package_manager", return_value="apt"),
-            patch.object(pathlib.Path, "exists", return_value=True),  # Repo exists
-            patch.object(
-                app.runner,
-                "run",
-                new_callable=unittest.mock.AsyncMock,
-            ) as mock_run,
-        ):
-            mock_run.side_effect = [
-                dot.CommandResult(success=True, stdout="terraform"),  # dpkg check
-            ]
+        assert stats.mean_ms == pytest.approx(12.0)
+        assert stats.stddev_ms == pytest.approx(1.5811, abs=1e-4)
+        assert stats.cv_pct == pytest.approx(13.18, abs=0.01)
+        assert stats.stability == "noisy"
+        assert stats.p50_ms == pytest.approx(12.0)
+        assert stats.p95_ms == pytest.approx(13.8)
+        assert (stats.min_ms, stats.max_ms) == (10.0, 14.0)
+
+    @pytest.mark.parametrize(
+        ("cv_pct", "band"),
+        [(2.9, "excellent"), (3.0, "good"), (9.9, "fair"), (10.0, "noisy")],
+    )
+    def test_stability_band(self, cv_pct, band) -> None:
+        """Test CV thresholds match scripts/shell_perf.sh."""
+        assert dot._stability_band(cv_pct) == band
+
+    def test_mann_whitney_separated_samples(self) -> None:
+        """Test clearly shifted distributions are significant."""
+        before = [100.0 + i for i in range(20)]
+        after = [80.0 + i for i in range(20)]
+
+        assert dot._mann_whitney_p(before, after) < 0.001
+
+    def test_mann_whitney_same_distribution(self) -> None:
+        """Test interleaved samples are not significant."""
+        before = [100.0, 102.0, 104.0, 106.0, 108.0, 110.0]
+        after = [101.0, 103.0, 105.0, 107.0, 109.0, 111.0]
+
+        assert dot._mann_whitney_p(before, after) > 0.5
+        assert dot._mann_whitney_p([5.0] * 10, [5.0] * 10) == 1.0
+
+    def test_run_startup_benchmark_counts_runs(self, tmp_path) -> None:
+        """Test warmup runs execute but are not sampled."""
+        counter = tmp_path / "count"
+        stats = dot.run_startup_benchmark(
+            "sh",
+            ["sh", "-c", f'echo x >> "{counter}"'],
+            runs=4,
+            warmup=2,
+        )
 
-            result = await app._install_system_packages()
+        assert len(stats.samples_ms) == 4
+        assert counter.read_text().count("x") == 6
+        assert all(sample > 0 for sample in stats.samples_ms)
 
-            assert result
-            # No GPG key download should occur
-            assert all("gpg" not in str(call) for call in mock_run.call_args_list)
+    def test_run_startup_benchmark_times_out(self) -> None:
+        """Test a shell that never exits is killed instead of hanging the bench."""
+        start = time.monotonic()
 
-    @pytest.mark.asyncio
-    async def test_brew_tap_installation(
-        self,
-        tmp_path: pathlib.Path,
-        temp_home: pathlib.Path,
-    ) -> None:
-        """Test Homebrew tap installation."""
-        config_toml = """
-[packages.brew]
-taps = ["hashicorp/tap"]
-packages = ["hashicorp/tap/terraform"]
-        """
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_toml)
+        with pytest.raises(TimeoutError, match=r"did not exit within 0\.2s"):
+            dot.run_startup_benchmark(
+                "sleep", ["sleep", "30"], runs=1, warmup=0, timeout=0.2
+            )
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
-        app.platform.info = dot.SystemInfo(
-            os="darwin",
-            hostname="mac",
-            arch="arm64",
-            distro=None,
-            is_linux=False,
-            is_macos=True,
-            is_wsl=False,
-            home=temp_home,
-            user="test",
-        )
+        assert time.monotonic() - start < 5
+
+    @pytest.mark.parametrize(
+        "argv",
+        [
+            ["--runs", "0"],
+            ["--runs", "-3"],
+            ["--runs", "many"],
+            ["--warmup", "-1"],
+            ["--warmup", "some"],
+        ],
+    )
+    def test_cli_bench_rejects_bad_counts(
+        self, argv: list[str], monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """Test `bench --runs` below 1 or `--warmup` below 0 is a usage error."""
+        monkeypatch.setattr("sys.argv", ["dot.py", "bench", *argv])
 
         with (
-            patch.object(app.platform, "get_package_manager", return_value="brew"),
-            patch.object(
-                app.runner,
-                "run",
-                new_callable=unittest.mock.AsyncMock,
-            ) as mock_run,
+            patch.object(dot, "run_bench") as mock_bench,
+            pytest.raises(SystemExit) as exc_info,
         ):
-            mock_run.side_effect = [
-                dot.CommandResult(success=True, stdout=""),  # brew tap (empty)
-                dot.CommandResult(success=True),  # brew tap hashicorp/tap
-                dot.CommandResult(success=True, stdout=""),  # brew list
-                dot.CommandResult(success=True),  # brew install
-            ]
-
-            result = await app._install_system_packages()
+            asyncio.run(dot.async_main())
 
-            assert result
-            assert "brew tap hashicorp/tap" in mock_run.call_args_list[1][0][0]
+        assert exc_info.value.code == 2
+        mock_bench.assert_not_called()
 
-    @pytest.mark.asyncio
-    async def test_brew_tap_skips_existing(
-        self,
-        tmp_path: pathlib.Path,
-        temp_home: pathlib.Path,
+    def test_cli_compare_missing_run_fails(
+        self, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch, caplog
     ) -> None:
-        """Test that existing taps are skipped."""
-        config_toml = """
-[packages.brew]
-taps = ["hashicorp/tap"]
-packages = ["hashicorp/tap/terraform"]
-        """
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_toml)
+        """Test `bench-compare` on a missing directory fails with a message."""
+        before, after = tmp_path / "before", tmp_path / "after"
+        monkeypatch.setattr(
+            "sys.argv",
+            ["dot.py", "bench-compare", "--before", str(before), "--after", str(after)],
+        )
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
-        app.platform.info = dot.SystemInfo(
-            os="darwin",
-            hostname="mac",
-            arch="arm64",
-            distro=None,
-            is_linux=False,
-            is_macos=True,
-            is_wsl=False,
-            home=temp_home,
-            user="test",
+        assert asyncio.run(dot.async_main()) == 1
+        assert f"Cannot read bench runs {before} and {after}" in caplog.text
+
+    def test_compare_round_trips_artifacts(self, tmp_path) -> None:
+        """Test bench.json artifacts load back and compare by name."""
+        command = ["zsh", "-i", "-c", "exit"]
+        slow = [100.0 + i for i in range(15)]
+        fast = [70.0 + i for i in range(15)]
+        dot.write_bench_run(
+            tmp_path / "before",
+            [
+                dot.BenchmarkStats.from_samples("zsh-startup", command, slow),
+                dot.BenchmarkStats.from_samples("fish-startup", command, slow),
+                dot.BenchmarkStats.from_samples("bash-startup", command, slow),
+            ],
+            {"runs": 15},
+        )
+        dot.write_bench_run(
+            tmp_path / "after",
+            [
+                dot.BenchmarkStats.from_samples("zsh-startup", command, fast),
+                dot.BenchmarkStats.from_samples("fish-startup", command, slow[::-1]),
+            ],
+            {"runs": 15},
         )
 
-        with (
-            patch.object(app.platform, "get_package_manager", return_value="brew"),
-            patch.object(
-                app.runner,
-                "run",
-                new_callable=unittest.mock.AsyncMock,
-            ) as mock_run,
-        ):
-            mock_run.side_effect = [
-                # Tap already exists
-                dot.CommandResult(success=True, stdout="hashicorp/tap\nhomebrew/core"),
-                dot.CommandResult(success=True, stdout=""),  # brew list
-                dot.CommandResult(success=True),  # brew install
-            ]
+        comparisons = dot.compare_bench_runs(tmp_path / "before", tmp_path / "after")
+
+        by_name = {item.name: item for item in comparisons}
+        assert set(by_name) == {"zsh-startup", "fish-startup"}
+        assert by_name["zsh-startup"].verdict == "faster"
+        assert by_name["zsh-startup"].delta_pct == pytest.approx(-28.0, abs=0.1)
+        assert by_name["fish-startup"].verdict == "unchanged"
+        assert "faster" in dot.format_bench_comparison(comparisons)
+
+    @pytest.mark.skipif(not shutil.which("bash"), reason="bash not installed")
+    def test_run_bench_writes_artifact(self, tmp_path, monkeypatch) -> None:
+        """Test run_bench skips missing shells and writes bench.json."""
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        (bin_dir / "bash").symlink_to(str(shutil.which("bash")))
+        monkeypatch.setenv("HOME", str(tmp_path))
+        monkeypatch.setenv("PATH", str(bin_dir))
 
-            result = await app._install_system_packages()
+        run_dir, results = dot.run_bench(
+            ["bash", "fish"],
+            runs=2,
+            warmup=0,
+            run_dir=tmp_path / "run",
+        )
 
-            assert result
-            # Should NOT call brew tap hashicorp/tap (already exists)
-            tap_calls = [
-                c for c in mock_run.call_args_list if "brew tap hashicorp" in str(c)
-            ]
-            assert len(tap_calls) == 0
+        assert run_dir == tmp_path / "run"
+        assert [result.name for result in results] == ["bash-startup"]
+        loaded = dot.load_bench_run(run_dir)
+        assert loaded["bash-startup"].samples_ms == results[0].samples_ms
 
-    @pytest.mark.asyncio
-    async def test_apt_package_detection_and_messaging(
-        self,
-        tmp_path: pathlib.Path,
-        temp_home: pathlib.Path,
-        caplog: pytest.LogCaptureFixture,
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PROVISIONER MANAGER TESTS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+class TestProvisionerManager:
+    """Test provisioner installation lifecycle management."""
+
+    @pytest.mark.asyncio
+    async def test_manager_init(self, config_with_provisioners) -> None:
+        """Test ProvisionerManager initialization."""
+        runner = dot.AsyncCommandRunner(dry_run=True)
+        platform_obj = dot.Platform()
+        all_provisioners = {
+            **config_with_provisioners.provisioners,
+            **config_with_provisioners.enhancements,
+        }
+
+        manager = dot.ProvisionerManager(all_provisioners, runner, platform_obj)
+
+        assert manager.provisioners == all_provisioners
+        assert manager.runner == runner
+        assert manager.platform == platform_obj
+        assert isinstance(manager.resolver, dot.DependencyResolver)
+
+    @pytest.mark.asyncio
+    async def test_is_installed_check(self, config_with_provisioners) -> None:
+        """Test checking if provisioner is installed."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+        all_provisioners = {
+            **config_with_provisioners.provisioners,
+            **config_with_provisioners.enhancements,
+        }
+
+        manager = dot.ProvisionerManager(all_provisioners, runner, platform_obj)
+        rust = config_with_provisioners.provisioners["rust"]
+
+        with patch.object(
+            runner,
+            "run",
+            new_callable=unittest.mock.AsyncMock,
+        ) as mock_run:
+            # Mock successful verification
+            mock_run.return_value = dot.CommandResult(
+                success=True,
+                stdout="cargo 1.70.0",
+            )
+
+            is_installed = await manager._is_installed(rust)
+
+            assert is_installed is True
+            mock_run.assert_called_once_with(
+                "cargo --version",
+                check=False,
+                capture=True,
+                env=None,
+                timeout=None,
+            )
+
+    @pytest.mark.asyncio
+    async def test_provision_all_dry_run(self, config_with_provisioners) -> None:
+        """Test provisioning all in dry run mode."""
+        runner = dot.AsyncCommandRunner(dry_run=True)
+        platform_obj = dot.Platform()
+        all_provisioners = {
+            **config_with_provisioners.provisioners,
+            **config_with_provisioners.enhancements,
+        }
+
+        manager = dot.ProvisionerManager(all_provisioners, runner, platform_obj)
+
+        with patch.object(
+            manager,
+            "_is_installed",
+            new_callable=unittest.mock.AsyncMock,
+        ) as mock_installed:
+            mock_installed.return_value = False
+
+            results = await manager.provision_all(dry_run=True)
+
+            assert len(results) == 2  # rust + starship
+            assert all(success for success in results.values())
+
+    @pytest.mark.asyncio
+    async def test_install_via_script(
+        self, config_with_provisioners, tmp_path: pathlib.Path
     ) -> None:
-        """Test apt package detection with proper messaging."""
-        config_toml = """
-[packages.apt]
-packages = ["git", "curl", "build-essential", "vim", "wget"]
-        """
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_toml)
+        """Test installing provisioner via its cached installer script."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+        all_provisioners = {
+            **config_with_provisioners.provisioners,
+            **config_with_provisioners.enhancements,
+        }
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        manager = dot.ProvisionerManager(all_provisioners, runner, platform_obj)
+        rust = config_with_provisioners.provisioners["rust"]
+        installer = tmp_path / "installer"
 
         with (
-            patch.object(app.platform, "get_package_manager", return_value="apt"),
             patch.object(
-                app.runner,
+                manager.downloads, "fetch", return_value=installer
+            ) as mock_fetch,
+            patch.object(
+                runner,
                 "run",
                 new_callable=unittest.mock.AsyncMock,
             ) as mock_run,
         ):
-            # dpkg shows git and curl already installed
-            mock_run.side_effect = [
-                dot.CommandResult(success=True, stdout="git\ncurl"),  # dpkg check
-                dot.CommandResult(success=True),  # apt install
-            ]
+            mock_run.return_value = dot.CommandResult(success=True)
 
-            caplog.clear()
-            with caplog.at_level(logging.INFO):
-                result = await app._install_system_packages()
+            success = await manager._install_via_script(rust)
 
-            assert result
+            assert success
+            mock_fetch.assert_called_once_with("https://sh.rustup.rs", "")
+            mock_run.assert_called_once_with(
+                f"sh < {installer}",
+                env=None,
+                check=False,
+                capture=True,
+            )
 
-            # Verify correct messaging appears in logs
-            log_messages = [record.message for record in caplog.records]
+    @pytest.mark.asyncio
+    async def test_filter_by_type(self, config_with_provisioners) -> None:
+        """Test filtering provisioners by type."""
+        runner = dot.AsyncCommandRunner(dry_run=True)
+        platform_obj = dot.Platform()
+        all_provisioners = {
+            **config_with_provisioners.provisioners,
+            **config_with_provisioners.enhancements,
+        }
 
-            # Should see "Ensuring X packages" message
-            ensuring_msg = next(
-                (msg for msg in log_messages if "Ensuring 5 apt packages" in msg), None
-            )
-            assert ensuring_msg is not None
+        manager = dot.ProvisionerManager(all_provisioners, runner, platform_obj)
 
-            # Should see package installation message with specific packages
-            install_msg = next(
-                (
-                    msg
-                    for msg in log_messages
-                    if "Need to install 3 apt packages" in msg
-                ),
-                None,
+        with patch.object(
+            manager,
+            "_is_installed",
+            new_callable=unittest.mock.AsyncMock,
+        ) as mock_installed:
+            mock_installed.return_value = False
+
+            # Test filtering by provisioner type
+            results = await manager.provision_all(
+                filter_type=dot.ProvisionerType.PROVISIONER,
             )
-            assert install_msg is not None
-            assert "build-essential, vim, wget" in install_msg
 
-    @pytest.mark.asyncio
-    async def test_apt_all_packages_installed(
+            assert "rust" in results  # rust is a provisioner
+            assert "starship" not in results  # starship is an enhancement
+
+
+class TestPackageDatabase:
+    """Test subprocess-free reads of local package databases."""
+
+    def test_dpkg_status_only_counts_installed(self, tmp_path: pathlib.Path) -> None:
+        """Test removed and config-only stanzas are not reported installed."""
+        status = tmp_path / "var/lib/dpkg/status"
+        status.parent.mkdir(parents=True)
+        status.write_text(
+            "Package: git\nStatus: install ok installed\nVersion: 1\n"
+            "Description: vcs\n continuation line\n\n"
+            "Package: vim\nStatus: deinstall ok config-files\n\n"
+            "Architecture: amd64\nPackage: libc6\nStatus: hold ok installed\n\n"
+            "Package: curl\nStatus: install ok unpacked\n"
+        )
+
+        installed = dot.PackageDatabase(root=tmp_path).installed("apt")
+
+        assert installed == frozenset({"git", "libc6"})
+
+    def test_pacman_local_db_names(self, tmp_path: pathlib.Path) -> None:
+        """Test pacman entries are named `<name>-<version>-<release>`."""
+        local = tmp_path / "var/lib/pacman/local"
+        for entry in ("git-2.45.0-1", "lib32-glibc-2.39-2", "python-pip-24.0-1"):
+            (local / entry).mkdir(parents=True)
+        (local / "ALPM_DB_VERSION").write_text("9\n")
+
+        installed = dot.PackageDatabase(root=tmp_path).installed("pacman")
+
+        assert installed == frozenset({"git", "lib32-glibc", "python-pip"})
+
+    def test_rpm_sqlite_name_index(self, tmp_path: pathlib.Path) -> None:
+        """Test rpm names come from the sqlite Name index table."""
+        import sqlite3
+
+        path = tmp_path / "var/lib/rpm/rpmdb.sqlite"
+        path.parent.mkdir(parents=True)
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE Name (key TEXT, hnum INTEGER, idx INTEGER)")
+        connection.executemany(
+            "INSERT INTO Name VALUES (?, ?, 0)", [("bash", 1), ("git-core", 2)]
+        )
+        connection.commit()
+        connection.close()
+
+        installed = dot.PackageDatabase(root=tmp_path).installed("dnf")
+
+        assert installed == frozenset({"bash", "git-core"})
+
+    def test_unreadable_database_returns_none(self, tmp_path: pathlib.Path) -> None:
+        """Test missing databases report None so callers can fall back."""
+        db = dot.PackageDatabase(root=tmp_path)
+
+        assert db.installed("apt") is None
+        assert db.installed("pacman") is None
+        assert db.installed("dnf") is None
+        assert db.installed("brew") is None
+
+    def test_read_once_until_invalidated(
         self,
-        tmp_path: pathlib.Path,
-        temp_home: pathlib.Path,
-        caplog: pytest.LogCaptureFixture,
+        dpkg_status: collections.abc.Callable[..., dot.PackageDatabase],
     ) -> None:
-        """Test apt when all packages are already installed."""
-        config_toml = """
-[packages.apt]
-packages = ["git", "curl", "vim"]
-        """
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_toml)
+        """Test the installed set is reused until invalidated."""
+        db = dpkg_status("git")
+        assert db.installed("apt") == frozenset({"git"})
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        (db.root / "var/lib/dpkg/status").write_text(
+            "Package: vim\nStatus: install ok installed\n"
+        )
+        assert db.installed("apt") == frozenset({"git"})
+
+        db.invalidate("apt")
+        assert db.installed("apt") == frozenset({"vim"})
+
+    @pytest.mark.asyncio
+    async def test_package_install_skipped_when_installed(
+        self,
+        config_with_provisioners: dot.DotfilesConfig,
+        dpkg_status: collections.abc.Callable[..., dot.PackageDatabase],
+    ) -> None:
+        """Test package provisioners already in the database are not reinstalled."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+        manager = dot.ProvisionerManager(
+            config_with_provisioners.provisioners,
+            runner,
+            platform_obj,
+            package_db=dpkg_status("rustup"),
+        )
+        rust = dataclasses.replace(
+            config_with_provisioners.provisioners["rust"],
+            install_method=dot.InstallMethod.PACKAGE,
+            package_name="rustup",
+        )
 
         with (
-            patch.object(app.platform, "get_package_manager", return_value="apt"),
+            patch.object(platform_obj, "get_package_manager", return_value="apt"),
             patch.object(
-                app.runner,
+                runner,
                 "run",
                 new_callable=unittest.mock.AsyncMock,
             ) as mock_run,
         ):
-            # dpkg shows all packages already installed
-            mock_run.side_effect = [
-                dot.CommandResult(success=True, stdout="git\ncurl\nvim"),  # dpkg check
-            ]
-
-            caplog.clear()
-            with caplog.at_level(logging.INFO):
-                result = await app._install_system_packages()
-
-            assert result
-            assert mock_run.call_count == 1  # Only dpkg check, no install
-
-            # Verify correct messaging appears in logs
-            log_messages = [record.message for record in caplog.records]
-
-            # Should see "Ensuring X packages" message
-            ensuring_msg = next(
-                (msg for msg in log_messages if "Ensuring 3 apt packages" in msg), None
-            )
-            assert ensuring_msg is not None
+            result = await manager._install_via_package(rust)
 
-            # Should see "all packages already installed" message with emoji
-            already_installed_msg = next(
-                (
-                    msg
-                    for msg in log_messages
-                    if "✅ All 3 apt packages are already installed" in msg
-                ),
-                None,
-            )
-            assert already_installed_msg is not None
+        assert result
+        mock_run.assert_not_called()
 
     @pytest.mark.asyncio
-    async def test_apt_many_packages_truncated_list(
+    async def test_pacman_system_packages_filtered(
         self,
         tmp_path: pathlib.Path,
         temp_home: pathlib.Path,
-        caplog: pytest.LogCaptureFixture,
     ) -> None:
-        """Test apt messaging with many packages shows truncated list."""
-        config_toml = """
-[packages.apt]
-packages = ["pkg1", "pkg2", "pkg3", "pkg4", "pkg5", "pkg6", "pkg7", "pkg8"]
-        """
+        """Test pacman only receives packages missing from its local db."""
         config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_toml)
+        config_path.write_text('[packages.pacman]\npackages = ["git", "fish"]\n')
+        (tmp_path / "root/var/lib/pacman/local/git-2.45.0-1").mkdir(parents=True)
 
         app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        app.package_db = dot.PackageDatabase(root=tmp_path / "root")
 
         with (
-            patch.object(app.platform, "get_package_manager", return_value="apt"),
+            patch.object(app.platform, "get_package_manager", return_value="pacman"),
             patch.object(
                 app.runner,
                 "run",
                 new_callable=unittest.mock.AsyncMock,
             ) as mock_run,
         ):
-            # dpkg shows no packages installed
-            mock_run.side_effect = [
-                dot.CommandResult(success=True, stdout=""),  # dpkg check
-                dot.CommandResult(success=True),  # apt install
-            ]
+            mock_run.return_value = dot.CommandResult(success=True)
 
-            caplog.clear()
-            with caplog.at_level(logging.INFO):
-                result = await app._install_system_packages()
+            result = await app._install_system_packages()
 
-            assert result
+        assert result
+        mock_run.assert_called_once_with(
+            "sudo pacman -S --noconfirm --needed fish", check=False, capture=True
+        )
 
-            # Verify correct messaging appears in logs
-            log_messages = [record.message for record in caplog.records]
 
-            # Should see package installation message with truncated list
-            install_msg = next(
-                (
-                    msg
-                    for msg in log_messages
-                    if "Need to install 8 apt packages" in msg
-                ),
-                None,
-            )
-            assert install_msg is not None
-            # Should show first 5 packages + "..."
-            assert "pkg1, pkg2, pkg3, pkg4, pkg5..." in install_msg
-            # Should not show the last packages in the truncated message
-            assert "pkg8" not in install_msg
+class TestAptUpdateCoordinator:
+    """Test the single-flight `apt-get update` coordinator."""
+
+    @staticmethod
+    def _write_apt_state(
+        root: pathlib.Path, *, updated_age: float, sources_age: float
+    ) -> None:
+        """Create apt lists, update stamp and sources aged in seconds."""
+        now = time.time()
+        lists = root / "var/lib/apt/lists"
+        lists.mkdir(parents=True)
+        packages = lists / "deb.debian.org_dists_stable_main_binary-amd64_Packages"
+        packages.write_text("")
+        # Indexes keep the mirror's Last-Modified time, not the update's
+        os.utime(packages, (0, 0))
+        stamp = root / "var/lib/apt/periodic/update-success-stamp"
+        stamp.parent.mkdir(parents=True)
+        stamp.write_text("")
+        os.utime(stamp, (now - updated_age, now - updated_age))
+        sources = root / "etc/apt/sources.list"
+        sources.parent.mkdir(parents=True)
+        sources.write_text("deb http://deb.debian.org/debian stable main\n")
+        os.utime(sources, (now - sources_age, now - sources_age))
 
     @pytest.mark.asyncio
-    async def test_install_system_packages_brew(self, tmp_path, temp_home) -> None:
-        """Test system package installation for brew."""
-        config_toml = """
-[packages.brew]
-packages = ["git", "curl", "cmake"]
-        """
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_toml)
+    async def test_concurrent_callers_share_one_update(
+        self, tmp_path: pathlib.Path
+    ) -> None:
+        """Test concurrent callers run a single `apt-get update`."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        coordinator = dot.AptUpdateCoordinator(runner, root=tmp_path)
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        async def slow_update(*_args: object, **_kwargs: object) -> dot.CommandResult:
+            await asyncio.sleep(0.05)
+            return dot.CommandResult(success=True)
 
-        # Mock platform to return brew
-        with (
-            patch.object(app.platform, "get_package_manager", return_value="brew"),
-            patch.object(
-                app.runner,
-                "run",
-                new_callable=unittest.mock.AsyncMock,
-            ) as mock_run,
-        ):
-            # First call: check installed packages (git already installed)
-            mock_run.side_effect = [
-                dot.CommandResult(success=True, stdout="git\nwget\nhtop"),  # brew list
-                dot.CommandResult(success=True),  # brew install
-            ]
+        with patch.object(runner, "run", side_effect=slow_update) as mock_run:
+            async with asyncio.TaskGroup() as tg:
+                for _ in range(3):
+                    tg.create_task(coordinator.ensure_fresh())
+            await coordinator.ensure_fresh()
 
-            result = await app._install_system_packages()
+        mock_run.assert_called_once_with(
+            "sudo apt-get update", check=False, capture=True
+        )
 
-            assert result
-            assert mock_run.call_count == 2
+    @pytest.mark.asyncio
+    async def test_fresh_lists_skip_update(self, tmp_path: pathlib.Path) -> None:
+        """Test lists newer than the window and every source skip the update."""
+        self._write_apt_state(tmp_path, updated_age=60, sources_age=3600)
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        coordinator = dot.AptUpdateCoordinator(runner, max_age=600, root=tmp_path)
 
-            # Check that brew list was called
-            brew_list_call = mock_run.call_args_list[0]
-            assert "brew list --formula" in brew_list_call[0][0]
+        with patch.object(
+            runner, "run", new_callable=unittest.mock.AsyncMock
+        ) as mock_run:
+            await coordinator.ensure_fresh()
 
-            # Check that brew install was called only with missing packages
-            brew_install_call = mock_run.call_args_list[1]
-            assert "brew install curl cmake" in brew_install_call[0][0]
-            assert "git" not in brew_install_call[0][0]  # git was already installed
+        mock_run.assert_not_called()
 
     @pytest.mark.asyncio
-    async def test_install_system_packages_dry_run(self, tmp_path, temp_home) -> None:
-        """Test system package installation in dry run mode."""
-        config_toml = """
-[packages.apt]
-packages = ["git", "curl"]
-        """
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_toml)
-
-        app = dot.DotfilesApp(config_path=config_path, dry_run=True)
+    @pytest.mark.parametrize(
+        ("updated_age", "sources_age"),
+        [(3600, 7200), (60, 10)],
+        ids=["update-too-old", "sources-newer"],
+    )
+    async def test_stale_lists_update(
+        self,
+        tmp_path: pathlib.Path,
+        updated_age: float,
+        sources_age: float,
+    ) -> None:
+        """Test an old update or sources edited after it trigger an update."""
+        self._write_apt_state(
+            tmp_path, updated_age=updated_age, sources_age=sources_age
+        )
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        coordinator = dot.AptUpdateCoordinator(runner, max_age=600, root=tmp_path)
 
-        with (
-            patch.object(app.platform, "get_package_manager", return_value="apt"),
-            patch.object(
-                app.runner,
-                "run",
-                new_callable=unittest.mock.AsyncMock,
-            ) as mock_run,
-        ):
-            result = await app._install_system_packages()
+        with patch.object(
+            runner, "run", new_callable=unittest.mock.AsyncMock
+        ) as mock_run:
+            mock_run.return_value = dot.CommandResult(success=True)
+            await coordinator.ensure_fresh()
+
+        mock_run.assert_called_once()
+
+    def test_index_mtimes_do_not_count(self, tmp_path: pathlib.Path) -> None:
+        """Test recently modified indexes without an update stamp are stale."""
+        self._write_apt_state(tmp_path, updated_age=3600, sources_age=7200)
+        lists = tmp_path / "var/lib/apt/lists"
+        for path in (lists, *lists.iterdir()):
+            os.utime(path)
+        coordinator = dot.AptUpdateCoordinator(
+            dot.AsyncCommandRunner(dry_run=False), max_age=600, root=tmp_path
+        )
 
-            assert result
-            mock_run.assert_not_called()
+        assert not coordinator._lists_fresh()
 
     @pytest.mark.asyncio
-    async def test_provision_installs_system_packages(
-        self,
-        tmp_path,
-        sample_toml_config,
-        temp_home,
+    async def test_successful_update_writes_stamp(self, tmp_path: pathlib.Path) -> None:
+        """Test a later session trusts the stamp of an update that succeeded."""
+        self._write_apt_state(tmp_path, updated_age=3600, sources_age=7200)
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        stamp = tmp_path / "stamp"
+
+        with patch.object(
+            runner, "run", new_callable=unittest.mock.AsyncMock
+        ) as mock_run:
+            mock_run.return_value = dot.CommandResult(success=True)
+            await dot.AptUpdateCoordinator(
+                runner, max_age=600, root=tmp_path, stamp=stamp
+            ).ensure_fresh()
+            await dot.AptUpdateCoordinator(
+                runner, max_age=600, root=tmp_path, stamp=stamp
+            ).ensure_fresh()
+
+        mock_run.assert_called_once()
+        assert stamp.exists()
+
+    def test_lists_without_package_index_are_stale(
+        self, tmp_path: pathlib.Path
     ) -> None:
-        """Test provision command installs system packages first."""
-        # Add packages section to config
-        config_with_packages = (
-            sample_toml_config
-            + """
-[packages.apt]
-packages = ["git", "curl"]
-        """
+        """Test a lists directory holding no `*_Packages` file needs an update."""
+        self._write_apt_state(tmp_path, updated_age=60, sources_age=3600)
+        for packages in (tmp_path / "var/lib/apt/lists").glob("*_Packages"):
+            packages.unlink()
+        coordinator = dot.AptUpdateCoordinator(
+            dot.AsyncCommandRunner(dry_run=False), max_age=600, root=tmp_path
         )
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_with_packages)
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        assert not coordinator._lists_fresh()
 
-        pkg_patch = patch.object(
-            app.platform,
-            "get_package_manager",
-            return_value="apt",
-        )
-        install_patch = patch.object(
-            app,
-            "_install_system_packages",
-            new_callable=unittest.mock.AsyncMock,
-        )
-        provision_patch = patch.object(
-            app.provisioner_manager,
-            "provision_all",
-            new_callable=unittest.mock.AsyncMock,
+    @pytest.mark.asyncio
+    async def test_sources_changed_and_failures_refresh_again(
+        self, tmp_path: pathlib.Path
+    ) -> None:
+        """Test added sources and failed updates lead to another refresh."""
+        self._write_apt_state(tmp_path, updated_age=60, sources_age=3600)
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        coordinator = dot.AptUpdateCoordinator(runner, root=tmp_path)
+
+        with patch.object(
+            runner, "run", new_callable=unittest.mock.AsyncMock
+        ) as mock_run:
+            mock_run.side_effect = [
+                dot.CommandResult(success=False, stderr="network down"),
+                dot.CommandResult(success=True),
+            ]
+            await coordinator.ensure_fresh()
+            assert mock_run.call_count == 0
+
+            coordinator.sources_changed()
+            await coordinator.ensure_fresh()
+            await coordinator.ensure_fresh()
+            await coordinator.ensure_fresh()
+
+        assert mock_run.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_provisioning_updates_once(self, tmp_path: pathlib.Path) -> None:
+        """Test several apt package provisioners share one index refresh."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+        provisioners = {
+            name: dot.Provisioner(
+                name=name,
+                description=name,
+                type=dot.ProvisionerType.PROVISIONER,
+                install_method=dot.InstallMethod.PACKAGE,
+                provides=frozenset([name]),
+                requires=frozenset(),
+            )
+            for name in ("jq", "ripgrep", "fd-find")
+        }
+        manager = dot.ProvisionerManager(
+            provisioners,
+            runner,
+            platform_obj,
+            apt_updates=dot.AptUpdateCoordinator(runner, root=tmp_path),
         )
 
         with (
-            pkg_patch,
-            install_patch as mock_install_packages,
-            provision_patch as mock_provision,
+            patch.object(platform_obj, "get_package_manager", return_value="apt"),
+            patch.object(
+                runner, "run", new_callable=unittest.mock.AsyncMock
+            ) as mock_run,
         ):
-            mock_install_packages.return_value = dot.Result.ok()
-            mock_provision.return_value = {
-                "rust": dot.Result.ok(),
-                "starship": dot.Result.ok(),
-            }
+            mock_run.return_value = dot.CommandResult(success=True)
+            results = await manager.provision_all()
 
-            result = await app.provision()
+        assert all(results.values())
+        commands = [call.args[0] for call in mock_run.call_args_list]
+        assert commands.count("sudo apt-get update") == 1
+        assert commands[0] == "sudo apt-get update"
 
-            assert result
-            mock_install_packages.assert_called_once()
-            mock_provision.assert_called_once()
+    def test_max_age_from_config(self, tmp_path: pathlib.Path) -> None:
+        """Test `update_max_age` under [packages.apt] sets the window."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text("[packages.apt]\nupdate_max_age = 120\npackages = []\n")
+
+        app = dot.DotfilesApp(config_path=config_path)
+
+        assert app.apt_updates.max_age == 120
+        assert app.provisioner_manager.apt_updates is app.apt_updates
+
+    @pytest.mark.parametrize("value", ['"6h"', "-1", "true"])
+    def test_invalid_max_age_rejected(self, tmp_path: pathlib.Path, value) -> None:
+        """Test a non-numeric or negative `update_max_age` names the key."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(f"[packages.apt]\nupdate_max_age = {value}\n")
+
+        with pytest.raises(ValueError, match="update_max_age"):
+            dot.ConfigLoader(config_path, use_cache=False).load()
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
-# CLI INTEGRATION TESTS
+# DOTFILES APP TESTS
 # ═══════════════════════════════════════════════════════════════════════════════
 
 
-class TestCLI:
-    """Test command-line interface integration."""
+class TestDotfilesApp:
+    """Test main application class."""
+
+    def test_app_init(self, tmp_path, sample_toml_config, temp_home) -> None:
+        """Test DotfilesApp initialization."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+
+        app = dot.DotfilesApp(config_path=config_path, dry_run=True)
+
+        assert app.dry_run is True
+        assert isinstance(app.platform, dot.Platform)
+        assert isinstance(app.runner, dot.AsyncCommandRunner)
+        assert isinstance(app.config, dot.DotfilesConfig)
+        assert isinstance(app.shell_generator, dot.ShellGenerator)
+        assert isinstance(app.provisioner_manager, dot.ProvisionerManager)
 
     @pytest.mark.asyncio
-    async def test_async_main_install(
+    async def test_install_dotfiles(
         self,
         tmp_path,
         sample_toml_config,
         temp_home,
-        monkeypatch,
     ) -> None:
-        """Test async_main with install command."""
+        """Test installing dotfiles symlinks."""
+        # Create source files
+        dot_config = tmp_path / "dot-config"
+        dot_config.mkdir()
+        (dot_config / ".gitconfig").write_text("git config")
+        (dot_config / ".zshrc").write_text("zsh config")
+        (dot_config / ".vim").mkdir()
+
+        # Update config to point to our test directory
+        config_content = sample_toml_config.replace("~/.dot-config", str(dot_config))
         config_path = tmp_path / "dot.toml"
-        config_path.write_text(sample_toml_config)
+        config_path.write_text(config_content)
 
-        # Mock sys.argv
-        monkeypatch.setattr(
-            "sys.argv",
-            ["dot.py", "--config", str(config_path), "install"],
-        )
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
 
-        with patch.object(
-            dot.DotfilesApp,
-            "install_dotfiles",
-            new_callable=unittest.mock.AsyncMock,
-        ) as mock_install:
-            mock_install.return_value = dot.InstallResult.ok()
+        success = await app.install_dotfiles()
 
-            result = await dot.async_main()
+        assert success
+        assert (temp_home / ".gitconfig").is_symlink()
+        assert (temp_home / ".zshrc").is_symlink()
+        assert (temp_home / ".vim").is_symlink()
 
-            assert result == 0
-            mock_install.assert_called_once()
+        # Verify symlinks point to the correct source files
+        assert (temp_home / ".gitconfig").resolve() == (
+            dot_config / ".gitconfig"
+        ).resolve()
+        assert (temp_home / ".zshrc").resolve() == (dot_config / ".zshrc").resolve()
+        assert (temp_home / ".vim").resolve() == (dot_config / ".vim").resolve()
 
     @pytest.mark.asyncio
-    async def test_async_main_provision(
+    async def test_provision_with_filter(
         self,
         tmp_path,
         sample_toml_config,
         temp_home,
-        monkeypatch,
     ) -> None:
-        """Test async_main with provision command."""
+        """Test provisioning with type filter."""
         config_path = tmp_path / "dot.toml"
         config_path.write_text(sample_toml_config)
 
-        monkeypatch.setattr(
-            "sys.argv",
-            [
-                "dot.py",
-                "--config",
-                str(config_path),
-                "provision",
-                "--type",
-                "provisioner",
-            ],
-        )
+        app = dot.DotfilesApp(config_path=config_path, dry_run=True)
 
         with patch.object(
-            dot.DotfilesApp,
-            "provision",
+            app.provisioner_manager,
+            "provision_all",
             new_callable=unittest.mock.AsyncMock,
         ) as mock_provision:
-            mock_provision.return_value = dot.ProvisionResult.ok()
+            mock_provision.return_value = {"rust": dot.Result.ok()}
 
-            result = await dot.async_main()
+            success = await app.provision(filter_type=dot.ProvisionerType.PROVISIONER)
 
-            assert result == 0
-            mock_provision.assert_called_once_with(dot.ProvisionerType.PROVISIONER)
+            assert success
+            mock_provision.assert_called_once_with(
+                dot.ProvisionerType.PROVISIONER,
+                True,
+                4,
+            )
 
-    @pytest.mark.asyncio
-    async def test_async_main_shell_generation(
-        self,
-        tmp_path,
-        sample_toml_config,
-        temp_home,
-        monkeypatch,
-        capsys,
-    ) -> None:
-        """Test async_main with shell command."""
+    def test_generate_shell_init(self, tmp_path, sample_toml_config, temp_home) -> None:
+        """Test generating shell initialization."""
         config_path = tmp_path / "dot.toml"
         config_path.write_text(sample_toml_config)
 
-        monkeypatch.setattr(
-            "sys.argv",
-            ["dot.py", "--config", str(config_path), "shell", "--zsh"],
-        )
+        app = dot.DotfilesApp(config_path=config_path, dry_run=True)
 
-        result = await dot.async_main()
+        zsh_init = app.generate_shell_init("zsh")
+        fish_init = app.generate_shell_init("fish", "early")
 
-        assert result == 0
-        captured = capsys.readouterr()
-        assert "Generated by dot.py v2.0" in captured.out
+        assert "Generated by dot.py v2.0" in zsh_init
+        assert "DOT_LOADED" in fish_init  # Early stage content should be present
+        assert "MAIN STAGE" not in fish_init  # only early stage requested
 
     @pytest.mark.asyncio
-    async def test_async_main_status(
+    async def test_status_reporting(
         self,
         tmp_path,
         sample_toml_config,
         temp_home,
-        monkeypatch,
-        capsys,
     ) -> None:
-        """Test async_main with status command."""
+        """Test system and provisioning status."""
         config_path = tmp_path / "dot.toml"
         config_path.write_text(sample_toml_config)
 
-        monkeypatch.setattr(
-            "sys.argv",
-            ["dot.py", "--config", str(config_path), "status"],
-        )
+        app = dot.DotfilesApp(config_path=config_path, dry_run=True)
 
         with patch.object(
-            dot.DotfilesApp,
-            "status",
+            app.provisioner_manager,
+            "_is_installed",
             new_callable=unittest.mock.AsyncMock,
-        ) as mock_status:
-            mock_status.return_value = {
-                "platform": {"os": "linux"},
-                "provisioners": {},
-                "dotfiles": {},
-            }
+        ) as mock_installed:
+            mock_installed.return_value = True
 
-            result = await dot.async_main()
+            status = await app.status()
 
-            assert result == 0
-            captured = capsys.readouterr()
-            assert "linux" in captured.out
+            assert "platform" in status
+            assert "provisioners" in status
+            assert "dotfiles" in status
+            assert status["platform"]["os"] == app.platform.info.os
+            assert "rust" in status["provisioners"]
+            assert "starship" in status["provisioners"]
 
-    def test_main_function(
-        self,
-        tmp_path,
-        sample_toml_config,
-        temp_home,
-        monkeypatch,
-    ) -> None:
-        """Test main() function entry point."""
+    @pytest.mark.asyncio
+    async def test_install_system_packages_apt(self, tmp_path, temp_home) -> None:
+        """Test apt installation falling back to dpkg without a status file."""
+        config_toml = """
+[packages.apt]
+packages = ["git", "curl", "build-essential"]
+        """
         config_path = tmp_path / "dot.toml"
-        config_path.write_text(sample_toml_config)
-
-        monkeypatch.setattr(
-            "sys.argv",
-            ["dot.py", "--config", str(config_path), "--help"],
-        )
+        config_path.write_text(config_toml)
 
-        with pytest.raises(SystemExit) as exc_info:
-            dot.main()
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        app.apt_updates = dot.AptUpdateCoordinator(app.runner, root=tmp_path)
+        app.package_db = dot.PackageDatabase(root=tmp_path / "no-such-root")
 
-        assert exc_info.value.code == 0
+        # Mock platform to return apt
+        with (
+            patch.object(app.platform, "get_package_manager", return_value="apt"),
+            patch.object(
+                app.runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            # First call: check installed packages (none installed)
+            mock_run.side_effect = [
+                dot.CommandResult(success=True, stdout=""),  # dpkg check
+                dot.CommandResult(success=True),  # apt update
+                dot.CommandResult(success=True),  # apt install
+            ]
 
+            result = await app._install_system_packages()
 
-# ═══════════════════════════════════════════════════════════════════════════════
-# INTEGRATION TESTS
-# ═══════════════════════════════════════════════════════════════════════════════
+            assert result
+            assert mock_run.call_count == 3
 
+            # Check that dpkg was called to check installed packages
+            dpkg_call = mock_run.call_args_list[0]
+            assert "dpkg -l" in dpkg_call[0][0]
 
-class TestIntegration:
-    """End-to-end integration tests."""
+            # Check that apt install was called with all packages
+            assert mock_run.call_args_list[1][0][0] == "sudo apt-get update"
+            apt_call = mock_run.call_args_list[2]
+            expected_cmd = "sudo apt-get install -y git curl build-essential"
+            assert expected_cmd in apt_call[0][0]
 
     @pytest.mark.asyncio
-    async def test_full_workflow(self, tmp_path, temp_home) -> None:
-        """Test complete workflow from config to installation."""
-        # Create realistic directory structure
-        dot_config = tmp_path / "dot-config"
-        dot_config.mkdir()
-
-        # Create source files
-        (dot_config / ".gitconfig").write_text("[user]\n    name = Test User")
-        (dot_config / ".zshrc").write_text("export PATH=/usr/local/bin:$PATH")
-        (dot_config / ".vim").mkdir()
-        (dot_config / "config").mkdir()
-        (dot_config / "config" / "starship.toml").write_text("[format]\n$all")
-
-        # Create comprehensive config
-        config_content = f"""
-[config]
-source = "{dot_config}"
-backup = true
-
-[home.files]
-".gitconfig" = ".gitconfig"
-".zshrc" = ".zshrc"
-".config/starship.toml" = "config/starship.toml"
-
-[home.dirs]
-".vim" = ".vim"
-
-[provisioners.rust]
-description = "Rust toolchain"
-install_script = "echo 'Installing Rust'"
-provides = ["cargo", "rustc"]
-requires = ["curl"]
-verify_command = "echo 'cargo 1.70.0'"
-priority = 3
-
-[shell_integration.snippets.rust_env]
-name = "rust_env"
-description = "Rust environment"
-stage = 5
-default = "export CARGO_HOME=~/.cargo"
-"""
-
-        config_path = dot_config / "dot.toml"
-        config_path.write_text(config_content)
+    async def test_install_system_packages_apt_adds_ppa_for_ubuntu(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+        dpkg_status: collections.abc.Callable[..., dot.PackageDatabase],
+    ) -> None:
+        """Test apt adds configured PPAs on Ubuntu."""
+        config_toml = """
+[packages.apt]
+ppas = ["ppa:fish-shell/release-4"]
+packages = ["fish"]
+        """
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(config_toml)
 
-        # Test complete workflow
         app = dot.DotfilesApp(config_path=config_path, dry_run=False)
-
-        # 1. Install dotfiles
-        install_success = await app.install_dotfiles()
-        assert install_success
-        assert (temp_home / ".gitconfig").exists()
-        assert (temp_home / ".config" / "starship.toml").exists()
-
-        # 2. Generate shell initialization
-        shell_init = app.generate_shell_init("zsh")
-        assert "Generated by dot.py v2.0" in shell_init
-        assert "CARGO_HOME" in shell_init
-
-        # 3. Check status
-        status = await app.status()
-        assert status["platform"]["os"] in {"linux", "darwin", "windows"}
-        assert "rust" in status["provisioners"]
-        assert ".gitconfig" in status["dotfiles"]
-
-        # 4. Test dry-run provisioning
-        app_dry = dot.DotfilesApp(config_path=config_path, dry_run=True)
-        provision_results = await app_dry.provision()
-        assert provision_results  # Should succeed in dry-run
-
-    def test_pattern_matching_usage(self) -> None:
-        """Test that our pattern matching features work correctly."""
-        # Test enum pattern matching in platform detection
-        platform_obj = dot.Platform()
-
-        # This tests the match statement in get_package_manager
-        mock_info = dot.SystemInfo(
-            os="darwin",
+        app.apt_updates = dot.AptUpdateCoordinator(app.runner, root=tmp_path)
+        app.package_db = dpkg_status()
+        app.platform.info = dot.SystemInfo(
+            os="linux",
             hostname="test",
             arch="x86_64",
-            distro=None,
-            is_linux=False,
-            is_macos=True,
+            distro="ubuntu",
+            is_linux=True,
+            is_macos=False,
             is_wsl=False,
-            home=pathlib.Path("/Users/test"),
+            home=temp_home,
             user="test",
         )
-        platform_obj.info = mock_info
-        with unittest.mock.patch("shutil.which", return_value="/usr/local/bin/brew"):
-            result = platform_obj.get_package_manager()
-            assert result == "brew"
 
-        # Test enum pattern matching in shell content
-        snippet = dot.ShellSnippet(
-            name="test",
-            description="Test",
-            stage=dot.ShellStage.MAIN,
-            bash="bash_content",
-            default="default_{shell}",
-        )
+        with (
+            patch.object(app.platform, "get_package_manager", return_value="apt"),
+            patch("shutil.which", return_value="/usr/bin/add-apt-repository"),
+            patch.object(
+                app.runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            mock_run.side_effect = [
+                dot.CommandResult(success=True),  # add-apt-repository
+                dot.CommandResult(success=True),  # apt update
+                dot.CommandResult(success=True),  # apt install
+            ]
 
-        # The get_content method uses match statements
-        assert snippet.get_content("bash") == "bash_content"
-        assert snippet.get_content("zsh") == "default_zsh"
-        assert snippet.get_content("powershell") == "default_powershell"  # type: ignore[arg-type]
+            result = await app._install_system_packages()
 
+            assert result
+            assert mock_run.call_count == 3
+            assert (
+                "add-apt-repository -y ppa:fish-shell/release-4 --no-update"
+                in (mock_run.call_args_list[0][0][0])
+            )
+            assert mock_run.call_args_list[1][0][0] == "sudo apt-get update"
+            assert "sudo apt-get install -y fish" in mock_run.call_args_list[2][0][0]
 
-# ═══════════════════════════════════════════════════════════════════════════════
-# PERFORMANCE TESTS
-# ═══════════════════════════════════════════════════════════════════════════════
+    @pytest.mark.asyncio
+    async def test_install_system_packages_apt_skips_ppa_on_debian(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+        dpkg_status: collections.abc.Callable[..., dot.PackageDatabase],
+    ) -> None:
+        """Test apt skips PPAs on non-Ubuntu distros."""
+        config_toml = """
+[packages.apt]
+ppas = ["ppa:fish-shell/release-4"]
+packages = ["fish"]
+        """
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(config_toml)
+
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        app.apt_updates = dot.AptUpdateCoordinator(app.runner, root=tmp_path)
+        app.package_db = dpkg_status()
+        app.platform.info = dot.SystemInfo(
+            os="linux",
+            hostname="test",
+            arch="x86_64",
+            distro="debian",
+            is_linux=True,
+            is_macos=False,
+            is_wsl=False,
+            home=temp_home,
+            user="test",
+        )
+
+        with (
+            patch.object(app.platform, "get_package_manager", return_value="apt"),
+            patch.object(
+                app.runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            mock_run.side_effect = [
+                dot.CommandResult(success=True),  # apt update
+                dot.CommandResult(success=True),  # apt install
+            ]
+
+            result = await app._install_system_packages()
+
+            assert result
+            assert mock_run.call_count == 2
+            assert all(
+                "add-apt-repository" not in call.args[0]
+                for call in mock_run.call_args_list
+            )
+
+    @pytest.mark.asyncio
+    async def test_apt_signed_repository_on_ubuntu(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+        dpkg_status: collections.abc.Callable[..., dot.PackageDatabase],
+    ) -> None:
+        """Test GPG-signed apt repository installation on Ubuntu."""
+        config_toml = """
+[packages.apt]
+packages = ["terraform"]
+
+[[packages.apt.repositories]]
+name = "hashicorp"
+gpg_url = "https://apt.releases.hashicorp.com/gpg"
+gpg_keyring = "/usr/share/keyrings/hashicorp-keyring.gpg"
+repo_url = "deb [arch={arch} signed-by={keyring}] https://apt.hc.io {codename} main"
+        """
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(config_toml)
+
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        app.apt_updates = dot.AptUpdateCoordinator(app.runner, root=tmp_path)
+        app.package_db = dpkg_status()
+        app.platform.info = dot.SystemInfo(
+            os="linux",
+            hostname="test",
+            arch="x86_64",
+            distro="ubuntu",
+            is_linux=True,
+            is_macos=False,
+            is_wsl=False,
+            home=temp_home,
+            user="test",
+        )
+
+        with (
+            patch.object(app.platform, "get_package_manager", return_value="apt"),
+            patch.object(pathlib.Path, "exists", return_value=False),
+            patch.object(
+                app.runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            mock_run.side_effect = [
+                dot.CommandResult(success=True),  # GPG key download
+                dot.CommandResult(success=True, stdout="amd64"),  # dpkg arch
+                dot.CommandResult(success=True, stdout="jammy"),  # codename
+                dot.CommandResult(success=True),  # add repo
+                dot.CommandResult(success=True),  # apt update
+                dot.CommandResult(success=True),  # apt install
+            ]
+
+            result = await app._install_system_packages()
+
+            assert result
+            # Verify GPG key was downloaded
+            assert "wget -qO -" in mock_run.call_args_list[0][0][0]
+            assert "hashicorp" in mock_run.call_args_list[0][0][0]
+
+    @pytest.mark.asyncio
+    async def test_apt_signed_repository_on_debian(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+        dpkg_status: collections.abc.Callable[..., dot.PackageDatabase],
+    ) -> None:
+        """Test GPG-signed apt repository installation on Debian."""
+        config_toml = """
+[packages.apt]
+packages = ["terraform"]
+
+[[packages.apt.repositories]]
+name = "hashicorp"
+gpg_url = "https://apt.releases.hashicorp.com/gpg"
+gpg_keyring = "/usr/share/keyrings/hashicorp-keyring.gpg"
+repo_url = "deb [arch={arch} signed-by={keyring}] https://apt.hc.io {codename} main"
+        """
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(config_toml)
+
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        app.apt_updates = dot.AptUpdateCoordinator(app.runner, root=tmp_path)
+        app.package_db = dpkg_status()
+        app.platform.info = dot.SystemInfo(
+            os="linux",
+            hostname="test",
+            arch="x86_64",
+            distro="debian",
+            is_linux=True,
+            is_macos=False,
+            is_wsl=False,
+            home=temp_home,
+            user="test",
+        )
+
+        with (
+            patch.object(app.platform, "get_package_manager", return_value="apt"),
+            patch.object(pathlib.Path, "exists", return_value=False),
+            patch.object(
+                app.runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            mock_run.side_effect = [
+                dot.CommandResult(success=True),  # GPG key download
+                dot.CommandResult(success=True, stdout="amd64"),  # dpkg arch
+                dot.CommandResult(success=True, stdout="bookworm"),  # codename
+                dot.CommandResult(success=True),  # add repo
+                dot.CommandResult(success=True),  # apt update
+                dot.CommandResult(success=True),  # apt install
+            ]
+
+            result = await app._install_system_packages()
+
+            assert result
+            # Verify it works on Debian (not just Ubuntu)
+            assert mock_run.call_count == 6
+
+    @pytest.mark.asyncio
+    async def test_apt_signed_repository_skips_if_exists(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+        dpkg_status: collections.abc.Callable[..., dot.PackageDatabase],
+    ) -> None:
+        """Test that existing repositories are skipped."""
+        config_toml = """
+[packages.apt]
+packages = ["terraform"]
+
+[[packages.apt.repositories]]
+name = "hashicorp"
+gpg_url = "https://apt.releases.hashicorp.com/gpg"
+gpg_keyring = "/usr/share/keyrings/hashicorp-keyring.gpg"
+repo_url = "deb [arch={arch} signed-by={keyring}] https://apt.hc.io {codename} main"
+        """
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(config_toml)
+
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        app.apt_updates = dot.AptUpdateCoordinator(app.runner, root=tmp_path)
+        app.package_db = dpkg_status("terraform")
+        app.platform.info = dot.SystemInfo(
+            os="linux",
+            hostname="test",
+            arch="x86_64",
+            distro="ubuntu",
+            is_linux=True,
+            is_macos=False,
+            is_wsl=False,
+            home=temp_home,
+            user="test",
+        )
+
+        with (
+            patch.object(app.platform, "get_package_manager", return_value="apt"),
+            patch.object(pathlib.Path, "exists", return_value=True),  # Repo exists
+            patch.object(
+                app.runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            mock_run.side_effect = []
+
+            result = await app._install_system_packages()
+
+            assert result
+            # No GPG key download should occur
+            assert all("gpg" not in str(call) for call in mock_run.call_args_list)
+
+    @pytest.mark.asyncio
+    async def test_brew_tap_installation(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+    ) -> None:
+        """Test Homebrew tap installation."""
+        config_toml = """
+[packages.brew]
+taps = ["hashicorp/tap"]
+packages = ["hashicorp/tap/terraform"]
+        """
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(config_toml)
+
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        app.platform.info = dot.SystemInfo(
+            os="darwin",
+            hostname="mac",
+            arch="arm64",
+            distro=None,
+            is_linux=False,
+            is_macos=True,
+            is_wsl=False,
+            home=temp_home,
+            user="test",
+        )
+
+        with (
+            patch.object(app.platform, "get_package_manager", return_value="brew"),
+            patch.object(
+                app.runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            mock_run.side_effect = [
+                dot.CommandResult(success=True, stdout=""),  # brew tap (empty)
+                dot.CommandResult(success=True),  # brew tap hashicorp/tap
+                dot.CommandResult(success=True, stdout=""),  # brew list
+                dot.CommandResult(success=True),  # brew install
+            ]
+
+            result = await app._install_system_packages()
+
+            assert result
+            assert "brew tap hashicorp/tap" in mock_run.call_args_list[1][0][0]
+
+    @pytest.mark.asyncio
+    async def test_brew_tap_skips_existing(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+    ) -> None:
+        """Test that existing taps are skipped."""
+        config_toml = """
+[packages.brew]
+taps = ["hashicorp/tap"]
+packages = ["hashicorp/tap/terraform"]
+        """
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(config_toml)
+
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        app.platform.info = dot.SystemInfo(
+            os="darwin",
+            hostname="mac",
+            arch="arm64",
+            distro=None,
+            is_linux=False,
+            is_macos=True,
+            is_wsl=False,
+            home=temp_home,
+            user="test",
+        )
+
+        with (
+            patch.object(app.platform, "get_package_manager", return_value="brew"),
+            patch.object(
+                app.runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            mock_run.side_effect = [
+                # Tap already exists
+                dot.CommandResult(success=True, stdout="hashicorp/tap\nhomebrew/core"),
+                dot.CommandResult(success=True, stdout=""),  # brew list
+                dot.CommandResult(success=True),  # brew install
+            ]
+
+            result = await app._install_system_packages()
+
+            assert result
+            # Should NOT call brew tap hashicorp/tap (already exists)
+            tap_calls = [
+                c for c in mock_run.call_args_list if "brew tap hashicorp" in str(c)
+            ]
+            assert len(tap_calls) == 0
+
+    @pytest.mark.asyncio
+    async def test_apt_package_detection_and_messaging(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+        dpkg_status: collections.abc.Callable[..., dot.PackageDatabase],
+        caplog: pytest.LogCaptureFixture,
+    ) -> None:
+        """Test apt package detection with proper messaging."""
+        config_toml = """
+[packages.apt]
+packages = ["git", "curl", "build-essential", "vim", "wget"]
+        """
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(config_toml)
+
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        app.apt_updates = dot.AptUpdateCoordinator(app.runner, root=tmp_path)
+        app.package_db = dpkg_status("git", "curl")
+
+        with (
+            patch.object(app.platform, "get_package_manager", return_value="apt"),
+            patch.object(
+                app.runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            mock_run.side_effect = [
+                dot.CommandResult(success=True),  # apt update
+                dot.CommandResult(success=True),  # apt install
+            ]
+
+            caplog.clear()
+            with caplog.at_level(logging.INFO):
+                result = await app._install_system_packages()
+
+            assert result
+
+            # Verify correct messaging appears in logs
+            log_messages = [record.message for record in caplog.records]
+
+            # Should see "Ensuring X packages" message
+            ensuring_msg = next(
+                (msg for msg in log_messages if "Ensuring 5 apt packages" in msg), None
+            )
+            assert ensuring_msg is not None
+
+            # Should see package installation message with specific packages
+            install_msg = next(
+                (
+                    msg
+                    for msg in log_messages
+                    if "Need to install 3 apt packages" in msg
+                ),
+                None,
+            )
+            assert install_msg is not None
+            assert "build-essential, vim, wget" in install_msg
+
+    @pytest.mark.asyncio
+    async def test_apt_all_packages_installed(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+        dpkg_status: collections.abc.Callable[..., dot.PackageDatabase],
+        caplog: pytest.LogCaptureFixture,
+    ) -> None:
+        """Test apt when all packages are already installed."""
+        config_toml = """
+[packages.apt]
+packages = ["git", "curl", "vim"]
+        """
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(config_toml)
+
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        app.apt_updates = dot.AptUpdateCoordinator(app.runner, root=tmp_path)
+        app.package_db = dpkg_status("git", "curl", "vim")
+
+        with (
+            patch.object(app.platform, "get_package_manager", return_value="apt"),
+            patch.object(
+                app.runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            mock_run.side_effect = []
+
+            caplog.clear()
+            with caplog.at_level(logging.INFO):
+                result = await app._install_system_packages()
+
+            assert result
+            mock_run.assert_not_called()  # Read from dpkg status, no install
+
+            # Verify correct messaging appears in logs
+            log_messages = [record.message for record in caplog.records]
+
+            # Should see "Ensuring X packages" message
+            ensuring_msg = next(
+                (msg for msg in log_messages if "Ensuring 3 apt packages" in msg), None
+            )
+            assert ensuring_msg is not None
+
+            # Should see "all packages already installed" message with emoji
+            already_installed_msg = next(
+                (
+                    msg
+                    for msg in log_messages
+                    if "✅ All 3 apt packages are already installed" in msg
+                ),
+                None,
+            )
+            assert already_installed_msg is not None
+
+    @pytest.mark.asyncio
+    async def test_apt_many_packages_truncated_list(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+        dpkg_status: collections.abc.Callable[..., dot.PackageDatabase],
+        caplog: pytest.LogCaptureFixture,
+    ) -> None:
+        """Test apt messaging with many packages shows truncated list."""
+        config_toml = """
+[packages.apt]
+packages = ["pkg1", "pkg2", "pkg3", "pkg4", "pkg5", "pkg6", "pkg7", "pkg8"]
+        """
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(config_toml)
+
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        app.apt_updates = dot.AptUpdateCoordinator(app.runner, root=tmp_path)
+        app.package_db = dpkg_status()
+
+        with (
+            patch.object(app.platform, "get_package_manager", return_value="apt"),
+            patch.object(
+                app.runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            mock_run.side_effect = [
+                dot.CommandResult(success=True),  # apt update
+                dot.CommandResult(success=True),  # apt install
+            ]
+
+            caplog.clear()
+            with caplog.at_level(logging.INFO):
+                result = await app._install_system_packages()
+
+            assert result
+
+            # Verify correct messaging appears in logs
+            log_messages = [record.message for record in caplog.records]
+
+            # Should see package installation message with truncated list
+            install_msg = next(
+                (
+                    msg
+                    for msg in log_messages
+                    if "Need to install 8 apt packages" in msg
+                ),
+                None,
+            )
+            assert install_msg is not None
+            # Should show first 5 packages + "..."
+            assert "pkg1, pkg2, pkg3, pkg4, pkg5..." in install_msg
+            # Should not show the last packages in the truncated message
+            assert "pkg8" not in install_msg
+
+    @pytest.mark.asyncio
+    async def test_install_system_packages_brew(self, tmp_path, temp_home) -> None:
+        """Test system package installation for brew."""
+        config_toml = """
+[packages.brew]
+packages = ["git", "curl", "cmake"]
+        """
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(config_toml)
+
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+
+        # Mock platform to return brew
+        with (
+            patch.object(app.platform, "get_package_manager", return_value="brew"),
+            patch.object(
+                app.runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            # First call: check installed packages (git already installed)
+            mock_run.side_effect = [
+                dot.CommandResult(success=True, stdout="git\nwget\nhtop"),  # brew list
+                dot.CommandResult(success=True),  # brew install
+            ]
+
+            result = await app._install_system_packages()
+
+            assert result
+            assert mock_run.call_count == 2
+
+            # Check that brew list was called
+            brew_list_call = mock_run.call_args_list[0]
+            assert "brew list --formula" in brew_list_call[0][0]
+
+            # Check that brew install was called only with missing packages
+            brew_install_call = mock_run.call_args_list[1]
+            assert "brew install curl cmake" in brew_install_call[0][0]
+            assert "git" not in brew_install_call[0][0]  # git was already installed
+
+    @pytest.mark.asyncio
+    async def test_install_system_packages_dry_run(self, tmp_path, temp_home) -> None:
+        """Test system package installation in dry run mode."""
+        config_toml = """
+[packages.apt]
+packages = ["git", "curl"]
+        """
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(config_toml)
+
+        app = dot.DotfilesApp(config_path=config_path, dry_run=True)
+
+        with (
+            patch.object(app.platform, "get_package_manager", return_value="apt"),
+            patch.object(
+                app.runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            result = await app._install_system_packages()
+
+            assert result
+            mock_run.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_provision_installs_system_packages(
+        self,
+        tmp_path,
+        sample_toml_config,
+        temp_home,
+    ) -> None:
+        """Test provision command installs system packages first."""
+        # Add packages section to config
+        config_with_packages = (
+            sample_toml_config
+            + """
+[packages.apt]
+packages = ["git", "curl"]
+        """
+        )
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(config_with_packages)
+
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+
+        pkg_patch = patch.object(
+            app.platform,
+            "get_package_manager",
+            return_value="apt",
+        )
+        install_patch = patch.object(
+            app,
+            "_install_system_packages",
+            new_callable=unittest.mock.AsyncMock,
+        )
+        provision_patch = patch.object(
+            app.provisioner_manager,
+            "provision_all",
+            new_callable=unittest.mock.AsyncMock,
+        )
+
+        with (
+            pkg_patch,
+            install_patch as mock_install_packages,
+            provision_patch as mock_provision,
+            patch.object(
+                app.provisioner_manager,
+                "prefetch",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_prefetch,
+        ):
+            mock_install_packages.return_value = dot.Result.ok()
+            mock_provision.return_value = {
+                "rust": dot.Result.ok(),
+                "starship": dot.Result.ok(),
+            }
+
+            result = await app.provision()
+
+            assert result
+            mock_prefetch.assert_awaited_once_with(None)
+            mock_install_packages.assert_called_once()
+            mock_provision.assert_called_once()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CLI INTEGRATION TESTS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+class TestCLI:
+    """Test command-line interface integration."""
+
+    @pytest.mark.asyncio
+    async def test_async_main_install(
+        self,
+        tmp_path,
+        sample_toml_config,
+        temp_home,
+        monkeypatch,
+    ) -> None:
+        """Test async_main with install command."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+
+        # Mock sys.argv
+        monkeypatch.setattr(
+            "sys.argv",
+            ["dot.py", "--config", str(config_path), "install"],
+        )
+
+        with patch.object(
+            dot.DotfilesApp,
+            "install_dotfiles",
+            new_callable=unittest.mock.AsyncMock,
+        ) as mock_install:
+            mock_install.return_value = dot.InstallResult.ok()
+
+            result = await dot.async_main()
+
+            assert result == 0
+            mock_install.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_async_main_provision(
+        self,
+        tmp_path,
+        sample_toml_config,
+        temp_home,
+        monkeypatch,
+    ) -> None:
+        """Test async_main with provision command."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+
+        monkeypatch.setattr(
+            "sys.argv",
+            [
+                "dot.py",
+                "--config",
+                str(config_path),
+                "provision",
+                "--type",
+                "provisioner",
+            ],
+        )
+
+        with patch.object(
+            dot.DotfilesApp,
+            "provision",
+            new_callable=unittest.mock.AsyncMock,
+        ) as mock_provision:
+            mock_provision.return_value = dot.ProvisionResult.ok()
+
+            result = await dot.async_main()
+
+            assert result == 0
+            mock_provision.assert_called_once_with(
+                dot.ProvisionerType.PROVISIONER, 4, None
+            )
+
+    @pytest.mark.asyncio
+    async def test_async_main_shell_generation(
+        self,
+        tmp_path,
+        sample_toml_config,
+        temp_home,
+        monkeypatch,
+        capsys,
+    ) -> None:
+        """Test async_main with shell command."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+
+        monkeypatch.setattr(
+            "sys.argv",
+            ["dot.py", "--config", str(config_path), "shell", "--zsh"],
+        )
+
+        result = await dot.async_main()
+
+        assert result == 0
+        captured = capsys.readouterr()
+        assert "Generated by dot.py v2.0" in captured.out
+
+    @pytest.mark.asyncio
+    async def test_async_main_status(
+        self,
+        tmp_path,
+        sample_toml_config,
+        temp_home,
+        monkeypatch,
+        capsys,
+    ) -> None:
+        """Test async_main with status command."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+
+        monkeypatch.setattr(
+            "sys.argv",
+            ["dot.py", "--config", str(config_path), "status"],
+        )
+
+        with patch.object(
+            dot.DotfilesApp,
+            "status",
+            new_callable=unittest.mock.AsyncMock,
+        ) as mock_status:
+            mock_status.return_value = {
+                "platform": {"os": "linux"},
+                "provisioners": {},
+                "dotfiles": {},
+            }
+
+            result = await dot.async_main()
+
+            assert result == 0
+            captured = capsys.readouterr()
+            assert "linux" in captured.out
+
+    def test_main_function(
+        self,
+        tmp_path,
+        sample_toml_config,
+        temp_home,
+        monkeypatch,
+    ) -> None:
+        """Test main() function entry point."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+
+        monkeypatch.setattr(
+            "sys.argv",
+            ["dot.py", "--config", str(config_path), "--help"],
+        )
+
+        with pytest.raises(SystemExit) as exc_info:
+            dot.main()
+
+        assert exc_info.value.code == 0
+
+
+class TestShellFastPath:
+    """Test the lightweight `shell` subcommand path."""
+
+    # Modules the shell path must never import
+    HEAVY_MODULES: typing.ClassVar[frozenset[str]] = frozenset(
+        {"asyncio", "argparse", "subprocess", "tomllib"},
+    )
+    # Generous ceiling on total import time so slow CI hosts stay green
+    IMPORT_BUDGET_US: typing.ClassVar[int] = 150_000
+
+    def test_parse_shell_request(self) -> None:
+        """Test shell invocations are parsed without argparse."""
+        request = dot._parse_shell_request(
+            ["--config", "/tmp/dot.toml", "-v", "shell", "--fish", "--stage=late"],
+        )
+
+        assert request == dot.ShellRequest(
+            shell="fish",
+            stage="late",
+            config=pathlib.Path("/tmp/dot.toml"),
+            verbose=True,
+        )
+
+    @pytest.mark.parametrize(
+        "argv",
+        [
+            ["status"],
+            ["shell"],
+            ["shell", "--help"],
+            ["shell", "--zsh", "--bash"],
+            ["shell", "--zsh", "--stage", "bogus"],
+            ["shell", "--zsh", "--unknown"],
+            ["--config"],
+        ],
+    )
+    def test_parse_defers_to_argparse(self, argv: list[str]) -> None:
+        """Test anything but a well-formed shell call uses the full CLI."""
+        assert dot._parse_shell_request(argv) is None
+
+    def test_main_shell_skips_app_construction(
+        self,
+        tmp_path,
+        sample_toml_config,
+        monkeypatch,
+        capsys,
+    ) -> None:
+        """Test main() serves `shell` without building a DotfilesApp."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+        monkeypatch.setattr(
+            "sys.argv",
+            ["dot.py", "--config", str(config_path), "shell", "--zsh"],
+        )
+
+        with (
+            patch.object(dot, "DotfilesApp") as mock_app,
+            patch.object(dot, "Platform") as mock_platform,
+        ):
+            exit_code = dot.main()
+
+        assert exit_code == 0
+        mock_app.assert_not_called()
+        mock_platform.assert_not_called()
+        assert "Generated by dot.py v2.0" in capsys.readouterr().out
+
+    def test_shell_import_budget(
+        self,
+        tmp_path,
+        sample_toml_config,
+        record_property,
+    ) -> None:
+        """Test `dot.py shell` avoids heavy imports (-X importtime parsed)."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+        cmd = [
+            sys.executable,
+            "-X",
+            "importtime",
+            str(pathlib.Path(dot.__file__)),
+            "--config",
+            str(config_path),
+            "shell",
+            "--zsh",
+        ]
+        env = {**os.environ, "PYTHONDONTWRITEBYTECODE": ""}
+        subprocess.run(cmd, check=True, capture_output=True, env=env)  # warm
+        proc = subprocess.run(cmd, check=True, capture_output=True, env=env, text=True)
+
+        imported: dict[str, int] = {}
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            self_us, _cumulative, name = line.removeprefix("import time:").split("|")
+            imported[name.strip()] = int(self_us)
+
+        total_us = sum(imported.values())
+        record_property("shell_import_time_us", total_us)
+        assert "Generated by dot.py v2.0" in proc.stdout
+        assert not self.HEAVY_MODULES & imported.keys()
+        assert total_us < self.IMPORT_BUDGET_US
+
+    def test_shell_wall_time_metric(
+        self,
+        tmp_path,
+        sample_toml_config,
+        record_property,
+    ) -> None:
+        """Record end-to-end `dot.py shell` wall time as a test metric."""
+        import time
+
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+        cmd = [
+            sys.executable,
+            str(pathlib.Path(dot.__file__)),
+            "--config",
+            str(config_path),
+            "shell",
+            "--zsh",
+        ]
+        subprocess.run(cmd, check=True, capture_output=True)  # warm snapshot
+
+        timings = []
+        for _ in range(5):
+            start = time.perf_counter()
+            subprocess.run(cmd, check=True, capture_output=True)
+            timings.append(time.perf_counter() - start)
+
+        record_property("shell_wall_time_ms", round(min(timings) * 1e3, 2))
+        assert min(timings) < 2.0
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# INTEGRATION TESTS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+class TestIntegration:
+    """End-to-end integration tests."""
+
+    @pytest.mark.asyncio
+    async def test_full_workflow(self, tmp_path, temp_home) -> None:
+        """Test complete workflow from config to installation."""
+        # Create realistic directory structure
+        dot_config = tmp_path / "dot-config"
+        dot_config.mkdir()
+
+        # Create source files
+        (dot_config / ".gitconfig").write_text("[user]\n    name = Test User")
+        (dot_config / ".zshrc").write_text("export PATH=/usr/local/bin:$PATH")
+        (dot_config / ".vim").mkdir()
+        (dot_config / "config").mkdir()
+        (dot_config / "config" / "starship.toml").write_text("[format]\n$all")
+
+        # Create comprehensive config
+        config_content = f"""
+[config]
+source = "{dot_config}"
+backup = true
+
+[home.files]
+".gitconfig" = ".gitconfig"
+".zshrc" = ".zshrc"
+".config/starship.toml" = "config/starship.toml"
+
+[home.dirs]
+".vim" = ".vim"
+
+[provisioners.rust]
+description = "Rust toolchain"
+install_script = "echo 'Installing Rust'"
+provides = ["cargo", "rustc"]
+requires = ["curl"]
+verify_command = "echo 'cargo 1.70.0'"
+priority = 3
+
+[shell_integration.snippets.rust_env]
+name = "rust_env"
+description = "Rust environment"
+stage = 5
+default = "export CARGO_HOME=~/.cargo"
+"""
+
+        config_path = dot_config / "dot.toml"
+        config_path.write_text(config_content)
+
+        # Test complete workflow
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+
+        # 1. Install dotfiles
+        install_success = await app.install_dotfiles()
+        assert install_success
+        assert (temp_home / ".gitconfig").exists()
+        assert (temp_home / ".config" / "starship.toml").exists()
+
+        # 2. Generate shell initialization
+        shell_init = app.generate_shell_init("zsh")
+        assert "Generated by dot.py v2.0" in shell_init
+        assert "CARGO_HOME" in shell_init
+
+        # 3. Check status
+        status = await app.status()
+        assert status["platform"]["os"] in {"linux", "darwin", "windows"}
+        assert "rust" in status["provisioners"]
+        assert ".gitconfig" in status["dotfiles"]
+
+        # 4. Test dry-run provisioning
+        app_dry = dot.DotfilesApp(config_path=config_path, dry_run=True)
+        provision_results = await app_dry.provision()
+        assert provision_results  # Should succeed in dry-run
+
+    def test_pattern_matching_usage(self) -> None:
+        """Test that our pattern matching features work correctly."""
+        # Test enum pattern matching in platform detection
+        platform_obj = dot.Platform()
+
+        # This tests the match statement in get_package_manager
+        mock_info = dot.SystemInfo(
+            os="darwin",
+            hostname="test",
+            arch="x86_64",
+            distro=None,
+            is_linux=False,
+            is_macos=True,
+            is_wsl=False,
+            home=pathlib.Path("/Users/test"),
+            user="test",
+        )
+        platform_obj.info = mock_info
+        with unittest.mock.patch("shutil.which", return_value="/usr/local/bin/brew"):
+            result = platform_obj.get_package_manager()
+            assert result == "brew"
+
+        # Test enum pattern matching in shell content
+        snippet = dot.ShellSnippet(
+            name="test",
+            description="Test",
+            stage=dot.ShellStage.MAIN,
+            bash="bash_content",
+            default="default_{shell}",
+        )
+
+        # The get_content method uses match statements
+        assert snippet.get_content("bash") == "bash_content"
+        assert snippet.get_content("zsh") == "default_zsh"
+        assert snippet.get_content("powershell") == "default_powershell"  # type: ignore[arg-type]
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PERFORMANCE TESTS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+class TestPerformance:
+    """Test performance improvements from v2.0."""
+
+    def test_staged_shell_performance(self) -> None:
+        """Test that staged shell generation provides performance benefits."""
+        platform_obj = dot.Platform()
+        generator = dot.ShellGenerator(platform_obj)
+
+        # Create snippets for different stages
+        early_snippets = [
+            dot.ShellSnippet(
+                name="env_var",
+                description="Environment variable",
+                stage=dot.ShellStage.EARLY,
+                default="export EARLY_VAR=1",
+            ),
+        ]
+
+        heavy_snippets = [
+            dot.ShellSnippet(
+                name="heavy_tool",
+                description="Heavy tool initialization",
+                stage=dot.ShellStage.LATE,
+                default="eval $(heavy_tool init)",
+            ),
+        ]
+
+        all_snippets = early_snippets + heavy_snippets
+
+        # Early stage should only include early snippets
+        early_init = generator.generate_staged_init("zsh", all_snippets, "early")
+        assert "EARLY_VAR" in early_init
+        assert "heavy_tool" not in early_init
+
+        # This demonstrates the performance benefit - shells can load just
+        # critical early-stage initialization for faster startup
+        assert len(early_init) < len(
+            generator.generate_staged_init("zsh", all_snippets),
+        )
+
+    def test_config_snapshot_cold_vs_warm_load(self, tmp_path) -> None:
+        """Benchmark cold TOML parsing against warm snapshot loads."""
+        import time
+
+        config_path = pathlib.Path(__file__).parent / "dot.toml"
+        cache_dir = tmp_path / "cache"
+
+        def best_of(loader: dot.ConfigLoader, rounds: int = 25) -> float:
+            timings = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                loader.load()
+                timings.append(time.perf_counter() - start)
+            return min(timings)
+
+        cold = best_of(dot.ConfigLoader(config_path, use_cache=False))
+        warm_loader = dot.ConfigLoader(config_path, cache_dir=cache_dir)
+        warm_loader.load()  # prime the snapshot
+        warm = best_of(warm_loader)
+
+        print(f"config load: cold={cold * 1e3:.3f}ms warm={warm * 1e3:.3f}ms")
+        assert warm < cold
+
+    # Renders a 10k-entry plan to /dev/null; prints elapsed ms and the growth
+    # in peak RSS (KiB) over the process with dot.py and the renderer loaded.
+    # Peak RSS is reset via clear_refs, as a forked child inherits its parent's.
+    PLAN_RENDER_SCRIPT: typing.ClassVar[str] = """
+import contextlib, os, pathlib, sys, time
+sys.path.insert(0, sys.argv[1])
+import dot
+
+def status(field):
+    for line in pathlib.Path("/proc/self/status").read_text().splitlines():
+        if line.startswith(field + ":"):
+            return int(line.split()[1])
+
+home, actions = pathlib.Path("/home/bench"), list(dot.SymlinkAction)
+plans = [
+    dot.SymlinkPlan(pathlib.Path(f"/src/f{i}"), home / f".f{i}", actions[i % 6])
+    for i in range(10_000)
+]
+with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+    render = {
+        "table": lambda p: dot.render_plan_table(p, home),
+        "plain": lambda p: dot.render_plan_plain(p, home, sink),
+        "json": lambda p: dot.render_plan_json(p, home, sink),
+    }[sys.argv[2]]
+    render([])
+    pathlib.Path("/proc/self/clear_refs").write_text("5")
+    before = status("VmRSS")
+    start = time.perf_counter()
+    render(plans)
+    elapsed = time.perf_counter() - start
+print(round(elapsed * 1e3), status("VmHWM") - before)
+"""
+
+    @pytest.mark.skipif(sys.platform != "linux", reason="reads /proc/self/status")
+    def test_plan_render_10k_memory(
+        self,
+        record_property: typing.Callable[[str, object], None],
+    ) -> None:
+        """Benchmark time and peak memory rendering a 10k-entry install plan."""
+        results = {}
+        for plan_format in ("table", "plain", "json"):
+            proc = subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    self.PLAN_RENDER_SCRIPT,
+                    str(pathlib.Path(dot.__file__).parent),
+                    plan_format,
+                ],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            ms, peak_kib = map(int, proc.stdout.split())
+            results[plan_format] = ms, peak_kib
+            record_property(f"render_{plan_format}_ms", ms)
+            record_property(f"render_{plan_format}_peak_kib", peak_kib)
+
+        print(
+            "render 10k: "
+            + " ".join(f"{k}={ms}ms/{kib}KiB" for k, (ms, kib) in results.items())
+        )
+        for plan_format in ("plain", "json"):
+            ms, peak_kib = results[plan_format]
+            assert ms < results["table"][0]
+            assert peak_kib * 3 < results["table"][1]
+
+    def test_changeset_classification_10k_tmpfs(
+        self,
+        tmp_path: pathlib.Path,
+        record_property: typing.Callable[[str, object], None],
+    ) -> None:
+        """Benchmark batched classification of 10k mappings on tmpfs."""
+        import tempfile
+
+        shm = pathlib.Path("/dev/shm")
+        root = pathlib.Path(tempfile.mkdtemp(dir=shm if shm.is_dir() else tmp_path))
+        try:
+            mappings = _synthetic_mappings(root, 10_000)
+            home = root / "home"
+            classifier = dot.SymlinkClassifier(home, source_root=root / "src")
+
+            def original() -> list[dot.SymlinkAction]:
+                return [_classify_reference(s, d, home, []) for s, d in mappings]
+
+            def batched() -> list[dot.SymlinkAction]:
+                return classifier.classify_all(mappings)
+
+            assert batched() == original()
+            before, after = _timed(original), _timed(batched)
+        finally:
+            shutil.rmtree(root)
+
+        print(f"classify 10k tmpfs: original={before:.0f}ms batched={after:.0f}ms")
+        record_property("classify_tmpfs_original_ms", round(before))
+        record_property("classify_tmpfs_batched_ms", round(after))
+        assert after < before
+
+    def test_changeset_classification_10k_slow_filesystem(
+        self,
+        tmp_path: pathlib.Path,
+        monkeypatch: pytest.MonkeyPatch,
+        record_property: typing.Callable[[str, object], None],
+    ) -> None:
+        """Benchmark 10k mappings with latency added to every stat call.
+
+        Timing the original planner at this latency would take most of a
+        minute, so the two are compared by syscall count and only the
+        batched one is timed.
+        """
+        mappings = _synthetic_mappings(tmp_path, 10_000)
+        home = tmp_path / "home"
+        classifier = dot.SymlinkClassifier(home, source_root=tmp_path / "src")
+        calls = [0]
+
+        def slowed(func: typing.Callable[..., typing.Any], latency: float):
+            def wrapper(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+                calls[0] += 1
+                if latency:
+                    time.sleep(latency)
+                return func(*args, **kwargs)
+
+            return wrapper
+
+        @contextlib.contextmanager
+        def slow_filesystem(latency: float) -> collections.abc.Iterator[None]:
+            with monkeypatch.context() as m:
+                for name in ("stat", "lstat", "readlink"):
+                    m.setattr(os, name, slowed(getattr(os, name), latency))
+                yield
+
+        with slow_filesystem(0.0):
+            [_classify_reference(s, d, home, []) for s, d in mappings]
+            before, calls[0] = calls[0], 0
+            classifier.classify_all(mappings)
+            after = calls[0]
+        with slow_filesystem(20e-6):
+            elapsed = _timed(lambda: classifier.classify_all(mappings))
+
+        print(
+            f"classify 10k slow fs: syscalls original={before} batched={after}, "
+            f"batched={elapsed:.0f}ms"
+        )
+        record_property("classify_slow_original_syscalls", before)
+        record_property("classify_slow_batched_syscalls", after)
+        record_property("classify_slow_batched_ms", round(elapsed))
+        assert after * 2 < before
+
+    @pytest.mark.skipif(shutil.which("dpkg") is None, reason="dpkg not available")
+    def test_dpkg_status_native_vs_pipeline(
+        self,
+        tmp_path: pathlib.Path,
+        record_property: typing.Callable[[str, object], None],
+    ) -> None:
+        """Benchmark the native status parse against the dpkg -l pipeline."""
+        admin_dir = tmp_path / "var/lib/dpkg"
+        (admin_dir / "info").mkdir(parents=True)
+        (admin_dir / "updates").mkdir()
+        names = [f"pkg{i}" for i in range(5000)]
+        (admin_dir / "status").write_text(
+            "".join(
+                f"Package: {name}\nStatus: install ok installed\n"
+                "Priority: optional\nSection: misc\nInstalled-Size: 10\n"
+                f"Maintainer: Nobody <nobody@example.com>\nArchitecture: amd64\n"
+                f"Version: 1.{i}-1\nDescription: synthetic package {i}\n"
+                " Long description continuation.\n\n"
+                for i, name in enumerate(names)
+            )
+        )
+        pipeline = (
+            f"dpkg --admindir={admin_dir} -l {' '.join(names)} 2>/dev/null | "
+            "grep '^ii' | awk '{print $2}' | cut -d: -f1"
+        )
+
+        def best_of(read: typing.Callable[[], frozenset[str]], rounds: int) -> float:
+            timings = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                assert len(read()) == len(names)
+                timings.append(time.perf_counter() - start)
+            return min(timings)
+
+        native = best_of(
+            lambda: dot.PackageDatabase(root=tmp_path).installed("apt") or frozenset(),
+            rounds=10,
+        )
+        shelled = best_of(
+            lambda: frozenset(
+                subprocess.run(
+                    pipeline, shell=True, capture_output=True, text=True, check=True
+                ).stdout.split()
+            ),
+            rounds=3,
+        )
+
+        print(
+            f"dpkg status: native={native * 1e3:.3f}ms pipeline={shelled * 1e3:.3f}ms"
+        )
+        record_property("dpkg_native_ms", round(native * 1e3, 3))
+        record_property("dpkg_pipeline_ms", round(shelled * 1e3, 3))
+        assert native < shelled
+
+    @pytest.mark.asyncio
+    async def test_async_concurrency(self) -> None:
+        """Test async command execution provides concurrency benefits."""
+        import time
+
+        runner = dot.AsyncCommandRunner(dry_run=False)
+
+        # Commands that each take ~0.1 seconds
+        commands = [f"sleep 0.1 && echo 'cmd{i}'" for i in range(3)]
+
+        # Test sequential vs concurrent execution
+        start_time = time.time()
+        results = await runner.run_many(commands, max_concurrent=3)
+        concurrent_time = time.time() - start_time
+
+        # With proper concurrency, 3 x 0.1s commands should take ~0.1s total
+        # (plus overhead), not 0.3s
+        assert concurrent_time < 0.25  # Allow for overhead
+        assert len(results) == 3
+        assert all(result.success for result in results)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PHASE 1: HIGH PRIORITY TESTS - Platform errors, edge cases
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+class TestPlatformEdgeCases:
+    """Test platform detection error scenarios."""
+
+    def test_wsl_detection_permission_error(self) -> None:
+        """Test WSL detection with permission error."""
+        with unittest.mock.patch(
+            "pathlib.Path.read_text",
+            side_effect=PermissionError("No access"),
+        ):
+            platform_obj = dot.Platform()
+            assert platform_obj._detect_wsl() is False
+
+    def test_wsl_detection_file_not_found(self) -> None:
+        """Test WSL detection with missing file."""
+        with unittest.mock.patch(
+            "pathlib.Path.read_text",
+            side_effect=FileNotFoundError("Not found"),
+        ):
+            platform_obj = dot.Platform()
+            assert platform_obj._detect_wsl() is False
+
+    def test_distro_detection_permission_error(self) -> None:
+        """Test distro detection with permission error."""
+        with unittest.mock.patch(
+            "pathlib.Path.read_text",
+            side_effect=PermissionError("No access"),
+        ):
+            platform_obj = dot.Platform()
+            assert platform_obj._detect_distro() is None
+
+    def test_distro_detection_file_not_found(self) -> None:
+        """Test distro detection with missing os-release."""
+        with unittest.mock.patch(
+            "pathlib.Path.read_text",
+            side_effect=FileNotFoundError("Not found"),
+        ):
+            platform_obj = dot.Platform()
+            assert platform_obj._detect_distro() is None
+
+    def test_arch_package_manager(self) -> None:
+        """Test Arch Linux package manager detection."""
+        platform_obj = dot.Platform()
+        mock_info = dot.SystemInfo(
+            os="linux",
+            hostname="archbox",
+            arch="x86_64",
+            distro="arch",
+            is_linux=True,
+            is_macos=False,
+            is_wsl=False,
+            home=pathlib.Path("/home/user"),
+            user="user",
+        )
+        platform_obj.info = mock_info
+        assert platform_obj.get_package_manager() == "pacman"
+
+    def test_manjaro_package_manager(self) -> None:
+        """Test Manjaro package manager detection."""
+        platform_obj = dot.Platform()
+        mock_info = dot.SystemInfo(
+            os="linux",
+            hostname="manjaro",
+            arch="x86_64",
+            distro="manjaro",
+            is_linux=True,
+            is_macos=False,
+            is_wsl=False,
+            home=pathlib.Path("/home/user"),
+            user="user",
+        )
+        platform_obj.info = mock_info
+        assert platform_obj.get_package_manager() == "pacman"
+
+    def test_unknown_distro_package_manager(self) -> None:
+        """Test package manager for unknown distro."""
+        platform_obj = dot.Platform()
+        mock_info = dot.SystemInfo(
+            os="linux",
+            hostname="unknown",
+            arch="x86_64",
+            distro="gentoo",  # Not in our supported list
+            is_linux=True,
+            is_macos=False,
+            is_wsl=False,
+            home=pathlib.Path("/home/user"),
+            user="user",
+        )
+        platform_obj.info = mock_info
+        assert platform_obj.get_package_manager() is None
+
+
+class TestShellSnippetEdgeCases:
+    """Test shell snippet edge cases."""
+
+    def test_shell_snippet_no_content_no_default(self) -> None:
+        """Test shell snippet with no content and no default."""
+        snippet = dot.ShellSnippet(
+            name="empty",
+            description="Empty snippet",
+            stage=dot.ShellStage.MAIN,
+            # No bash, zsh, fish, or default content
+        )
+        assert snippet.get_content("bash") == ""
+        assert snippet.get_content("zsh") == ""
+        assert snippet.get_content("fish") == ""
+
+
+class TestProvisionerEdgeCases:
+    """Test provisioner edge cases."""
+
+    @pytest.mark.asyncio
+    async def test_provisioner_no_verify_command(self) -> None:
+        """Test provisioner without verify command."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+
+        prov = dot.Provisioner(
+            name="no-verify",
+            description="No verify command",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["tool"]),
+            requires=frozenset(),
+            verify_command="",  # No verify command
+        )
+
+        manager = dot.ProvisionerManager({"no-verify": prov}, runner, platform_obj)
+        is_installed = await manager._is_installed(prov)
+        assert is_installed is False
+
+
+class TestCLIVerboseLogging:
+    """Test CLI verbose logging."""
+
+    @pytest.mark.asyncio
+    async def test_verbose_flag_sets_debug_level(self, monkeypatch) -> None:
+        """Test --verbose flag sets DEBUG level."""
+        test_args = ["dot.py", "--verbose", "status"]
+        monkeypatch.setattr(sys, "argv", test_args)
+
+        with unittest.mock.patch("logging.getLogger") as mock_logger:
+            mock_root_logger = mock_logger.return_value
+            with patch.object(
+                dot.DotfilesApp,
+                "status",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_status:
+                mock_status.return_value = {"test": "status"}
+                await dot.async_main()
+
+            mock_root_logger.setLevel.assert_called_with(logging.DEBUG)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PHASE 2: MEDIUM PRIORITY TESTS - Package managers, binary install, error handling
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+class TestPackageManagerInstallation:
+    """Test different package manager installation methods."""
+
+    @pytest.mark.asyncio
+    async def test_install_via_package_apt(self, tmp_path: pathlib.Path) -> None:
+        """Test package installation via apt."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+
+        # Mock platform to return apt
+        mock_info = dot.SystemInfo(
+            os="linux",
+            hostname="ubuntu",
+            arch="x86_64",
+            distro="ubuntu",
+            is_linux=True,
+            is_macos=False,
+            is_wsl=False,
+            home=pathlib.Path("/home/user"),
+            user="user",
+        )
+        platform_obj.info = mock_info
+
+        prov = dot.Provisioner(
+            name="test-pkg",
+            description="Test package",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.PACKAGE,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+            package_name="test-package",
+        )
+
+        manager = dot.ProvisionerManager(
+            {"test-pkg": prov},
+            runner,
+            platform_obj,
+            apt_updates=dot.AptUpdateCoordinator(runner, root=tmp_path),
+        )
+
+        with patch.object(
+            runner,
+            "run",
+            new_callable=unittest.mock.AsyncMock,
+        ) as mock_run:
+            mock_run.return_value = dot.CommandResult(success=True)
+
+            success = await manager._install_via_package(prov)
+
+            assert success
+            assert mock_run.call_args_list == [
+                unittest.mock.call("sudo apt-get update", check=False, capture=True),
+                unittest.mock.call(
+                    "sudo apt-get install -y test-package",
+                    env=None,
+                    check=False,
+                    capture=True,
+                ),
+            ]
+
+    @pytest.mark.asyncio
+    async def test_install_via_package_brew(self) -> None:
+        """Test package installation via brew."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+
+        # Mock platform to return brew
+        mock_info = dot.SystemInfo(
+            os="darwin",
+            hostname="mac",
+            arch="x86_64",
+            distro=None,
+            is_linux=False,
+            is_macos=True,
+            is_wsl=False,
+            home=pathlib.Path("/Users/user"),
+            user="user",
+        )
+        platform_obj.info = mock_info
+
+        prov = dot.Provisioner(
+            name="test-pkg",
+            description="Test package",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.PACKAGE,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+            package_name="test-package",
+        )
+
+        manager = dot.ProvisionerManager({"test-pkg": prov}, runner, platform_obj)
+
+        with (
+            patch.object(platform_obj, "get_package_manager", return_value="brew"),
+            patch.object(
+                runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            mock_run.return_value = dot.CommandResult(success=True)
+
+            success = await manager._install_via_package(prov)
+
+            assert success
+            mock_run.assert_called_once_with(
+                "brew install test-package",
+                env=None,
+                check=False,
+                capture=True,
+            )
+
+    @pytest.mark.asyncio
+    async def test_install_via_package_dnf(self) -> None:
+        """Test package installation via dnf."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+
+        # Mock platform to return dnf
+        mock_info = dot.SystemInfo(
+            os="linux",
+            hostname="fedora",
+            arch="x86_64",
+            distro="fedora",
+            is_linux=True,
+            is_macos=False,
+            is_wsl=False,
+            home=pathlib.Path("/home/user"),
+            user="user",
+        )
+        platform_obj.info = mock_info
+
+        prov = dot.Provisioner(
+            name="test-pkg",
+            description="Test package",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.PACKAGE,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+        )
+
+        manager = dot.ProvisionerManager({"test-pkg": prov}, runner, platform_obj)
+
+        with patch.object(
+            runner,
+            "run",
+            new_callable=unittest.mock.AsyncMock,
+        ) as mock_run:
+            mock_run.return_value = dot.CommandResult(success=True)
+
+            success = await manager._install_via_package(prov)
+
+            assert success
+            # When no package_name, it uses the provisioner name
+            mock_run.assert_called_once_with(
+                "sudo dnf install -y test-pkg",
+                env=None,
+                check=False,
+                capture=True,
+            )
+
+    @pytest.mark.asyncio
+    async def test_install_via_package_pacman(self) -> None:
+        """Test package installation via pacman."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+
+        # Mock platform to return pacman
+        mock_info = dot.SystemInfo(
+            os="linux",
+            hostname="arch",
+            arch="x86_64",
+            distro="arch",
+            is_linux=True,
+            is_macos=False,
+            is_wsl=False,
+            home=pathlib.Path("/home/user"),
+            user="user",
+        )
+        platform_obj.info = mock_info
+
+        prov = dot.Provisioner(
+            name="test-pkg",
+            description="Test package",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.PACKAGE,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+        )
+
+        manager = dot.ProvisionerManager({"test-pkg": prov}, runner, platform_obj)
+
+        with patch.object(
+            runner,
+            "run",
+            new_callable=unittest.mock.AsyncMock,
+        ) as mock_run:
+            mock_run.return_value = dot.CommandResult(success=True)
+
+            success = await manager._install_via_package(prov)
+
+            assert success
+            mock_run.assert_called_once_with(
+                "sudo pacman -S --noconfirm test-pkg",
+                env=None,
+                check=False,
+                capture=True,
+            )
+
+    @pytest.mark.asyncio
+    async def test_install_via_package_no_manager(self) -> None:
+        """Test package installation with no package manager."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+
+        prov = dot.Provisioner(
+            name="test-pkg",
+            description="Test package",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.PACKAGE,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+        )
+
+        manager = dot.ProvisionerManager({"test-pkg": prov}, runner, platform_obj)
+
+        with patch.object(platform_obj, "get_package_manager", return_value=None):
+            success = await manager._install_via_package(prov)
+            assert not success
+
+    @pytest.mark.asyncio
+    async def test_install_via_package_unsupported_manager(self) -> None:
+        """Test package installation with unsupported package manager."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+
+        prov = dot.Provisioner(
+            name="test-pkg",
+            description="Test package",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.PACKAGE,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+        )
+
+        manager = dot.ProvisionerManager({"test-pkg": prov}, runner, platform_obj)
+
+        with patch.object(platform_obj, "get_package_manager", return_value="zypper"):
+            success = await manager._install_via_package(prov)
+            assert not success
+
+
+class TestBinaryInstallation:
+    """Test binary download installation."""
+
+    @pytest.mark.asyncio
+    async def test_install_via_binary_success(self, tmp_path: pathlib.Path) -> None:
+        """Test binary installation copies the cached download into PATH."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+
+        prov = dot.Provisioner(
+            name="test-bin",
+            description="Test binary",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.BINARY,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+            binary_url="https://example.com/test-bin",
+        )
+
+        manager = dot.ProvisionerManager({"test-bin": prov}, runner, platform_obj)
+        blob = tmp_path / "blobs" / "abc123"
+
+        with (
+            patch.object(manager.downloads, "fetch", return_value=blob) as mock_fetch,
+            patch.object(
+                runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            mock_run.return_value = dot.CommandResult(success=True)
+
+            success = await manager._install_via_binary(prov)
+
+            assert success
+            mock_fetch.assert_called_once_with("https://example.com/test-bin", "")
+            mock_run.assert_called_once_with(
+                f"sudo install -m 0755 {blob} /usr/local/bin/test-bin",
+                env=None,
+                check=False,
+                capture=True,
+            )
+
+    @pytest.mark.asyncio
+    async def test_install_via_binary_no_url(self) -> None:
+        """Test binary installation without URL."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+
+        prov = dot.Provisioner(
+            name="test-bin",
+            description="Test binary",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.BINARY,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+            binary_url="",  # No URL
+        )
+
+        manager = dot.ProvisionerManager({"test-bin": prov}, runner, platform_obj)
+
+        success = await manager._install_via_binary(prov)
+        assert not success
+
+    @pytest.mark.asyncio
+    async def test_install_via_binary_download_fails(self) -> None:
+        """Test binary installation when download fails."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+
+        prov = dot.Provisioner(
+            name="test-bin",
+            description="Test binary",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.BINARY,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+            binary_url="https://example.com/test-bin",
+        )
+
+        manager = dot.ProvisionerManager({"test-bin": prov}, runner, platform_obj)
+
+        with (
+            patch.object(
+                manager.downloads, "fetch", side_effect=OSError("HTTP Error 404")
+            ),
+            patch.object(
+                runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            success = await manager._install_via_binary(prov)
+
+            assert not success
+            mock_run.assert_not_called()  # Nothing to install
+
+    @pytest.mark.asyncio
+    async def test_install_via_binary_checksum_mismatch(self) -> None:
+        """Test binary installation refuses content not matching its digest."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+
+        prov = dot.Provisioner(
+            name="test-bin",
+            description="Test binary",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.BINARY,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+            binary_url="https://example.com/test-bin",
+            binary_sha256="0" * 64,
+        )
+
+        manager = dot.ProvisionerManager({"test-bin": prov}, runner, platform_obj)
+
+        with (
+            patch.object(
+                manager.downloads,
+                "fetch",
+                side_effect=ValueError("Checksum mismatch for test-bin"),
+            ) as mock_fetch,
+            patch.object(
+                runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+        ):
+            success = await manager._install_via_binary(prov)
+
+            assert not success
+            assert success.error == "Checksum mismatch for test-bin"
+            mock_fetch.assert_called_once_with("https://example.com/test-bin", "0" * 64)
+            mock_run.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_install_via_binary_dry_run(self) -> None:
+        """Test dry-run binary installation downloads nothing."""
+        runner = dot.AsyncCommandRunner(dry_run=True)
+        prov = dot.Provisioner(
+            name="test-bin",
+            description="Test binary",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.BINARY,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+            binary_url="https://example.com/test-bin",
+        )
+        manager = dot.ProvisionerManager({"test-bin": prov}, runner, dot.Platform())
+
+        with patch.object(manager.downloads, "fetch") as mock_fetch:
+            success = await manager._install_via_binary(prov)
+
+        assert success
+        mock_fetch.assert_not_called()
+
+
+class _ArtifactHandler(http.server.BaseHTTPRequestHandler):
+    """Serve one artifact with ETag and Range support, recording requests."""
+
+    server: _ArtifactServer
+
+    def do_GET(self) -> None:
+        """Answer conditional and range requests like a static file server."""
+        srv = self.server
+        srv.requests.append(dict(self.headers))
+        if srv.fail:
+            self.send_error(503)
+            return
+        if srv.redirect:
+            self.send_response(302)
+            self.send_header("Location", srv.redirect)
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == srv.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body, status = srv.body, 200
+        range_header = self.headers.get("Range", "")
+        start = 0
+        if range_header and self.headers.get("If-Range") == srv.etag:
+            start = int(range_header.removeprefix("bytes=").rstrip("-"))
+            body, status = srv.body[start:], 206
+        self.send_response(status)
+        self.send_header("ETag", srv.etag)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 206:
+            total = len(srv.body)
+            self.send_header("Content-Range", f"bytes {start}-{total - 1}/{total}")
+        self.end_headers()
+        if srv.truncate is not None:
+            # Promise the whole body but hang up partway through it
+            body = body[: srv.truncate]
+            self.close_connection = True
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: typing.Any) -> None:  # noqa: A002
+        """Keep test output quiet."""
+
+
+class _ArtifactServer(http.server.ThreadingHTTPServer):
+    """Local stand-in for a release download host."""
+
+    def __init__(self, certificate: pathlib.Path | None = None) -> None:
+        super().__init__(("127.0.0.1", 0), _ArtifactHandler)
+        self.body = b"#!/bin/sh\necho tool v1\n" * 500
+        self.etag = '"v1"'
+        self.fail = False
+        self.truncate: int | None = None
+        self.redirect = ""
+        self.requests: list[dict[str, str]] = []
+        self.scheme = "http"
+        self.client_context: ssl.SSLContext | None = None
+        if certificate is not None:
+            server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            server_context.load_cert_chain(
+                certificate / "cert.pem", certificate / "key.pem"
+            )
+            self.socket = server_context.wrap_socket(self.socket, server_side=True)
+            self.scheme = "https"
+            self.client_context = ssl.create_default_context(
+                cafile=certificate / "cert.pem"
+            )
+
+    @property
+    def url(self) -> str:
+        """URL the artifact is served at."""
+        return f"{self.scheme}://127.0.0.1:{self.server_address[1]}/tool"
+
+
+@contextlib.contextmanager
+def _serving(server: _ArtifactServer) -> collections.abc.Iterator[_ArtifactServer]:
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def artifact_server() -> collections.abc.Iterator[_ArtifactServer]:
+    """Run an artifact server on a loopback port for the test."""
+    with _serving(_ArtifactServer()) as server:
+        yield server
+
+
+@pytest.fixture(scope="session")
+def loopback_certificate(
+    tmp_path_factory: pytest.TempPathFactory,
+) -> pathlib.Path:
+    """Create a self-signed certificate for 127.0.0.1."""
+    openssl = shutil.which("openssl")
+    if openssl is None:
+        pytest.skip("openssl not available")
+    directory = tmp_path_factory.mktemp("tls")
+    subprocess.run(
+        [
+            openssl,
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=127.0.0.1",
+            "-addext",
+            "subjectAltName=IP:127.0.0.1",
+            "-keyout",
+            str(directory / "key.pem"),
+            "-out",
+            str(directory / "cert.pem"),
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return directory
+
+
+@pytest.fixture
+def https_artifact_server(
+    loopback_certificate: pathlib.Path,
+) -> collections.abc.Iterator[_ArtifactServer]:
+    """Run an artifact server behind TLS on a loopback port for the test."""
+    with _serving(_ArtifactServer(loopback_certificate)) as server:
+        yield server
+
+
+class TestDownloadCache:
+    """Test the content-addressed BINARY download cache."""
+
+    def test_fetch_stores_content_by_digest(
+        self, tmp_path: pathlib.Path, artifact_server: _ArtifactServer
+    ) -> None:
+        """Test a download lands in a blob named after its sha256."""
+        cache = dot.DownloadCache(tmp_path / "downloads")
+
+        blob = cache.fetch(artifact_server.url)
+
+        digest = hashlib.sha256(artifact_server.body).hexdigest()
+        assert blob == tmp_path / "downloads" / "blobs" / digest
+        assert blob.read_bytes() == artifact_server.body
+        assert not list((tmp_path / "downloads" / "partial").iterdir())
+
+    def test_unchanged_artifact_revalidates_with_etag(
+        self, tmp_path: pathlib.Path, artifact_server: _ArtifactServer
+    ) -> None:
+        """Test a second fetch sends If-None-Match and reuses the blob on 304."""
+        cache = dot.DownloadCache(tmp_path / "downloads")
+        first = cache.fetch(artifact_server.url)
+
+        second = dot.DownloadCache(tmp_path / "downloads").fetch(artifact_server.url)
+
+        assert second == first
+        assert artifact_server.requests[1]["If-None-Match"] == '"v1"'
+
+    def test_changed_artifact_is_downloaded_again(
+        self, tmp_path: pathlib.Path, artifact_server: _ArtifactServer
+    ) -> None:
+        """Test a new ETag replaces what the URL points at."""
+        cache = dot.DownloadCache(tmp_path / "downloads")
+        first = cache.fetch(artifact_server.url)
+        artifact_server.body = b"tool v2\n"
+        artifact_server.etag = '"v2"'
+
+        second = cache.fetch(artifact_server.url)
+
+        assert second != first
+        assert second.read_bytes() == b"tool v2\n"
+
+    def test_truncated_download_is_not_cached(
+        self, tmp_path: pathlib.Path, artifact_server: _ArtifactServer
+    ) -> None:
+        """Test a body shorter than Content-Length is kept partial and resumed."""
+        cache = dot.DownloadCache(tmp_path / "downloads")
+        artifact_server.truncate = 3000
+
+        with pytest.raises(ConnectionError, match="Incomplete download"):
+            cache.fetch(artifact_server.url)
+
+        assert cache.pinned(artifact_server.url) == ""
+        assert not (tmp_path / "downloads" / "blobs").exists()
+        (partial,) = (tmp_path / "downloads" / "partial").glob("*.part")
+        assert partial.stat().st_size == 3000
+
+        artifact_server.truncate = None
+        blob = cache.fetch(artifact_server.url)
+
+        assert blob.read_bytes() == artifact_server.body
+        assert artifact_server.requests[-1]["Range"] == "bytes=3000-"
+
+    def test_declared_digest_hit_skips_network(
+        self, tmp_path: pathlib.Path, artifact_server: _ArtifactServer
+    ) -> None:
+        """Test a cached blob matching the declared sha256 needs no request."""
+        cache = dot.DownloadCache(tmp_path / "downloads")
+        digest = hashlib.sha256(artifact_server.body).hexdigest()
+        blob = cache.fetch(artifact_server.url, digest)
+
+        assert cache.fetch(artifact_server.url, digest.upper()) == blob
+        assert len(artifact_server.requests) == 1
+
+    def test_checksum_mismatch_is_rejected(
+        self, tmp_path: pathlib.Path, artifact_server: _ArtifactServer
+    ) -> None:
+        """Test content not matching the declared sha256 is not cached."""
+        cache = dot.DownloadCache(tmp_path / "downloads")
+
+        with pytest.raises(ValueError, match="Checksum mismatch"):
+            cache.fetch(artifact_server.url, "0" * 64)
+
+        assert not (tmp_path / "downloads" / "blobs").exists()
+        assert not list((tmp_path / "downloads" / "partial").iterdir())
+
+    def test_interrupted_download_resumes_with_range(
+        self, tmp_path: pathlib.Path, artifact_server: _ArtifactServer
+    ) -> None:
+        """Test a partial file continues from its size and hashes as a whole."""
+        import json
+
+        url = artifact_server.url
+        key = hashlib.sha256(url.encode()).hexdigest()
+        partial_dir = tmp_path / "downloads" / "partial"
+        partial_dir.mkdir(parents=True)
+        (partial_dir / f"{key}.part").write_bytes(artifact_server.body[:1000])
+        (partial_dir / f"{key}.json").write_text(json.dumps({"validator": '"v1"'}))
+        digest = hashlib.sha256(artifact_server.body).hexdigest()
+
+        blob = dot.DownloadCache(tmp_path / "downloads").fetch(url, digest)
+
+        assert blob.read_bytes() == artifact_server.body
+        assert artifact_server.requests[0]["Range"] == "bytes=1000-"
+        assert artifact_server.requests[0]["If-Range"] == '"v1"'
+
+    def test_stale_partial_restarts_from_scratch(
+        self, tmp_path: pathlib.Path, artifact_server: _ArtifactServer
+    ) -> None:
+        """Test a partial from an older representation is overwritten."""
+        import json
+
+        url = artifact_server.url
+        key = hashlib.sha256(url.encode()).hexdigest()
+        partial_dir = tmp_path / "downloads" / "partial"
+        partial_dir.mkdir(parents=True)
+        (partial_dir / f"{key}.part").write_bytes(b"old bytes")
+        (partial_dir / f"{key}.json").write_text(json.dumps({"validator": '"v0"'}))
+
+        blob = dot.DownloadCache(tmp_path / "downloads").fetch(url)
+
+        assert blob.read_bytes() == artifact_server.body
+
+    def test_unreachable_server_falls_back_to_cached_copy(
+        self,
+        tmp_path: pathlib.Path,
+        artifact_server: _ArtifactServer,
+        caplog: pytest.LogCaptureFixture,
+    ) -> None:
+        """Test revalidation errors reuse the last good download."""
+        cache = dot.DownloadCache(tmp_path / "downloads")
+        blob = cache.fetch(artifact_server.url)
+        artifact_server.fail = True
+
+        with caplog.at_level(logging.WARNING):
+            assert cache.fetch(artifact_server.url) == blob
+
+        assert "using cached copy" in caplog.text
+
+    def test_unreachable_server_without_cache_raises(
+        self, tmp_path: pathlib.Path, artifact_server: _ArtifactServer
+    ) -> None:
+        """Test a failed first download surfaces as OSError."""
+        artifact_server.fail = True
+
+        with pytest.raises(OSError, match="503"):
+            dot.DownloadCache(tmp_path / "downloads").fetch(artifact_server.url)
+
+    def test_default_root_is_xdg_cache(self) -> None:
+        """Test the cache lives under the XDG cache dir by default."""
+        assert dot.DownloadCache().root == dot._xdg_cache_dir() / "downloads"
+
+
+class TestPrefetch:
+    """Test artifact prefetch ahead of BINARY and SCRIPT installs."""
+
+    @staticmethod
+    def _manager() -> dot.ProvisionerManager:
+        provisioners = {
+            "tool": dot.Provisioner(
+                name="tool",
+                description="Binary tool",
+                type=dot.ProvisionerType.PROVISIONER,
+                install_method=dot.InstallMethod.BINARY,
+                provides=frozenset(["tool"]),
+                requires=frozenset(),
+                binary_url="https://example.com/tool",
+                binary_sha256="ab" * 32,
+            ),
+            "rust": dot.Provisioner(
+                name="rust",
+                description="Rust",
+                type=dot.ProvisionerType.PROVISIONER,
+                install_method=dot.InstallMethod.SCRIPT,
+                provides=frozenset(["cargo"]),
+                requires=frozenset(),
+                install_script="curl -sSf https://sh.rustup.rs | sh -s -- -y",
+            ),
+            "sheldon": dot.Provisioner(
+                name="sheldon",
+                description="Plugin manager",
+                type=dot.ProvisionerType.ENHANCEMENT,
+                install_method=dot.InstallMethod.SCRIPT,
+                provides=frozenset(["sheldon"]),
+                requires=frozenset(["cargo"]),
+                install_script="cargo install sheldon",
+            ),
+            "starship": dot.Provisioner(
+                name="starship",
+                description="Prompt",
+                type=dot.ProvisionerType.ENHANCEMENT,
+                install_method=dot.InstallMethod.SCRIPT,
+                provides=frozenset(["starship"]),
+                requires=frozenset(),
+                install_script="curl -sS https://starship.rs/install.sh | sh",
+            ),
+        }
+        return dot.ProvisionerManager(
+            provisioners, dot.AsyncCommandRunner(dry_run=False), dot.Platform()
+        )
+
+    @pytest.mark.parametrize(
+        ("script", "expected"),
+        [
+            (
+                "curl --proto '=https' --tlsv1.2 -sSf https://sh.rustup.rs"
+                " | sh -s -- -y",
+                ("https://sh.rustup.rs", "sh -s -- -y"),
+            ),
+            ("curl https://mise.run | sh", ("https://mise.run", "sh")),
+            ("curl -fsSL https://x.dev/i.sh | bash", ("https://x.dev/i.sh", "bash")),
+            ("cargo install sheldon", None),
+            ("curl https://a.dev/i.sh | sh && rm -rf ~/tmp", None),
+            ("curl https://a.dev/i.sh | sh || true", None),
+            ("curl $URL | sh", None),
+            ("wget -qO- https://a.dev/i.sh | sh", None),
+            ("curl https://a.dev/i.sh | python3", None),
+        ],
+    )
+    def test_remote_installer(
+        self, script: str, expected: tuple[str, str] | None
+    ) -> None:
+        """Test only lone `curl URL | sh` pipelines are recognized."""
+        assert dot._remote_installer(script) == expected
+
+    @pytest.mark.asyncio
+    async def test_prefetch_downloads_missing_artifacts(
+        self, tmp_path: pathlib.Path
+    ) -> None:
+        """Test binaries and remote installers of missing tools are fetched."""
+        manager = self._manager()
+
+        def fetch(url: str, sha256: str) -> pathlib.Path:
+            return tmp_path / url.rsplit("/", 1)[-1]
+
+        with (
+            patch.object(
+                manager,
+                "_is_installed",
+                side_effect=lambda prov: prov.name == "starship",
+            ),
+            patch.object(manager.downloads, "fetch", side_effect=fetch) as mock_fetch,
+        ):
+            await manager.prefetch()
+
+        assert sorted(call.args for call in mock_fetch.call_args_list) == [
+            ("https://example.com/tool", "ab" * 32),
+            ("https://sh.rustup.rs", ""),
+        ]
+        assert manager.prefetched == {
+            "https://example.com/tool": tmp_path / "tool",
+            "https://sh.rustup.rs": tmp_path / "sh.rustup.rs",
+        }
+
+    @pytest.mark.asyncio
+    async def test_prefetch_respects_filter(self) -> None:
+        """Test only artifacts of the selected type are fetched."""
+        manager = self._manager()
+
+        with (
+            patch.object(manager, "_is_installed", return_value=False),
+            patch.object(manager.downloads, "fetch") as mock_fetch,
+        ):
+            await manager.prefetch(dot.ProvisionerType.ENHANCEMENT)
+
+        mock_fetch.assert_called_once_with("https://starship.rs/install.sh", "")
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "error",
+        [OSError("unreachable"), http.client.IncompleteRead(b"#!/bin/sh", 100)],
+    )
+    async def test_prefetch_failures_are_left_to_install(
+        self, error: Exception
+    ) -> None:
+        """Test a failed prefetch records nothing and raises nothing."""
+        manager = self._manager()
+
+        with (
+            patch.object(manager, "_is_installed", return_value=False),
+            patch.object(manager.downloads, "fetch", side_effect=error),
+        ):
+            await manager.prefetch()
+
+        assert manager.prefetched == {}
+
+    @pytest.mark.asyncio
+    async def test_script_install_uses_prefetched_installer(
+        self, tmp_path: pathlib.Path
+    ) -> None:
+        """Test a prefetched installer is piped from disk instead of curl."""
+        manager = self._manager()
+        installer = tmp_path / "rustup init.sh"
+        manager.prefetched["https://sh.rustup.rs"] = installer
+
+        with patch.object(
+            manager.runner, "run", new_callable=unittest.mock.AsyncMock
+        ) as mock_run:
+            mock_run.return_value = dot.CommandResult(success=True)
+            assert await manager._install_via_script(manager.provisioners["rust"])
+
+        assert mock_run.call_args.args[0] == f"sh -s -- -y < '{installer}'"
+
+    @pytest.mark.asyncio
+    async def test_script_install_offline_is_not_piped(
+        self, caplog: pytest.LogCaptureFixture
+    ) -> None:
+        """Test an unpinned installer that can't be cached isn't piped from curl."""
+        manager = self._manager()
+
+        with (
+            patch.object(manager.downloads, "fetch", side_effect=OSError("offline")),
+            patch.object(
+                manager.runner, "run", new_callable=unittest.mock.AsyncMock
+            ) as mock_run,
+        ):
+            result = await manager._install_via_script(manager.provisioners["rust"])
+
+        assert not result
+        assert result.error == "offline"
+        mock_run.assert_not_called()
+        assert "Failed to download installer for rust" in caplog.text
+
+    @pytest.mark.asyncio
+    async def test_binary_install_uses_prefetched_blob(
+        self, tmp_path: pathlib.Path
+    ) -> None:
+        """Test a prefetched binary is installed without another fetch."""
+        manager = self._manager()
+        manager.prefetched["https://example.com/tool"] = tmp_path / "blob"
+
+        with (
+            patch.object(manager.downloads, "fetch") as mock_fetch,
+            patch.object(
+                manager.runner, "run", new_callable=unittest.mock.AsyncMock
+            ) as mock_run,
+        ):
+            mock_run.return_value = dot.CommandResult(success=True)
+            assert await manager._install_via_binary(manager.provisioners["tool"])
+
+        mock_fetch.assert_not_called()
+        assert mock_run.call_args.args[0] == (
+            f"sudo install -m 0755 {tmp_path / 'blob'} /usr/local/bin/tool"
+        )
+
+    @pytest.mark.asyncio
+    async def test_provision_overlaps_prefetch_with_system_packages(
+        self,
+        tmp_path: pathlib.Path,
+        sample_toml_config: str,
+        temp_home: pathlib.Path,
+    ) -> None:
+        """Test prefetch runs while system packages are still installing."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+        app = dot.DotfilesApp(config_path=config_path)
+        prefetch_started = asyncio.Event()
+
+        async def prefetch(filter_type: dot.ProvisionerType | None) -> None:
+            prefetch_started.set()
+
+        async def install_system_packages(
+            *args: typing.Any, **kwargs: typing.Any
+        ) -> dot.Result:
+            # Completes only if prefetch started before packages finished
+            await asyncio.wait_for(prefetch_started.wait(), timeout=5)
+            return dot.Result.ok()
+
+        with (
+            patch.object(app.provisioner_manager, "prefetch", side_effect=prefetch),
+            patch.object(
+                app.provisioner_manager,
+                "mergeable_packages",
+                new_callable=unittest.mock.AsyncMock,
+                return_value=[],
+            ),
+            patch.object(
+                app, "_install_system_packages", side_effect=install_system_packages
+            ),
+            patch.object(
+                app.provisioner_manager,
+                "provision_all",
+                new_callable=unittest.mock.AsyncMock,
+                return_value={},
+            ),
+            patch.object(
+                app,
+                "install_language_packages",
+                new_callable=unittest.mock.AsyncMock,
+                return_value={},
+            ),
+        ):
+            result = await app.provision()
+
+        assert result
+
+    @pytest.mark.asyncio
+    async def test_provision_cancels_prefetch_when_packages_fail(
+        self,
+        tmp_path: pathlib.Path,
+        sample_toml_config: str,
+        temp_home: pathlib.Path,
+    ) -> None:
+        """Test a system package failure doesn't wait on downloads."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(sample_toml_config)
+        app = dot.DotfilesApp(config_path=config_path)
+        started, cancelled = asyncio.Event(), asyncio.Event()
+
+        async def prefetch(filter_type: dot.ProvisionerType | None) -> None:
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def install_system_packages(
+            *args: typing.Any, **kwargs: typing.Any
+        ) -> dot.Result:
+            await started.wait()
+            return dot.Result.fail(error="apt broke")
+
+        with (
+            patch.object(app.provisioner_manager, "prefetch", side_effect=prefetch),
+            patch.object(
+                app.provisioner_manager,
+                "mergeable_packages",
+                new_callable=unittest.mock.AsyncMock,
+                return_value=[],
+            ),
+            patch.object(
+                app, "_install_system_packages", side_effect=install_system_packages
+            ),
+        ):
+            result = await asyncio.wait_for(app.provision(), timeout=5)
+            await asyncio.sleep(0)
+
+        assert not result
+        assert cancelled.is_set()
+
+
+class TestPinnedInstallers:
+    """Test `curl | sh` installers run from a hash-pinned local copy."""
+
+    @staticmethod
+    def _manager(
+        tmp_path: pathlib.Path, server: _ArtifactServer, sha256: str = ""
+    ) -> dot.ProvisionerManager:
+        prov = dot.Provisioner(
+            name="tool",
+            description="Tool",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["tool"]),
+            requires=frozenset(),
+            install_script=f"curl -fsSL {server.url} | sh -s -- --yes",
+            script_sha256=sha256,
+        )
+        return dot.ProvisionerManager(
+            {"tool": prov},
+            dot.AsyncCommandRunner(dry_run=False),
+            dot.Platform(),
+            downloads=dot.DownloadCache(
+                tmp_path / "downloads", context=server.client_context
+            ),
+        )
+
+    @staticmethod
+    async def _install(manager: dot.ProvisionerManager) -> tuple[dot.Result, str]:
+        with patch.object(
+            manager.runner, "run", new_callable=unittest.mock.AsyncMock
+        ) as mock_run:
+            mock_run.return_value = dot.CommandResult(success=True)
+            result = await manager._install_via_script(manager.provisioners["tool"])
+        return result, mock_run.call_args.args[0] if mock_run.called else ""
+
+    def test_script_sha256_parsed_from_toml(self, tmp_path: pathlib.Path) -> None:
+        """Test `script_sha256` is read from the provisioner table."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(
+            """
+[provisioners.mise]
+description = "mise"
+install_method = "script"
+install_script = "curl https://mise.run | sh"
+script_sha256 = "abc123"
+provides = ["mise"]
+"""
+        )
+
+        config = dot.ConfigLoader(config_path, use_cache=False).load()
+
+        assert config.provisioners["mise"].script_sha256 == "abc123"
+
+    @pytest.mark.asyncio
+    async def test_pinned_installer_runs_without_network(
+        self, tmp_path: pathlib.Path, https_artifact_server: _ArtifactServer
+    ) -> None:
+        """Test a cached installer matching its pin needs no request."""
+        digest = hashlib.sha256(https_artifact_server.body).hexdigest()
+        first, _ = await self._install(
+            self._manager(tmp_path, https_artifact_server, digest)
+        )
+
+        result, command = await self._install(
+            self._manager(tmp_path, https_artifact_server, digest)
+        )
+
+        assert first
+        assert result
+        blob = tmp_path / "downloads" / "blobs" / digest
+        assert command == f"sh -s -- --yes < {blob}"
+        assert len(https_artifact_server.requests) == 1
+
+    @pytest.mark.asyncio
+    async def test_pinned_installer_mismatch_is_not_run(
+        self, tmp_path: pathlib.Path, https_artifact_server: _ArtifactServer
+    ) -> None:
+        """Test an installer not matching its pin fails without running."""
+        manager = self._manager(tmp_path, https_artifact_server, "0" * 64)
+
+        result, command = await self._install(manager)
+
+        assert not result
+        assert "Refusing to run installer for tool: Checksum mismatch" in result.error
+        assert command == ""
+
+    @pytest.mark.asyncio
+    async def test_pinned_installer_unreachable_is_not_piped(
+        self, tmp_path: pathlib.Path, https_artifact_server: _ArtifactServer
+    ) -> None:
+        """Test a pinned installer is never piped unverified from curl."""
+        https_artifact_server.fail = True
+        manager = self._manager(tmp_path, https_artifact_server, "0" * 64)
+
+        result, command = await self._install(manager)
+
+        assert not result
+        assert command == ""
+
+    @pytest.mark.asyncio
+    async def test_upstream_change_is_reported(
+        self,
+        tmp_path: pathlib.Path,
+        https_artifact_server: _ArtifactServer,
+        caplog: pytest.LogCaptureFixture,
+    ) -> None:
+        """Test an unpinned installer whose content changed is reported."""
+        old = hashlib.sha256(https_artifact_server.body).hexdigest()
+        await self._install(self._manager(tmp_path, https_artifact_server))
+        https_artifact_server.body = b"echo v2\n"
+        https_artifact_server.etag = '"v2"'
+        new = hashlib.sha256(b"echo v2\n").hexdigest()
+
+        with caplog.at_level(logging.WARNING):
+            result, command = await self._install(
+                self._manager(tmp_path, https_artifact_server)
+            )
+
+        assert result
+        assert command.endswith(new)
+        assert f"changed upstream (sha256 {old} -> {new})" in caplog.text
+
+    @pytest.mark.asyncio
+    async def test_unchanged_installer_revalidates_quietly(
+        self,
+        tmp_path: pathlib.Path,
+        https_artifact_server: _ArtifactServer,
+        caplog: pytest.LogCaptureFixture,
+    ) -> None:
+        """Test an unpinned, unchanged installer costs a 304 and no warning."""
+        await self._install(self._manager(tmp_path, https_artifact_server))
+
+        with caplog.at_level(logging.WARNING):
+            result, _ = await self._install(
+                self._manager(tmp_path, https_artifact_server)
+            )
+
+        assert result
+        assert "changed upstream" not in caplog.text
+        assert https_artifact_server.requests[-1]["If-None-Match"] == '"v1"'
+
+    @pytest.mark.asyncio
+    async def test_dry_run_downloads_nothing(
+        self, tmp_path: pathlib.Path, https_artifact_server: _ArtifactServer
+    ) -> None:
+        """Test dry runs leave the installer script untouched."""
+        manager = self._manager(tmp_path, https_artifact_server)
+        manager.runner = dot.AsyncCommandRunner(dry_run=True)
+
+        result, command = await self._install(manager)
+
+        assert result
+        assert command == f"curl -fsSL {https_artifact_server.url} | sh -s -- --yes"
+        assert https_artifact_server.requests == []
+
+    @pytest.mark.asyncio
+    async def test_truncated_installer_is_not_run(
+        self, tmp_path: pathlib.Path, https_artifact_server: _ArtifactServer
+    ) -> None:
+        """Test an unpinned installer cut off mid-body is neither run nor piped."""
+        https_artifact_server.truncate = 100
+
+        result, command = await self._install(
+            self._manager(tmp_path, https_artifact_server)
+        )
+
+        assert not result
+        assert "Incomplete download" in result.error
+        assert command == ""
+
+    @pytest.mark.asyncio
+    async def test_redirect_to_http_is_not_run(
+        self,
+        tmp_path: pathlib.Path,
+        https_artifact_server: _ArtifactServer,
+        artifact_server: _ArtifactServer,
+    ) -> None:
+        """Test an installer redirected off https is refused, not downloaded."""
+        https_artifact_server.redirect = artifact_server.url
+
+        result, command = await self._install(
+            self._manager(tmp_path, https_artifact_server)
+        )
+
+        assert not result
+        assert "redirected to non-https" in result.error
+        assert command == ""
+        assert not (tmp_path / "downloads" / "blobs").exists()
+
+    @pytest.mark.asyncio
+    async def test_http_installer_is_refused(
+        self, tmp_path: pathlib.Path, artifact_server: _ArtifactServer
+    ) -> None:
+        """Test an installer served over plain http is neither fetched nor run."""
+        result, command = await self._install(self._manager(tmp_path, artifact_server))
+
+        assert not result
+        assert "Refusing to run installer for tool over http://" in result.error
+        assert command == ""
+        assert artifact_server.requests == []
+
+
+class TestAsyncCommandRunnerErrors:
+    """Test AsyncCommandRunner error handling."""
+
+    @pytest.mark.asyncio
+    async def test_raise_process_error(self) -> None:
+        """Test _raise_process_error method."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+
+        result = dot.CommandResult(
+            success=False,
+            stdout="output",
+            stderr="error",
+            returncode=1,
+            duration=0.1,
+        )
+
+        with pytest.raises(subprocess.CalledProcessError) as exc_info:
+            runner._raise_process_error(result, "test command")
+
+        assert exc_info.value.returncode == 1
+        assert exc_info.value.cmd == "test command"
+        assert exc_info.value.stdout == "output"
+        assert exc_info.value.stderr == "error"
+
+    @pytest.mark.asyncio
+    async def test_run_with_check_raises_on_failure(self) -> None:
+        """Test that run with check=True raises on failure."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+
+        with pytest.raises(subprocess.CalledProcessError):
+            await runner.run("exit 1", check=True, shell=True)
 
+    @pytest.mark.asyncio
+    async def test_run_handles_generic_exception(self) -> None:
+        """Test run handles generic exceptions."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
 
-class TestPerformance:
-    """Test performance improvements from v2.0."""
+        with unittest.mock.patch(
+            "asyncio.create_subprocess_shell",
+            side_effect=RuntimeError("Test error"),
+        ):
+            result = await runner.run("echo test", shell=True)
 
-    def test_staged_shell_performance(self) -> None:
-        """Test that staged shell generation provides performance benefits."""
-        platform_obj = dot.Platform()
-        generator = dot.ShellGenerator(platform_obj)
+            assert result.success is False
+            assert "Test error" in result.stderr
+            assert result.returncode == -1
 
-        # Create snippets for different stages
-        early_snippets = [
-            dot.ShellSnippet(
-                name="env_var",
-                description="Environment variable",
-                stage=dot.ShellStage.EARLY,
-                default="export EARLY_VAR=1",
-            ),
-        ]
+    @pytest.mark.asyncio
+    async def test_run_many_with_stop_on_error(self) -> None:
+        """Test run_many stops on error when requested."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
 
-        heavy_snippets = [
-            dot.ShellSnippet(
-                name="heavy_tool",
-                description="Heavy tool initialization",
-                stage=dot.ShellStage.LATE,
-                default="eval $(heavy_tool init)",
-            ),
+        # Use 'false' command which reliably returns exit code 1
+        commands = [
+            ["sh", "-c", "echo ok"],
+            ["sh", "-c", "false"],
+            ["sh", "-c", "echo should_not_run"],
         ]
+        results = await runner.run_many(commands, stop_on_error=True)
 
-        all_snippets = early_snippets + heavy_snippets
+        # Should only have 2 results (stopped after failure)
+        assert len(results) == 2
+        assert results[0].success is True
+        assert results[1].success is False
 
-        # Early stage should only include early snippets
-        early_init = generator.generate_staged_init("zsh", all_snippets, "early")
-        assert "EARLY_VAR" in early_init
-        assert "heavy_tool" not in early_init
+    @pytest.mark.asyncio
+    async def test_run_many_exception_handling(self) -> None:
+        """Test run_many handles exceptions in task group."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
 
-        # This demonstrates the performance benefit - shells can load just
-        # critical early-stage initialization for faster startup
-        assert len(early_init) < len(
-            generator.generate_staged_init("zsh", all_snippets),
+        with patch.object(runner, "run", side_effect=RuntimeError("Test error")):
+            results = await runner.run_many(["echo test"])
+
+            # Should return empty results on exception
+            assert results == []
+
+
+class TestConfigLoaderErrors:
+    """Test ConfigLoader error handling."""
+
+    def test_config_loader_os_error(self, tmp_path) -> None:
+        """Test ConfigLoader handles OS errors."""
+        config_path = tmp_path / "unreadable.toml"
+        config_path.write_text("[test]")
+        config_path.chmod(0o000)  # Remove read permissions
+
+        loader = dot.ConfigLoader(config_path)
+
+        with pytest.raises(OSError):
+            loader.load()
+
+        # Cleanup
+        config_path.chmod(0o644)
+
+    def test_provisioner_parsing_skips_non_dict(self, tmp_path) -> None:
+        """Test provisioner parsing skips non-dict entries."""
+        config_path = tmp_path / "test.toml"
+        config_path.write_text("""
+[provisioners]
+valid = { description = "Valid", provides = ["test"] }
+invalid = "not a dict"
+""")
+
+        loader = dot.ConfigLoader(config_path)
+        config = loader.load()
+
+        # Should only have the valid provisioner
+        assert "valid" in config.provisioners
+        assert "invalid" not in config.provisioners
+
+    def test_provisioner_parsing_unknown_type(self, tmp_path) -> None:
+        """Test provisioner parsing with unknown type falls back to default."""
+        config_path = tmp_path / "test.toml"
+        config_path.write_text("""
+[provisioners.test]
+description = "Test"
+type = "unknown_type"
+provides = ["test"]
+""")
+
+        loader = dot.ConfigLoader(config_path)
+        config = loader.load()
+
+        # Should use default type
+        assert config.provisioners["test"].type == dot.ProvisionerType.PROVISIONER
+
+    def test_provisioner_parsing_unknown_install_method(self, tmp_path) -> None:
+        """Test provisioner parsing with unknown install method defaults."""
+        config_path = tmp_path / "test.toml"
+        config_path.write_text("""
+[provisioners.test]
+description = "Test"
+install_method = "unknown_method"
+provides = ["test"]
+""")
+
+        loader = dot.ConfigLoader(config_path)
+        config = loader.load()
+
+        # Should use default install method
+        assert config.provisioners["test"].install_method == dot.InstallMethod.SCRIPT
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PHASE 3: LOW PRIORITY TESTS - Cleanup, symlinks, CLI edge cases
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+class TestCleanupFunctionality:
+    """Test cleanup functionality."""
+
+    @pytest.mark.asyncio
+    async def test_cleanup_removes_files_and_dirs(self, temp_home) -> None:
+        """Test cleanup removes files and directories."""
+        # Create test files and directories
+        test_file = temp_home / "test.tmp"
+        test_file.write_text("test")
+        test_dir = temp_home / "test_dir"
+        test_dir.mkdir()
+        (test_dir / "nested.txt").write_text("nested")
+
+        app = dot.DotfilesApp(dry_run=False)
+        app.platform.info = dot.SystemInfo(
+            os="linux",
+            hostname="test",
+            arch="x86_64",
+            distro="ubuntu",
+            is_linux=True,
+            is_macos=False,
+            is_wsl=False,
+            home=temp_home,
+            user="test",
         )
 
+        # Run cleanup with patterns
+        success = await app.cleanup(["*.tmp", "test_dir"])
+
+        assert success
+        assert not test_file.exists()
+        assert not test_dir.exists()
+
     @pytest.mark.asyncio
-    async def test_async_concurrency(self) -> None:
-        """Test async command execution provides concurrency benefits."""
-        import time
+    async def test_cleanup_no_patterns(self, temp_home) -> None:
+        """Test cleanup with no patterns configured."""
+        app = dot.DotfilesApp(dry_run=False)
+        app.config.cleanup_patterns = []
 
-        runner = dot.AsyncCommandRunner(dry_run=False)
+        success = await app.cleanup()
 
-        # Commands that each take ~0.1 seconds
-        commands = [f"sleep 0.1 && echo 'cmd{i}'" for i in range(3)]
+        assert success  # Should succeed with no patterns
+
+    @pytest.mark.asyncio
+    async def test_cleanup_dry_run(self, temp_home) -> None:
+        """Test cleanup in dry run mode."""
+        test_file = temp_home / "test.tmp"
+        test_file.write_text("test")
+
+        app = dot.DotfilesApp(dry_run=True)
+        app.platform.info = dot.SystemInfo(
+            os="linux",
+            hostname="test",
+            arch="x86_64",
+            distro="ubuntu",
+            is_linux=True,
+            is_macos=False,
+            is_wsl=False,
+            home=temp_home,
+            user="test",
+        )
+
+        success = await app.cleanup(["*.tmp"])
+
+        assert success
+        assert test_file.exists()  # Should not be removed in dry run
+
+    @pytest.mark.asyncio
+    async def test_cleanup_handles_errors(self, temp_home) -> None:
+        """Test cleanup handles errors gracefully."""
+        app = dot.DotfilesApp(dry_run=False)
+        app.platform.info = dot.SystemInfo(
+            os="linux",
+            hostname="test",
+            arch="x86_64",
+            distro="ubuntu",
+            is_linux=True,
+            is_macos=False,
+            is_wsl=False,
+            home=temp_home,
+            user="test",
+        )
+
+        with unittest.mock.patch(
+            "pathlib.Path.glob",
+            side_effect=PermissionError("No access"),
+        ):
+            success = await app.cleanup(["*.tmp"])
+
+            assert not success  # Should fail on error
+
+
+class TestSymlinkEdgeCases:
+    """Test symlink creation edge cases."""
+
+    @pytest.mark.asyncio
+    async def test_symlink_already_correct(self, temp_home) -> None:
+        """Test symlink that's already correct is skipped."""
+        source = temp_home / "source.txt"
+        source.write_text("content")
+        dest = temp_home / "dest.txt"
+        dest.symlink_to(source)
+
+        app = dot.DotfilesApp(dry_run=False)
+
+        # Should succeed without modification
+        success = await app._create_symlink(source, dest)
+
+        assert success
+        assert dest.is_symlink()
+        assert dest.resolve() == source.resolve()
+
+    @pytest.mark.asyncio
+    async def test_symlink_replaces_directory(self, temp_home) -> None:
+        """Test symlink replaces existing directory."""
+        source = temp_home / "source"
+        source.mkdir()
+        (source / "file.txt").write_text("content")
 
-        # Test sequential vs concurrent execution
-        start_time = time.time()
-        results = await runner.run_many(commands, max_concurrent=3)
-        concurrent_time = time.time() - start_time
+        dest = temp_home / "dest"
+        dest.mkdir()
+        (dest / "old.txt").write_text("old")
 
-        # With proper concurrency, 3 x 0.1s commands should take ~0.1s total
-        # (plus overhead), not 0.3s
-        assert concurrent_time < 0.25  # Allow for overhead
-        assert len(results) == 3
-        assert all(result.success for result in results)
+        app = dot.DotfilesApp(dry_run=False)
 
+        success = await app._create_symlink(source, dest)
 
-# ═══════════════════════════════════════════════════════════════════════════════
-# PHASE 1: HIGH PRIORITY TESTS - Platform errors, edge cases
-# ═══════════════════════════════════════════════════════════════════════════════
+        assert success
+        assert dest.is_symlink()
+        assert dest.resolve() == source.resolve()
 
+    @pytest.mark.asyncio
+    async def test_symlink_handles_os_error(self, temp_home) -> None:
+        """Test symlink handles OS errors."""
+        source = temp_home / "source.txt"
+        source.write_text("content")
+        dest = temp_home / "readonly" / "dest.txt"
 
-class TestPlatformEdgeCases:
-    """Test platform detection error scenarios."""
+        app = dot.DotfilesApp(dry_run=False)
 
-    def test_wsl_detection_permission_error(self) -> None:
-        """Test WSL detection with permission error."""
         with unittest.mock.patch(
-            "pathlib.Path.read_text",
-            side_effect=PermissionError("No access"),
+            "pathlib.Path.symlink_to",
+            side_effect=OSError("Permission denied"),
         ):
-            platform_obj = dot.Platform()
-            assert platform_obj._detect_wsl() is False
+            success = await app._create_symlink(source, dest)
 
-    def test_wsl_detection_file_not_found(self) -> None:
-        """Test WSL detection with missing file."""
-        with unittest.mock.patch(
-            "pathlib.Path.read_text",
-            side_effect=FileNotFoundError("Not found"),
-        ):
-            platform_obj = dot.Platform()
-            assert platform_obj._detect_wsl() is False
+            assert not success
 
-    def test_distro_detection_permission_error(self) -> None:
-        """Test distro detection with permission error."""
-        with unittest.mock.patch(
-            "pathlib.Path.read_text",
-            side_effect=PermissionError("No access"),
-        ):
-            platform_obj = dot.Platform()
-            assert platform_obj._detect_distro() is None
 
-    def test_distro_detection_file_not_found(self) -> None:
-        """Test distro detection with missing os-release."""
-        with unittest.mock.patch(
-            "pathlib.Path.read_text",
-            side_effect=FileNotFoundError("Not found"),
-        ):
-            platform_obj = dot.Platform()
-            assert platform_obj._detect_distro() is None
+class TestStatusEdgeCases:
+    """Test status command edge cases."""
 
-    def test_arch_package_manager(self) -> None:
-        """Test Arch Linux package manager detection."""
-        platform_obj = dot.Platform()
-        mock_info = dot.SystemInfo(
-            os="linux",
-            hostname="archbox",
-            arch="x86_64",
-            distro="arch",
-            is_linux=True,
-            is_macos=False,
-            is_wsl=False,
-            home=pathlib.Path("/home/user"),
-            user="user",
-        )
-        platform_obj.info = mock_info
-        assert platform_obj.get_package_manager() == "pacman"
+    @pytest.mark.asyncio
+    async def test_status_file_not_symlink(self, temp_home) -> None:
+        """Test status detects file that's not a symlink."""
+        app = dot.DotfilesApp(dry_run=False)
+        app.config.source = temp_home / "dotfiles"
+        app.config.source.mkdir()
 
-    def test_manjaro_package_manager(self) -> None:
-        """Test Manjaro package manager detection."""
-        platform_obj = dot.Platform()
-        mock_info = dot.SystemInfo(
+        # Create source file
+        source = app.config.source / "test.txt"
+        source.write_text("source")
+
+        # Create regular file at destination
+        dest = temp_home / "test.txt"
+        dest.write_text("not a symlink")
+
+        app.config.files[dot.DestPath(pathlib.Path("test.txt"))] = dot.TemplateDef(
+            source=dot.SourcePath(pathlib.Path("test.txt")),
+        )
+        app.platform.info = dot.SystemInfo(
             os="linux",
-            hostname="manjaro",
+            hostname="test",
             arch="x86_64",
-            distro="manjaro",
+            distro="ubuntu",
             is_linux=True,
             is_macos=False,
             is_wsl=False,
-            home=pathlib.Path("/home/user"),
-            user="user",
+            home=temp_home,
+            user="test",
         )
-        platform_obj.info = mock_info
-        assert platform_obj.get_package_manager() == "pacman"
 
-    def test_unknown_distro_package_manager(self) -> None:
-        """Test package manager for unknown distro."""
-        platform_obj = dot.Platform()
-        mock_info = dot.SystemInfo(
+        status = await app.status()
+
+        assert status["dotfiles"]["test.txt"] == "not_symlink"
+
+    @pytest.mark.asyncio
+    async def test_status_symlink_wrong_target(self, temp_home) -> None:
+        """Test status detects symlink with wrong target."""
+        app = dot.DotfilesApp(dry_run=False)
+        app.config.source = temp_home / "dotfiles"
+        app.config.source.mkdir()
+
+        # Create source file
+        source = app.config.source / "test.txt"
+        source.write_text("source")
+
+        # Create wrong file and symlink to it
+        wrong = temp_home / "wrong.txt"
+        wrong.write_text("wrong")
+        dest = temp_home / "test.txt"
+        dest.symlink_to(wrong)
+
+        app.config.files[dot.DestPath(pathlib.Path("test.txt"))] = dot.TemplateDef(
+            source=dot.SourcePath(pathlib.Path("test.txt")),
+        )
+        app.platform.info = dot.SystemInfo(
             os="linux",
-            hostname="unknown",
+            hostname="test",
             arch="x86_64",
-            distro="gentoo",  # Not in our supported list
+            distro="ubuntu",
             is_linux=True,
             is_macos=False,
             is_wsl=False,
-            home=pathlib.Path("/home/user"),
-            user="user",
+            home=temp_home,
+            user="test",
         )
-        platform_obj.info = mock_info
-        assert platform_obj.get_package_manager() is None
 
+        status = await app.status()
 
-class TestShellSnippetEdgeCases:
-    """Test shell snippet edge cases."""
+        assert status["dotfiles"]["test.txt"] == "wrong_target"
 
-    def test_shell_snippet_no_content_no_default(self) -> None:
-        """Test shell snippet with no content and no default."""
-        snippet = dot.ShellSnippet(
-            name="empty",
-            description="Empty snippet",
-            stage=dot.ShellStage.MAIN,
-            # No bash, zsh, fish, or default content
+
+class TestConcurrentStatus:
+    """Test that status fans out verify probes."""
+
+    @staticmethod
+    def app_with_probes(tmp_path, commands: dict[str, str]) -> dot.DotfilesApp:
+        """Build an app whose provisioners verify with *commands*."""
+        app = dot.DotfilesApp(config_path=tmp_path / "missing.toml")
+        app.config.provisioners = {
+            name: dot.Provisioner(
+                name=name,
+                description=name,
+                type=dot.ProvisionerType.PROVISIONER,
+                install_method=dot.InstallMethod.SCRIPT,
+                provides=frozenset([name]),
+                requires=frozenset(),
+                verify_command=command,
+            )
+            for name, command in commands.items()
+        }
+        return app
+
+    @pytest.mark.asyncio
+    async def test_probes_overlap(self, tmp_path) -> None:
+        """Test status costs about the slowest probe, not their sum."""
+        app = self.app_with_probes(tmp_path, {f"tool{i}": "true" for i in range(6)})
+        active = 0
+        peak = 0
+
+        async def slow_probe(provisioner, env=None, *, timeout=None):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.05)
+            active -= 1
+            return provisioner.name != "tool3"
+
+        with patch.object(
+            app.provisioner_manager,
+            "_is_installed",
+            side_effect=slow_probe,
+        ):
+            status = await app.status(max_concurrent=4)
+
+        assert peak == 4
+        assert status["provisioners"]["tool0"]["installed"] is True
+        assert status["provisioners"]["tool3"]["installed"] is False
+        assert list(status["provisioners"]) == [f"tool{i}" for i in range(6)]
+
+    @pytest.mark.asyncio
+    async def test_probe_timeout_kills_command(self, tmp_path) -> None:
+        """Test a hung verify command is killed and reported not installed."""
+        app = self.app_with_probes(tmp_path, {"hung": "sleep 3", "ok": "true"})
+
+        start = time.monotonic()
+        status = await app.status(probe_timeout=0.3)
+        elapsed = time.monotonic() - start
+
+        assert elapsed < 2.5
+        assert status["provisioners"]["hung"]["installed"] is False
+        assert status["provisioners"]["ok"]["installed"] is True
+
+    @pytest.mark.asyncio
+    async def test_timeout_kills_grandchildren(self, tmp_path) -> None:
+        """Test a timed-out shell command takes its children down with it."""
+        marker = tmp_path / "finished"
+        runner = dot.AsyncCommandRunner()
+
+        result = await runner.run(
+            f"sleep 1 && touch {marker}",
+            check=False,
+            timeout=0.2,
         )
-        assert snippet.get_content("bash") == ""
-        assert snippet.get_content("zsh") == ""
-        assert snippet.get_content("fish") == ""
+        await asyncio.sleep(1.2)
+
+        assert not result.success
+        assert "Timed out" in result.stderr
+        assert not marker.exists()
+
+
+class TestCLIEdgeCases:
+    """Test CLI edge cases."""
+
+    def test_unknown_command(self, monkeypatch) -> None:
+        """Test handling of unknown commands."""
+        test_args = ["dot.py", "unknown-command"]
+        monkeypatch.setattr(sys, "argv", test_args)
+
+        # argparse exits with code 2 for invalid arguments
+        with pytest.raises(SystemExit) as exc_info:
+            dot.main()
+
+        assert exc_info.value.code == 2
+
+    @pytest.mark.asyncio
+    async def test_cleanup_command(self, monkeypatch, temp_home) -> None:
+        """Test cleanup command execution."""
+        test_args = ["dot.py", "cleanup", "*.tmp"]
+        monkeypatch.setattr(sys, "argv", test_args)
+
+        with patch.object(
+            dot.DotfilesApp,
+            "cleanup",
+            new_callable=unittest.mock.AsyncMock,
+        ) as mock_cleanup:
+            mock_cleanup.return_value = dot.CleanupResult.ok()
+
+            exit_code = await dot.async_main()
+
+            assert exit_code == 0
+            mock_cleanup.assert_called_once_with(["*.tmp"])
+
+    def test_main_keyboard_interrupt(self) -> None:
+        """Test main handles KeyboardInterrupt."""
+
+        def mock_run(coro):
+            coro.close()  # Close coroutine to prevent "never awaited" warning
+            raise KeyboardInterrupt
+
+        with unittest.mock.patch("asyncio.run", side_effect=mock_run):
+            exit_code = dot.main()
+
+            assert exit_code == 130  # Standard Unix exit code for SIGINT
+
+    def test_main_generic_exception(self) -> None:
+        """Test main handles generic exceptions."""
+
+        def mock_run(coro):
+            coro.close()  # Close coroutine to prevent "never awaited" warning
+            raise RuntimeError("Test error")
+
+        with unittest.mock.patch("asyncio.run", side_effect=mock_run):
+            exit_code = dot.main()
+
+            assert exit_code == 1
+
+    @pytest.mark.asyncio
+    async def test_no_command_shows_help(
+        self, monkeypatch: typing.Any, capsys: typing.Any
+    ) -> None:
+        """Test no command shows help."""
+        test_args = ["dot.py"]
+        monkeypatch.setattr(sys, "argv", test_args)
+
+        await dot.async_main()
 
+        captured = capsys.readouterr()
+        assert "usage:" in captured.out.lower()
 
-class TestProvisionerEdgeCases:
-    """Test provisioner edge cases."""
+
+class TestProvisionerInstallErrors:
+    """Test provisioner installation error cases."""
 
     @pytest.mark.asyncio
-    async def test_provisioner_no_verify_command(self) -> None:
-        """Test provisioner without verify command."""
+    async def test_install_script_no_script(self) -> None:
+        """Test install via script with no script provided."""
         runner = dot.AsyncCommandRunner(dry_run=False)
         platform_obj = dot.Platform()
 
         prov = dot.Provisioner(
-            name="no-verify",
-            description="No verify command",
+            name="no-script",
+            description="No script",
             type=dot.ProvisionerType.PROVISIONER,
             install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["tool"]),
+            provides=frozenset(["test"]),
             requires=frozenset(),
-            verify_command="",  # No verify command
+            install_script="",  # No script
         )
 
-        manager = dot.ProvisionerManager({"no-verify": prov}, runner, platform_obj)
-        is_installed = await manager._is_installed(prov)
-        assert is_installed is False
-
+        manager = dot.ProvisionerManager({"no-script": prov}, runner, platform_obj)
 
-class TestCLIVerboseLogging:
-    """Test CLI verbose logging."""
+        success = await manager._install_via_script(prov)
+        assert not success
 
     @pytest.mark.asyncio
-    async def test_verbose_flag_sets_debug_level(self, monkeypatch) -> None:
-        """Test --verbose flag sets DEBUG level."""
-        test_args = ["dot.py", "--verbose", "status"]
-        monkeypatch.setattr(sys, "argv", test_args)
+    async def test_provision_missing_requirements(
+        self,
+        config_with_provisioners,
+    ) -> None:
+        """Test provisioning fails when requirements are missing."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+        all_provisioners = config_with_provisioners.provisioners
 
-        with unittest.mock.patch("logging.getLogger") as mock_logger:
-            mock_root_logger = mock_logger.return_value
-            with patch.object(
-                dot.DotfilesApp,
-                "status",
-                new_callable=unittest.mock.AsyncMock,
-            ) as mock_status:
-                mock_status.return_value = {"test": "status"}
-                await dot.async_main()
+        manager = dot.ProvisionerManager(all_provisioners, runner, platform_obj)
 
-            mock_root_logger.setLevel.assert_called_with(logging.DEBUG)
+        # Mock that requirements are not met and provisioner is not installed
+        with (
+            patch.object(
+                manager.resolver,
+                "check_requirements",
+                return_value=(False, ["curl"]),
+            ),
+            patch.object(manager, "_is_installed", return_value=False),
+        ):
+            results = await manager.provision_all()
 
+            # Should return dict of results with rust failed
+            assert isinstance(results, dict)
+            assert "rust" in results
+            assert not results["rust"]
 
-# ═══════════════════════════════════════════════════════════════════════════════
-# PHASE 2: MEDIUM PRIORITY TESTS - Package managers, binary install, error handling
-# ═══════════════════════════════════════════════════════════════════════════════
 
+class TestProvisionerDependencies:
+    """Test provisioner dependency handling."""
 
-class TestPackageManagerInstallation:
-    """Test different package manager installation methods."""
+    def test_build_essential_install_order(self) -> None:
+        """Test that build_essential has proper priority for installation order."""
+        # Create provisioners
+        build_essential = dot.Provisioner(
+            name="build_essential",
+            description="Essential build tools",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.PACKAGE,
+            provides=frozenset(["cc", "gcc", "make", "pkg-config", "openssl"]),
+            requires=frozenset(),
+            package_name="build-essential",
+            priority=1,  # Lower priority = installed first
+            verify_command="cc --version",
+        )
 
-    @pytest.mark.asyncio
-    async def test_install_via_package_apt(self) -> None:
-        """Test package installation via apt."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
+        rust = dot.Provisioner(
+            name="rust",
+            description="Rust toolchain",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["cargo", "rustc"]),
+            requires=frozenset(["curl"]),
+            priority=3,
+        )
 
-        # Mock platform to return apt
-        mock_info = dot.SystemInfo(
-            os="linux",
-            hostname="ubuntu",
-            arch="x86_64",
-            distro="ubuntu",
-            is_linux=True,
-            is_macos=False,
-            is_wsl=False,
-            home=pathlib.Path("/home/user"),
-            user="user",
+        sheldon = dot.Provisioner(
+            name="sheldon",
+            description="Zsh plugin manager",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["sheldon"]),
+            requires=frozenset(["cargo", "cc"]),  # Requires both cargo and cc
+            priority=4,
         )
-        platform_obj.info = mock_info
 
-        prov = dot.Provisioner(
-            name="test-pkg",
-            description="Test package",
+        provisioners = {
+            "build_essential": build_essential,
+            "rust": rust,
+            "sheldon": sheldon,
+        }
+
+        resolver = dot.DependencyResolver(provisioners)
+
+        # Get install order - should be sorted by priority
+        install_order = resolver.get_install_order()
+
+        # build_essential (priority 1) should come first
+        # rust (priority 3) should come second
+        # sheldon (priority 4) should come third
+        assert install_order.index("build_essential") == 0
+        assert install_order.index("rust") == 1
+        assert install_order.index("sheldon") == 2
+
+    def test_sheldon_requires_cc_from_build_essential(self) -> None:
+        """Test that sheldon's cc requirement is provided by build_essential."""
+        build_essential = dot.Provisioner(
+            name="build_essential",
+            description="Essential build tools",
             type=dot.ProvisionerType.PROVISIONER,
             install_method=dot.InstallMethod.PACKAGE,
-            provides=frozenset(["test"]),
+            provides=frozenset(["cc", "gcc", "make", "pkg-config", "openssl"]),
             requires=frozenset(),
-            package_name="test-package",
+            priority=1,
         )
 
-        manager = dot.ProvisionerManager({"test-pkg": prov}, runner, platform_obj)
+        sheldon = dot.Provisioner(
+            name="sheldon",
+            description="Zsh plugin manager",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["sheldon"]),
+            requires=frozenset(["cargo", "cc"]),
+            priority=4,
+        )
 
-        with patch.object(
-            runner,
-            "run",
-            new_callable=unittest.mock.AsyncMock,
-        ) as mock_run:
-            mock_run.return_value = dot.CommandResult(success=True)
+        provisioners = {"build_essential": build_essential, "sheldon": sheldon}
+        resolver = dot.DependencyResolver(provisioners)
 
-            success = await manager._install_via_package(prov)
+        # Check that cc is in the provides map
+        assert "cc" in resolver._provides_map
+        assert resolver._provides_map["cc"] == "build_essential"
 
-            assert success
-            mock_run.assert_called_once_with(
-                "sudo apt-get update && sudo apt-get install -y test-package",
-                env=None,
-                check=False,
-                capture=True,
-            )
+        # Find who provides cc for sheldon
+        provider = resolver.find_provider("cc")
+        assert provider == "build_essential"
 
     @pytest.mark.asyncio
-    async def test_install_via_package_brew(self) -> None:
-        """Test package installation via brew."""
+    async def test_provision_build_essential_enables_sheldon_install(self) -> None:
+        """Test that build-essential installation enables sheldon to compile."""
         runner = dot.AsyncCommandRunner(dry_run=False)
         platform_obj = dot.Platform()
 
-        # Mock platform to return brew
-        mock_info = dot.SystemInfo(
-            os="darwin",
-            hostname="mac",
-            arch="x86_64",
-            distro=None,
-            is_linux=False,
-            is_macos=True,
-            is_wsl=False,
-            home=pathlib.Path("/Users/user"),
-            user="user",
-        )
-        platform_obj.info = mock_info
-
-        prov = dot.Provisioner(
-            name="test-pkg",
-            description="Test package",
+        # Create provisioners with proper dependencies
+        build_essential = dot.Provisioner(
+            name="build_essential",
+            description="Essential build tools",
             type=dot.ProvisionerType.PROVISIONER,
             install_method=dot.InstallMethod.PACKAGE,
-            provides=frozenset(["test"]),
+            provides=frozenset(["cc", "gcc", "make", "pkg-config", "openssl"]),
             requires=frozenset(),
-            package_name="test-package",
+            package_name="build-essential",
+            priority=1,
+            verify_command="cc --version",
+        )
+
+        rust = dot.Provisioner(
+            name="rust",
+            description="Rust toolchain",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["cargo", "rustc"]),
+            requires=frozenset(["curl"]),
+            priority=2,
+            install_script=(
+                "curl --proto '=https' --tlsv1.2 -sSf "
+                "https://sh.rustup.rs | sh -s -- -y"
+            ),
+            verify_command="cargo --version",
+        )
+
+        sheldon = dot.Provisioner(
+            name="sheldon",
+            description="Zsh plugin manager",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["sheldon"]),
+            requires=frozenset(["cargo", "cc"]),
+            install_script="cargo install sheldon",
+            priority=3,
+            verify_command="sheldon --version",
         )
 
-        manager = dot.ProvisionerManager({"test-pkg": prov}, runner, platform_obj)
+        provisioners = {
+            "build_essential": build_essential,
+            "rust": rust,
+            "sheldon": sheldon,
+        }
+        manager = dot.ProvisionerManager(provisioners, runner, platform_obj)
+
+        # Track installation order
+        install_order = []
+
+        async def mock_run(cmd, *args, **kwargs):
+            # Track installation order
+            if "build-essential" in cmd:
+                install_order.append("build_essential")
+            elif "rustup.rs" in cmd:
+                install_order.append("rust")
+            elif "cargo install sheldon" in cmd:
+                install_order.append("sheldon")
+            return dot.CommandResult(success=True)
+
+        # Mock shutil.which to simulate curl is available but not cc/cargo initially
+        def mock_which(tool) -> str | None:
+            if tool == "curl":
+                return "/usr/bin/curl"
+            # After build_essential is "installed", cc is available
+            if tool in {"cc", "gcc", "make"} and "build_essential" in install_order:
+                return f"/usr/bin/{tool}"
+            # After rust is "installed", cargo is available
+            if tool in {"cargo", "rustc"} and "rust" in install_order:
+                return f"/home/user/.cargo/bin/{tool}"
+            return None
 
         with (
-            patch.object(platform_obj, "get_package_manager", return_value="brew"),
+            patch.object(runner, "run", side_effect=mock_run),
+            patch.object(manager, "_is_installed", return_value=False),
+            patch("shutil.which", side_effect=mock_which),
+            # The rustup installer runs from its cached copy
             patch.object(
-                runner,
-                "run",
-                new_callable=unittest.mock.AsyncMock,
-            ) as mock_run,
+                manager.downloads,
+                "fetch",
+                return_value=pathlib.Path("/downloads/sh.rustup.rs"),
+            ),
         ):
-            mock_run.return_value = dot.CommandResult(success=True)
+            results = await manager.provision_all()
 
-            success = await manager._install_via_package(prov)
+        # All should succeed in the right order
+        assert all(r.success for r in results.values())
+        assert set(results.keys()) == {"build_essential", "rust", "sheldon"}
+
+        # Verify installation order
+        assert install_order == ["build_essential", "rust", "sheldon"]
 
-            assert success
-            mock_run.assert_called_once_with(
-                "brew install test-package",
-                env=None,
-                check=False,
-                capture=True,
-            )
+
+class TestProvisionerPathHandling:
+    """Test PATH handling between provisioner installations."""
 
     @pytest.mark.asyncio
-    async def test_install_via_package_dnf(self) -> None:
-        """Test package installation via dnf."""
+    async def test_detect_path_additions(self, tmp_path) -> None:
+        """Test detection of new PATH entries after installation."""
         runner = dot.AsyncCommandRunner(dry_run=False)
         platform_obj = dot.Platform()
 
-        # Mock platform to return dnf
-        mock_info = dot.SystemInfo(
-            os="linux",
-            hostname="fedora",
-            arch="x86_64",
-            distro="fedora",
-            is_linux=True,
-            is_macos=False,
-            is_wsl=False,
-            home=pathlib.Path("/home/user"),
-            user="user",
-        )
-        platform_obj.info = mock_info
-
+        # Create a provisioner that provides cargo
         prov = dot.Provisioner(
-            name="test-pkg",
-            description="Test package",
+            name="rust",
+            description="Rust",
             type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.PACKAGE,
-            provides=frozenset(["test"]),
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["cargo", "rustc"]),
             requires=frozenset(),
         )
 
-        manager = dot.ProvisionerManager({"test-pkg": prov}, runner, platform_obj)
+        # Create the expected directory
+        cargo_bin = tmp_path / ".cargo" / "bin"
+        cargo_bin.mkdir(parents=True)
 
-        with patch.object(
-            runner,
-            "run",
-            new_callable=unittest.mock.AsyncMock,
-        ) as mock_run:
-            mock_run.return_value = dot.CommandResult(success=True)
+        with patch.dict(os.environ, {"HOME": str(tmp_path)}):
+            manager = dot.ProvisionerManager({"rust": prov}, runner, platform_obj)
 
-            success = await manager._install_via_package(prov)
+            # Detect PATH additions
+            paths = await manager._detect_path_additions(prov)
 
-            assert success
-            # When no package_name, it uses the provisioner name
-            mock_run.assert_called_once_with(
-                "sudo dnf install -y test-pkg",
-                env=None,
-                check=False,
-                capture=True,
-            )
+            assert str(cargo_bin) in paths
 
     @pytest.mark.asyncio
-    async def test_install_via_package_pacman(self) -> None:
-        """Test package installation via pacman."""
+    async def test_path_updated_between_provisioners(
+        self,
+        tmp_path,
+        monkeypatch,
+    ) -> None:
+        """Test that PATH is updated after provisioner installs to new location."""
         runner = dot.AsyncCommandRunner(dry_run=False)
         platform_obj = dot.Platform()
 
-        # Mock platform to return pacman
-        mock_info = dot.SystemInfo(
-            os="linux",
-            hostname="arch",
-            arch="x86_64",
-            distro="arch",
-            is_linux=True,
-            is_macos=False,
-            is_wsl=False,
-            home=pathlib.Path("/home/user"),
-            user="user",
+        # Create mock provisioners
+        rust = dot.Provisioner(
+            name="rust",
+            description="Rust toolchain",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["cargo", "rustc"]),
+            requires=frozenset(),
+            install_script=(
+                f"mkdir -p {tmp_path}/.cargo/bin && "
+                f"echo '#!/bin/sh\necho mock cargo' > {tmp_path}/.cargo/bin/cargo && "
+                f"chmod +x {tmp_path}/.cargo/bin/cargo"
+            ),
+            priority=3,
         )
-        platform_obj.info = mock_info
 
-        prov = dot.Provisioner(
-            name="test-pkg",
-            description="Test package",
+        sheldon = dot.Provisioner(
+            name="sheldon",
+            description="Plugin manager",
             type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.PACKAGE,
-            provides=frozenset(["test"]),
-            requires=frozenset(),
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["sheldon"]),
+            requires=frozenset(["cargo"]),
+            install_script="cargo --version",  # Should find the mock cargo
+            priority=4,
         )
 
-        manager = dot.ProvisionerManager({"test-pkg": prov}, runner, platform_obj)
+        provisioners = {"rust": rust, "sheldon": sheldon}
 
-        with patch.object(
-            runner,
-            "run",
-            new_callable=unittest.mock.AsyncMock,
-        ) as mock_run:
-            mock_run.return_value = dot.CommandResult(success=True)
+        # Mock home directory and clean PATH
+        monkeypatch.setenv("HOME", str(tmp_path))
+        monkeypatch.setenv("PATH", "/usr/bin:/bin")
 
-            success = await manager._install_via_package(prov)
+        manager = dot.ProvisionerManager(provisioners, runner, platform_obj)
 
-            assert success
-            mock_run.assert_called_once_with(
-                "sudo pacman -S --noconfirm test-pkg",
-                env=None,
-                check=False,
-                capture=True,
-            )
+        # Mock _is_installed to return False for both
+        with patch.object(manager, "_is_installed", return_value=False):
+            # Run provisioning
+            results = await manager.provision_all()
+
+        # Both should succeed if PATH handling works
+        assert results["rust"]
+        assert results["sheldon"]
 
     @pytest.mark.asyncio
-    async def test_install_via_package_no_manager(self) -> None:
-        """Test package installation with no package manager."""
+    async def test_environment_passed_to_install_commands(self) -> None:
+        """Test that updated environment is passed to installation commands."""
         runner = dot.AsyncCommandRunner(dry_run=False)
         platform_obj = dot.Platform()
 
-        prov = dot.Provisioner(
-            name="test-pkg",
-            description="Test package",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.PACKAGE,
-            provides=frozenset(["test"]),
-            requires=frozenset(),
-        )
-
-        manager = dot.ProvisionerManager({"test-pkg": prov}, runner, platform_obj)
-
-        with patch.object(platform_obj, "get_package_manager", return_value=None):
-            success = await manager._install_via_package(prov)
-            assert not success
+        # Track environments passed to run()
+        environments = []
 
-    @pytest.mark.asyncio
-    async def test_install_via_package_unsupported_manager(self) -> None:
-        """Test package installation with unsupported package manager."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
+        async def mock_run(cmd, **kwargs):
+            if kwargs.get("env"):
+                environments.append(kwargs["env"].get("PATH", ""))
+            return dot.CommandResult(success=True)
 
-        prov = dot.Provisioner(
-            name="test-pkg",
-            description="Test package",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.PACKAGE,
-            provides=frozenset(["test"]),
-            requires=frozenset(),
-        )
+        with patch.object(runner, "run", side_effect=mock_run):
+            prov1 = dot.Provisioner(
+                name="tool1",
+                description="Tool 1",
+                type=dot.ProvisionerType.PROVISIONER,
+                install_method=dot.InstallMethod.SCRIPT,
+                provides=frozenset(["tool1"]),
+                requires=frozenset(),
+                install_script="echo installing tool1",
+                priority=1,
+            )
 
-        manager = dot.ProvisionerManager({"test-pkg": prov}, runner, platform_obj)
+            prov2 = dot.Provisioner(
+                name="tool2",
+                description="Tool 2",
+                type=dot.ProvisionerType.PROVISIONER,
+                install_method=dot.InstallMethod.SCRIPT,
+                provides=frozenset(["tool2"]),
+                requires=frozenset(["tool1"]),
+                install_script="echo installing tool2",
+                priority=2,
+            )
 
-        with patch.object(platform_obj, "get_package_manager", return_value="zypper"):
-            success = await manager._install_via_package(prov)
-            assert not success
+            manager = dot.ProvisionerManager(
+                {"tool1": prov1, "tool2": prov2},
+                runner,
+                platform_obj,
+            )
 
+            # Mock _is_installed and _detect_path_additions
+            with (
+                patch.object(manager, "_is_installed", return_value=False),
+                patch.object(
+                    manager,
+                    "_detect_path_additions",
+                    return_value=["/new/path"],
+                ),
+            ):
+                await manager.provision_all()
 
-class TestBinaryInstallation:
-    """Test binary download installation."""
+            # Should have called run with environments
+            assert len(environments) >= 2
+            # Second call should have updated PATH
+            if len(environments) >= 2:
+                assert "/new/path" in environments[1]
 
     @pytest.mark.asyncio
-    async def test_install_via_binary_success(self) -> None:
-        """Test successful binary installation."""
+    async def test_path_additions_with_wildcards(self, tmp_path) -> None:
+        """Test PATH detection with wildcard patterns (e.g., ruby gems)."""
         runner = dot.AsyncCommandRunner(dry_run=False)
         platform_obj = dot.Platform()
 
+        # Create a provisioner that provides gem
         prov = dot.Provisioner(
-            name="test-bin",
-            description="Test binary",
+            name="ruby",
+            description="Ruby",
             type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.BINARY,
-            provides=frozenset(["test"]),
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["gem"]),
             requires=frozenset(),
-            binary_url="https://example.com/test-bin",
         )
 
-        manager = dot.ProvisionerManager({"test-bin": prov}, runner, platform_obj)
+        # Create ruby gem directories with version
+        gem_path = tmp_path / ".gem" / "ruby" / "3.0.0" / "bin"
+        gem_path.mkdir(parents=True)
 
-        with patch.object(
-            runner,
-            "run",
-            new_callable=unittest.mock.AsyncMock,
-        ) as mock_run:
-            # All commands succeed
-            mock_run.return_value = dot.CommandResult(success=True)
+        with patch.dict(os.environ, {"HOME": str(tmp_path)}):
+            manager = dot.ProvisionerManager({"ruby": prov}, runner, platform_obj)
 
-            success = await manager._install_via_binary(prov)
+            # Detect PATH additions
+            paths = await manager._detect_path_additions(prov)
 
-            assert success
-            assert mock_run.call_count == 3
-            mock_run.assert_any_call(
-                "curl -L https://example.com/test-bin -o /tmp/test-bin",
-                env=None,
-                check=False,
-                capture=True,
-            )
-            mock_run.assert_any_call(
-                "chmod +x /tmp/test-bin",
-                env=None,
-                check=False,
-                capture=True,
-            )
-            mock_run.assert_any_call(
-                "sudo mv /tmp/test-bin /usr/local/bin/",
-                env=None,
-                check=False,
-                capture=True,
-            )
+            # Should find the versioned gem bin directory
+            assert any("3.0.0/bin" in path for path in paths)
 
     @pytest.mark.asyncio
-    async def test_install_via_binary_no_url(self) -> None:
-        """Test binary installation without URL."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
+    async def test_dry_run_does_not_update_path(self) -> None:
+        """Test that dry run mode doesn't update PATH."""
+        runner = dot.AsyncCommandRunner(dry_run=True)
         platform_obj = dot.Platform()
 
         prov = dot.Provisioner(
-            name="test-bin",
-            description="Test binary",
+            name="test",
+            description="Test",
             type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.BINARY,
+            install_method=dot.InstallMethod.SCRIPT,
             provides=frozenset(["test"]),
             requires=frozenset(),
-            binary_url="",  # No URL
+            install_script="echo test",
         )
 
-        manager = dot.ProvisionerManager({"test-bin": prov}, runner, platform_obj)
+        manager = dot.ProvisionerManager({"test": prov}, runner, platform_obj)
 
-        success = await manager._install_via_binary(prov)
-        assert not success
+        # Track if _detect_path_additions is called
+        detect_called = False
+
+        async def mock_detect(prov):
+            nonlocal detect_called
+            detect_called = True
+            return ["/some/path"]
+
+        with (
+            patch.object(manager, "_is_installed", return_value=False),
+            patch.object(manager, "_detect_path_additions", side_effect=mock_detect),
+        ):
+            results = await manager.provision_all(dry_run=True)
+
+        # Should succeed but not call path detection in dry run
+        assert results["test"]
+        assert not detect_called
 
     @pytest.mark.asyncio
-    async def test_install_via_binary_download_fails(self) -> None:
-        """Test binary installation when download fails."""
+    async def test_multiple_path_patterns_for_single_tool(self, tmp_path) -> None:
+        """Test tools with multiple possible PATH locations."""
         runner = dot.AsyncCommandRunner(dry_run=False)
         platform_obj = dot.Platform()
 
+        # npm can install to multiple locations
         prov = dot.Provisioner(
-            name="test-bin",
-            description="Test binary",
+            name="npm",
+            description="NPM",
             type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.BINARY,
-            provides=frozenset(["test"]),
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["npm"]),
             requires=frozenset(),
-            binary_url="https://example.com/test-bin",
         )
 
-        manager = dot.ProvisionerManager({"test-bin": prov}, runner, platform_obj)
+        # Create both possible npm paths
+        npm_global = tmp_path / ".npm-global" / "bin"
+        npm_packages = tmp_path / ".npm-packages" / "bin"
+        npm_global.mkdir(parents=True)
+        npm_packages.mkdir(parents=True)
 
-        with patch.object(
-            runner,
-            "run",
-            new_callable=unittest.mock.AsyncMock,
-        ) as mock_run:
-            # Download fails
-            mock_run.return_value = dot.CommandResult(success=False)
+        with patch.dict(os.environ, {"HOME": str(tmp_path)}):
+            manager = dot.ProvisionerManager({"npm": prov}, runner, platform_obj)
 
-            success = await manager._install_via_binary(prov)
+            # Detect PATH additions
+            paths = await manager._detect_path_additions(prov)
 
-            assert not success
-            mock_run.assert_called_once()  # Only the download attempt
+            # Should find both npm paths
+            assert str(npm_global) in paths
+            assert str(npm_packages) in paths
 
-    @pytest.mark.asyncio
-    async def test_install_via_binary_chmod_fails(self) -> None:
-        """Test binary installation when chmod fails."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
 
+class TestVerificationCache:
+    """Test the persistent cache of successful verify commands."""
+
+    @pytest.fixture
+    def tool(
+        self,
+        tmp_path: pathlib.Path,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> pathlib.Path:
+        """Put a verify target on PATH that counts its invocations."""
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        tool = bin_dir / "dot-fake-tool"
+        tool.write_text(f'#!/bin/sh\necho run >> "{tmp_path}/calls"\n')
+        tool.chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bin_dir}:/usr/bin:/bin")
+        return tool
+
+    @staticmethod
+    def manager(cache: dot.VerificationCache) -> dot.ProvisionerManager:
+        """Build a manager with one provisioner verified by dot-fake-tool."""
         prov = dot.Provisioner(
-            name="test-bin",
-            description="Test binary",
+            name="fake",
+            description="Fake",
             type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.BINARY,
-            provides=frozenset(["test"]),
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["dot-fake-tool"]),
             requires=frozenset(),
-            binary_url="https://example.com/test-bin",
+            verify_command="dot-fake-tool --version",
+        )
+        return dot.ProvisionerManager(
+            {"fake": prov},
+            dot.AsyncCommandRunner(dry_run=False),
+            dot.Platform(),
+            cache,
         )
 
-        manager = dot.ProvisionerManager({"test-bin": prov}, runner, platform_obj)
+    def calls(self, tool: pathlib.Path) -> int:
+        """Count how often the fake tool ran."""
+        calls = tool.parent.parent / "calls"
+        return calls.read_text().count("run") if calls.exists() else 0
+
+    @pytest.mark.parametrize(
+        "command",
+        [
+            "dot-fake-tool --version | grep 1",
+            "dot-fake-tool $HOME",
+            "test -f ~/.fzf",
+            "FOO=1 dot-fake-tool",
+            "dot-no-such-tool-xyz --version",
+        ],
+    )
+    def test_uncacheable_commands(self, tool, command) -> None:
+        """Test shell syntax, test(1) and unknown binaries are not cached."""
+        assert dot.VerificationCache().key(command) is None
+
+    def test_key_tracks_binary_and_path(self, tool, monkeypatch) -> None:
+        """Test the key changes when the binary or PATH changes."""
+        cache = dot.VerificationCache()
+        command = "dot-fake-tool --version && sh --version"
+        before = cache.key(command)
+
+        tool.write_text(tool.read_text() + "# upgraded\n")
+        replaced = cache.key(command)
+        monkeypatch.setenv("PATH", f"{tool.parent}:/bin:/usr/bin")
+
+        assert before is not None
+        assert len({before, replaced, cache.key(command)}) == 3
 
-        with patch.object(
-            runner,
-            "run",
-            new_callable=unittest.mock.AsyncMock,
-        ) as mock_run:
-            # Download succeeds, chmod fails
-            mock_run.side_effect = [
-                dot.CommandResult(success=True),  # curl
-                dot.CommandResult(success=False),  # chmod
-            ]
+    @pytest.mark.asyncio
+    async def test_repeat_verify_spawns_nothing(self, tool, tmp_path) -> None:
+        """Test a cached success skips the verify command across instances."""
+        path = tmp_path / "verify.json"
+        prov = self.manager(dot.VerificationCache(path)).provisioners["fake"]
 
-            success = await manager._install_via_binary(prov)
+        assert await self.manager(dot.VerificationCache(path))._is_installed(prov)
+        assert await self.manager(dot.VerificationCache(path))._is_installed(prov)
 
-            assert not success
-            assert mock_run.call_count == 2
+        assert self.calls(tool) == 1
 
+    @pytest.mark.asyncio
+    async def test_replaced_binary_reverifies(self, tool, tmp_path) -> None:
+        """Test replacing the binary invalidates the cached success."""
+        manager = self.manager(dot.VerificationCache(tmp_path / "verify.json"))
+        prov = manager.provisioners["fake"]
 
-class TestAsyncCommandRunnerErrors:
-    """Test AsyncCommandRunner error handling."""
+        await manager._is_installed(prov)
+        tool.write_text(tool.read_text() + "exit 1\n")
 
-    @pytest.mark.asyncio
-    async def test_raise_process_error(self) -> None:
-        """Test _raise_process_error method."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
+        assert not await manager._is_installed(prov)
+        assert not await manager._is_installed(prov)
+        assert self.calls(tool) == 3
 
-        result = dot.CommandResult(
-            success=False,
-            stdout="output",
-            stderr="error",
-            returncode=1,
-            duration=0.1,
-        )
+    @pytest.mark.asyncio
+    async def test_expired_entry_reverifies(self, tool, tmp_path) -> None:
+        """Test entries older than the TTL are ignored."""
+        manager = self.manager(dot.VerificationCache(tmp_path / "v.json", ttl=0))
+        prov = manager.provisioners["fake"]
 
-        with pytest.raises(subprocess.CalledProcessError) as exc_info:
-            runner._raise_process_error(result, "test command")
+        await manager._is_installed(prov)
+        await manager._is_installed(prov)
 
-        assert exc_info.value.returncode == 1
-        assert exc_info.value.cmd == "test command"
-        assert exc_info.value.stdout == "output"
-        assert exc_info.value.stderr == "error"
+        assert self.calls(tool) == 2
 
     @pytest.mark.asyncio
-    async def test_run_with_check_raises_on_failure(self) -> None:
-        """Test that run with check=True raises on failure."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
+    async def test_dry_run_not_recorded(self, tool, tmp_path) -> None:
+        """Test dry-run successes never reach the cache."""
+        path = tmp_path / "verify.json"
+        manager = self.manager(dot.VerificationCache(path))
+        manager.runner = dot.AsyncCommandRunner(dry_run=True)
+
+        assert await manager._is_installed(manager.provisioners["fake"])
+        assert not path.exists()
+
+    def test_no_cache_disables_caches(self, tmp_path) -> None:
+        """Test --no-cache skips verify results and config snapshots."""
+        app = dot.DotfilesApp(config_path=tmp_path / "dot.toml", no_cache=True)
+
+        assert app.provisioner_manager.verify_cache is None
+        assert app.config_loader.use_cache is False
+        cached = dot.DotfilesApp(config_path=tmp_path / "dot.toml")
+        assert isinstance(
+            cached.provisioner_manager.verify_cache,
+            dot.VerificationCache,
+        )
 
-        with pytest.raises(subprocess.CalledProcessError):
-            await runner.run("exit 1", check=True, shell=True)
 
-    @pytest.mark.asyncio
-    async def test_run_handles_generic_exception(self) -> None:
-        """Test run handles generic exceptions."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
+class TestParallelProvisioning:
+    """Test DAG-parallel scheduling in provision_all."""
 
-        with unittest.mock.patch(
-            "asyncio.create_subprocess_shell",
-            side_effect=RuntimeError("Test error"),
-        ):
-            result = await runner.run("echo test", shell=True)
+    @staticmethod
+    def provisioner(
+        name: str,
+        priority: int,
+        requires: frozenset[str] = frozenset(),
+    ) -> dot.Provisioner:
+        """Build a script provisioner that provides a tool named *name*."""
+        return dot.Provisioner(
+            name=name,
+            description=name,
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset([name]),
+            requires=requires,
+            install_script=f"install {name}",
+            priority=priority,
+        )
 
-            assert result.success is False
-            assert "Test error" in result.stderr
-            assert result.returncode == -1
+    @staticmethod
+    def manager(*provisioners: dot.Provisioner) -> dot.ProvisionerManager:
+        """Build a manager over *provisioners*."""
+        return dot.ProvisionerManager(
+            {prov.name: prov for prov in provisioners},
+            dot.AsyncCommandRunner(dry_run=False),
+            dot.Platform(),
+        )
+
+    def test_get_dependencies(self) -> None:
+        """Test dependencies are providers of requires, ignoring unknowns."""
+        resolver = dot.DependencyResolver(
+            {
+                "rust": self.provisioner("cargo", 3),
+                "sheldon": self.provisioner("sheldon", 4, frozenset(["cargo", "cc"])),
+            },
+        )
+
+        assert resolver.get_dependencies("sheldon") == {"rust"}
+        assert resolver.get_dependencies("rust") == set()
 
     @pytest.mark.asyncio
-    async def test_run_many_with_stop_on_error(self) -> None:
-        """Test run_many stops on error when requested."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
+    async def test_independent_provisioners_overlap(self) -> None:
+        """Test independent provisioners run concurrently up to the limit."""
+        manager = self.manager(
+            *(self.provisioner(name, 5) for name in ["fzf", "mise", "rust", "sheldon"]),
+        )
+        active = 0
+        peak = 0
 
-        # Use 'false' command which reliably returns exit code 1
-        commands = [
-            ["sh", "-c", "echo ok"],
-            ["sh", "-c", "false"],
-            ["sh", "-c", "echo should_not_run"],
-        ]
-        results = await runner.run_many(commands, stop_on_error=True)
+        async def mock_run(cmd, **kwargs):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return dot.CommandResult(success=True)
 
-        # Should only have 2 results (stopped after failure)
-        assert len(results) == 2
-        assert results[0].success is True
-        assert results[1].success is False
+        with (
+            patch.object(manager.runner, "run", side_effect=mock_run),
+            patch.object(manager, "_is_installed", return_value=False),
+            patch.object(manager, "_detect_path_additions", return_value=[]),
+        ):
+            results = await manager.provision_all(max_concurrent=3)
+
+        assert peak == 3
+        assert list(results) == ["fzf", "mise", "rust", "sheldon"]
+        assert all(results.values())
 
     @pytest.mark.asyncio
-    async def test_run_many_exception_handling(self) -> None:
-        """Test run_many handles exceptions in task group."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
+    async def test_dependent_waits_for_provider_only(self) -> None:
+        """Test a dependent starts after its provider, not after siblings."""
+        manager = self.manager(
+            self.provisioner("cargo", 3),
+            self.provisioner("sheldon", 4, frozenset(["cargo"])),
+            self.provisioner("starship", 7),
+        )
+        events: list[str] = []
+        delays = {"cargo": 0.01, "sheldon": 0.0, "starship": 0.05}
 
-        with patch.object(runner, "run", side_effect=RuntimeError("Test error")):
-            results = await runner.run_many(["echo test"])
+        async def mock_run(cmd, **kwargs):
+            name = cmd.removeprefix("install ")
+            events.append(f"start {name}")
+            await asyncio.sleep(delays[name])
+            events.append(f"end {name}")
+            return dot.CommandResult(success=True)
 
-            # Should return empty results on exception
-            assert results == []
+        with (
+            patch.object(manager.runner, "run", side_effect=mock_run),
+            patch.object(manager, "_is_installed", return_value=False),
+            patch.object(manager, "_detect_path_additions", return_value=[]),
+        ):
+            await manager.provision_all()
 
+        assert events.index("start starship") < events.index("end cargo")
+        assert events.index("end cargo") < events.index("start sheldon")
+        assert events.index("end sheldon") < events.index("end starship")
 
-class TestConfigLoaderErrors:
-    """Test ConfigLoader error handling."""
+    @pytest.mark.asyncio
+    async def test_priority_breaks_ties(self) -> None:
+        """Test ready provisioners start in priority order."""
+        manager = self.manager(
+            self.provisioner("late", 9),
+            self.provisioner("early", 1),
+            self.provisioner("middle", 5),
+        )
+        started: list[str] = []
 
-    def test_config_loader_os_error(self, tmp_path) -> None:
-        """Test ConfigLoader handles OS errors."""
-        config_path = tmp_path / "unreadable.toml"
-        config_path.write_text("[test]")
-        config_path.chmod(0o000)  # Remove read permissions
+        async def mock_run(cmd, **kwargs):
+            started.append(cmd.removeprefix("install "))
+            return dot.CommandResult(success=True)
 
-        loader = dot.ConfigLoader(config_path)
+        with (
+            patch.object(manager.runner, "run", side_effect=mock_run),
+            patch.object(manager, "_is_installed", return_value=False),
+            patch.object(manager, "_detect_path_additions", return_value=[]),
+        ):
+            await manager.provision_all(max_concurrent=1)
 
-        with pytest.raises(OSError):
-            loader.load()
+        assert started == ["early", "middle", "late"]
 
-        # Cleanup
-        config_path.chmod(0o644)
+    @pytest.mark.asyncio
+    async def test_path_propagates_to_dependents(self) -> None:
+        """Test a provider's PATH additions reach provisioners waiting on it."""
+        manager = self.manager(
+            self.provisioner("cargo", 3),
+            self.provisioner("sheldon", 4, frozenset(["cargo"])),
+        )
+        paths: dict[str, str] = {}
 
-    def test_provisioner_parsing_skips_non_dict(self, tmp_path) -> None:
-        """Test provisioner parsing skips non-dict entries."""
-        config_path = tmp_path / "test.toml"
-        config_path.write_text("""
-[provisioners]
-valid = { description = "Valid", provides = ["test"] }
-invalid = "not a dict"
-""")
+        async def mock_run(cmd, **kwargs):
+            paths[cmd.removeprefix("install ")] = kwargs["env"]["PATH"]
+            return dot.CommandResult(success=True)
 
-        loader = dot.ConfigLoader(config_path)
-        config = loader.load()
+        async def mock_detect(prov):
+            return ["/fake/.cargo/bin"] if prov.name == "cargo" else []
+
+        with (
+            patch.object(manager.runner, "run", side_effect=mock_run),
+            patch.object(manager, "_is_installed", return_value=False),
+            patch.object(manager, "_detect_path_additions", side_effect=mock_detect),
+        ):
+            await manager.provision_all()
 
-        # Should only have the valid provisioner
-        assert "valid" in config.provisioners
-        assert "invalid" not in config.provisioners
+        assert "/fake/.cargo/bin" not in paths["cargo"]
+        assert paths["sheldon"].startswith("/fake/.cargo/bin" + os.pathsep)
 
-    def test_provisioner_parsing_unknown_type(self, tmp_path) -> None:
-        """Test provisioner parsing with unknown type falls back to default."""
-        config_path = tmp_path / "test.toml"
-        config_path.write_text("""
-[provisioners.test]
-description = "Test"
-type = "unknown_type"
-provides = ["test"]
-""")
+    @pytest.mark.asyncio
+    async def test_dependency_cycle_still_runs(self) -> None:
+        """Test a requires cycle falls back to priority order."""
+        manager = self.manager(
+            self.provisioner("a", 1, frozenset(["b"])),
+            self.provisioner("b", 2, frozenset(["a"])),
+        )
 
-        loader = dot.ConfigLoader(config_path)
-        config = loader.load()
+        with (
+            patch.object(
+                manager.runner,
+                "run",
+                return_value=dot.CommandResult(success=True),
+            ),
+            patch.object(manager, "_is_installed", return_value=False),
+            patch.object(manager, "_detect_path_additions", return_value=[]),
+        ):
+            results = await asyncio.wait_for(manager.provision_all(), timeout=5)
 
-        # Should use default type
-        assert config.provisioners["test"].type == dot.ProvisionerType.PROVISIONER
+        assert all(results.values())
 
-    def test_provisioner_parsing_unknown_install_method(self, tmp_path) -> None:
-        """Test provisioner parsing with unknown install method defaults."""
-        config_path = tmp_path / "test.toml"
-        config_path.write_text("""
-[provisioners.test]
-description = "Test"
-install_method = "unknown_method"
-provides = ["test"]
-""")
+    @pytest.mark.asyncio
+    async def test_package_installs_serialized(self) -> None:
+        """Test package manager installs never overlap."""
+        packages = [
+            dot.Provisioner(
+                name=name,
+                description=name,
+                type=dot.ProvisionerType.PROVISIONER,
+                install_method=dot.InstallMethod.PACKAGE,
+                provides=frozenset([name]),
+                requires=frozenset(),
+            )
+            for name in ["jq", "ripgrep"]
+        ]
+        manager = self.manager(*packages)
+        active = 0
+        peak = 0
 
-        loader = dot.ConfigLoader(config_path)
-        config = loader.load()
+        async def mock_run(cmd, **kwargs):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return dot.CommandResult(success=True)
 
-        # Should use default install method
-        assert config.provisioners["test"].install_method == dot.InstallMethod.SCRIPT
+        with (
+            patch.object(manager.platform, "get_package_manager", return_value="brew"),
+            patch.object(manager.runner, "run", side_effect=mock_run),
+            patch.object(manager, "_is_installed", return_value=False),
+            patch.object(manager, "_detect_path_additions", return_value=[]),
+        ):
+            await manager.provision_all()
 
+        assert peak == 1
 
-# ═══════════════════════════════════════════════════════════════════════════════
-# PHASE 3: LOW PRIORITY TESTS - Cleanup, symlinks, CLI edge cases
-# ═══════════════════════════════════════════════════════════════════════════════
 
+class TestPackageBatching:
+    """Test coalescing PACKAGE provisioners into one transaction."""
 
-class TestCleanupFunctionality:
-    """Test cleanup functionality."""
+    @staticmethod
+    def provisioner(
+        name: str,
+        priority: int = 5,
+        requires: frozenset[str] = frozenset(),
+    ) -> dot.Provisioner:
+        """Build a brew-style PACKAGE provisioner named *name*."""
+        return dot.Provisioner(
+            name=name,
+            description=name,
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.PACKAGE,
+            provides=frozenset([name]),
+            requires=requires,
+            priority=priority,
+        )
 
-    @pytest.mark.asyncio
-    async def test_cleanup_removes_files_and_dirs(self, temp_home) -> None:
-        """Test cleanup removes files and directories."""
-        # Create test files and directories
-        test_file = temp_home / "test.tmp"
-        test_file.write_text("test")
-        test_dir = temp_home / "test_dir"
-        test_dir.mkdir()
-        (test_dir / "nested.txt").write_text("nested")
+    @staticmethod
+    def manager(*provisioners: dot.Provisioner) -> dot.ProvisionerManager:
+        """Build a manager over *provisioners*."""
+        return dot.ProvisionerManager(
+            {prov.name: prov for prov in provisioners},
+            dot.AsyncCommandRunner(dry_run=False),
+            dot.Platform(),
+        )
 
-        app = dot.DotfilesApp(dry_run=False)
-        app.platform.info = dot.SystemInfo(
-            os="linux",
-            hostname="test",
-            arch="x86_64",
-            distro="ubuntu",
-            is_linux=True,
-            is_macos=False,
-            is_wsl=False,
-            home=temp_home,
-            user="test",
+    @pytest.mark.asyncio
+    async def test_ready_packages_share_one_transaction(self) -> None:
+        """Test ready PACKAGE provisioners install with one command."""
+        manager = self.manager(
+            self.provisioner("jq", 1),
+            self.provisioner("fzf", 2),
+            self.provisioner("ripgrep", 3),
         )
 
-        # Run cleanup with patterns
-        success = await app.cleanup(["*.tmp", "test_dir"])
+        with (
+            patch.object(manager.platform, "get_package_manager", return_value="brew"),
+            patch.object(
+                manager.runner, "run", new_callable=unittest.mock.AsyncMock
+            ) as mock_run,
+            patch.object(manager, "_is_installed", side_effect=[False, True, False]),
+            patch.object(manager, "_detect_path_additions", return_value=[]),
+        ):
+            mock_run.return_value = dot.CommandResult(success=True)
+            results = await manager.provision_all()
 
-        assert success
-        assert not test_file.exists()
-        assert not test_dir.exists()
+        assert list(results) == ["jq", "fzf", "ripgrep"]
+        assert all(results.values())
+        assert [call.args[0] for call in mock_run.call_args_list] == [
+            "brew install jq ripgrep",
+        ]
 
     @pytest.mark.asyncio
-    async def test_cleanup_no_patterns(self, temp_home) -> None:
-        """Test cleanup with no patterns configured."""
-        app = dot.DotfilesApp(dry_run=False)
-        app.config.cleanup_patterns = []
+    async def test_failed_transaction_maps_results_per_provisioner(self) -> None:
+        """Test a failed batch retries singly so only the bad package fails."""
+        manager = self.manager(
+            self.provisioner("jq", 1),
+            self.provisioner("no-such-pkg", 2),
+            self.provisioner("ripgrep", 3),
+        )
 
-        success = await app.cleanup()
+        async def mock_run(cmd: str, **_kwargs: object) -> dot.CommandResult:
+            return dot.CommandResult(success="no-such-pkg" not in cmd)
 
-        assert success  # Should succeed with no patterns
+        with (
+            patch.object(manager.platform, "get_package_manager", return_value="brew"),
+            patch.object(manager.runner, "run", side_effect=mock_run) as run,
+            patch.object(manager, "_is_installed", return_value=False),
+            patch.object(manager, "_detect_path_additions", return_value=[]),
+        ):
+            results = await manager.provision_all()
 
-    @pytest.mark.asyncio
-    async def test_cleanup_dry_run(self, temp_home) -> None:
-        """Test cleanup in dry run mode."""
-        test_file = temp_home / "test.tmp"
-        test_file.write_text("test")
+        assert results["jq"]
+        assert not results["no-such-pkg"]
+        assert results["ripgrep"]
+        assert [call.args[0] for call in run.call_args_list] == [
+            "brew install jq no-such-pkg ripgrep",
+            "brew install jq",
+            "brew install no-such-pkg",
+            "brew install ripgrep",
+        ]
 
-        app = dot.DotfilesApp(dry_run=True)
-        app.platform.info = dot.SystemInfo(
-            os="linux",
-            hostname="test",
-            arch="x86_64",
-            distro="ubuntu",
-            is_linux=True,
-            is_macos=False,
-            is_wsl=False,
-            home=temp_home,
-            user="test",
+    @pytest.mark.asyncio
+    async def test_dependent_package_waits_for_provider(self) -> None:
+        """Test a PACKAGE provisioner isn't batched ahead of its provider."""
+        manager = self.manager(
+            self.provisioner("python3", 1),
+            self.provisioner("jq", 2),
+            self.provisioner("pipx", 3, frozenset(["python3"])),
         )
 
-        success = await app.cleanup(["*.tmp"])
+        with (
+            patch.object(manager.platform, "get_package_manager", return_value="brew"),
+            patch.object(
+                manager.runner, "run", new_callable=unittest.mock.AsyncMock
+            ) as mock_run,
+            patch.object(manager, "_is_installed", return_value=False),
+            patch.object(manager, "_detect_path_additions", return_value=[]),
+        ):
+            mock_run.return_value = dot.CommandResult(success=True)
+            await manager.provision_all()
 
-        assert success
-        assert test_file.exists()  # Should not be removed in dry run
+        assert [call.args[0] for call in mock_run.call_args_list] == [
+            "brew install python3 jq",
+            "brew install pipx",
+        ]
 
     @pytest.mark.asyncio
-    async def test_cleanup_handles_errors(self, temp_home) -> None:
-        """Test cleanup handles errors gracefully."""
-        app = dot.DotfilesApp(dry_run=False)
-        app.platform.info = dot.SystemInfo(
-            os="linux",
-            hostname="test",
-            arch="x86_64",
-            distro="ubuntu",
-            is_linux=True,
-            is_macos=False,
-            is_wsl=False,
-            home=temp_home,
-            user="test",
+    async def test_provision_merges_with_system_packages(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+    ) -> None:
+        """Test independent PACKAGE provisioners join the system transaction."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(
+            """
+[packages.brew]
+packages = ["git"]
+
+[provisioners.jq]
+description = "JSON processor"
+install_method = "package"
+provides = ["jq"]
+
+[provisioners.pipx]
+description = "Python apps"
+install_method = "package"
+provides = ["pipx"]
+requires = ["jq"]
+"""
         )
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        manager = app.provisioner_manager
 
-        with unittest.mock.patch(
-            "pathlib.Path.glob",
-            side_effect=PermissionError("No access"),
+        with (
+            patch.object(app.platform, "get_package_manager", return_value="brew"),
+            patch.object(
+                app.runner, "run", new_callable=unittest.mock.AsyncMock
+            ) as mock_run,
+            patch.object(
+                manager,
+                "_is_installed",
+                side_effect=lambda prov, env=None: (
+                    any(
+                        call.args[0] == "brew install git jq"
+                        for call in mock_run.call_args_list
+                    )
+                    and prov.name == "jq"
+                ),
+            ),
+            patch.object(manager, "_detect_path_additions", return_value=[]),
         ):
-            success = await app.cleanup(["*.tmp"])
+            mock_run.return_value = dot.CommandResult(success=True)
+            result = await app.provision()
 
-            assert not success  # Should fail on error
+        assert result
+        assert [call.args[0] for call in mock_run.call_args_list] == [
+            "brew list --formula",
+            "brew install git jq",
+            "brew install pipx",
+        ]
 
 
-class TestSymlinkEdgeCases:
-    """Test symlink creation edge cases."""
+class TestLanguagePackages:
+    """Test the concurrent pip/npm/cargo package installers."""
 
-    @pytest.mark.asyncio
-    async def test_symlink_already_correct(self, temp_home) -> None:
-        """Test symlink that's already correct is skipped."""
-        source = temp_home / "source.txt"
-        source.write_text("content")
-        dest = temp_home / "dest.txt"
-        dest.symlink_to(source)
+    CONFIG = """
+[packages.pip]
+packages = ["virtualenv", "Git_Sweep", "black"]
 
-        app = dot.DotfilesApp(dry_run=False)
+[packages.npm]
+packages = ["typescript", "@angular/cli"]
 
-        # Should succeed without modification
-        success = await app._create_symlink(source, dest)
+[packages.cargo]
+packages = ["gitui", "hyperfine"]
+"""
 
-        assert success
-        assert dest.is_symlink()
-        assert dest.resolve() == source.resolve()
+    LISTINGS: typing.ClassVar[dict[str, str]] = {
+        "pip": '[{"name": "virtualenv", "version": "20.26"},'
+        ' {"name": "git-sweep", "version": "0.1.1"}]',
+        "npm": '{"dependencies": {"typescript": {"version": "5.4.5"}}}',
+        "cargo": "gitui v0.26.3:\n    gitui\nripgrep v14.1.0:\n    rg\n",
+    }
+
+    def test_parse_installed_packages(self) -> None:
+        """Test each listing format parses to normalized names."""
+        assert dot._parse_installed_packages("pip", self.LISTINGS["pip"]) == frozenset(
+            {"virtualenv", "git-sweep"}
+        )
+        assert dot._parse_installed_packages("npm", self.LISTINGS["npm"]) == frozenset(
+            {"typescript"}
+        )
+        assert dot._parse_installed_packages(
+            "cargo", self.LISTINGS["cargo"]
+        ) == frozenset({"gitui", "ripgrep"})
+        assert dot._parse_installed_packages("npm", "") == frozenset()
 
     @pytest.mark.asyncio
-    async def test_symlink_replaces_directory(self, temp_home) -> None:
-        """Test symlink replaces existing directory."""
-        source = temp_home / "source"
-        source.mkdir()
-        (source / "file.txt").write_text("content")
+    async def test_installs_only_missing_packages(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+    ) -> None:
+        """Test one listing per ecosystem, then an install of the difference."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(self.CONFIG)
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        listings = {
+            dot._language_package_commands(name)[0]: output
+            for name, output in self.LISTINGS.items()
+        }
 
-        dest = temp_home / "dest"
-        dest.mkdir()
-        (dest / "old.txt").write_text("old")
+        async def mock_run(cmd: str, **_kwargs: object) -> dot.CommandResult:
+            return dot.CommandResult(success=True, stdout=listings.get(cmd, ""))
 
-        app = dot.DotfilesApp(dry_run=False)
+        with (
+            patch("shutil.which", return_value="/usr/bin/tool"),
+            patch.object(app.runner, "run", side_effect=mock_run) as run,
+        ):
+            results = await app.install_language_packages()
 
-        success = await app._create_symlink(source, dest)
+        assert results == {
+            "pip": dot.Result.ok(),
+            "npm": dot.Result.ok(),
+            "cargo": dot.Result.ok(),
+        }
+        installs = sorted(
+            call.args[0] for call in run.call_args_list if call.args[0] not in listings
+        )
+        assert installs == [
+            "cargo install hyperfine",
+            "npm install --global @angular/cli",
+            "pip install --user --disable-pip-version-check black",
+        ]
+        assert len(run.call_args_list) == 6
 
-        assert success
-        assert dest.is_symlink()
-        assert dest.resolve() == source.resolve()
+    @pytest.mark.asyncio
+    async def test_upgrade_installs_every_package(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+    ) -> None:
+        """Test --upgrade skips the listing and upgrades installed packages too."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(self.CONFIG)
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+
+        with (
+            patch("shutil.which", return_value="/usr/bin/tool"),
+            patch.object(
+                app.runner, "run", new_callable=unittest.mock.AsyncMock
+            ) as mock_run,
+        ):
+            mock_run.return_value = dot.CommandResult(success=True)
+            results = await app.install_language_packages(["pip"], upgrade=True)
+
+        assert results == {"pip": dot.Result.ok()}
+        mock_run.assert_called_once()
+        assert mock_run.call_args.args[0] == (
+            "pip install --user --disable-pip-version-check --upgrade"
+            " virtualenv Git_Sweep black"
+        )
 
     @pytest.mark.asyncio
-    async def test_symlink_handles_os_error(self, temp_home) -> None:
-        """Test symlink handles OS errors."""
-        source = temp_home / "source.txt"
-        source.write_text("content")
-        dest = temp_home / "readonly" / "dest.txt"
+    async def test_cli_list_prints_selection(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+        monkeypatch: pytest.MonkeyPatch,
+        capsys: pytest.CaptureFixture[str],
+    ) -> None:
+        """Test `packages --list` prints names for scripts, installing nothing."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(self.CONFIG)
+        monkeypatch.setattr(
+            "sys.argv",
+            [
+                "dot.py",
+                "--config",
+                str(config_path),
+                "packages",
+                "--ecosystem",
+                "pip",
+                "--list",
+            ],
+        )
 
-        app = dot.DotfilesApp(dry_run=False)
+        with patch.object(dot.DotfilesApp, "install_language_packages") as mock_install:
+            assert await dot.async_main() == 0
 
-        with unittest.mock.patch(
-            "pathlib.Path.symlink_to",
-            side_effect=OSError("Permission denied"),
+        mock_install.assert_not_called()
+        assert capsys.readouterr().out == "virtualenv\nGit_Sweep\nblack\n"
+
+    @pytest.mark.asyncio
+    async def test_ecosystems_run_concurrently(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+    ) -> None:
+        """Test ecosystems don't wait for each other."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(self.CONFIG)
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        active = 0
+        peak = 0
+
+        async def mock_run(cmd: str, **_kwargs: object) -> dot.CommandResult:
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return dot.CommandResult(success=True)
+
+        with (
+            patch("shutil.which", return_value="/usr/bin/tool"),
+            patch.object(app.runner, "run", side_effect=mock_run),
         ):
-            success = await app._create_symlink(source, dest)
+            await app.install_language_packages()
 
-            assert not success
+        assert peak == 3
 
+    @pytest.mark.asyncio
+    async def test_missing_tool_and_failure(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+    ) -> None:
+        """Test an absent tool is skipped and a failed install is reported."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(self.CONFIG)
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
 
-class TestStatusEdgeCases:
-    """Test status command edge cases."""
+        with (
+            patch(
+                "shutil.which",
+                side_effect=lambda tool, path=None: None if tool == "npm" else tool,
+            ),
+            patch.object(
+                app.runner, "run", new_callable=unittest.mock.AsyncMock
+            ) as mock_run,
+        ):
+            mock_run.return_value = dot.CommandResult(success=False, stderr="boom")
+            results = await app.install_language_packages(["npm", "cargo"])
 
-    @pytest.mark.asyncio
-    async def test_status_file_not_symlink(self, temp_home) -> None:
-        """Test status detects file that's not a symlink."""
-        app = dot.DotfilesApp(dry_run=False)
-        app.config.source = temp_home / "dotfiles"
-        app.config.source.mkdir()
+        assert results["npm"]
+        assert not results["cargo"]
+        assert results["cargo"].error == "boom"
+        assert all("npm" not in call.args[0] for call in mock_run.call_args_list)
 
-        # Create source file
-        source = app.config.source / "test.txt"
-        source.write_text("source")
 
-        # Create regular file at destination
-        dest = temp_home / "test.txt"
-        dest.write_text("not a symlink")
+class TestPackageGroups:
+    """Test package group composition and incremental group switches."""
 
-        app.config.files[dot.DestPath(pathlib.Path("test.txt"))] = dot.TemplateDef(
-            source=dot.SourcePath(pathlib.Path("test.txt")),
-        )
-        app.platform.info = dot.SystemInfo(
-            os="linux",
-            hostname="test",
-            arch="x86_64",
-            distro="ubuntu",
-            is_linux=True,
-            is_macos=False,
-            is_wsl=False,
-            home=temp_home,
-            user="test",
-        )
+    CONFIG = """
+[package_groups]
+full = ["desktop", "development"]
 
-        status = await app.status()
+[packages.brew]
+packages = ["git", "tmux"]
 
-        assert status["dotfiles"]["test.txt"] == "not_symlink"
+[packages.brew.groups]
+minimal = []
+desktop = ["kitty", "git"]
+development = ["ripgrep", "jq"]
+full = ["neovim"]
+"""
 
-    @pytest.mark.asyncio
-    async def test_status_symlink_wrong_target(self, temp_home) -> None:
-        """Test status detects symlink with wrong target."""
-        app = dot.DotfilesApp(dry_run=False)
-        app.config.source = temp_home / "dotfiles"
-        app.config.source.mkdir()
+    def test_resolve_composition(self) -> None:
+        """Test composed groups expand transitively, each group once."""
+        compositions = {
+            "full": ["desktop", "development"],
+            "desktop": ["minimal"],
+            "development": ["minimal"],
+        }
 
-        # Create source file
-        source = app.config.source / "test.txt"
-        source.write_text("source")
+        assert dot.resolve_package_groups(compositions, "full") == [
+            "minimal",
+            "desktop",
+            "development",
+            "full",
+        ]
+        assert dot.resolve_package_groups(compositions, "minimal") == ["minimal"]
+
+    def test_resolve_cycle_raises(self) -> None:
+        """Test a composition cycle is reported with its path."""
+        with pytest.raises(ValueError, match="full -> desktop -> full"):
+            dot.resolve_package_groups(
+                {"full": ["desktop"], "desktop": ["full"]},
+                "full",
+            )
 
-        # Create wrong file and symlink to it
-        wrong = temp_home / "wrong.txt"
-        wrong.write_text("wrong")
-        dest = temp_home / "test.txt"
-        dest.symlink_to(wrong)
+    def test_select_packages_deduplicates(self) -> None:
+        """Test base and group packages merge in first-seen order."""
+        package_config = {
+            "packages": ["git", "tmux"],
+            "groups": {"desktop": ["kitty", "git"], "full": ["neovim", "kitty"]},
+        }
 
-        app.config.files[dot.DestPath(pathlib.Path("test.txt"))] = dot.TemplateDef(
-            source=dot.SourcePath(pathlib.Path("test.txt")),
-        )
-        app.platform.info = dot.SystemInfo(
-            os="linux",
-            hostname="test",
-            arch="x86_64",
-            distro="ubuntu",
-            is_linux=True,
-            is_macos=False,
-            is_wsl=False,
-            home=temp_home,
-            user="test",
-        )
+        assert dot.select_packages(package_config, ["desktop", "full"]) == [
+            "git",
+            "tmux",
+            "kitty",
+            "neovim",
+        ]
 
-        status = await app.status()
+    def test_repo_full_group_covers_desktop_and_development(self) -> None:
+        """Test the shipped dot.toml's `full` includes both groups it composes."""
+        config_path = pathlib.Path(__file__).parent / "dot.toml"
+        app = dot.DotfilesApp(config_path=config_path, no_cache=True)
 
-        assert status["dotfiles"]["test.txt"] == "wrong_target"
+        full = app.package_selection("full")
+        for group in ("desktop", "development"):
+            for manager, packages in app.package_selection(group).items():
+                assert set(packages) <= set(full[manager])
 
+    @pytest.mark.asyncio
+    async def test_switching_group_installs_only_delta(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+    ) -> None:
+        """Test development -> full installs just what full adds."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(self.CONFIG)
+        commands: list[str] = []
 
-class TestCLIEdgeCases:
-    """Test CLI edge cases."""
+        async def install(group: dot.PackageGroup) -> None:
+            app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+            with (
+                patch.object(app.platform, "get_package_manager", return_value="brew"),
+                patch.object(
+                    app.runner, "run", new_callable=unittest.mock.AsyncMock
+                ) as mock_run,
+            ):
+                mock_run.return_value = dot.CommandResult(success=True)
+                assert await app._install_system_packages(group=group)
+            commands.extend(call.args[0] for call in mock_run.call_args_list)
+
+        await install("development")
+        await install("full")
+        await install("full")
+
+        assert commands == [
+            "brew list --formula",
+            "brew install git tmux ripgrep jq",
+            "brew list --formula",
+            "brew install kitty neovim",
+        ]
 
-    def test_unknown_command(self, monkeypatch) -> None:
-        """Test handling of unknown commands."""
-        test_args = ["dot.py", "unknown-command"]
-        monkeypatch.setattr(sys, "argv", test_args)
+    @pytest.mark.asyncio
+    async def test_provision_rejects_group_cycle(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+    ) -> None:
+        """Test provision fails cleanly on a composition cycle."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text('[package_groups]\nfull = ["full"]\n')
+        app = dot.DotfilesApp(config_path=config_path)
 
-        # argparse exits with code 2 for invalid arguments
-        with pytest.raises(SystemExit) as exc_info:
-            dot.main()
+        result = await app.provision(group="full")
 
-        assert exc_info.value.code == 2
+        assert not result
+        assert "cycle" in result.error
 
     @pytest.mark.asyncio
-    async def test_cleanup_command(self, monkeypatch, temp_home) -> None:
-        """Test cleanup command execution."""
-        test_args = ["dot.py", "cleanup", "*.tmp"]
-        monkeypatch.setattr(sys, "argv", test_args)
+    async def test_cli_group_flag(
+        self,
+        tmp_path: pathlib.Path,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        """Test `provision --group` reaches DotfilesApp.provision."""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(self.CONFIG)
+        monkeypatch.setattr(
+            sys,
+            "argv",
+            ["dot.py", "--config", str(config_path), "provision", "--group", "full"],
+        )
 
         with patch.object(
             dot.DotfilesApp,
-            "cleanup",
+            "provision",
             new_callable=unittest.mock.AsyncMock,
-        ) as mock_cleanup:
-            mock_cleanup.return_value = dot.CleanupResult.ok()
+        ) as mock_provision:
+            mock_provision.return_value = dot.ProvisionResult.ok()
 
-            exit_code = await dot.async_main()
+            assert await dot.async_main() == 0
 
-            assert exit_code == 0
-            mock_cleanup.assert_called_once_with(["*.tmp"])
+        mock_provision.assert_called_once_with(None, 4, "full")
 
-    def test_main_keyboard_interrupt(self) -> None:
-        """Test main handles KeyboardInterrupt."""
 
-        def mock_run(coro):
-            coro.close()  # Close coroutine to prevent "never awaited" warning
-            raise KeyboardInterrupt
+class TestErrorOutputCapture:
+    """Test error output capture and logging."""
 
-        with unittest.mock.patch("asyncio.run", side_effect=mock_run):
-            exit_code = dot.main()
+    @pytest.mark.asyncio
+    async def test_script_install_captures_stderr(
+        self,
+        caplog: pytest.LogCaptureFixture,
+    ) -> None:
+        """Test that script installation captures and logs stderr."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
 
-            assert exit_code == 130  # Standard Unix exit code for SIGINT
+        prov = dot.Provisioner(
+            name="test-fail",
+            description="Test failing script",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+            install_script="echo 'Error: Missing dependency' >&2 && exit 1",
+        )
 
-    def test_main_generic_exception(self) -> None:
-        """Test main handles generic exceptions."""
+        manager = dot.ProvisionerManager({"test-fail": prov}, runner, platform_obj)
 
-        def mock_run(coro):
-            coro.close()  # Close coroutine to prevent "never awaited" warning
-            raise RuntimeError("Test error")
+        with caplog.at_level(logging.ERROR):
+            success = await manager._install_via_script(prov)
 
-        with unittest.mock.patch("asyncio.run", side_effect=mock_run):
-            exit_code = dot.main()
+        assert not success
+        assert "Failed to install test-fail" in caplog.text
+        assert "Error output:" in caplog.text
+        assert "Error: Missing dependency" in caplog.text
 
-            assert exit_code == 1
+    @pytest.mark.asyncio
+    async def test_script_install_captures_stdout_in_debug(
+        self,
+        caplog: pytest.LogCaptureFixture,
+    ) -> None:
+        """Test that script installation captures stdout to debug log."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
+
+        prov = dot.Provisioner(
+            name="test-fail",
+            description="Test failing script with stdout",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+            install_script=(
+                "echo 'Starting installation...' && echo 'ERROR!' >&2 && exit 1"
+            ),
+        )
+
+        manager = dot.ProvisionerManager({"test-fail": prov}, runner, platform_obj)
+
+        with caplog.at_level(logging.DEBUG):
+            success = await manager._install_via_script(prov)
+
+        assert not success
+        assert "Standard output:" in caplog.text
+        assert "Starting installation..." in caplog.text
 
     @pytest.mark.asyncio
-    async def test_no_command_shows_help(
-        self, monkeypatch: typing.Any, capsys: typing.Any
+    async def test_package_install_captures_errors(
+        self,
+        caplog: pytest.LogCaptureFixture,
     ) -> None:
-        """Test no command shows help."""
-        test_args = ["dot.py"]
-        monkeypatch.setattr(sys, "argv", test_args)
+        """Test that package installation captures and logs errors."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
 
-        await dot.async_main()
+        prov = dot.Provisioner(
+            name="nonexistent-pkg",
+            description="Test nonexistent package",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.PACKAGE,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+        )
 
-        captured = capsys.readouterr()
-        assert "usage:" in captured.out.lower()
+        manager = dot.ProvisionerManager(
+            {"nonexistent-pkg": prov},
+            runner,
+            platform_obj,
+        )
+
+        # Mock the package manager command to fail
+        with (
+            patch.object(platform_obj, "get_package_manager", return_value="apt"),
+            patch.object(
+                runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+            caplog.at_level(logging.ERROR),
+        ):
+            mock_run.return_value = dot.CommandResult(
+                success=False,
+                stderr="E: Unable to locate package nonexistent-pkg",
+                returncode=100,
+            )
 
+            success = await manager._install_via_package(prov)
 
-class TestProvisionerInstallErrors:
-    """Test provisioner installation error cases."""
+        assert not success
+        assert "Failed to install nonexistent-pkg via apt" in caplog.text
+        assert "Error output:" in caplog.text
+        assert "Unable to locate package nonexistent-pkg" in caplog.text
 
     @pytest.mark.asyncio
-    async def test_install_script_no_script(self) -> None:
-        """Test install via script with no script provided."""
+    async def test_binary_install_download_error(
+        self,
+        caplog: pytest.LogCaptureFixture,
+    ) -> None:
+        """Test binary installation captures download errors."""
         runner = dot.AsyncCommandRunner(dry_run=False)
         platform_obj = dot.Platform()
 
         prov = dot.Provisioner(
-            name="no-script",
-            description="No script",
+            name="test-bin",
+            description="Test binary",
             type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.SCRIPT,
+            install_method=dot.InstallMethod.BINARY,
             provides=frozenset(["test"]),
             requires=frozenset(),
-            install_script="",  # No script
+            binary_url="https://invalid.example.com/nonexistent",
         )
 
-        manager = dot.ProvisionerManager({"no-script": prov}, runner, platform_obj)
+        manager = dot.ProvisionerManager({"test-bin": prov}, runner, platform_obj)
+
+        with (
+            patch.object(
+                manager.downloads,
+                "fetch",
+                side_effect=OSError("Could not resolve host: invalid.example.com"),
+            ),
+            caplog.at_level(logging.ERROR),
+        ):
+            success = await manager._install_via_binary(prov)
 
-        success = await manager._install_via_script(prov)
         assert not success
+        assert "Failed to download test-bin" in caplog.text
+        assert "Error output:" in caplog.text
+        assert "Could not resolve host" in caplog.text
 
     @pytest.mark.asyncio
-    async def test_provision_missing_requirements(
+    async def test_binary_install_permission_error(
         self,
-        config_with_provisioners,
+        caplog: pytest.LogCaptureFixture,
     ) -> None:
-        """Test provisioning fails when requirements are missing."""
+        """Test binary installation captures permission errors."""
         runner = dot.AsyncCommandRunner(dry_run=False)
         platform_obj = dot.Platform()
-        all_provisioners = config_with_provisioners.provisioners
 
-        manager = dot.ProvisionerManager(all_provisioners, runner, platform_obj)
+        prov = dot.Provisioner(
+            name="test-bin",
+            description="Test binary",
+            type=dot.ProvisionerType.PROVISIONER,
+            install_method=dot.InstallMethod.BINARY,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+            binary_url="https://example.com/test-bin",
+        )
+
+        manager = dot.ProvisionerManager({"test-bin": prov}, runner, platform_obj)
 
-        # Mock that requirements are not met and provisioner is not installed
         with (
             patch.object(
-                manager.resolver,
-                "check_requirements",
-                return_value=(False, ["curl"]),
+                manager.downloads,
+                "fetch",
+                return_value=pathlib.Path("/cache/blobs/abc123"),
             ),
-            patch.object(manager, "_is_installed", return_value=False),
+            patch.object(
+                runner,
+                "run",
+                new_callable=unittest.mock.AsyncMock,
+            ) as mock_run,
+            caplog.at_level(logging.ERROR),
         ):
-            results = await manager.provision_all()
-
-            # Should return dict of results with rust failed
-            assert isinstance(results, dict)
-            assert "rust" in results
-            assert not results["rust"]
-
+            mock_run.return_value = dot.CommandResult(
+                success=False,
+                stderr=(
+                    "install: cannot create regular file "
+                    "'/usr/local/bin/test-bin': Permission denied"
+                ),
+                returncode=1,
+            )
 
-class TestProvisionerDependencies:
-    """Test provisioner dependency handling."""
+            success = await manager._install_via_binary(prov)
 
-    def test_build_essential_install_order(self) -> None:
-        """Test that build_essential has proper priority for installation order."""
-        # Create provisioners
-        build_essential = dot.Provisioner(
-            name="build_essential",
-            description="Essential build tools",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.PACKAGE,
-            provides=frozenset(["cc", "gcc", "make", "pkg-config", "openssl"]),
-            requires=frozenset(),
-            package_name="build-essential",
-            priority=1,  # Lower priority = installed first
-            verify_command="cc --version",
-        )
+        assert not success
+        assert "Failed to move test-bin to /usr/local/bin/" in caplog.text
+        assert "Error output:" in caplog.text
+        assert "Permission denied" in caplog.text
 
-        rust = dot.Provisioner(
-            name="rust",
-            description="Rust toolchain",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["cargo", "rustc"]),
-            requires=frozenset(["curl"]),
-            priority=3,
-        )
+    @pytest.mark.asyncio
+    async def test_exception_logging(self, caplog: pytest.LogCaptureFixture) -> None:
+        """Test that exceptions are logged with traceback."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
 
-        sheldon = dot.Provisioner(
-            name="sheldon",
-            description="Zsh plugin manager",
+        prov = dot.Provisioner(
+            name="test-exception",
+            description="Test exception",
             type=dot.ProvisionerType.PROVISIONER,
             install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["sheldon"]),
-            requires=frozenset(["cargo", "cc"]),  # Requires both cargo and cc
-            priority=4,
+            provides=frozenset(["test"]),
+            requires=frozenset(),
+            install_script="test",
         )
 
-        provisioners = {
-            "build_essential": build_essential,
-            "rust": rust,
-            "sheldon": sheldon,
-        }
+        manager = dot.ProvisionerManager({"test-exception": prov}, runner, platform_obj)
 
-        resolver = dot.DependencyResolver(provisioners)
+        with (
+            patch.object(runner, "run", side_effect=Exception("Unexpected error")),
+            caplog.at_level(logging.ERROR),
+        ):
+            success = await manager._install_via_script(prov)
 
-        # Get install order - should be sorted by priority
-        install_order = resolver.get_install_order()
+        assert not success
+        assert "Failed to install test-exception" in caplog.text
+        # logger.exception includes traceback info
 
-        # build_essential (priority 1) should come first
-        # rust (priority 3) should come second
-        # sheldon (priority 4) should come third
-        assert install_order.index("build_essential") == 0
-        assert install_order.index("rust") == 1
-        assert install_order.index("sheldon") == 2
+    @pytest.mark.asyncio
+    async def test_real_command_error(self, caplog: pytest.LogCaptureFixture) -> None:
+        """Test with a real command that fails."""
+        runner = dot.AsyncCommandRunner(dry_run=False)
+        platform_obj = dot.Platform()
 
-    def test_sheldon_requires_cc_from_build_essential(self) -> None:
-        """Test that sheldon's cc requirement is provided by build_essential."""
-        build_essential = dot.Provisioner(
-            name="build_essential",
-            description="Essential build tools",
+        prov = dot.Provisioner(
+            name="test-real",
+            description="Test real command",
             type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.PACKAGE,
-            provides=frozenset(["cc", "gcc", "make", "pkg-config", "openssl"]),
+            install_method=dot.InstallMethod.SCRIPT,
+            provides=frozenset(["test"]),
             requires=frozenset(),
-            priority=1,
+            install_script="ls /nonexistent/directory",
         )
 
-        sheldon = dot.Provisioner(
-            name="sheldon",
-            description="Zsh plugin manager",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["sheldon"]),
-            requires=frozenset(["cargo", "cc"]),
-            priority=4,
-        )
+        manager = dot.ProvisionerManager({"test-real": prov}, runner, platform_obj)
 
-        provisioners = {"build_essential": build_essential, "sheldon": sheldon}
-        resolver = dot.DependencyResolver(provisioners)
+        with caplog.at_level(logging.ERROR):
+            success = await manager._install_via_script(prov)
 
-        # Check that cc is in the provides map
-        assert "cc" in resolver._provides_map
-        assert resolver._provides_map["cc"] == "build_essential"
+        assert not success
+        assert "Failed to install test-real" in caplog.text
+        assert "Error output:" in caplog.text
+        # The actual error message varies by system but should mention the directory
+        assert (
+            "nonexistent" in caplog.text or "No such file or directory" in caplog.text
+        )
 
-        # Find who provides cc for sheldon
-        provider = resolver.find_provider("cc")
-        assert provider == "build_essential"
+
+class TestNonInteractiveInstallers:
+    """Test non-interactive installation scripts."""
 
     @pytest.mark.asyncio
-    async def test_provision_build_essential_enables_sheldon_install(self) -> None:
-        """Test that build-essential installation enables sheldon to compile."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
+    async def test_starship_installer_non_interactive(self) -> None:
+        """Test that starship installer includes --yes flag."""
+        config_loader = dot.ConfigLoader()
+        config = config_loader.load()
 
-        # Create provisioners with proper dependencies
-        build_essential = dot.Provisioner(
-            name="build_essential",
-            description="Essential build tools",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.PACKAGE,
-            provides=frozenset(["cc", "gcc", "make", "pkg-config", "openssl"]),
-            requires=frozenset(),
-            package_name="build-essential",
-            priority=1,
-            verify_command="cc --version",
-        )
+        # Find starship enhancement
+        starship = config.enhancements.get("starship")
+        assert starship is not None
+        assert "--yes" in starship.install_script
+        assert "sh -s -- --yes" in starship.install_script
 
-        rust = dot.Provisioner(
-            name="rust",
-            description="Rust toolchain",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["cargo", "rustc"]),
-            requires=frozenset(["curl"]),
-            priority=2,
-            install_script=(
-                "curl --proto '=https' --tlsv1.2 -sSf "
-                "https://sh.rustup.rs | sh -s -- -y"
-            ),
-            verify_command="cargo --version",
-        )
+    def test_build_essential_includes_pkg_config(self) -> None:
+        """Test that build_essential provisioner includes pkg-config."""
+        config_loader = dot.ConfigLoader()
+        config = config_loader.load()
 
-        sheldon = dot.Provisioner(
-            name="sheldon",
-            description="Zsh plugin manager",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["sheldon"]),
-            requires=frozenset(["cargo", "cc"]),
-            install_script="cargo install sheldon",
-            priority=3,
-            verify_command="sheldon --version",
-        )
+        # Find build_essential provisioner
+        build_essential = config.provisioners.get("build_essential")
+        assert build_essential is not None
+        assert "pkg-config" in build_essential.provides
+        assert "openssl" in build_essential.provides
+        # Should use script method to install multiple packages
+        assert build_essential.install_method == dot.InstallMethod.SCRIPT
+        assert "pkg-config" in build_essential.install_script
+        assert "libssl-dev" in build_essential.install_script
+
+
+class TestSymlinkCorrectness:
+    """Test that symlinks are created in the correct direction."""
+
+    @pytest.mark.asyncio
+    async def test_symlink_direction(
+        self,
+        tmp_path: pathlib.Path,
+        temp_home: pathlib.Path,
+    ) -> None:
+        """Test that symlinks are created from home to dot-config, not vice versa."""
+        # Create source directory and file
+        dot_config = tmp_path / "dot-config"
+        dot_config.mkdir()
+        source_file = dot_config / ".zshrc"
+        source_file.write_text("# zsh config")
 
-        provisioners = {
-            "build_essential": build_essential,
-            "rust": rust,
-            "sheldon": sheldon,
-        }
-        manager = dot.ProvisionerManager(provisioners, runner, platform_obj)
+        # Create a simple config
+        config_content = f"""
+[config]
+source = "{dot_config}"
 
-        # Track installation order
-        install_order = []
+[home.files]
+".zshrc" = ".zshrc"
+"""
+        config_path = tmp_path / "dot.toml"
+        config_path.write_text(config_content)
 
-        async def mock_run(cmd, *args, **kwargs):
-            # Track installation order
-            if "build-essential" in cmd:
-                install_order.append("build_essential")
-            elif "rustup.rs" in cmd:
-                install_order.append("rust")
-            elif "cargo install sheldon" in cmd:
-                install_order.append("sheldon")
-            return dot.CommandResult(success=True)
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
 
-        # Mock shutil.which to simulate curl is available but not cc/cargo initially
-        def mock_which(tool) -> str | None:
-            if tool == "curl":
-                return "/usr/bin/curl"
-            # After build_essential is "installed", cc is available
-            if tool in {"cc", "gcc", "make"} and "build_essential" in install_order:
-                return f"/usr/bin/{tool}"
-            # After rust is "installed", cargo is available
-            if tool in {"cargo", "rustc"} and "rust" in install_order:
-                return f"/home/user/.cargo/bin/{tool}"
-            return None
+        success = await app.install_dotfiles()
 
-        with (
-            patch.object(runner, "run", side_effect=mock_run),
-            patch.object(manager, "_is_installed", return_value=False),
-            patch("shutil.which", side_effect=mock_which),
-        ):
-            results = await manager.provision_all()
+        assert success
 
-        # All should succeed in the right order
-        assert all(r.success for r in results.values())
-        assert set(results.keys()) == {"build_essential", "rust", "sheldon"}
+        # The symlink should exist in the home directory
+        home_link = temp_home / ".zshrc"
+        assert home_link.exists()
+        assert home_link.is_symlink()
 
-        # Verify installation order
-        assert install_order == ["build_essential", "rust", "sheldon"]
+        # The symlink should point to the source file
+        assert home_link.resolve() == source_file.resolve()
 
+        # The source file should NOT be a symlink
+        assert not source_file.is_symlink()
+        assert source_file.is_file()
 
-class TestProvisionerPathHandling:
-    """Test PATH handling between provisioner installations."""
+        # Reading through the symlink should give us the source content
+        assert home_link.read_text() == "# zsh config"
 
-    @pytest.mark.asyncio
-    async def test_detect_path_additions(self, tmp_path) -> None:
-        """Test detection of new PATH entries after installation."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
 
-        # Create a provisioner that provides cargo
-        prov = dot.Provisioner(
-            name="rust",
-            description="Rust",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["cargo", "rustc"]),
-            requires=frozenset(),
-        )
+class TestPathExpansionBug:
+    """Test that config.source path is properly expanded."""
 
-        # Create the expected directory
-        cargo_bin = tmp_path / ".cargo" / "bin"
-        cargo_bin.mkdir(parents=True)
+    async def test_config_source_path_expansion(self, tmp_path: pathlib.Path) -> None:
+        """Test that ~/.dot-config is expanded to full path."""
+        # Create config with unexpanded path
+        config_content = """
+[config]
+source = "~/.dot-config"
 
-        with patch.dict(os.environ, {"HOME": str(tmp_path)}):
-            manager = dot.ProvisionerManager({"rust": prov}, runner, platform_obj)
+[home.files]
+".gitconfig" = ".gitconfig"
+"""
+        config_file = tmp_path / "dot.toml"
+        config_file.write_text(config_content)
 
-            # Detect PATH additions
-            paths = await manager._detect_path_additions(prov)
+        # Load config
+        loader = dot.ConfigLoader(config_file)
+        config = loader.load()
 
-            assert str(cargo_bin) in paths
+        # Fixed: config.source should be expanded
+        assert config.source == pathlib.Path.home() / ".dot-config"
+        assert "~" not in str(config.source)
 
-    @pytest.mark.asyncio
-    async def test_path_updated_between_provisioners(
+    async def test_status_reports_ok_with_expanded_paths(
         self,
-        tmp_path,
-        monkeypatch,
+        tmp_path: pathlib.Path,
+        monkeypatch: pytest.MonkeyPatch,
     ) -> None:
-        """Test that PATH is updated after provisioner installs to new location."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
-
-        # Create mock provisioners
-        rust = dot.Provisioner(
-            name="rust",
-            description="Rust toolchain",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["cargo", "rustc"]),
-            requires=frozenset(),
-            install_script=(
-                f"mkdir -p {tmp_path}/.cargo/bin && "
-                f"echo '#!/bin/sh\necho mock cargo' > {tmp_path}/.cargo/bin/cargo && "
-                f"chmod +x {tmp_path}/.cargo/bin/cargo"
-            ),
-            priority=3,
-        )
+        """Test that status reports ok when paths are properly expanded."""
+        # Setup paths
+        home_dir = tmp_path / "home"
+        dot_config_dir = home_dir / ".dot-config"
+        home_dir.mkdir()
+        dot_config_dir.mkdir()
 
-        sheldon = dot.Provisioner(
-            name="sheldon",
-            description="Plugin manager",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["sheldon"]),
-            requires=frozenset(["cargo"]),
-            install_script="cargo --version",  # Should find the mock cargo
-            priority=4,
-        )
+        # Create source file
+        source_file = dot_config_dir / ".gitconfig"
+        source_file.write_text("[user]\nname = Test")
 
-        provisioners = {"rust": rust, "sheldon": sheldon}
+        # Create symlink (as dot.py would)
+        symlink = home_dir / ".gitconfig"
+        symlink.symlink_to(dot_config_dir / ".gitconfig")
 
-        # Mock home directory and clean PATH
-        monkeypatch.setenv("HOME", str(tmp_path))
-        monkeypatch.setenv("PATH", "/usr/bin:/bin")
+        # Mock home directory BEFORE creating config
+        monkeypatch.setenv("HOME", str(home_dir))
 
-        manager = dot.ProvisionerManager(provisioners, runner, platform_obj)
+        # Create config
+        config_content = """
+[config]
+source = "~/.dot-config"
 
-        # Mock _is_installed to return False for both
-        with patch.object(manager, "_is_installed", return_value=False):
-            # Run provisioning
-            results = await manager.provision_all()
+[home.files]
+".gitconfig" = ".gitconfig"
+"""
+        config_file = tmp_path / "dot.toml"
+        config_file.write_text(config_content)
 
-        # Both should succeed if PATH handling works
-        assert results["rust"]
-        assert results["sheldon"]
+        # Create app and check status (HOME is already mocked)
+        app = dot.DotfilesApp(config_path=config_file)
+        status = await app.status()
 
-    @pytest.mark.asyncio
-    async def test_environment_passed_to_install_commands(self) -> None:
-        """Test that updated environment is passed to installation commands."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
+        # Fixed: status should report "ok" now that paths are expanded
+        assert status["dotfiles"][".gitconfig"] == "ok"
 
-        # Track environments passed to run()
-        environments = []
 
-        async def mock_run(cmd, **kwargs):
-            if kwargs.get("env"):
-                environments.append(kwargs["env"].get("PATH", ""))
-            return dot.CommandResult(success=True)
+# ═══════════════════════════════════════════════════════════════════════════════
+# RESULT DATACLASS TESTS
+# ═══════════════════════════════════════════════════════════════════════════════
 
-        with patch.object(runner, "run", side_effect=mock_run):
-            prov1 = dot.Provisioner(
-                name="tool1",
-                description="Tool 1",
-                type=dot.ProvisionerType.PROVISIONER,
-                install_method=dot.InstallMethod.SCRIPT,
-                provides=frozenset(["tool1"]),
-                requires=frozenset(),
-                install_script="echo installing tool1",
-                priority=1,
-            )
 
-            prov2 = dot.Provisioner(
-                name="tool2",
-                description="Tool 2",
-                type=dot.ProvisionerType.PROVISIONER,
-                install_method=dot.InstallMethod.SCRIPT,
-                provides=frozenset(["tool2"]),
-                requires=frozenset(["tool1"]),
-                install_script="echo installing tool2",
-                priority=2,
-            )
+class TestResultDataclasses:
+    """Test Result hierarchy behavior."""
 
-            manager = dot.ProvisionerManager(
-                {"tool1": prov1, "tool2": prov2},
-                runner,
-                platform_obj,
-            )
+    def test_result_bool_true(self):
+        """Successful Result is truthy."""
+        r = dot.Result(success=True)
+        assert r
+        assert bool(r) is True
 
-            # Mock _is_installed and _detect_path_additions
-            with (
-                patch.object(manager, "_is_installed", return_value=False),
-                patch.object(
-                    manager,
-                    "_detect_path_additions",
-                    return_value=["/new/path"],
-                ),
-            ):
-                await manager.provision_all()
+    def test_result_bool_false(self):
+        """Failed Result is falsy and carries error."""
+        r = dot.Result(success=False, error="something broke")
+        assert not r
+        assert bool(r) is False
+        assert r.error == "something broke"
 
-            # Should have called run with environments
-            assert len(environments) >= 2
-            # Second call should have updated PATH
-            if len(environments) >= 2:
-                assert "/new/path" in environments[1]
+    def test_result_ok_factory(self):
+        """Result.ok() creates successful result."""
+        r = dot.Result.ok()
+        assert r.success is True
+        assert r.error == ""
 
-    @pytest.mark.asyncio
-    async def test_path_additions_with_wildcards(self, tmp_path) -> None:
-        """Test PATH detection with wildcard patterns (e.g., ruby gems)."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
+    def test_result_fail_factory(self):
+        """Result.fail() creates failed result with error."""
+        r = dot.Result.fail(error="disk full")
+        assert r.success is False
+        assert r.error == "disk full"
 
-        # Create a provisioner that provides gem
-        prov = dot.Provisioner(
-            name="ruby",
-            description="Ruby",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["gem"]),
-            requires=frozenset(),
+    def test_symlink_result_inherits_bool(self):
+        """SymlinkResult inherits __bool__ and carries action."""
+        ok = dot.SymlinkResult.ok(
+            source=pathlib.Path("/a"),
+            dest=pathlib.Path("/b"),
+            action=dot.SymlinkAction.CREATE,
         )
+        assert ok
+        assert ok.action == dot.SymlinkAction.CREATE
 
-        # Create ruby gem directories with version
-        gem_path = tmp_path / ".gem" / "ruby" / "3.0.0" / "bin"
-        gem_path.mkdir(parents=True)
+        fail = dot.SymlinkResult.fail(
+            error="perm denied",
+            source=pathlib.Path("/a"),
+            dest=pathlib.Path("/b"),
+        )
+        assert not fail
+        assert "perm denied" in fail.error
 
-        with patch.dict(os.environ, {"HOME": str(tmp_path)}):
-            manager = dot.ProvisionerManager({"ruby": prov}, runner, platform_obj)
+    def test_install_result_failed_property(self):
+        """InstallResult.failed returns only failed items."""
+        items = [
+            dot.SymlinkResult.ok(
+                source=pathlib.Path("/a"),
+                dest=pathlib.Path("/b"),
+                action=dot.SymlinkAction.CREATE,
+            ),
+            dot.SymlinkResult.fail(
+                error="err",
+                source=pathlib.Path("/c"),
+                dest=pathlib.Path("/d"),
+            ),
+        ]
+        r = dot.InstallResult(success=False, error="1 failed", items=items)
+        assert len(r.failed) == 1
+        assert r.failed[0].dest == pathlib.Path("/d")
 
-            # Detect PATH additions
-            paths = await manager._detect_path_additions(prov)
+    def test_provision_result_failed_names(self):
+        """ProvisionResult.failed_names returns names of failed provisioners."""
+        r = dot.ProvisionResult(
+            success=False,
+            error="failed",
+            results={
+                "rust": dot.Result.ok(),
+                "sheldon": dot.Result.fail(error="missing cargo"),
+            },
+        )
+        assert r.failed_names == ["sheldon"]
 
-            # Should find the versioned gem bin directory
-            assert any("3.0.0/bin" in path for path in paths)
+    def test_cleanup_result_fields(self):
+        """CleanupResult tracks removed paths and errors."""
+        r = dot.CleanupResult(
+            success=False,
+            error="1 pattern(s) failed",
+            removed=[pathlib.Path("/tmp/foo")],
+            errors=[("*.bak", "permission denied")],
+        )
+        assert not r
+        assert len(r.removed) == 1
+        assert len(r.errors) == 1
 
-    @pytest.mark.asyncio
-    async def test_dry_run_does_not_update_path(self) -> None:
-        """Test that dry run mode doesn't update PATH."""
-        runner = dot.AsyncCommandRunner(dry_run=True)
-        platform_obj = dot.Platform()
 
-        prov = dot.Provisioner(
-            name="test",
-            description="Test",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["test"]),
-            requires=frozenset(),
-            install_script="echo test",
-        )
+# ═══════════════════════════════════════════════════════════════════════════════
+# PROTECTED DIRECTORIES & CHANGESET TESTS
+# ═══════════════════════════════════════════════════════════════════════════════
 
-        manager = dot.ProvisionerManager({"test": prov}, runner, platform_obj)
 
-        # Track if _detect_path_additions is called
-        detect_called = False
+class TestConfigProtectedParsing:
+    """Test parsing protected list from TOML."""
 
-        async def mock_detect(prov):
-            nonlocal detect_called
-            detect_called = True
-            return ["/some/path"]
+    def test_parse_protected_list(self, tmp_path):
+        """Protected dirs parsed from TOML."""
+        config_content = """
+[home]
+protected = [".claude", ".cursor", ".config/codex"]
 
-        with (
-            patch.object(manager, "_is_installed", return_value=False),
-            patch.object(manager, "_detect_path_additions", side_effect=mock_detect),
-        ):
-            results = await manager.provision_all(dry_run=True)
+[home.files]
+".gitconfig" = ".gitconfig"
+"""
+        config_file = tmp_path / "dot.toml"
+        config_file.write_text(config_content)
 
-        # Should succeed but not call path detection in dry run
-        assert results["test"]
-        assert not detect_called
+        loader = dot.ConfigLoader(config_file)
+        config = loader.load()
 
-    @pytest.mark.asyncio
-    async def test_multiple_path_patterns_for_single_tool(self, tmp_path) -> None:
-        """Test tools with multiple possible PATH locations."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
+        assert len(config.protected) == 3
+        assert pathlib.Path(".claude") in config.protected
+        assert pathlib.Path(".cursor") in config.protected
+        assert pathlib.Path(".config/codex") in config.protected
 
-        # npm can install to multiple locations
-        prov = dot.Provisioner(
-            name="npm",
-            description="NPM",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["npm"]),
-            requires=frozenset(),
-        )
+    def test_parse_no_protected(self, tmp_path):
+        """Missing protected key defaults to empty list."""
+        config_content = """
+[home.files]
+".gitconfig" = ".gitconfig"
+"""
+        config_file = tmp_path / "dot.toml"
+        config_file.write_text(config_content)
 
-        # Create both possible npm paths
-        npm_global = tmp_path / ".npm-global" / "bin"
-        npm_packages = tmp_path / ".npm-packages" / "bin"
-        npm_global.mkdir(parents=True)
-        npm_packages.mkdir(parents=True)
+        loader = dot.ConfigLoader(config_file)
+        config = loader.load()
 
-        with patch.dict(os.environ, {"HOME": str(tmp_path)}):
-            manager = dot.ProvisionerManager({"npm": prov}, runner, platform_obj)
+        assert config.protected == []
 
-            # Detect PATH additions
-            paths = await manager._detect_path_additions(prov)
 
-            # Should find both npm paths
-            assert str(npm_global) in paths
-            assert str(npm_packages) in paths
+def _classify_reference(
+    source: pathlib.Path,
+    dest: pathlib.Path,
+    home: pathlib.Path,
+    protected: list[pathlib.Path],
+) -> dot.SymlinkAction:
+    """Classify a mapping the way the original pathlib-based planner did."""
+    if not source.exists():
+        return dot.SymlinkAction.SKIP
+    if dest.is_symlink() and dest.resolve() == source.resolve():
+        return dot.SymlinkAction.OK
+    if dest.exists() or dest.is_symlink():
+        if dest.is_dir() and not dest.is_symlink():
+            try:
+                rel = dest.relative_to(home)
+            except ValueError:
+                return dot.SymlinkAction.DELETING
+            if rel in protected:
+                return dot.SymlinkAction.PROTECTED
+            return dot.SymlinkAction.DELETING
+        return dot.SymlinkAction.REPLACE
+    return dot.SymlinkAction.CREATE
+
+
+def _timed(plan: typing.Callable[[], object]) -> float:
+    """Run *plan* once and return how long it took in milliseconds."""
+    start = time.perf_counter()
+    plan()
+    return (time.perf_counter() - start) * 1e3
+
+
+def _synthetic_mappings(
+    root: pathlib.Path, count: int
+) -> list[tuple[pathlib.Path, pathlib.Path]]:
+    """Lay out *count* mappings covering every classification outcome."""
+    source_root, home = root / "src", root / "home"
+    source_root.mkdir()
+    home.mkdir()
+    mappings = []
+    for i in range(count):
+        source, dest = source_root / f"f{i}", home / f".f{i}"
+        match i % 10:
+            case 0 | 1 | 2 | 3 | 4 | 5:
+                source.write_text("x")
+                dest.symlink_to(source)
+            case 6:
+                source.write_text("x")  # dest missing
+            case 7:
+                source.write_text("x")
+                dest.symlink_to(source_root)
+            case 8:
+                source.write_text("x")
+                dest.write_text("y")
+            case _:
+                source.mkdir()
+                dest.mkdir()
+        mappings.append((source, dest))
+    return mappings
 
 
-class TestErrorOutputCapture:
-    """Test error output capture and logging."""
+class TestSymlinkClassification:
+    """Test _classify_action for all SymlinkAction variants."""
 
     @pytest.mark.asyncio
-    async def test_script_install_captures_stderr(
-        self,
-        caplog: pytest.LogCaptureFixture,
-    ) -> None:
-        """Test that script installation captures and logs stderr."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
-
-        prov = dot.Provisioner(
-            name="test-fail",
-            description="Test failing script",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["test"]),
-            requires=frozenset(),
-            install_script="echo 'Error: Missing dependency' >&2 && exit 1",
-        )
+    async def test_classify_ok(self, temp_home):
+        """Correct symlink -> OK."""
+        source = temp_home / "source"
+        source.mkdir()
+        dest = temp_home / "dest"
+        dest.symlink_to(source)
 
-        manager = dot.ProvisionerManager({"test-fail": prov}, runner, platform_obj)
+        app = dot.DotfilesApp(dry_run=False)
+        assert app._classify_action(source, dest) == dot.SymlinkAction.OK
 
-        with caplog.at_level(logging.ERROR):
-            success = await manager._install_via_script(prov)
+    @pytest.mark.asyncio
+    async def test_classify_create(self, temp_home):
+        """No dest -> CREATE."""
+        source = temp_home / "source"
+        source.mkdir()
+        dest = temp_home / "dest"
 
-        assert not success
-        assert "Failed to install test-fail" in caplog.text
-        assert "Error output:" in caplog.text
-        assert "Error: Missing dependency" in caplog.text
+        app = dot.DotfilesApp(dry_run=False)
+        assert app._classify_action(source, dest) == dot.SymlinkAction.CREATE
 
     @pytest.mark.asyncio
-    async def test_script_install_captures_stdout_in_debug(
-        self,
-        caplog: pytest.LogCaptureFixture,
-    ) -> None:
-        """Test that script installation captures stdout to debug log."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
+    async def test_classify_replace_file(self, temp_home):
+        """Existing regular file -> REPLACE."""
+        source = temp_home / "source.txt"
+        source.write_text("content")
+        dest = temp_home / "dest.txt"
+        dest.write_text("old")
 
-        prov = dot.Provisioner(
-            name="test-fail",
-            description="Test failing script with stdout",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["test"]),
-            requires=frozenset(),
-            install_script=(
-                "echo 'Starting installation...' && echo 'ERROR!' >&2 && exit 1"
-            ),
-        )
+        app = dot.DotfilesApp(dry_run=False)
+        assert app._classify_action(source, dest) == dot.SymlinkAction.REPLACE
 
-        manager = dot.ProvisionerManager({"test-fail": prov}, runner, platform_obj)
+    @pytest.mark.asyncio
+    async def test_classify_replace_wrong_symlink(self, temp_home):
+        """Symlink to wrong target -> REPLACE."""
+        source = temp_home / "source"
+        source.mkdir()
+        wrong = temp_home / "wrong"
+        wrong.mkdir()
+        dest = temp_home / "dest"
+        dest.symlink_to(wrong)
+
+        app = dot.DotfilesApp(dry_run=False)
+        assert app._classify_action(source, dest) == dot.SymlinkAction.REPLACE
 
-        with caplog.at_level(logging.DEBUG):
-            success = await manager._install_via_script(prov)
+    @pytest.mark.asyncio
+    async def test_classify_deleting(self, temp_home):
+        """Real directory (not protected) -> DELETING."""
+        source = temp_home / "source"
+        source.mkdir()
+        dest = temp_home / "dest"
+        dest.mkdir()
+        (dest / "file.txt").write_text("data")
 
-        assert not success
-        assert "Standard output:" in caplog.text
-        assert "Starting installation..." in caplog.text
+        app = dot.DotfilesApp(dry_run=False)
+        assert app._classify_action(source, dest) == dot.SymlinkAction.DELETING
 
     @pytest.mark.asyncio
-    async def test_package_install_captures_errors(
-        self,
-        caplog: pytest.LogCaptureFixture,
-    ) -> None:
-        """Test that package installation captures and logs errors."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
+    async def test_classify_protected(self, temp_home):
+        """Real directory that's protected -> PROTECTED."""
+        source = temp_home / "source"
+        source.mkdir()
+        dest = temp_home / ".claude"
+        dest.mkdir()
+        (dest / "history.jsonl").write_text("precious data")
 
-        prov = dot.Provisioner(
-            name="nonexistent-pkg",
-            description="Test nonexistent package",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.PACKAGE,
-            provides=frozenset(["test"]),
-            requires=frozenset(),
-        )
+        app = dot.DotfilesApp(dry_run=False)
+        app.config.protected = [pathlib.Path(".claude")]
+        assert app._classify_action(source, dest) == dot.SymlinkAction.PROTECTED
 
-        manager = dot.ProvisionerManager(
-            {"nonexistent-pkg": prov},
-            runner,
-            platform_obj,
-        )
+    @pytest.mark.asyncio
+    async def test_classify_skip(self, temp_home):
+        """Source doesn't exist -> SKIP."""
+        source = temp_home / "nonexistent"
+        dest = temp_home / "dest"
 
-        # Mock the package manager command to fail
-        with (
-            patch.object(platform_obj, "get_package_manager", return_value="apt"),
-            patch.object(
-                runner,
-                "run",
-                new_callable=unittest.mock.AsyncMock,
-            ) as mock_run,
-            caplog.at_level(logging.ERROR),
-        ):
-            mock_run.return_value = dot.CommandResult(
-                success=False,
-                stderr="E: Unable to locate package nonexistent-pkg",
-                returncode=100,
-            )
+        app = dot.DotfilesApp(dry_run=False)
+        assert app._classify_action(source, dest) == dot.SymlinkAction.SKIP
 
-            success = await manager._install_via_package(prov)
+    def test_classify_ok_via_relative_symlink(self, temp_home):
+        """Relative symlink to the source -> OK."""
+        source = temp_home / "source"
+        source.mkdir()
+        dest = temp_home / "dest"
+        dest.symlink_to("source")
 
-        assert not success
-        assert "Failed to install nonexistent-pkg via apt" in caplog.text
-        assert "Error output:" in caplog.text
-        assert "Unable to locate package nonexistent-pkg" in caplog.text
+        app = dot.DotfilesApp(dry_run=False)
+        assert app._classify_action(source, dest) == dot.SymlinkAction.OK
 
-    @pytest.mark.asyncio
-    async def test_binary_install_download_error(
-        self,
-        caplog: pytest.LogCaptureFixture,
-    ) -> None:
-        """Test binary installation captures download errors."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
+    def test_classify_ok_via_resolved_source_root(self, tmp_path, temp_home):
+        """Symlink into the real path of a symlinked source root -> OK."""
+        real_root = tmp_path / "real-dot-config"
+        (real_root / "nvim").mkdir(parents=True)
+        root = temp_home / ".dot-config"
+        root.symlink_to(real_root)
+        dest = temp_home / ".nvim"
+        dest.symlink_to(real_root / "nvim")
+        classifier = dot.SymlinkClassifier(temp_home, source_root=root)
+
+        with patch.object(pathlib.Path, "resolve", side_effect=AssertionError):
+            assert classifier.classify(root / "nvim", dest) == dot.SymlinkAction.OK
+
+    def test_classify_dangling_symlink(self, temp_home):
+        """Dangling symlink -> REPLACE."""
+        source = temp_home / "source"
+        source.mkdir()
+        dest = temp_home / "dest"
+        dest.symlink_to(temp_home / "gone")
 
-        prov = dot.Provisioner(
-            name="test-bin",
-            description="Test binary",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.BINARY,
-            provides=frozenset(["test"]),
-            requires=frozenset(),
-            binary_url="https://invalid.example.com/nonexistent",
-        )
+        app = dot.DotfilesApp(dry_run=False)
+        assert app._classify_action(source, dest) == dot.SymlinkAction.REPLACE
 
-        manager = dot.ProvisionerManager({"test-bin": prov}, runner, platform_obj)
+    def test_classify_all_matches_reference(self, tmp_path):
+        """Batched classification agrees with per-mapping pathlib checks."""
+        mappings = _synthetic_mappings(tmp_path, 40)
+        home = tmp_path / "home"
+        (home / ".keep").mkdir()
+        mappings.append((tmp_path / "src" / "f0", home / ".keep"))
+        protected = [pathlib.Path(".keep")]
+        classifier = dot.SymlinkClassifier(home, protected, tmp_path / "src")
 
-        with (
-            patch.object(
-                runner,
-                "run",
-                new_callable=unittest.mock.AsyncMock,
-            ) as mock_run,
-            caplog.at_level(logging.ERROR),
-        ):
-            # First call fails (curl download)
-            mock_run.return_value = dot.CommandResult(
-                success=False,
-                stderr="curl: (6) Could not resolve host: invalid.example.com",
-                returncode=6,
-            )
+        actions = classifier.classify_all(mappings)
 
-            success = await manager._install_via_binary(prov)
+        assert actions == [
+            _classify_reference(source, dest, home, protected)
+            for source, dest in mappings
+        ]
+        assert set(actions) == {
+            dot.SymlinkAction.OK,
+            dot.SymlinkAction.CREATE,
+            dot.SymlinkAction.REPLACE,
+            dot.SymlinkAction.DELETING,
+            dot.SymlinkAction.PROTECTED,
+        }
 
-        assert not success
-        assert "Failed to download test-bin" in caplog.text
-        assert "Error output:" in caplog.text
-        assert "Could not resolve host" in caplog.text
+    def test_classify_all_fans_out_on_slow_filesystem(self, tmp_path, monkeypatch):
+        """Mappings past the probe go to threads when syscalls are slow."""
+        mappings = _synthetic_mappings(tmp_path, 30)
+        classifier = dot.SymlinkClassifier(tmp_path / "home")
+        monkeypatch.setattr(dot, "CLASSIFY_PROBE", 10)
+        monkeypatch.setattr(dot, "CLASSIFY_PARALLEL_LATENCY", 0.0)
+        threads: set[str] = set()
+        classify = classifier.classify
 
-    @pytest.mark.asyncio
-    async def test_binary_install_permission_error(
-        self,
-        caplog: pytest.LogCaptureFixture,
-    ) -> None:
-        """Test binary installation captures permission errors."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
+        def record_thread(
+            source: pathlib.Path, dest: pathlib.Path
+        ) -> dot.SymlinkAction:
+            threads.add(threading.current_thread().name)
+            return classify(source, dest)
 
-        prov = dot.Provisioner(
-            name="test-bin",
-            description="Test binary",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.BINARY,
-            provides=frozenset(["test"]),
-            requires=frozenset(),
-            binary_url="https://example.com/test-bin",
-        )
+        monkeypatch.setattr(classifier, "classify", record_thread)
 
-        manager = dot.ProvisionerManager({"test-bin": prov}, runner, platform_obj)
+        actions = classifier.classify_all(mappings)
 
-        with (
-            patch.object(
-                runner,
-                "run",
-                new_callable=unittest.mock.AsyncMock,
-            ) as mock_run,
-            caplog.at_level(logging.ERROR),
-        ):
-            # Download succeeds, chmod succeeds, mv fails
-            mock_run.side_effect = [
-                dot.CommandResult(success=True),  # curl
-                dot.CommandResult(success=True),  # chmod
-                dot.CommandResult(
-                    success=False,
-                    stderr=(
-                        "mv: cannot move '/tmp/test-bin' to "
-                        "'/usr/local/bin/': Permission denied"
-                    ),
-                    returncode=1,
-                ),  # mv
-            ]
+        assert actions == [classify(source, dest) for source, dest in mappings]
+        assert len(threads) > 1
 
-            success = await manager._install_via_binary(prov)
+    def test_classify_all_stays_serial_on_fast_filesystem(self, tmp_path, monkeypatch):
+        """Fast syscalls keep classification on the calling thread."""
+        mappings = _synthetic_mappings(tmp_path, 30)
+        classifier = dot.SymlinkClassifier(tmp_path / "home")
+        monkeypatch.setattr(dot, "CLASSIFY_PROBE", 10)
+        monkeypatch.setattr(dot, "CLASSIFY_PARALLEL_LATENCY", 60.0)
 
-        assert not success
-        assert "Failed to move test-bin to /usr/local/bin/" in caplog.text
-        assert "Error output:" in caplog.text
-        assert "Permission denied" in caplog.text
+        with patch("concurrent.futures.ThreadPoolExecutor", side_effect=AssertionError):
+            assert len(classifier.classify_all(mappings)) == len(mappings)
 
     @pytest.mark.asyncio
-    async def test_exception_logging(self, caplog: pytest.LogCaptureFixture) -> None:
-        """Test that exceptions are logged with traceback."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
+    async def test_build_changeset_mixed(self, temp_home):
+        """Integration test building changeset with multiple action types."""
+        dot_config = temp_home / "dot-config"
+        dot_config.mkdir()
+        (dot_config / ".gitconfig").write_text("git config")
+        # .zshrc source missing -> SKIP
 
-        prov = dot.Provisioner(
-            name="test-exception",
-            description="Test exception",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["test"]),
-            requires=frozenset(),
-            install_script="test",
-        )
+        config_content = f"""
+[config]
+source = "{dot_config}"
 
-        manager = dot.ProvisionerManager({"test-exception": prov}, runner, platform_obj)
+[home]
+protected = [".claude"]
 
-        with (
-            patch.object(runner, "run", side_effect=Exception("Unexpected error")),
-            caplog.at_level(logging.ERROR),
-        ):
-            success = await manager._install_via_script(prov)
+[home.files]
+".gitconfig" = ".gitconfig"
+".zshrc" = ".zshrc"
+"""
+        config_path = temp_home / "dot.toml"
+        config_path.write_text(config_content)
 
-        assert not success
-        assert "Failed to install test-exception" in caplog.text
-        # logger.exception includes traceback info
+        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
 
-    @pytest.mark.asyncio
-    async def test_real_command_error(self, caplog: pytest.LogCaptureFixture) -> None:
-        """Test with a real command that fails."""
-        runner = dot.AsyncCommandRunner(dry_run=False)
-        platform_obj = dot.Platform()
+        plans = app._build_changeset()
+        actions = {p.action for p in plans}
+        assert dot.SymlinkAction.CREATE in actions  # .gitconfig
+        assert dot.SymlinkAction.SKIP in actions  # .zshrc (no source)
 
-        prov = dot.Provisioner(
-            name="test-real",
-            description="Test real command",
-            type=dot.ProvisionerType.PROVISIONER,
-            install_method=dot.InstallMethod.SCRIPT,
-            provides=frozenset(["test"]),
-            requires=frozenset(),
-            install_script="ls /nonexistent/directory",
-        )
 
-        manager = dot.ProvisionerManager({"test-real": prov}, runner, platform_obj)
+class TestInstallJournal:
+    """Test incremental install driven by the applied-state journal."""
 
-        with caplog.at_level(logging.ERROR):
-            success = await manager._install_via_script(prov)
+    @pytest.fixture
+    def dotfiles(self, temp_home: pathlib.Path) -> pathlib.Path:
+        """Write a config mapping two files and a directory into home."""
+        dot_config = temp_home / "dot-config"
+        (dot_config / "nvim").mkdir(parents=True)
+        (dot_config / ".zshrc").write_text("zsh")
+        (dot_config / ".gitconfig").write_text("git")
+        config_path = temp_home / "dot.toml"
+        config_path.write_text(
+            f"""
+[config]
+source = "{dot_config}"
 
-        assert not success
-        assert "Failed to install test-real" in caplog.text
-        assert "Error output:" in caplog.text
-        # The actual error message varies by system but should mention the directory
-        assert (
-            "nonexistent" in caplog.text or "No such file or directory" in caplog.text
+[home.files]
+".zshrc" = ".zshrc"
+".gitconfig" = ".gitconfig"
+
+[home.dirs]
+".config/nvim" = "nvim"
+"""
         )
+        (temp_home / ".config").mkdir()
+        return config_path
+
+    @staticmethod
+    async def _install(
+        config_path: pathlib.Path, *, full: bool = False
+    ) -> tuple[dot.InstallResult, list[pathlib.Path]]:
+        """Install with a fresh app, returning the dests that were classified."""
+        app = dot.DotfilesApp(config_path=config_path, force=True)
+        classify_all = app._classifier().classify_all
+        classified: list[pathlib.Path] = []
+
+        def spy(
+            mappings: collections.abc.Sequence[tuple[pathlib.Path, pathlib.Path]],
+        ) -> list[dot.SymlinkAction]:
+            classified.extend(dest for _, dest in mappings)
+            return classify_all(mappings)
+
+        with patch.object(dot.SymlinkClassifier, "classify_all", side_effect=spy):
+            result = await app.install_dotfiles(full=full)
+        return result, classified
 
+    @pytest.mark.asyncio
+    async def test_first_install_classifies_everything(
+        self, dotfiles: pathlib.Path, temp_home: pathlib.Path
+    ) -> None:
+        """Test an empty journal falls back to classifying every mapping."""
+        result, classified = await self._install(dotfiles)
 
-class TestNonInteractiveInstallers:
-    """Test non-interactive installation scripts."""
+        assert result
+        assert len(classified) == 3
+        assert (temp_home / ".config/nvim").is_symlink()
+        assert (dot._xdg_cache_dir() / "install-journal.json").is_file()
 
     @pytest.mark.asyncio
-    async def test_starship_installer_non_interactive(self) -> None:
-        """Test that starship installer includes --yes flag."""
-        config_loader = dot.ConfigLoader()
-        config = config_loader.load()
-
-        # Find starship enhancement
-        starship = config.enhancements.get("starship")
-        assert starship is not None
-        assert "--yes" in starship.install_script
-        assert "sh -s -- --yes" in starship.install_script
+    async def test_unchanged_install_classifies_nothing(
+        self, dotfiles: pathlib.Path
+    ) -> None:
+        """Test a repeat install trusts the journal for every mapping."""
+        await self._install(dotfiles)
 
-    def test_build_essential_includes_pkg_config(self) -> None:
-        """Test that build_essential provisioner includes pkg-config."""
-        config_loader = dot.ConfigLoader()
-        config = config_loader.load()
+        result, classified = await self._install(dotfiles)
 
-        # Find build_essential provisioner
-        build_essential = config.provisioners.get("build_essential")
-        assert build_essential is not None
-        assert "pkg-config" in build_essential.provides
-        assert "openssl" in build_essential.provides
-        # Should use script method to install multiple packages
-        assert build_essential.install_method == dot.InstallMethod.SCRIPT
-        assert "pkg-config" in build_essential.install_script
-        assert "libssl-dev" in build_essential.install_script
+        assert result
+        assert classified == []
+        assert all(item.action is dot.SymlinkAction.OK for item in result.items)
 
+    @pytest.mark.asyncio
+    async def test_settled_directories_skip_per_entry_checks(
+        self, dotfiles: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """Test unchanged directories vouch for their entries without syscalls."""
+        monkeypatch.setattr(dot, "JOURNAL_RACY_NS", 0)
+        await self._install(dotfiles)
+        await self._install(dotfiles)  # records directories as settled
 
-class TestSymlinkCorrectness:
-    """Test that symlinks are created in the correct direction."""
+        with patch.object(pathlib.Path, "readlink", side_effect=AssertionError):
+            result, classified = await self._install(dotfiles)
+
+        assert result
+        assert classified == []
 
     @pytest.mark.asyncio
-    async def test_symlink_direction(
-        self,
-        tmp_path: pathlib.Path,
-        temp_home: pathlib.Path,
+    async def test_replaced_dest_is_reclassified(
+        self, dotfiles: pathlib.Path, temp_home: pathlib.Path
     ) -> None:
-        """Test that symlinks are created from home to dot-config, not vice versa."""
-        # Create source directory and file
-        dot_config = tmp_path / "dot-config"
-        dot_config.mkdir()
-        source_file = dot_config / ".zshrc"
-        source_file.write_text("# zsh config")
+        """Test a dest replaced since the last run is repaired."""
+        await self._install(dotfiles)
+        await self._install(dotfiles)
+        zshrc = temp_home / ".zshrc"
+        zshrc.unlink()
+        zshrc.write_text("local edits")
 
-        # Create a simple config
-        config_content = f"""
-[config]
-source = "{dot_config}"
+        result, classified = await self._install(dotfiles)
 
-[home.files]
-".zshrc" = ".zshrc"
-"""
-        config_path = tmp_path / "dot.toml"
-        config_path.write_text(config_content)
+        assert result
+        assert classified == [zshrc]
+        assert zshrc.is_symlink()
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+    @pytest.mark.asyncio
+    async def test_removed_source_is_reclassified(
+        self, dotfiles: pathlib.Path, temp_home: pathlib.Path
+    ) -> None:
+        """Test a source deleted since the last run is planned as SKIP."""
+        await self._install(dotfiles)
+        (temp_home / "dot-config" / ".gitconfig").unlink()
 
-        success = await app.install_dotfiles()
+        result, classified = await self._install(dotfiles)
 
-        assert success
+        assert classified == [temp_home / ".gitconfig"]
+        skipped = [i for i in result.items if i.action is dot.SymlinkAction.SKIP]
+        assert [i.dest for i in skipped] == [temp_home / ".gitconfig"]
 
-        # The symlink should exist in the home directory
-        home_link = temp_home / ".zshrc"
-        assert home_link.exists()
-        assert home_link.is_symlink()
+    @pytest.mark.asyncio
+    async def test_changed_mapping_is_reclassified(
+        self, dotfiles: pathlib.Path, temp_home: pathlib.Path
+    ) -> None:
+        """Test a mapping whose config changed is not trusted."""
+        await self._install(dotfiles)
+        (temp_home / "dot-config" / "zshrc-work").write_text("work")
+        dotfiles.write_text(
+            dotfiles.read_text().replace(
+                '".zshrc" = ".zshrc"', '".zshrc" = "zshrc-work"'
+            )
+        )
 
-        # The symlink should point to the source file
-        assert home_link.resolve() == source_file.resolve()
+        result, classified = await self._install(dotfiles)
 
-        # The source file should NOT be a symlink
-        assert not source_file.is_symlink()
-        assert source_file.is_file()
+        assert result
+        assert classified == [temp_home / ".zshrc"]
+        assert (temp_home / ".zshrc").read_text() == "work"
 
-        # Reading through the symlink should give us the source content
-        assert home_link.read_text() == "# zsh config"
+    @pytest.mark.asyncio
+    async def test_full_ignores_journal(self, dotfiles: pathlib.Path) -> None:
+        """Test --full classifies every mapping even when nothing changed."""
+        await self._install(dotfiles)
 
+        result, classified = await self._install(dotfiles, full=True)
 
-class TestPathExpansionBug:
-    """Test that config.source path is properly expanded."""
+        assert result
+        assert len(classified) == 3
 
-    async def test_config_source_path_expansion(self, tmp_path: pathlib.Path) -> None:
-        """Test that ~/.dot-config is expanded to full path."""
-        # Create config with unexpanded path
-        config_content = """
-[config]
-source = "~/.dot-config"
+    @pytest.mark.asyncio
+    async def test_dry_run_leaves_journal_alone(self, dotfiles: pathlib.Path) -> None:
+        """Test a dry run neither creates nor updates the journal."""
+        app = dot.DotfilesApp(config_path=dotfiles, dry_run=True)
 
-[home.files]
-".gitconfig" = ".gitconfig"
-"""
-        config_file = tmp_path / "dot.toml"
-        config_file.write_text(config_content)
+        assert await app.install_dotfiles()
 
-        # Load config
-        loader = dot.ConfigLoader(config_file)
-        config = loader.load()
+        assert not (dot._xdg_cache_dir() / "install-journal.json").exists()
 
-        # Fixed: config.source should be expanded
-        assert config.source == pathlib.Path.home() / ".dot-config"
-        assert "~" not in str(config.source)
+    def test_no_cache_disables_journal(self, dotfiles: pathlib.Path) -> None:
+        """Test --no-cache runs without a journal."""
+        app = dot.DotfilesApp(config_path=dotfiles, no_cache=True)
 
-    async def test_status_reports_ok_with_expanded_paths(
-        self,
-        tmp_path: pathlib.Path,
-        monkeypatch: pytest.MonkeyPatch,
+        assert app.install_journal is None
+
+    @pytest.mark.asyncio
+    async def test_cli_full_flag(
+        self, dotfiles: pathlib.Path, monkeypatch: pytest.MonkeyPatch
     ) -> None:
-        """Test that status reports ok when paths are properly expanded."""
-        # Setup paths
-        home_dir = tmp_path / "home"
-        dot_config_dir = home_dir / ".dot-config"
-        home_dir.mkdir()
-        dot_config_dir.mkdir()
+        """Test `install --full` reaches install_dotfiles."""
+        monkeypatch.setattr(
+            "sys.argv", ["dot.py", "--config", str(dotfiles), "install", "--full"]
+        )
 
-        # Create source file
-        source_file = dot_config_dir / ".gitconfig"
-        source_file.write_text("[user]\nname = Test")
+        with patch.object(
+            dot.DotfilesApp, "install_dotfiles", new_callable=unittest.mock.AsyncMock
+        ) as mock_install:
+            mock_install.return_value = dot.InstallResult.ok()
+            assert await dot.async_main() == 0
 
-        # Create symlink (as dot.py would)
-        symlink = home_dir / ".gitconfig"
-        symlink.symlink_to(dot_config_dir / ".gitconfig")
+        mock_install.assert_awaited_once_with(full=True, plan_format=None)
 
-        # Mock home directory BEFORE creating config
-        monkeypatch.setenv("HOME", str(home_dir))
 
-        # Create config
-        config_content = """
+class TestTrashBin:
+    """Test trash-and-reap replacement of real directories."""
+
+    @pytest.fixture
+    def nvim_config(self, temp_home: pathlib.Path) -> pathlib.Path:
+        """Write a trash-mode config mapping ~/.config/nvim over a real tree."""
+        dot_config = temp_home / "dot-config"
+        (dot_config / "nvim").mkdir(parents=True)
+        real = temp_home / ".config" / "nvim"
+        (real / "lua").mkdir(parents=True)
+        (real / "lua" / "init.lua").write_text("old config")
+        config_path = temp_home / "dot.toml"
+        config_path.write_text(
+            f"""
 [config]
-source = "~/.dot-config"
+source = "{dot_config}"
+trash = true
+# Backups would take the replaced tree before the trash sees it
+backup = false
 
-[home.files]
-".gitconfig" = ".gitconfig"
+[home]
+protected = [".claude"]
+
+[home.dirs]
+".config/nvim" = "nvim"
+".claude" = "claude"
 """
-        config_file = tmp_path / "dot.toml"
-        config_file.write_text(config_content)
+        )
+        return config_path
 
-        # Create app and check status (HOME is already mocked)
-        app = dot.DotfilesApp(config_path=config_file)
-        status = await app.status()
+    def test_move_renames_into_trash(self, tmp_path: pathlib.Path) -> None:
+        """Test a directory keeps its inode when moved into the trash."""
+        victim = tmp_path / "victim"
+        (victim / "sub").mkdir(parents=True)
+        inode = victim.stat().st_ino
+        trash = dot.TrashBin(tmp_path / "trash")
 
-        # Fixed: status should report "ok" now that paths are expanded
-        assert status["dotfiles"][".gitconfig"] == "ok"
+        moved = trash.move(victim)
 
+        assert moved is not None
+        assert not victim.exists()
+        assert moved.stat().st_ino == inode
+        assert trash.entries() == [moved]
 
-# ═══════════════════════════════════════════════════════════════════════════════
-# RESULT DATACLASS TESTS
-# ═══════════════════════════════════════════════════════════════════════════════
+    def test_move_across_filesystems_declines(self, tmp_path: pathlib.Path) -> None:
+        """Test a cross-device rename leaves the directory in place."""
+        import errno
 
+        victim = tmp_path / "victim"
+        victim.mkdir()
+        trash = dot.TrashBin(tmp_path / "trash")
 
-class TestResultDataclasses:
-    """Test Result hierarchy behavior."""
+        with patch.object(
+            pathlib.Path, "rename", side_effect=OSError(errno.EXDEV, "cross-device")
+        ):
+            assert trash.move(victim) is None
 
-    def test_result_bool_true(self):
-        """Successful Result is truthy."""
-        r = dot.Result(success=True)
-        assert r
-        assert bool(r) is True
+        assert victim.is_dir()
 
-    def test_result_bool_false(self):
-        """Failed Result is falsy and carries error."""
-        r = dot.Result(success=False, error="something broke")
-        assert not r
-        assert bool(r) is False
-        assert r.error == "something broke"
+    def test_reap_empties_trash(self, tmp_path: pathlib.Path) -> None:
+        """Test reaping deletes trashed trees and files."""
+        trash = dot.TrashBin(tmp_path / "trash")
+        tree = tmp_path / "tree"
+        (tree / "deep").mkdir(parents=True)
+        (tree / "deep" / "file").write_text("x")
+        trash.move(tree)
 
-    def test_result_ok_factory(self):
-        """Result.ok() creates successful result."""
-        r = dot.Result.ok()
-        assert r.success is True
-        assert r.error == ""
+        removed = trash.reap()
 
-    def test_result_fail_factory(self):
-        """Result.fail() creates failed result with error."""
-        r = dot.Result.fail(error="disk full")
-        assert r.success is False
-        assert r.error == "disk full"
+        assert len(removed) == 1
+        assert trash.entries() == []
 
-    def test_symlink_result_inherits_bool(self):
-        """SymlinkResult inherits __bool__ and carries action."""
-        ok = dot.SymlinkResult.ok(
-            source=pathlib.Path("/a"),
-            dest=pathlib.Path("/b"),
-            action=dot.SymlinkAction.CREATE,
-        )
-        assert ok
-        assert ok.action == dot.SymlinkAction.CREATE
+    def test_move_beside_itself_across_filesystems(
+        self, tmp_path: pathlib.Path
+    ) -> None:
+        """Test a directory off the trash's filesystem is hidden next to itself."""
+        victim = tmp_path / "config" / "victim"
+        victim.mkdir(parents=True)
+        trash = dot.TrashBin(tmp_path / "trash")
+
+        with patch.object(trash, "_same_device", return_value=False):
+            moved = trash.move(victim)
+
+        assert moved is not None
+        assert moved.parent == victim.parent
+        assert moved.name.startswith(".victim.dot-trash.")
+        assert trash.entries() == []
+        assert trash.entries([victim]) == [moved]
+        assert trash.reap([victim]) == [moved]
+        assert list(victim.parent.iterdir()) == []
+
+    def test_trash_on_dest_device(self, tmp_path: pathlib.Path) -> None:
+        """Test a not-yet-created trash is judged by its nearest ancestor."""
+        victim = tmp_path / "victim"
+        victim.mkdir()
+        trash = dot.TrashBin(tmp_path / "data" / "dot" / "trash")
+
+        assert trash._same_device(victim)
+        moved = trash.move(victim)
+        assert moved is not None
+        assert moved.parent == trash.root
+
+    def test_reap_in_background_detaches(self, tmp_path: pathlib.Path) -> None:
+        """Test background reaping deletes only this session's entries."""
+        trash = dot.TrashBin(tmp_path / "trash")
+        (trash.root / "older.1").mkdir(parents=True)
+        tree = tmp_path / "tree"
+        tree.mkdir()
+        moved = trash.move(tree)
+
+        with patch("subprocess.Popen") as mock_popen:
+            trash.reap_in_background()
+            trash.reap_in_background()
+
+        mock_popen.assert_called_once()
+        assert mock_popen.call_args.args[0] == ["rm", "-rf", "--", str(moved)]
+        assert mock_popen.call_args.kwargs["start_new_session"] is True
+
+    def test_reap_in_background_removes_entries(self, tmp_path: pathlib.Path) -> None:
+        """Test the detached `rm -rf` actually empties the trash."""
+        trash = dot.TrashBin(tmp_path / "trash")
+        tree = tmp_path / "tree"
+        (tree / "sub").mkdir(parents=True)
+        trash.move(tree)
+
+        trash.reap_in_background()
+
+        deadline = time.monotonic() + 5
+        while trash.entries() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert trash.entries() == []
+
+    def test_trash_parsed_from_config(self, nvim_config: pathlib.Path) -> None:
+        """Test `[config] trash` enables the trash."""
+        app = dot.DotfilesApp(config_path=nvim_config)
+
+        assert app.config.trash
+        assert app.trash is not None
 
-        fail = dot.SymlinkResult.fail(
-            error="perm denied",
-            source=pathlib.Path("/a"),
-            dest=pathlib.Path("/b"),
-        )
-        assert not fail
-        assert "perm denied" in fail.error
+    @pytest.mark.asyncio
+    async def test_install_trashes_replaced_directory(
+        self, nvim_config: pathlib.Path, temp_home: pathlib.Path
+    ) -> None:
+        """Test the symlink replaces a real directory without deleting it inline."""
+        app = dot.DotfilesApp(config_path=nvim_config, force=True)
+        assert app.trash is not None
 
-    def test_install_result_failed_property(self):
-        """InstallResult.failed returns only failed items."""
-        items = [
-            dot.SymlinkResult.ok(
-                source=pathlib.Path("/a"),
-                dest=pathlib.Path("/b"),
-                action=dot.SymlinkAction.CREATE,
-            ),
-            dot.SymlinkResult.fail(
-                error="err",
-                source=pathlib.Path("/c"),
-                dest=pathlib.Path("/d"),
-            ),
-        ]
-        r = dot.InstallResult(success=False, error="1 failed", items=items)
-        assert len(r.failed) == 1
-        assert r.failed[0].dest == pathlib.Path("/d")
+        with (
+            patch.object(app.trash, "reap_in_background") as mock_reap,
+            patch("shutil.rmtree", side_effect=AssertionError),
+        ):
+            result = await app.install_dotfiles()
 
-    def test_provision_result_failed_names(self):
-        """ProvisionResult.failed_names returns names of failed provisioners."""
-        r = dot.ProvisionResult(
-            success=False,
-            error="failed",
-            results={
-                "rust": dot.Result.ok(),
-                "sheldon": dot.Result.fail(error="missing cargo"),
-            },
-        )
-        assert r.failed_names == ["sheldon"]
+        assert result
+        dest = temp_home / ".config" / "nvim"
+        assert dest.is_symlink()
+        (trashed,) = app.trash.entries()
+        assert (trashed / "lua" / "init.lua").read_text() == "old config"
+        mock_reap.assert_called_once()
 
-    def test_cleanup_result_fields(self):
-        """CleanupResult tracks removed paths and errors."""
-        r = dot.CleanupResult(
-            success=False,
-            error="1 pattern(s) failed",
-            removed=[pathlib.Path("/tmp/foo")],
-            errors=[("*.bak", "permission denied")],
-        )
-        assert not r
-        assert len(r.removed) == 1
-        assert len(r.errors) == 1
+    @pytest.mark.asyncio
+    async def test_install_deletes_inline_across_filesystems(
+        self, nvim_config: pathlib.Path, temp_home: pathlib.Path
+    ) -> None:
+        """Test a trash on another filesystem falls back to rmtree."""
+        app = dot.DotfilesApp(config_path=nvim_config, force=True)
+        assert app.trash is not None
 
+        with (
+            patch.object(app.trash, "move", return_value=None),
+            patch.object(app.trash, "reap_in_background"),
+        ):
+            result = await app.install_dotfiles()
 
-# ═══════════════════════════════════════════════════════════════════════════════
-# PROTECTED DIRECTORIES & CHANGESET TESTS
-# ═══════════════════════════════════════════════════════════════════════════════
+        assert result
+        assert (temp_home / ".config" / "nvim").is_symlink()
+        assert app.trash.entries() == []
 
+    @pytest.mark.asyncio
+    async def test_protected_directory_is_never_trashed(
+        self, nvim_config: pathlib.Path, temp_home: pathlib.Path
+    ) -> None:
+        """Test the protected-directory guard runs before any rename."""
+        claude = temp_home / ".claude"
+        claude.mkdir()
+        (claude / "history.jsonl").write_text("precious")
+        app = dot.DotfilesApp(config_path=nvim_config, force=True)
+        assert app.trash is not None
 
-class TestConfigProtectedParsing:
-    """Test parsing protected list from TOML."""
+        result = await app._create_symlink(temp_home / "dot-config" / "claude", claude)
 
-    def test_parse_protected_list(self, tmp_path):
-        """Protected dirs parsed from TOML."""
-        config_content = """
-[home]
-protected = [".claude", ".cursor", ".config/codex"]
+        assert not result
+        assert result.action is dot.SymlinkAction.PROTECTED
+        assert (claude / "history.jsonl").read_text() == "precious"
+        assert app.trash.entries() == []
 
-[home.files]
-".gitconfig" = ".gitconfig"
-"""
-        config_file = tmp_path / "dot.toml"
-        config_file.write_text(config_content)
+    @pytest.mark.asyncio
+    async def test_cleanup_reaps_trash(
+        self, nvim_config: pathlib.Path, tmp_path: pathlib.Path
+    ) -> None:
+        """Test `cleanup` empties what a previous install left in the trash."""
+        app = dot.DotfilesApp(config_path=nvim_config)
+        app.config.cleanup_patterns = []
+        assert app.trash is not None
+        tree = tmp_path / "tree"
+        tree.mkdir()
+        moved = app.trash.move(tree)
 
-        loader = dot.ConfigLoader(config_file)
-        config = loader.load()
+        result = await app.cleanup()
 
-        assert len(config.protected) == 3
-        assert pathlib.Path(".claude") in config.protected
-        assert pathlib.Path(".cursor") in config.protected
-        assert pathlib.Path(".config/codex") in config.protected
+        assert result
+        assert result.removed == [moved]
+        assert app.trash.entries() == []
+
+    @pytest.mark.asyncio
+    async def test_cleanup_dry_run_keeps_trash(
+        self, nvim_config: pathlib.Path, tmp_path: pathlib.Path
+    ) -> None:
+        """Test a dry-run cleanup only reports the trash."""
+        app = dot.DotfilesApp(config_path=nvim_config, dry_run=True)
+        app.config.cleanup_patterns = []
+        assert app.trash is not None
+        tree = tmp_path / "tree"
+        tree.mkdir()
+        app.trash.move(tree)
+
+        assert await app.cleanup()
+
+        assert len(app.trash.entries()) == 1
+
+
+class TestBackupStore:
+    """Test backups of dests replaced by install, and restoring them."""
+
+    @pytest.fixture
+    def replaced_config(self, temp_home: pathlib.Path) -> pathlib.Path:
+        """Write a config whose mappings replace a real file, tree and symlink."""
+        dot_config = temp_home / "dot-config"
+        (dot_config / "nvim").mkdir(parents=True)
+        (dot_config / "gitconfig").write_text("[user]\n")
+        (dot_config / "zshrc").write_text("# new\n")
+        (temp_home / ".gitconfig").write_text("[core]\n")
+        real = temp_home / ".config" / "nvim"
+        (real / "lua").mkdir(parents=True)
+        (real / "lua" / "init.lua").write_text("old config")
+        (real / "current").symlink_to("lua")
+        (temp_home / ".zshrc").symlink_to(temp_home / "elsewhere")
+        config_path = temp_home / "dot.toml"
+        config_path.write_text(
+            f"""
+[config]
+source = "{dot_config}"
+backup_keep = 3
 
-    def test_parse_no_protected(self, tmp_path):
-        """Missing protected key defaults to empty list."""
-        config_content = """
 [home.files]
-".gitconfig" = ".gitconfig"
-"""
-        config_file = tmp_path / "dot.toml"
-        config_file.write_text(config_content)
+".gitconfig" = "gitconfig"
+".zshrc" = "zshrc"
 
-        loader = dot.ConfigLoader(config_file)
-        config = loader.load()
+[home.dirs]
+".config/nvim" = "nvim"
+"""
+        )
+        return config_path
 
-        assert config.protected == []
+    @pytest.mark.asyncio
+    async def test_install_backs_up_and_restore_reverts(
+        self, replaced_config: pathlib.Path, temp_home: pathlib.Path
+    ) -> None:
+        """Test every replaced dest comes back as it was."""
+        app = dot.DotfilesApp(config_path=replaced_config, force=True)
+        assert app.backups is not None
+        assert app.backups.keep == 3
+
+        assert await app.install_dotfiles()
+        (run,) = app.backups.runs()
+        assert {e.kind for e in app.backups.entries(run)} == {"file", "dir", "symlink"}
+
+        result = await app.restore()
+
+        assert result
+        assert len(result.restored) == 3
+        assert (temp_home / ".gitconfig").read_text() == "[core]\n"
+        assert not (temp_home / ".gitconfig").is_symlink()
+        nvim = temp_home / ".config" / "nvim"
+        assert not nvim.is_symlink()
+        assert (nvim / "lua" / "init.lua").read_text() == "old config"
+        assert (nvim / "current").readlink() == pathlib.Path("lua")
+        assert (temp_home / ".zshrc").readlink() == temp_home / "elsewhere"
 
+    @pytest.mark.asyncio
+    async def test_replaced_directory_moves_into_backup(
+        self, replaced_config: pathlib.Path, temp_home: pathlib.Path
+    ) -> None:
+        """Test a replaced tree is renamed into the run, not copied or trashed."""
+        nvim = temp_home / ".config" / "nvim"
+        inode = nvim.stat().st_ino
+        app = dot.DotfilesApp(config_path=replaced_config, force=True)
+        assert app.backups is not None
 
-class TestSymlinkClassification:
-    """Test _classify_action for all SymlinkAction variants."""
+        with (
+            patch.object(dot.BackupStore, "_copy_tree") as mock_copy,
+            patch.object(dot.TrashBin, "move") as mock_trash,
+        ):
+            assert await app.install_dotfiles()
+
+        mock_copy.assert_not_called()
+        mock_trash.assert_not_called()
+        (entry,) = (
+            e for e in app.backups.entries(app.backups.runs()[0]) if e.kind == "dir"
+        )
+        assert entry.data.stat().st_ino == inode
+        assert nvim.is_symlink()
 
     @pytest.mark.asyncio
-    async def test_classify_ok(self, temp_home):
-        """Correct symlink -> OK."""
-        source = temp_home / "source"
-        source.mkdir()
-        dest = temp_home / "dest"
-        dest.symlink_to(source)
+    async def test_restore_selected_paths(
+        self, replaced_config: pathlib.Path, temp_home: pathlib.Path
+    ) -> None:
+        """Test restoring one dest leaves the other symlinks installed."""
+        app = dot.DotfilesApp(config_path=replaced_config, force=True)
+        assert await app.install_dotfiles()
 
-        app = dot.DotfilesApp(dry_run=False)
-        assert app._classify_action(source, dest) == dot.SymlinkAction.OK
+        result = await app.restore(paths=[pathlib.Path(".gitconfig")])
 
-    @pytest.mark.asyncio
-    async def test_classify_create(self, temp_home):
-        """No dest -> CREATE."""
-        source = temp_home / "source"
-        source.mkdir()
-        dest = temp_home / "dest"
+        assert result.restored == [temp_home / ".gitconfig"]
+        assert not (temp_home / ".gitconfig").is_symlink()
+        assert (temp_home / ".config" / "nvim").is_symlink()
 
-        app = dot.DotfilesApp(dry_run=False)
-        assert app._classify_action(source, dest) == dot.SymlinkAction.CREATE
+        unknown = await app.restore(paths=[pathlib.Path(".bashrc")])
+        assert not unknown
+        assert ".bashrc" in unknown.error
 
     @pytest.mark.asyncio
-    async def test_classify_replace_file(self, temp_home):
-        """Existing regular file -> REPLACE."""
-        source = temp_home / "source.txt"
-        source.write_text("content")
-        dest = temp_home / "dest.txt"
-        dest.write_text("old")
+    async def test_restore_refuses_real_directory(
+        self, replaced_config: pathlib.Path, temp_home: pathlib.Path
+    ) -> None:
+        """Test a directory created since install is not overwritten."""
+        app = dot.DotfilesApp(config_path=replaced_config, force=True)
+        assert await app.install_dotfiles()
+        gitconfig = temp_home / ".gitconfig"
+        gitconfig.unlink()
+        gitconfig.mkdir()
 
-        app = dot.DotfilesApp(dry_run=False)
-        assert app._classify_action(source, dest) == dot.SymlinkAction.REPLACE
+        result = await app.restore(paths=[pathlib.Path(".gitconfig")])
+
+        assert not result
+        assert gitconfig.is_dir()
 
     @pytest.mark.asyncio
-    async def test_classify_replace_wrong_symlink(self, temp_home):
-        """Symlink to wrong target -> REPLACE."""
-        source = temp_home / "source"
-        source.mkdir()
-        wrong = temp_home / "wrong"
-        wrong.mkdir()
-        dest = temp_home / "dest"
-        dest.symlink_to(wrong)
+    async def test_restore_dry_run_changes_nothing(
+        self, replaced_config: pathlib.Path, temp_home: pathlib.Path
+    ) -> None:
+        """Test dry-run restore leaves the installed symlinks."""
+        assert await dot.DotfilesApp(
+            config_path=replaced_config, force=True
+        ).install_dotfiles()
+        app = dot.DotfilesApp(config_path=replaced_config, dry_run=True)
 
-        app = dot.DotfilesApp(dry_run=False)
-        assert app._classify_action(source, dest) == dot.SymlinkAction.REPLACE
+        assert await app.restore()
+        assert (temp_home / ".gitconfig").is_symlink()
 
     @pytest.mark.asyncio
-    async def test_classify_deleting(self, temp_home):
-        """Real directory (not protected) -> DELETING."""
-        source = temp_home / "source"
-        source.mkdir()
-        dest = temp_home / "dest"
-        dest.mkdir()
-        (dest / "file.txt").write_text("data")
+    async def test_restore_without_backups_fails(
+        self, replaced_config: pathlib.Path
+    ) -> None:
+        """Test restore reports when there is nothing to restore."""
+        app = dot.DotfilesApp(config_path=replaced_config)
 
-        app = dot.DotfilesApp(dry_run=False)
-        assert app._classify_action(source, dest) == dot.SymlinkAction.DELETING
+        result = await app.restore()
+
+        assert not result
+        assert result.error == "No backups found"
 
     @pytest.mark.asyncio
-    async def test_classify_protected(self, temp_home):
-        """Real directory that's protected -> PROTECTED."""
-        source = temp_home / "source"
-        source.mkdir()
-        dest = temp_home / ".claude"
-        dest.mkdir()
-        (dest / "history.jsonl").write_text("precious data")
+    async def test_backup_disabled(
+        self, replaced_config: pathlib.Path, temp_home: pathlib.Path
+    ) -> None:
+        """Test `backup = false` replaces dests without snapshots."""
+        replaced_config.write_text(
+            replaced_config.read_text().replace("backup_keep = 3", "backup = false")
+        )
+        app = dot.DotfilesApp(config_path=replaced_config, force=True)
+        assert app.backups is None
 
-        app = dot.DotfilesApp(dry_run=False)
-        app.config.protected = [pathlib.Path(".claude")]
-        assert app._classify_action(source, dest) == dot.SymlinkAction.PROTECTED
+        assert await app.install_dotfiles()
+        assert dot.BackupStore().runs() == []
 
     @pytest.mark.asyncio
-    async def test_classify_skip(self, temp_home):
-        """Source doesn't exist -> SKIP."""
-        source = temp_home / "nonexistent"
-        dest = temp_home / "dest"
+    async def test_failed_backup_keeps_dest(
+        self, replaced_config: pathlib.Path, temp_home: pathlib.Path
+    ) -> None:
+        """Test a dest that cannot be backed up is not replaced."""
+        app = dot.DotfilesApp(config_path=replaced_config, force=True)
+        assert app.backups is not None
 
-        app = dot.DotfilesApp(dry_run=False)
-        assert app._classify_action(source, dest) == dot.SymlinkAction.SKIP
+        with patch.object(app.backups, "snapshot", side_effect=OSError("disk full")):
+            result = await app.install_dotfiles()
 
-    @pytest.mark.asyncio
-    async def test_build_changeset_mixed(self, temp_home):
-        """Integration test building changeset with multiple action types."""
-        dot_config = temp_home / "dot-config"
-        dot_config.mkdir()
-        (dot_config / ".gitconfig").write_text("git config")
-        # .zshrc source missing -> SKIP
+        assert not result
+        assert (temp_home / ".gitconfig").read_text() == "[core]\n"
+        assert (temp_home / ".config" / "nvim" / "lua").is_dir()
 
-        config_content = f"""
-[config]
-source = "{dot_config}"
+    def test_unchanged_files_hardlink_previous_run(
+        self, tmp_path: pathlib.Path
+    ) -> None:
+        """Test a file unchanged since the last backup shares its copy."""
+        tree = tmp_path / "tree"
+        tree.mkdir()
+        (tree / "same").write_text("same")
+        (tree / "edited").write_text("v1")
+        store = dot.BackupStore(tmp_path / "backups")
+        store.snapshot(tree)
+        store.finish()
+        (tree / "edited").write_text("v2 longer")
+        store.snapshot(tree)
+        store.finish()
+
+        first, second = (store.entries(run)[0].data for run in store.runs())
+
+        assert (second / "same").stat().st_ino == (first / "same").stat().st_ino
+        assert (second / "edited").stat().st_ino != (first / "edited").stat().st_ino
+        assert (second / "edited").read_text() == "v2 longer"
+
+    def test_reflink_falls_back_to_copy_once(self, tmp_path: pathlib.Path) -> None:
+        """Test an unsupported FICLONE is tried once, then plain copies follow."""
+        import errno
+
+        tree = tmp_path / "tree"
+        tree.mkdir()
+        for name in ("a", "b", "c"):
+            (tree / name).write_text(name)
+        store = dot.BackupStore(tmp_path / "backups")
+
+        with patch(
+            "fcntl.ioctl", side_effect=OSError(errno.EOPNOTSUPP, "no reflink")
+        ) as mock_ioctl:
+            store.snapshot(tree)
+
+        (entry,) = store.entries(store.runs()[0])
+        assert sorted(p.read_text() for p in entry.data.iterdir()) == ["a", "b", "c"]
+        assert mock_ioctl.call_count == (1 if sys.platform == "linux" else 0)
+
+    @pytest.mark.skipif(sys.platform != "linux", reason="FICLONE is Linux-only")
+    def test_reflink_clones_file(self, tmp_path: pathlib.Path) -> None:
+        """Test FICLONE is issued from the source onto the backup copy."""
+        import fcntl
+
+        source = tmp_path / "file"
+        source.write_text("data")
+        store = dot.BackupStore(tmp_path / "backups")
+
+        with patch("fcntl.ioctl") as mock_ioctl:
+            store.snapshot(source)
+
+        assert mock_ioctl.call_args.args[1] == fcntl.FICLONE
+
+    def test_retention_prunes_oldest_runs(self, tmp_path: pathlib.Path) -> None:
+        """Test only the newest *keep* runs survive."""
+        source = tmp_path / "file"
+        source.write_text("data")
+        store = dot.BackupStore(tmp_path / "backups", keep=2)
+
+        for _ in range(4):
+            store.snapshot(source)
+            store.finish()
+        runs = store.runs()
+
+        assert len(runs) == 2
+        assert sorted(p.name for p in store.root.iterdir()) == runs
+
+    def test_move_across_devices_copies(self, tmp_path: pathlib.Path) -> None:
+        """Test a tree that can't be renamed into the run is copied and kept."""
+        import errno
+
+        tree = tmp_path / "tree"
+        tree.mkdir()
+        (tree / "file").write_text("tree")
+        store = dot.BackupStore(tmp_path / "backups")
 
-[home]
-protected = [".claude"]
+        with patch.object(
+            pathlib.Path, "rename", side_effect=OSError(errno.EXDEV, "cross-device")
+        ):
+            moved = store.snapshot(tree, move=True)
+
+        assert not moved
+        assert (tree / "file").read_text() == "tree"
+        (entry,) = store.entries(store.runs()[0])
+        assert (entry.data / "file").read_text() == "tree"
+
+    def test_failed_snapshot_frees_its_slot(self, tmp_path: pathlib.Path) -> None:
+        """Test a copy failing halfway leaves no data for the next snapshot."""
+        tree = tmp_path / "tree"
+        tree.mkdir()
+        (tree / "file").write_text("tree")
+        other = tmp_path / "other"
+        other.write_text("other")
+        store = dot.BackupStore(tmp_path / "backups")
 
-[home.files]
-".gitconfig" = ".gitconfig"
-".zshrc" = ".zshrc"
-"""
-        config_path = temp_home / "dot.toml"
-        config_path.write_text(config_content)
+        with (
+            patch.object(store, "_copy_file", side_effect=PermissionError("denied")),
+            pytest.raises(PermissionError),
+        ):
+            store.snapshot(tree)
+        store.snapshot(other)
 
-        app = dot.DotfilesApp(config_path=config_path, dry_run=False)
+        (entry,) = store.entries(store.runs()[0])
+        assert entry.dest == other
+        assert entry.data.read_text() == "other"
 
-        plans = app._build_changeset()
-        actions = {p.action for p in plans}
-        assert dot.SymlinkAction.CREATE in actions  # .gitconfig
-        assert dot.SymlinkAction.SKIP in actions  # .zshrc (no source)
+    def test_special_files_skipped(self, tmp_path: pathlib.Path) -> None:
+        """Test a FIFO is neither copied nor opens a run."""
+        fifo = tmp_path / "fifo"
+        os.mkfifo(fifo)
+        store = dot.BackupStore(tmp_path / "backups")
+
+        store.snapshot(fifo)
+        store.finish()
+
+        assert not store.root.exists()
 
 
 class TestProtectedDirectories:
@@ -4428,12 +8890,456 @@ source = "{dot_config}"
         app = dot.DotfilesApp(config_path=config_path, dry_run=False)
 
         with unittest.mock.patch("rich.console.Console.input", return_value="no"):
-            success = await app.install_dotfiles()
+            success = await app.install_dotfiles(plan_format="table")
 
         assert not success
         assert dest.is_dir()
         assert not dest.is_symlink()
 
+        with unittest.mock.patch("sys.stdin", io.StringIO("no\n")):
+            success = await app.install_dotfiles(plan_format="plain")
+
+        assert not success
+        assert dest.is_dir()
+
+
+class TestPlanRendering:
+    """Test install plan output chosen by destination."""
+
+    @pytest.fixture
+    def plans(self, temp_home: pathlib.Path) -> list[dot.SymlinkPlan]:
+        """Plans in unsorted order, one outside home."""
+        src = pathlib.Path("/src")
+        return [
+            dot.SymlinkPlan(src / "zshrc", temp_home / ".zshrc", dot.SymlinkAction.OK),
+            dot.SymlinkPlan(
+                src / "nvim",
+                temp_home / ".config" / "nvim",
+                dot.SymlinkAction.CREATE,
+                is_dir=True,
+            ),
+            dot.SymlinkPlan(
+                src / "hosts", pathlib.Path("/etc/hosts"), dot.SymlinkAction.SKIP
+            ),
+        ]
+
+    def test_plain_lines(
+        self, plans: list[dot.SymlinkPlan], temp_home: pathlib.Path
+    ) -> None:
+        """Test one aligned line per plan, ordered by action then dest."""
+        out = io.StringIO()
+
+        dot.render_plan_plain(plans, temp_home, out)
+
+        assert out.getvalue().splitlines() == [
+            "[CREATE]     dir   .config/nvim -> /src/nvim",
+            "[OK]         file  .zshrc -> /src/zshrc",
+            "[SKIP]       file  /etc/hosts -> /src/hosts",
+        ]
+
+    def test_json_lines(
+        self, plans: list[dot.SymlinkPlan], temp_home: pathlib.Path
+    ) -> None:
+        """Test NDJSON records carry absolute paths."""
+        import json
+
+        out = io.StringIO()
+
+        dot.render_plan_json(plans, temp_home, out)
+
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert records[0] == {
+            "action": "create",
+            "type": "dir",
+            "dest": str(temp_home / ".config" / "nvim"),
+            "source": "/src/nvim",
+        }
+        assert [r["action"] for r in records] == ["create", "ok", "skip"]
+
+    def test_table_lists_every_plan(
+        self,
+        plans: list[dot.SymlinkPlan],
+        temp_home: pathlib.Path,
+        capsys: pytest.CaptureFixture[str],
+    ) -> None:
+        """Test the rich table still shows each plan."""
+        dot.render_plan_table(plans, temp_home)
+
+        out = capsys.readouterr().out
+        assert "Dotfiles Install Plan" in out
+        assert ".config/nvim" in out
+        assert "[SKIP]" in out
+
+    @pytest.mark.asyncio
+    async def test_install_off_tty_streams_plain(
+        self,
+        temp_home: pathlib.Path,
+        capsys: pytest.CaptureFixture[str],
+    ) -> None:
+        """Test install picks plain lines when stdout is not a TTY."""
+        dot_config = temp_home / "dot-config"
+        dot_config.mkdir()
+        (dot_config / "gitconfig").write_text("git config")
+        config_path = temp_home / "dot.toml"
+        config_path.write_text(
+            f"""
+[config]
+source = "{dot_config}"
+
+[home.files]
+".gitconfig" = "gitconfig"
+"""
+        )
+        app = dot.DotfilesApp(config_path=config_path, dry_run=True)
+
+        with patch.object(dot, "render_plan_table") as mock_table:
+            assert await app.install_dotfiles()
+
+        mock_table.assert_not_called()
+        assert capsys.readouterr().out.startswith("[CREATE]     file  .gitconfig")
+
+    def test_cli_json_skips_rich(
+        self,
+        temp_home: pathlib.Path,
+        record_property: typing.Callable[[str, object], None],
+    ) -> None:
+        """Test `install --format json` prints only NDJSON and never loads rich."""
+        import json
+
+        dot_config = temp_home / "dot-config"
+        dot_config.mkdir()
+        (dot_config / "gitconfig").write_text("git config")
+        config_path = temp_home / "dot.toml"
+        config_path.write_text(
+            f"""
+[config]
+source = "{dot_config}"
+
+[home.files]
+".gitconfig" = "gitconfig"
+"""
+        )
+
+        def run(plan_format: str) -> tuple[str, dict[str, int]]:
+            proc = subprocess.run(
+                [
+                    sys.executable,
+                    "-X",
+                    "importtime",
+                    str(pathlib.Path(dot.__file__)),
+                    "--config",
+                    str(config_path),
+                    "--dry-run",
+                    "install",
+                    "--format",
+                    plan_format,
+                ],
+                check=True,
+                capture_output=True,
+                env={**os.environ, "HOME": str(temp_home)},
+                text=True,
+            )
+            imported: dict[str, int] = {}
+            for line in proc.stderr.splitlines():
+                if not line.startswith("import time:") or "self [us]" in line:
+                    continue
+                self_us, _cumulative, name = line.removeprefix("import time:").split(
+                    "|"
+                )
+                imported[name.strip()] = int(self_us)
+            return proc.stdout, imported
+
+        stdout, imported = run("json")
+        _table_stdout, table_imported = run("table")
+
+        assert [json.loads(line)["action"] for line in stdout.splitlines()] == [
+            "create"
+        ]
+        assert not any(name.split(".")[0] == "rich" for name in imported)
+        rich_us = sum(
+            us for name, us in table_imported.items() if name.startswith("rich")
+        )
+        print(f"install imports: json={sum(imported.values())}us rich={rich_us}us")
+        record_property("install_json_import_us", sum(imported.values()))
+        record_property("install_rich_import_us", rich_us)
+        assert rich_us > 0
+
+
+async def _wait_for(
+    predicate: collections.abc.Callable[[], bool], timeout: float = 2.0
+) -> float:
+    """Yield to the event loop until *predicate* holds.
+
+    Returns:
+        Seconds waited.
+
+    """
+    start = time.monotonic()
+    while not predicate():
+        if time.monotonic() - start > timeout:
+            pytest.fail("condition not reached in time")
+        await asyncio.sleep(0.005)
+    return time.monotonic() - start
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="inotify is Linux-only")
+class TestWatch:
+    """Test the inotify-driven `watch` daemon."""
+
+    CONFIG: typing.ClassVar[str] = """
+[config]
+source = "{source}"
+
+[home.files]
+".gitconfig" = "gitconfig"
+".config/app/settings" = "app/settings"
+
+[home.dirs]
+".config/nvim" = "nvim"
+
+[shell_integration.snippets.early_env]
+stage = 0
+default = "export DOT_EARLY=1"
+
+[shell_integration.snippets.late_prompt]
+stage = 9
+default = "export DOT_LATE=1"
+"""
+
+    @pytest.fixture
+    def config_path(self, temp_home: pathlib.Path) -> pathlib.Path:
+        """Write a config with installed, missing and nested mappings."""
+        source = temp_home / "dot-config"
+        (source / "nvim").mkdir(parents=True)
+        (source / "gitconfig").write_text("[user]\n")
+        (temp_home / ".gitconfig").symlink_to(source / "gitconfig")
+        path = temp_home / "dot.toml"
+        path.write_text(self.CONFIG.format(source=source))
+        return path
+
+    @pytest.fixture
+    async def watcher(
+        self, config_path: pathlib.Path
+    ) -> collections.abc.AsyncGenerator[dot.DotfilesWatcher, None]:
+        """Run a watcher over the config until the test ends."""
+        app = dot.DotfilesApp(config_path=config_path, force=True)
+        watcher = dot.DotfilesWatcher(app, debounce=0.02)
+        task = asyncio.create_task(watcher.run())
+        await asyncio.sleep(0)
+        yield watcher
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    def test_inotify_reports_entries(self, tmp_path: pathlib.Path) -> None:
+        """Test created entries are read back with their directory."""
+        inotify = dot.Inotify()
+        try:
+            assert inotify.add(tmp_path, dot.Inotify.ENTRY_EVENTS)
+            assert not inotify.add(tmp_path, dot.Inotify.ENTRY_EVENTS)
+            assert inotify.read() == []
+            (tmp_path / "new").write_text("x")
+
+            events = inotify.read()
+        finally:
+            inotify.close()
+
+        assert events == [(tmp_path, dot.Inotify.CREATE, "new")]
+
+    def test_compiled_shell_request(self, tmp_path: pathlib.Path) -> None:
+        """Test a loader stub yields the invocation that compiled it."""
+        config_path = tmp_path / "dot.toml"
+        compiled = dot.compile_shell_init(
+            dot.ShellGenerator(defer_late=True),
+            config_path,
+            [],
+            "zsh",
+            "early",
+            cache_dir=tmp_path / "shell",
+        )
+
+        assert dot._compiled_shell_request(compiled.loader) == dot.ShellRequest(
+            shell="zsh",
+            stage="early",
+            config=config_path,
+            compile=True,
+            defer_late=True,
+        )
+
+    @pytest.mark.asyncio
+    async def test_new_source_is_linked(
+        self,
+        watcher: dot.DotfilesWatcher,
+        temp_home: pathlib.Path,
+        record_property: typing.Callable[[str, object], None],
+    ) -> None:
+        """Test a source created in a new directory is linked within a second."""
+        settings = temp_home / "dot-config" / "app" / "settings"
+        settings.parent.mkdir()
+        settings.write_text("theme = dark\n")
+        dest = temp_home / ".config" / "app" / "settings"
+
+        latency = await _wait_for(dest.is_symlink)
+
+        record_property("watch_link_latency_ms", round(latency * 1e3))
+        assert dest.read_text() == "theme = dark\n"
+        assert latency < 1.0
+
+    @pytest.mark.asyncio
+    async def test_removed_dest_is_relinked(
+        self, watcher: dot.DotfilesWatcher, temp_home: pathlib.Path
+    ) -> None:
+        """Test a dest replaced by hand is linked back to its source."""
+        gitconfig = temp_home / ".gitconfig"
+        gitconfig.unlink()
+        gitconfig.write_text("[core]\n")
+
+        await _wait_for(gitconfig.is_symlink)
+
+        assert gitconfig.read_text() == "[user]\n"
+
+    @pytest.mark.asyncio
+    async def test_real_directory_needs_force(
+        self,
+        watcher: dot.DotfilesWatcher,
+        temp_home: pathlib.Path,
+        caplog: pytest.LogCaptureFixture,
+    ) -> None:
+        """Test a real directory at a dest is reported, not deleted."""
+        watcher.app.force = False
+        nvim = temp_home / ".config" / "nvim"
+        nvim.mkdir(parents=True)
+
+        await _wait_for(lambda: "without --force" in caplog.text)
+
+        assert nvim.is_dir()
+        assert not nvim.is_symlink()
+
+    @pytest.mark.asyncio
+    async def test_events_are_coalesced(
+        self, watcher: dot.DotfilesWatcher, temp_home: pathlib.Path
+    ) -> None:
+        """Test a burst of changes is applied as one batch."""
+        gitconfig = temp_home / ".gitconfig"
+
+        with patch.object(watcher, "apply", wraps=watcher.apply) as mock_apply:
+            for _ in range(5):
+                gitconfig.unlink()
+                gitconfig.symlink_to(temp_home / "elsewhere")
+            await _wait_for(lambda: gitconfig.readlink().name == "gitconfig")
+
+        mock_apply.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_config_edit_adds_mapping_and_recompiles_changed_stage(
+        self,
+        watcher: dot.DotfilesWatcher,
+        config_path: pathlib.Path,
+        temp_home: pathlib.Path,
+    ) -> None:
+        """Test a dot.toml edit links new mappings and rewrites one stage."""
+        compiled = dot.compile_shell_init(
+            dot.ShellGenerator(),
+            config_path,
+            watcher.app.config.shell_snippets,
+            "bash",
+        )
+        early, late = compiled.artifacts
+        early_mtime = early.stat().st_mtime_ns
+        (temp_home / "dot-config" / "zshrc").write_text("# zsh\n")
+
+        config_path.write_text(
+            config_path.read_text()
+            .replace("DOT_LATE=1", "DOT_LATE=2")
+            .replace("[home.files]\n", '[home.files]\n".zshrc" = "zshrc"\n')
+        )
+
+        await _wait_for((temp_home / ".zshrc").is_symlink)
+        await _wait_for(lambda: not late.exists())
+        assert early.stat().st_mtime_ns == early_mtime
+        (new_late,) = compiled.loader.parent.glob("late-*.bash")
+        assert "DOT_LATE=2" in new_late.read_text()
+
+    @pytest.mark.asyncio
+    async def test_invalid_config_is_ignored(
+        self,
+        watcher: dot.DotfilesWatcher,
+        config_path: pathlib.Path,
+        caplog: pytest.LogCaptureFixture,
+    ) -> None:
+        """Test a half-written dot.toml keeps the previous mappings."""
+        mappings = dict(watcher.mappings)
+
+        config_path.write_text("[home.files\n")
+
+        await _wait_for(lambda: "Keeping the previous config" in caplog.text)
+        assert watcher.mappings == mappings
+
+    @pytest.mark.asyncio
+    async def test_invalid_value_keeps_watching(
+        self,
+        watcher: dot.DotfilesWatcher,
+        config_path: pathlib.Path,
+        temp_home: pathlib.Path,
+        caplog: pytest.LogCaptureFixture,
+    ) -> None:
+        """Test a dot.toml that parses but fails to load doesn't stop the watch."""
+        mappings = dict(watcher.mappings)
+
+        config_path.write_text(
+            config_path.read_text().replace("stage = 0", "stage = 7")
+        )
+
+        await _wait_for(lambda: "Keeping the previous config" in caplog.text)
+        assert watcher.mappings == mappings
+        gitconfig = temp_home / ".gitconfig"
+        gitconfig.unlink()
+        gitconfig.write_text("[core]\n")
+        await _wait_for(gitconfig.is_symlink)
+
+    @pytest.mark.asyncio
+    async def test_failed_batch_keeps_watching(
+        self,
+        watcher: dot.DotfilesWatcher,
+        temp_home: pathlib.Path,
+        caplog: pytest.LogCaptureFixture,
+    ) -> None:
+        """Test an error applying one batch is logged and later batches apply."""
+        classifier = watcher.app._classifier
+        calls = 0
+
+        def flaky() -> dot.SymlinkClassifier:
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                msg = "boom"
+                raise RuntimeError(msg)
+            return classifier()
+
+        gitconfig = temp_home / ".gitconfig"
+        with patch.object(watcher.app, "_classifier", side_effect=flaky):
+            gitconfig.unlink()
+            gitconfig.write_text("[core]\n")
+            await _wait_for(lambda: "Failed to apply changes" in caplog.text)
+            gitconfig.unlink()
+            gitconfig.write_text("[core]\n")
+
+            await _wait_for(gitconfig.is_symlink)
+
+    @pytest.mark.asyncio
+    async def test_cli_watch_requires_linux(
+        self,
+        config_path: pathlib.Path,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        """Test `watch` refuses to start without inotify."""
+        monkeypatch.setattr(
+            "sys.argv", ["dot.py", "--config", str(config_path), "watch"]
+        )
+        monkeypatch.setattr("sys.platform", "darwin")
+
+        assert await dot.async_main() == 1
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v", "--cov=dot", "--cov-report=term-missing"])